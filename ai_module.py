@@ -1,13 +1,13 @@
 # -*- coding: utf-8 -*-
 """AI-модуль — работа с LLM API (Groq / DeepSeek / OpenAI-совместимый)."""
 
+import asyncio
 import json
 import logging
 import os
-import tempfile
 from datetime import datetime
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
 logger = logging.getLogger(__name__)
 
@@ -40,23 +40,71 @@ def _get_client() -> OpenAI:
     return _client
 
 
-def transcribe_voice(voice_bytes: bytes, suffix: str = ".ogg") -> str | None:
-    """Распознаёт голосовое сообщение через Whisper API (Groq). suffix — расширение временного файла (ogg, webm, wav…)."""
+# Одновременных запросов к Whisper из веба: медленный API не должен забирать все соединения.
+VOICE_MAX_CONCURRENCY = max(1, int(os.environ.get("VOICE_MAX_CONCURRENCY", "4") or 4))
+_WHISPER_TIMEOUT_SEC = 20.0
+
+_async_client: AsyncOpenAI | None = None
+_voice_sem: tuple[asyncio.AbstractEventLoop, asyncio.Semaphore] | None = None
+
+
+def _get_async_client() -> AsyncOpenAI:
+    global _async_client
+    if _async_client is None:
+        if not AI_API_KEY:
+            raise RuntimeError(
+                "API-ключ не задан. Задайте GROQ_API_KEY или DEEPSEEK_API_KEY."
+            )
+        _async_client = AsyncOpenAI(api_key=AI_API_KEY, base_url=AI_BASE_URL)
+    return _async_client
+
+
+def _voice_semaphore() -> asyncio.Semaphore:
+    """Семафор текущего event loop (в тестах и при перезапуске loop бывает не один)."""
+    global _voice_sem
+    loop = asyncio.get_running_loop()
+    if _voice_sem is None or _voice_sem[0] is not loop:
+        _voice_sem = (loop, asyncio.Semaphore(VOICE_MAX_CONCURRENCY))
+    return _voice_sem[1]
+
+
+def _voice_upload(voice_bytes: bytes, suffix: str) -> tuple[str, bytes]:
+    """Файл для API прямо из памяти: (имя, байты) — по расширению API определяет формат."""
     if not suffix or not suffix.startswith("."):
         suffix = ".ogg"
-    tmp_path = None
+    return f"voice{suffix}", voice_bytes
+
+
+def transcribe_voice(voice_bytes: bytes, suffix: str = ".ogg") -> str | None:
+    """Распознаёт голосовое сообщение через Whisper API (Groq). suffix — расширение файла (ogg, webm, wav…)."""
     try:
         client = _get_client()
-        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
-            f.write(voice_bytes)
-            tmp_path = f.name
+        transcription = client.audio.transcriptions.create(
+            model=WHISPER_MODEL,
+            file=_voice_upload(voice_bytes, suffix),
+            language="ru",
+            timeout=_WHISPER_TIMEOUT_SEC,
+        )
+        text = transcription.text.strip()
+        if text:
+            logger.info("Голос распознан: %s", text[:80])
+            return text
+        return None
+    except Exception as e:
+        logger.exception("Ошибка распознавания голоса: %s", e)
+        return None
+
 
-        with open(tmp_path, "rb") as audio_file:
-            transcription = client.audio.transcriptions.create(
+async def transcribe_voice_async(voice_bytes: bytes, suffix: str = ".ogg") -> str | None:
+    """То же, что transcribe_voice, но без блокировки event loop; не больше VOICE_MAX_CONCURRENCY запросов сразу."""
+    try:
+        client = _get_async_client()
+        async with _voice_semaphore():
+            transcription = await client.audio.transcriptions.create(
                 model=WHISPER_MODEL,
-                file=audio_file,
+                file=_voice_upload(voice_bytes, suffix),
                 language="ru",
-                timeout=20.0,
+                timeout=_WHISPER_TIMEOUT_SEC,
             )
         text = transcription.text.strip()
         if text:
@@ -66,12 +114,6 @@ def transcribe_voice(voice_bytes: bytes, suffix: str = ".ogg") -> str | None:
     except Exception as e:
         logger.exception("Ошибка распознавания голоса: %s", e)
         return None
-    finally:
-        if tmp_path and os.path.exists(tmp_path):
-            try:
-                os.unlink(tmp_path)
-            except OSError:
-                pass
 
 
 SYSTEM_PROMPT = """\
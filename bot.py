@@ -22,6 +22,7 @@ from telegram.ext import (
 
 import db
 import ai_module
+import tg_outbox
 
 BOT_TOKEN = os.environ.get(
     "TELEGRAM_BOT_TOKEN", "8785603117:AAGWVVEWSVbIc_ZZDhd26OprknT0e6Ldh1Q"
@@ -100,31 +101,10 @@ BOT_COMMANDS = [
 
 # ── Утилиты ──────────────────────────────────────────────────────────────
 
-async def _reply(update: Update, text: str, max_retries: int = 3) -> None:
-    for attempt in range(max_retries + 1):
-        try:
-            await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
-            return
-        except (TimedOut, NetworkError) as e:
-            if attempt < max_retries:
-                wait = 2 ** attempt
-                logger.info("Retry %s/%s через %sс (%s)", attempt + 1, max_retries, wait, type(e).__name__)
-                await asyncio.sleep(wait)
-            else:
-                logger.warning("Не удалось отправить после %s попыток: %s", max_retries + 1, e)
-        except Exception:
-            try:
-                await update.message.reply_text(text)
-                return
-            except (TimedOut, NetworkError) as e:
-                if attempt < max_retries:
-                    wait = 2 ** attempt
-                    await asyncio.sleep(wait)
-                else:
-                    logger.warning("Не удалось отправить (plain) после %s попыток: %s", max_retries + 1, e)
-            except Exception as e2:
-                logger.warning("Ошибка отправки: %s", e2)
-                return
+async def _reply(update: Update, text: str, parse_mode: str | None = ParseMode.MARKDOWN) -> None:
+    """Ответ в чат апдейта через общую очередь отправки (лимиты Telegram, повторы — в tg_outbox)."""
+    message = update.message
+    await tg_outbox.send(message.get_bot(), message.chat_id, text, parse_mode=parse_mode)
 
 
 def _get_tip(tips_shown: int) -> str | None:
@@ -937,20 +917,13 @@ async def _process_user_text(update: Update, user_text: str) -> None:
 
     elif msg_type == "done_multiple":
         searches = ai_result.get("search_texts", [])
-        found_tasks = db.find_tasks_by_texts(user_row["id"], searches)
-        if found_tasks:
-            done_names = []
-            for t in found_tasks:
-                db.complete_task(t["id"], user_id=user_row["id"])
-                done_names.append(t["text"])
+        # Все фразы сопоставляются за один проход, отметка — одной транзакцией.
+        completed, not_found = db.complete_tasks_by_texts(user_row["id"], searches)
+        if completed:
+            done_names = [t["text"] for t in completed]
             reply_text = f"✅ *Отмечено {len(done_names)} задач:*\n" + "\n".join(
                 f"  ☑ {name}" for name in done_names
             )
-            not_found = [
-                s for s in searches
-                if s.lower().strip() not in [n.lower() for n in done_names]
-                and not db.find_task_by_text(user_row["id"], s)
-            ]
             if not_found:
                 reply_text += "\n\n⚠️ _Не нашла:_ " + ", ".join(not_found)
             reply_text += "\n\n_Отличная работа!_"
@@ -1105,12 +1078,7 @@ def main() -> None:
         else:
             logger.exception("Ошибка: %s", context.error)
             if isinstance(update, Update) and update.message:
-                try:
-                    await update.message.reply_text(
-                        "⚠️ Произошла ошибка. Попробуй ещё раз через пару секунд."
-                    )
-                except Exception:
-                    pass
+                await _reply(update, "⚠️ Произошла ошибка. Попробуй ещё раз через пару секунд.", parse_mode=None)
 
     app.add_error_handler(on_error)
     logger.info("Бот запущен (v2.4-fix-routines). [меню при старте]")
@@ -100,6 +100,9 @@ if __name__ == "__main__":
     if not BOT_TOKEN or BOT_TOKEN == "YOUR_BOT_TOKEN":
         print("TELEGRAM_BOT_TOKEN not set", flush=True)
         sys.exit(1)
+    if not USE_V1 and os.environ.get("TELEGRAM_WEBHOOK_URL", "").strip():
+        print("TELEGRAM_WEBHOOK_URL задан: бот работает внутри веба (uvicorn web.app:app).", flush=True)
+        sys.exit(0)
 
     http_thread = threading.Thread(target=run_http, daemon=True)
     http_thread.start()
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Параллельная обработка апдейтов бота с сохранением порядка внутри чата.
+
+PTB по умолчанию обрабатывает апдейты строго по одному: пока распознаётся
+голосовое одного пользователя (Whisper — до 20 с), остальные чаты ждут.
+ChatOrderedUpdateProcessor пропускает до BOT_CONCURRENT_UPDATES апдейтов
+одновременно, но апдейты одного чата — по очереди, в порядке поступления:
+«/add» и следующее за ним сообщение не поменяются местами.
+
+Блокирующая работа из обработчиков уходит в пулы потоков:
+- run_db — запросы к БД (пул db_async, согласован с DB_POOL_MAX);
+- run_voice — распознавание речи, свой небольшой пул BOT_VOICE_WORKERS, чтобы
+  длинные расшифровки не занимали потоки, нужные запросам к БД.
+
+stats() — глубина очередей и задержки обработчиков; раз в BOT_STATS_LOG_SEC
+сводка пишется в лог.
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.ext import BaseUpdateProcessor
+
+import db_async
+import tg_outbox
+
+logger = logging.getLogger(__name__)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, "") or default)
+    except ValueError:
+        return default
+
+
+BOT_CONCURRENT_UPDATES = max(1, int(_env_float("BOT_CONCURRENT_UPDATES", 64)))
+BOT_VOICE_WORKERS = max(1, int(_env_float("BOT_VOICE_WORKERS", 2)))
+# Обработчик дольше этого попадает в лог предупреждением.
+BOT_SLOW_UPDATE_SEC = _env_float("BOT_SLOW_UPDATE_SEC", 5.0)
+# Как часто писать сводку stats() в лог (0 — не писать).
+BOT_STATS_LOG_SEC = _env_float("BOT_STATS_LOG_SEC", 300.0)
+
+_lock = threading.Lock()
+_metrics = {
+    "updates": 0,
+    "running": 0,
+    "peak_running": 0,
+    "waiting_chat": 0,
+    "slow": 0,
+    "handler_ms_max": 0.0,
+}
+# Последние задержки обработчиков (мс) для перцентилей.
+_latencies: deque[float] = deque(maxlen=1000)
+_pools = {
+    "db": {"inflight": 0, "peak": 0, "completed": 0},
+    "voice": {"inflight": 0, "peak": 0, "completed": 0},
+}
+_last_stats_log = time.monotonic()
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return round(sorted_values[idx], 1)
+
+
+def stats() -> dict:
+    """Метрики: апдейты в работе и в очереди своего чата, задержки (мс), загрузка пулов, отправка."""
+    with _lock:
+        out = dict(_metrics)
+        lat = sorted(_latencies)
+        pools = {name: dict(p) for name, p in _pools.items()}
+    out["handler_ms_p50"] = _percentile(lat, 0.5)
+    out["handler_ms_p95"] = _percentile(lat, 0.95)
+    out["handler_ms_max"] = round(out["handler_ms_max"], 1)
+    out["max_concurrent"] = BOT_CONCURRENT_UPDATES
+    pools["db"]["workers"] = db_async._workers()
+    pools["voice"]["workers"] = BOT_VOICE_WORKERS
+    for p in pools.values():
+        p["queued"] = max(0, p["inflight"] - p["workers"])
+    out["pools"] = pools
+    out["outbox"] = tg_outbox.stats()
+    return out
+
+
+def _maybe_log_stats() -> None:
+    global _last_stats_log
+    if BOT_STATS_LOG_SEC <= 0:
+        return
+    now = time.monotonic()
+    with _lock:
+        if now - _last_stats_log < BOT_STATS_LOG_SEC:
+            return
+        _last_stats_log = now
+    logger.info("bot stats: %s", stats())
+
+
+def _chat_key(update: object) -> int | None:
+    chat = getattr(update, "effective_chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(update, "effective_user", None)
+    return user.id if user is not None else None
+
+
+# Лимит семафора PTB: он берётся до do_process_update, то есть ещё до очереди
+# чата — апдейты, ждущие своей очереди, занимали бы слоты. Поэтому PTB
+# пропускает всё, а BOT_CONCURRENT_UPDATES держит свой семафор вокруг обработчика.
+_PTB_UNBOUNDED = 1 << 30
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Апдейты разных чатов — параллельно, одного чата — по очереди (FIFO)."""
+
+    def __init__(self, max_concurrent_updates: int = BOT_CONCURRENT_UPDATES):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        # Базовый __init__ строит свой семафор по max_concurrent_updates.
+        self._limit = _PTB_UNBOUNDED
+        super().__init__(_PTB_UNBOUNDED)
+        self._limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._running = 0
+        # chat_id → [замок, число апдейтов чата в работе и в ожидании].
+        self._chats: dict[int, list] = {}
+
+    @property
+    def max_concurrent_updates(self) -> int:
+        return self._limit
+
+    @property
+    def current_concurrent_updates(self) -> int:
+        return self._running
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = _chat_key(update)
+        if key is None:
+            await self._run(update, coroutine)
+            return
+        entry = self._chats.get(key)
+        if entry is None:
+            entry = self._chats[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        waiting = entry[0].locked()
+        if waiting:
+            with _lock:
+                _metrics["waiting_chat"] += 1
+        try:
+            async with entry[0]:
+                if waiting:
+                    with _lock:
+                        _metrics["waiting_chat"] -= 1
+                    waiting = False
+                await self._run(update, coroutine)
+        finally:
+            if waiting:
+                with _lock:
+                    _metrics["waiting_chat"] -= 1
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._chats.pop(key, None)
+
+    async def _run(self, update: object, coroutine) -> None:
+        async with self._slots:
+            self._running += 1
+            try:
+                await self._timed(update, coroutine)
+            finally:
+                self._running -= 1
+
+    async def _timed(self, update: object, coroutine) -> None:
+        with _lock:
+            _metrics["updates"] += 1
+            _metrics["running"] += 1
+            _metrics["peak_running"] = max(_metrics["peak_running"], _metrics["running"])
+        started = time.perf_counter()
+        try:
+            await coroutine
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000.0
+            with _lock:
+                _metrics["running"] -= 1
+                _latencies.append(elapsed_ms)
+                _metrics["handler_ms_max"] = max(_metrics["handler_ms_max"], elapsed_ms)
+                if elapsed_ms >= BOT_SLOW_UPDATE_SEC * 1000.0:
+                    _metrics["slow"] += 1
+            if elapsed_ms >= BOT_SLOW_UPDATE_SEC * 1000.0:
+                logger.warning("bot: медленный апдейт chat=%s %.0f мс", _chat_key(update), elapsed_ms)
+            _maybe_log_stats()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+# ── Пулы для блокирующих вызовов ─────────────────────────────────────────
+
+_voice_executor: ThreadPoolExecutor | None = None
+
+
+def _get_voice_executor() -> ThreadPoolExecutor:
+    global _voice_executor
+    with _lock:
+        if _voice_executor is None:
+            _voice_executor = ThreadPoolExecutor(
+                max_workers=BOT_VOICE_WORKERS, thread_name_prefix="bot-voice"
+            )
+        return _voice_executor
+
+
+async def _tracked(pool: str, awaitable):
+    m = _pools[pool]
+    with _lock:
+        m["inflight"] += 1
+        m["peak"] = max(m["peak"], m["inflight"])
+    try:
+        return await awaitable
+    finally:
+        with _lock:
+            m["inflight"] -= 1
+            m["completed"] += 1
+
+
+async def run_db(fn, *args, **kwargs):
+    """Синхронная функция с запросами к БД (db.* или хелпер поверх него) — вне event loop."""
+    return await _tracked("db", db_async.run(fn, *args, **kwargs))
+
+
+async def run_voice(fn, *args, **kwargs):
+    """Распознавание речи и прочие долгие вызовы внешних API — в отдельном пуле."""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(fn, *args, **kwargs)
+    return await _tracked("voice", loop.run_in_executor(_get_voice_executor(), call))
@@ -5,7 +5,6 @@
 Голос — только Whisper (распознавание речи), дальше тот же алгоритм.
 """
 
-import asyncio
 import logging
 import os
 from collections import defaultdict
@@ -27,9 +26,14 @@ from telegram.ext import (
     ContextTypes,
 )
 
+import bot_updates
 import db
+import events
+import intent_router
 import ai_module
+import reminders
 import routines
+import tg_outbox
 from categories import assign_category
 from task_parsing import (
     parse_due_date,
@@ -37,18 +41,12 @@ from task_parsing import (
     infer_time_of_day,
     time_of_day_from_hour,
     classify_time_of_day_edit,
-    extract_task_text,
-    starts_with_add_marker,
-    starts_with_done_marker,
     extract_done_target,
     extract_done_targets,
     clean_task_text_from_datetime,
     normalize_task_display,
-    starts_with_edit_marker,
     extract_edit_target,
-    starts_with_reschedule_marker,
     extract_reschedule_target,
-    starts_with_delete_marker,
     extract_delete_target,
 )
 
@@ -122,45 +120,6 @@ HELP_TEXT = (
     "• «Перенеси задачу 6 на второе апреля», «на 2 апреля», «на 15.05»\n"
 )
 
-# Синонимы для текстовых/голосовых команд (без слэша)
-SYN_LIST_TASKS = (
-    "покажи список задач", "список задач", "все задачи", "мои задачи",
-    "покажи список", "что в списке", "план", "задачи",
-    "покажи задачи", "покажи все задачи", "покажи мои задачи",
-)
-SYN_TODAY = (
-    "план на сегодня", "задачи на сегодня", "что на сегодня", "на сегодня",
-    "покажи задачи на сегодня", "покажи план на сегодня", "что на сегодня сделать",
-)
-SYN_ADD_TASK = (
-    "добавить задачу", "новая задача", "добавить новую задачу", "создать задачу",
-)
-SYN_DONE_TODAY = (
-    "что сделала сегодня", "что сделал сегодня", "мои достижения сегодня",
-    "сделано сегодня", "выполнено сегодня", "отчёт за день",
-    "покажи отчёт за сегодня", "отчёт за сегодня", "покажи сделанное сегодня",
-)
-SYN_DONE_WEEK = (
-    "отчёт за неделю", "сделано за неделю", "выполнено за неделю",
-    "что сделала за неделю", "что сделал за неделю", "мои достижения за неделю",
-    "покажи отчёт за неделю", "покажи сделанное за неделю",
-)
-SYN_ROUTINES = (
-    "рутины", "мои рутины", "покажи рутины", "список рутин", "регулярные дела",
-)
-SYN_UNCOMPLETE = (
-    "отменить выполнение задачи номер",
-    "отменить выполнение задачи",
-    "отменить выполнение",
-    "вернуть в список",
-    "вернуть задачу",
-)
-SYN_HELP = (
-    "помощь", "справка", "как пользоваться", "что умеешь", "команды",
-    "покажи помощь", "покажи справку",
-)
-# Изменение и перенос — маркеры в task_parsing (изменить задачу, перенеси на ...)
-# SYN_EDIT / SYN_RESCHEDULE не нужны: проверяем starts_with_edit_marker, starts_with_reschedule_marker
 
 ONBOARDING_V2 = (
     "Привет! Я помощник по задачам.\n\n"
@@ -392,25 +351,10 @@ def _format_task_list(tasks: list[dict]) -> str:
     return "\n".join(lines).strip()
 
 
-async def _reply(update: Update, text: str, max_retries: int = 3) -> None:
-    for attempt in range(max_retries + 1):
-        try:
-            await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
-            return
-        except (TimedOut, NetworkError) as e:
-            if attempt < max_retries:
-                wait = 2 ** attempt
-                logger.info("Retry %s/%s через %ss (%s)", attempt + 1, max_retries, wait, type(e).__name__)
-                await asyncio.sleep(wait)
-            else:
-                logger.warning("Не удалось отправить после %s попыток: %s", max_retries + 1, e)
-        except Exception:
-            try:
-                await update.message.reply_text(text)
-                return
-            except Exception as e2:
-                logger.warning("Ошибка отправки: %s", e2)
-                return
+async def _reply(update: Update, text: str, parse_mode: str | None = ParseMode.MARKDOWN) -> None:
+    """Ответ в чат апдейта через общую очередь отправки (лимиты Telegram, повторы — в tg_outbox)."""
+    message = update.message
+    await tg_outbox.send(message.get_bot(), message.chat_id, text, parse_mode=parse_mode)
 
 
 async def _save_one_task_and_reply(
@@ -422,7 +366,11 @@ async def _save_one_task_and_reply(
     if not task_text or not task_text.strip():
         await _reply(update, "⚠️ Текст задачи пустой. Напиши, что нужно сделать.")
         return
+    await _reply(update, await bot_updates.run_db(_save_one_task, user_row, task_text))
+
 
+def _save_one_task(user_row: dict, task_text: str) -> str:
+    """Синхронная часть _save_one_task_and_reply (запросы к БД): возвращает текст ответа."""
     task_text = task_text.strip()
     internal_user_id = user_row["id"]
     settings = db.get_settings(internal_user_id)
@@ -482,29 +430,32 @@ async def _save_one_task_and_reply(
             is_routine=is_routine,
             repeat_day=repeat_day,
         )
-        if task_row:
-            msg = _build_confirmation(
-                task_title, due_date, date_label, due_time,
-                category_emoji=category_emoji,
-                category_name=category_name,
-                is_routine=is_routine,
-                repeat_day=task_row.get("repeat_day") or repeat_day,
-                time_of_day=(task_row.get("time_of_day") or time_of_day_val),
-            )
-            await _reply(update, msg)
-            logger.info("v2: задача сохранена id=%s text='%s'", task_row.get("id"), task_title[:50])
-        else:
-            await _reply(update, "⚠️ Не удалось сохранить задачу. Попробуй ещё раз.")
     except Exception as e:
         logger.exception("v2: ошибка сохранения задачи: %s", e)
-        await _reply(update, "⚠️ Произошла ошибка. Попробуй ещё раз.")
+        return "⚠️ Произошла ошибка. Попробуй ещё раз."
+    if not task_row:
+        return "⚠️ Не удалось сохранить задачу. Попробуй ещё раз."
+    logger.info("v2: задача сохранена id=%s text='%s'", task_row.get("id"), task_title[:50])
+    return _build_confirmation(
+        task_title, due_date, date_label, due_time,
+        category_emoji=category_emoji,
+        category_name=category_name,
+        is_routine=is_routine,
+        repeat_day=task_row.get("repeat_day") or repeat_day,
+        time_of_day=(task_row.get("time_of_day") or time_of_day_val),
+    )
 
 
 # ─── Обработчики команд ────────────────────────────────────────────────────
 
+async def _get_user_row(update: Update) -> dict:
+    user = update.effective_user
+    return await bot_updates.run_db(db.get_or_create_user, user.id, user.first_name or "")
+
+
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
-    db.get_or_create_user(user.id, user.first_name or "")
+    await _get_user_row(update)
     _awaiting_task.pop(user.id, None)
     _awaiting_done.pop(user.id, None)
     await _reply(update, ONBOARDING_V2)
@@ -517,7 +468,7 @@ async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def cmd_add(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
-    db.get_or_create_user(user.id, user.first_name or "")
+    await _get_user_row(update)
     _awaiting_done.pop(user.id, None)
     _awaiting_task[user.id] = True
     await _reply(
@@ -537,39 +488,41 @@ def _active_tasks_display_order(user_id: int) -> list[dict]:
     return sorted(tasks, key=key)
 
 
-async def cmd_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    user = update.effective_user
-    user_row = db.get_or_create_user(user.id, user.first_name or "")
-    uid = user_row["id"]
+def _tasks_list_text(uid: int) -> str:
     db.transfer_overdue_tasks(uid)
-    tasks = _active_tasks_display_order(uid)
-    text = _format_task_list(tasks)
-    await _reply(update, text)
+    return _format_task_list(_active_tasks_display_order(uid))
 
 
-async def cmd_today(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    user = update.effective_user
-    user_row = db.get_or_create_user(user.id, user.first_name or "")
-    uid = user_row["id"]
+def _today_plan_text(uid: int) -> str:
     db.transfer_overdue_tasks(uid)
     ordered = _active_tasks_display_order(uid)
     today_tasks = db.get_today_tasks(uid)
     today_ids = {t["id"] for t in today_tasks}
     # Нумерация как в полном списке (чтобы «отметь 5» работало однозначно)
     ordered_today = [(i, t) for i, t in enumerate(ordered, start=1) if t["id"] in today_ids]
-    text = _format_today_list(ordered_today) if ordered_today else "_На сегодня задач нет._"
-    await _reply(update, text)
+    return _format_today_list(ordered_today) if ordered_today else "_На сегодня задач нет._"
+
+
+async def cmd_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_row = await _get_user_row(update)
+    await _reply(update, await bot_updates.run_db(_tasks_list_text, user_row["id"]))
+
+
+async def cmd_today(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_row = await _get_user_row(update)
+    await _reply(update, await bot_updates.run_db(_today_plan_text, user_row["id"]))
 
 
 async def cmd_routines(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Отдельный экран со списком рутин и регулярностью (RT-F4, RT-F5)."""
-    user = update.effective_user
-    user_row = db.get_or_create_user(user.id, user.first_name or "")
-    uid = user_row["id"]
+    user_row = await _get_user_row(update)
+    await _reply(update, await bot_updates.run_db(_routines_text, user_row["id"]))
+
+
+def _routines_text(uid: int) -> str:
     routine_tasks = db.get_routine_tasks(uid)
     if not routine_tasks:
-        await _reply(update, "🔁 *Рутины*\n\n_Пока нет рутин. Добавь, например: «Ежедневная зарядка», «Поливать цветы каждый четверг», «Уборка раз в неделю»._")
-        return
+        return "🔁 *Рутины*\n\n_Пока нет рутин. Добавь, например: «Ежедневная зарядка», «Поливать цветы каждый четверг», «Уборка раз в неделю»._"
     lines = ["🔁 *Рутины*", ""]
     indexed = [(i, t) for i, t in enumerate(routine_tasks, start=1)]
     for bucket, group in _group_tasks_by_time_bucket(indexed):
@@ -581,7 +534,7 @@ async def cmd_routines(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             emoji = _task_line_emoji(t)
             lines.append(f"• {emoji} {t['text']} — _{repeat_label}_")
         lines.append("")
-    await _reply(update, "\n".join(lines).rstrip())
+    return "\n".join(lines).rstrip()
 
 
 def _format_today_list(ordered_today: list[tuple[int, dict]], title: str = "📅 *План на сегодня*") -> str:
@@ -610,15 +563,17 @@ def _format_today_list(ordered_today: list[tuple[int, dict]], title: str = "📅
 
 async def _send_remaining_today(update: Update, user_id: int) -> None:
     """После выполнения задачи — отправить список «ОСТАЛОСЬ СЕГОДНЯ СДЕЛАТЬ» (как план на сегодня)."""
+    await _reply(update, await bot_updates.run_db(_remaining_today_text, user_id))
+
+
+def _remaining_today_text(user_id: int) -> str:
     ordered = _active_tasks_display_order(user_id)
     today_tasks = db.get_today_tasks(user_id)
     today_ids = {t["id"] for t in today_tasks}
     ordered_today = [(i, t) for i, t in enumerate(ordered, start=1) if t["id"] in today_ids]
     if ordered_today:
-        text = _format_today_list(ordered_today, title="🔥 *ОСТАЛОСЬ СЕГОДНЯ СДЕЛАТЬ*")
-    else:
-        text = "🔥 *ОСТАЛОСЬ СЕГОДНЯ СДЕЛАТЬ*\n\n_Всё сделано на сегодня._"
-    await _reply(update, text)
+        return _format_today_list(ordered_today, title="🔥 *ОСТАЛОСЬ СЕГОДНЯ СДЕЛАТЬ*")
+    return "🔥 *ОСТАЛОСЬ СЕГОДНЯ СДЕЛАТЬ*\n\n_Всё сделано на сегодня._"
 
 
 async def cmd_done(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -1230,27 +1185,22 @@ def _format_done_report(tasks: list[dict], title: str) -> str:
     return "\n".join(lines)
 
 
-async def cmd_done_today(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    user = update.effective_user
-    user_row = db.get_or_create_user(user.id, user.first_name or "")
+def _done_today_text(user_row: dict) -> str:
     uid = user_row["id"]
     tasks = db.get_done_tasks_today(uid)
     db.attach_project_labels(uid, tasks)
     tz_name = (user_row.get("timezone") or "Europe/Moscow").strip() or "Europe/Moscow"
     sched = db.list_routines_due_today(uid)
-    text = _format_done_report_today(tasks, tz_name, routines_scheduled=sched)
-    await _reply(update, text)
+    return _format_done_report_today(tasks, tz_name, routines_scheduled=sched)
 
 
-async def cmd_done_week(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    user = update.effective_user
-    user_row = db.get_or_create_user(user.id, user.first_name or "")
+def _done_week_text(user_row: dict) -> str:
     uid = user_row["id"]
     tasks, mon, sun, start_utc, end_utc = db.get_done_tasks_calendar_week(uid)
     db.attach_project_labels(uid, tasks)
     tz_name = (user_row.get("timezone") or "Europe/Moscow").strip() or "Europe/Moscow"
     raw_h = db.routine_completions_raw_between(uid, start_utc, end_utc)
-    text = _format_done_report_week(
+    return _format_done_report_week(
         tasks,
         tz_name,
         week_mon=mon,
@@ -1258,7 +1208,16 @@ async def cmd_done_week(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         habit_completion_rows=raw_h,
         user_id=uid,
     )
-    await _reply(update, text)
+
+
+async def cmd_done_today(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_row = await _get_user_row(update)
+    await _reply(update, await bot_updates.run_db(_done_today_text, user_row))
+
+
+async def cmd_done_week(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_row = await _get_user_row(update)
+    await _reply(update, await bot_updates.run_db(_done_week_text, user_row))
 
 
 async def _handle_complete(
@@ -1266,26 +1225,27 @@ async def _handle_complete(
 ) -> None:
     """Обработка «выполни [название]»: по тексту; при нескольких совпадениях — уточнение."""
     uid = user_row["id"]
+    msg, completed = await bot_updates.run_db(_complete_by_text, uid, text)
+    await _reply(update, msg)
+    if completed:
+        await _send_remaining_today(update, uid)
+
+
+def _complete_by_text(uid: int, text: str) -> tuple[str, bool]:
+    """Синхронная часть _handle_complete: (текст ответа, выполнена ли задача)."""
     nums, num, rest = extract_done_targets(text)
     ordered = _active_tasks_display_order(uid)
     if not ordered:
-        await _reply(update, "Нет активных задач для выполнения.")
-        return
+        return "Нет активных задач для выполнения.", False
 
     if nums or num is not None:
-        await _reply(
-            update,
+        return (
             "Отметка по номеру отключена. Напиши часть названия задачи, например: "
-            "_«Выполни купить молоко»_.",
-        )
-        return
+            "_«Выполни купить молоко»_."
+        ), False
     # По названию
     if not rest:
-        await _reply(
-            update,
-            "Напиши часть названия задачи, например: _«Выполни купить молоко»_.",
-        )
-        return
+        return "Напиши часть названия задачи, например: _«Выполни купить молоко»_.", False
     # Голос может дать «зарегистрировать домен или отогнать машину» — пробуем по частям до первого однозначного
     search_phrases = [s.strip() for s in rest.split(" или ") if s.strip()]
     if not search_phrases:
@@ -1305,16 +1265,12 @@ async def _handle_complete(
         matches = db.find_tasks_matching_text(uid, rest)
         used_query = rest
     if not matches:
-        await _reply(update, f"Задача по запросу «{used_query}» не найдена.")
-        return
+        return f"Задача по запросу «{used_query}» не найдена.", False
     if len(matches) == 1:
         task = matches[0]
         if db.complete_task(task["id"], uid, task=task):
-            await _reply(update, f"🔥 Выполнено: «{task['text']}»")
-            await _send_remaining_today(update, uid)
-        else:
-            await _reply(update, "Не удалось отметить задачу.")
-        return
+            return f"🔥 Выполнено: «{task['text']}»", True
+        return "Не удалось отметить задачу.", False
     parts = []
     for t in matches:
         em = _task_line_emoji(t)
@@ -1324,22 +1280,24 @@ async def _handle_complete(
         + "\n".join(parts)
         + "\n\n_Уточни формулировку, чтобы совпала одна задача (добавь слова из названия)._"
     )
-    await _reply(update, msg)
+    return msg, False
 
 
 async def _handle_uncomplete(update: Update, user_row: dict, text: str) -> None:
     """Отмена выполнения: вернуть задачу в активные (из списка «Сделано сегодня») по фрагменту названия."""
+    await _reply(update, await bot_updates.run_db(_uncomplete_by_text, user_row["id"], text))
+
+
+def _uncomplete_by_text(uid: int, text: str) -> str:
     import re
 
-    uid = user_row["id"]
     done_tasks = db.get_done_tasks_today(uid)
     if not done_tasks:
-        await _reply(update, "Сегодня пока нет выполненных задач. Нечего отменять.")
-        return
+        return "Сегодня пока нет выполненных задач. Нечего отменять."
 
     lower = text.strip().lower()
     rest = ""
-    for syn in SYN_UNCOMPLETE:
+    for syn in intent_router.SYN_UNCOMPLETE:
         if syn in lower:
             rest = text[lower.index(syn) + len(syn) :].strip()
             rest = re.sub(r"^(?:задач[уа]\.?\s*)?(?:номер\s*)?", "", rest, flags=re.IGNORECASE).strip()
@@ -1352,22 +1310,18 @@ async def _handle_uncomplete(update: Update, user_row: dict, text: str) -> None:
         ]
         for t in done_tasks:
             lines.append(f"• {t.get('text', '')}")
-        await _reply(update, "\n".join(lines))
-        return
+        return "\n".join(lines)
 
     q = rest.lower()
     matches = [t for t in done_tasks if q in (t.get("text") or "").lower()]
     if len(matches) > 1:
-        await _reply(update, "Найдено несколько совпадений — уточни фразу из названия.")
-        return
+        return "Найдено несколько совпадений — уточни фразу из названия."
     if len(matches) == 0:
-        await _reply(update, "Не нашла такую задачу среди выполненных сегодня.")
-        return
+        return "Не нашла такую задачу среди выполненных сегодня."
     task = matches[0]
     if db.uncomplete_task(task["id"], uid):
-        await _reply(update, f"↩️ Задача «{task.get('text', '')}» снова в списке активных.")
-    else:
-        await _reply(update, "Не удалось отменить выполнение.")
+        return f"↩️ Задача «{task.get('text', '')}» снова в списке активных."
+    return "Не удалось отменить выполнение."
 
 
 def _resolve_task_by_num_or_search(uid: int, num: int | None, search_text: str | None) -> dict | None:
@@ -1385,28 +1339,30 @@ def _resolve_task_by_num_or_search(uid: int, num: int | None, search_text: str |
             return matches[0]
         if len(matches) > 1:
             return None
+        # Голос мог исказить слова («малоко») — допускаем опечатки, если совпадение однозначно.
+        return db.find_task_fuzzy_unique(uid, search_text.strip())
     return None
 
 
 async def _handle_edit(update: Update, user_row: dict, text: str) -> None:
     """Изменить текст задачи/рутины или только время суток (глобальный номер из списка задач)."""
-    uid = user_row["id"]
+    await _reply(update, await bot_updates.run_db(_edit_by_text, user_row["id"], text))
+
+
+def _edit_by_text(uid: int, text: str) -> str:
     num, search_text, new_text = extract_edit_target(text)
     if not new_text or not new_text.strip():
-        await _reply(
-            update,
+        return (
             "Напиши, например: _Изменить задачу 2 на Купить хлеб_, "
             "_Изменить рутину 3 на вечер_, "
-            "_Исправить купить молоко на Купить хлеб_.",
+            "_Исправить купить молоко на Купить хлеб_."
         )
-        return
     task = _resolve_task_by_num_or_search(uid, num, search_text)
     if task is None:
         if num is not None:
-            await _reply(update, f"Нет задачи с номером {num}. Посмотри список задач и укажи верный номер.")
+            return f"Нет задачи с номером {num}. Посмотри список задач и укажи верный номер."
         else:
-            await _reply(update, f"Задача по запросу «{search_text}» не найдена или найдено несколько — укажи номер.")
-        return
+            return f"Задача по запросу «{search_text}» не найдена или найдено несколько — укажи номер."
     new_raw = new_text.strip()
     tod_action = classify_time_of_day_edit(new_raw)
     if tod_action != "not":
@@ -1415,42 +1371,38 @@ async def _handle_edit(update: Update, user_row: dict, text: str) -> None:
         if updated:
             title = updated.get("text") or task.get("text", "")
             if tod_action == "clear":
-                await _reply(update, f"✏️ Время суток сброшено: «{title}»")
+                return f"✏️ Время суток сброшено: «{title}»"
             else:
-                await _reply(
-                    update,
-                    f"✏️ Время суток: *{new_tod}* — «{title}»",
-                )
+                return f"✏️ Время суток: *{new_tod}* — «{title}»"
         else:
-            await _reply(update, "Не удалось обновить время суток.")
-        return
+            return "Не удалось обновить время суток."
     new_title = normalize_task_display(new_raw)
     if new_title and new_title[0].isalpha():
         new_title = new_title[0].upper() + new_title[1:]
     updated = db.update_task(task["id"], uid, text=new_title)
     if updated:
-        await _reply(update, f"✏️ Задача обновлена: «{updated.get('text', new_title)}»")
+        return f"✏️ Задача обновлена: «{updated.get('text', new_title)}»"
     else:
-        await _reply(update, "Не удалось изменить задачу.")
+        return "Не удалось изменить задачу."
 
 
 async def _handle_reschedule(update: Update, user_row: dict, text: str) -> None:
     """Перенести задачу по дате/времени: «Перенеси задачу 3 на завтра», для рутины — смена дня недели."""
-    uid = user_row["id"]
+    await _reply(update, await bot_updates.run_db(_reschedule_by_text, user_row["id"], text))
+
+
+def _reschedule_by_text(uid: int, text: str) -> str:
     num, search_text, due_date, due_time = extract_reschedule_target(text)
     task = _resolve_task_by_num_or_search(uid, num, search_text)
     if task is None:
         if num is not None:
-            await _reply(update, f"Нет задачи с номером {num}. Посмотри список задач и укажи верный номер.")
+            return f"Нет задачи с номером {num}. Посмотри список задач и укажи верный номер."
         else:
-            await _reply(update, f"Задача по запросу «{search_text}» не найдена или найдено несколько — укажи номер.")
-        return
+            return f"Задача по запросу «{search_text}» не найдена или найдено несколько — укажи номер."
     if not due_date and not due_time:
-        await _reply(
-            update,
-            "Укажи новую дату или время, например: _Перенеси задачу 2 на завтра_, _на пятницу в 10:00_.",
+        return (
+            "Укажи новую дату или время, например: _Перенеси задачу 2 на завтра_, _на пятницу в 10:00_."
         )
-        return
     updates = {}
     if task.get("is_routine") and due_date:
         try:
@@ -1474,34 +1426,35 @@ async def _handle_reschedule(update: Update, user_row: dict, text: str) -> None:
         except Exception:
             pass
     if not updates:
-        await _reply(update, "Не удалось определить новую дату или день. Попробуй: _на завтра_, _на пятницу_.")
-        return
+        return "Не удалось определить новую дату или день. Попробуй: _на завтра_, _на пятницу_."
     updated = db.update_task(task["id"], uid, **updates)
     if updated:
         if "repeat_day" in updates:
             label = db.format_repeat_day_display(updates["repeat_day"])
-            await _reply(update, f"📅 Рутина перенесена: «{task.get('text', '')}» — _{label}_")
+            return f"📅 Рутина перенесена: «{task.get('text', '')}» — _{label}_"
         else:
             parts = [f"«{updated.get('text', task.get('text', ''))}»"]
             if updates.get("due_date"):
                 parts.append(f"на {updates['due_date']}")
             if updates.get("due_time"):
                 parts.append(f"в {updates['due_time']}")
-            await _reply(update, "📅 Задача перенесена: " + " ".join(parts))
+            return "📅 Задача перенесена: " + " ".join(parts)
     else:
-        await _reply(update, "Не удалось перенести задачу.")
+        return "Не удалось перенести задачу."
 
 
 async def _handle_delete(update: Update, user_row: dict, text: str) -> None:
     """Удаление задачи или рутины по номеру: «Удали задачу 3», «Удали рутину 2»."""
-    uid = user_row["id"]
+    await _reply(update, await bot_updates.run_db(_delete_by_text, user_row["id"], text))
+
+
+def _delete_by_text(uid: int, text: str) -> str:
     num, is_routine = extract_delete_target(text)
     if num is None:
         if is_routine:
-            await _reply(update, "Напиши номер рутины для удаления, например: _Удали рутину 2_. Список: /routines")
+            return "Напиши номер рутины для удаления, например: _Удали рутину 2_. Список: /routines"
         else:
-            await _reply(update, "Напиши номер задачи для удаления, например: _Удали задачу 3_. Номера — в списке задач.")
-        return
+            return "Напиши номер задачи для удаления, например: _Удали задачу 3_. Номера — в списке задач."
     if is_routine:
         tasks = db.get_routine_tasks(uid)
         list_name = "рутин"
@@ -1509,42 +1462,31 @@ async def _handle_delete(update: Update, user_row: dict, text: str) -> None:
         tasks = _active_tasks_display_order(uid)
         list_name = "задач"
     if not tasks:
-        await _reply(update, f"Нет {list_name} для удаления.")
-        return
+        return f"Нет {list_name} для удаления."
     if 1 <= num <= len(tasks):
         task = tasks[num - 1]
         if db.delete_task(task["id"], uid):
-            await _reply(update, f"🗑 Удалено: «{task.get('text', '')}»")
+            return f"🗑 Удалено: «{task.get('text', '')}»"
         else:
-            await _reply(update, "Не удалось удалить.")
+            return "Не удалось удалить."
     else:
-        await _reply(update, f"Нет {list_name} с номером {num}. В списке от 1 до {len(tasks)}.")
-
-
-def _match_synonym(text: str, phrases: tuple[str, ...]) -> bool:
-    """True, если текст (нижний регистр) совпадает с фразой или содержит её."""
-    lower = text.strip().lower()
-    return any(p in lower or lower == p for p in phrases)
+        return f"Нет {list_name} с номером {num}. В списке от 1 до {len(tasks)}."
 
 
 # ─── Обработка текста и голоса ─────────────────────────────────────────────
 
-async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def _handle_message_text(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, user_row: dict, text: str
+) -> None:
+    """Общая часть handle_text и handle_voice: режимы ожидания, затем намерение из intent_router."""
     user = update.effective_user
-    user_row = db.get_or_create_user(user.id, user.first_name or "")
-    text = (update.message.text or "").strip()
-
-    if not text:
-        await _reply(update, "Напиши текст задачи или используй «Добавь [задача]».")
-        return
 
     # Режим «ожидаю номер/название для выполнения» после /done
     if _awaiting_done.pop(user.id, False):
-        msg = text.strip()
-        if msg.isdigit():
-            await _handle_complete(update, user_row, f"отметь {msg}")
+        if text.isdigit():
+            await _handle_complete(update, user_row, f"отметь {text}")
         else:
-            await _handle_complete(update, user_row, f"выполни {msg}")
+            await _handle_complete(update, user_row, f"выполни {text}")
         return
 
     # Режим «ожидаю задачу» после /add
@@ -1552,110 +1494,50 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         await _save_one_task_and_reply(update, user_row, text)
         return
 
-    # Синонимы: помощь
-    if _match_synonym(text, SYN_HELP):
+    intent, payload = intent_router.route(text)
+    if intent == "help":
         await cmd_help(update, context)
-        return
-
-    # Синонимы: список задач
-    if _match_synonym(text, SYN_LIST_TASKS):
-        uid = user_row["id"]
-        db.transfer_overdue_tasks(uid)
-        tasks = _active_tasks_display_order(uid)
-        await _reply(update, _format_task_list(tasks))
-        return
-
-    # Синонимы: план на сегодня
-    if _match_synonym(text, SYN_TODAY):
-        uid = user_row["id"]
-        db.transfer_overdue_tasks(uid)
-        ordered = _active_tasks_display_order(uid)
-        today_tasks = db.get_today_tasks(uid)
-        today_ids = {t["id"] for t in today_tasks}
-        ordered_today = [(i, t) for i, t in enumerate(ordered, start=1) if t["id"] in today_ids]
-        msg = _format_today_list(ordered_today) if ordered_today else "_На сегодня задач нет._"
-        await _reply(update, msg)
-        return
-
-    # Синонимы: рутины
-    if _match_synonym(text, SYN_ROUTINES):
+    elif intent == "list_tasks":
+        await _reply(update, await bot_updates.run_db(_tasks_list_text, user_row["id"]))
+    elif intent == "today":
+        await _reply(update, await bot_updates.run_db(_today_plan_text, user_row["id"]))
+    elif intent == "routines":
         await cmd_routines(update, context)
-        return
-
-    # Синонимы: сделано сегодня
-    if _match_synonym(text, SYN_DONE_TODAY):
-        uid = user_row["id"]
-        tasks = db.get_done_tasks_today(uid)
-        db.attach_project_labels(uid, tasks)
-        tz_name = (user_row.get("timezone") or "Europe/Moscow").strip() or "Europe/Moscow"
-        sched = db.list_routines_due_today(uid)
-        await _reply(update, _format_done_report_today(tasks, tz_name, routines_scheduled=sched))
-        return
-
-    # Синонимы: сделано за неделю
-    if _match_synonym(text, SYN_DONE_WEEK):
-        uid = user_row["id"]
-        tasks, mon, sun, start_utc, end_utc = db.get_done_tasks_calendar_week(uid)
-        db.attach_project_labels(uid, tasks)
-        tz_name = (user_row.get("timezone") or "Europe/Moscow").strip() or "Europe/Moscow"
-        raw_h = db.routine_completions_raw_between(uid, start_utc, end_utc)
-        await _reply(
-            update,
-            _format_done_report_week(
-                tasks,
-                tz_name,
-                week_mon=mon,
-                week_sun=sun,
-                habit_completion_rows=raw_h,
-                user_id=uid,
-            ),
-        )
-        return
-
-    # Синонимы: добавить задачу (без текста задачи) — включить режим «следующее сообщение = задача»
-    if _match_synonym(text, SYN_ADD_TASK):
+    elif intent == "done_today":
+        await _reply(update, await bot_updates.run_db(_done_today_text, user_row))
+    elif intent == "done_week":
+        await _reply(update, await bot_updates.run_db(_done_week_text, user_row))
+    elif intent == "await_task":
+        # «Добавить задачу» без текста — следующее сообщение будет задачей.
         _awaiting_task[user.id] = True
         await _reply(update, "Напиши или надиктуй задачу — *следующее* сообщение я сохраню как задачу.")
-        return
-
-    # Удалить задачу/рутину по номеру: «Удали задачу 3», «Удали рутину 2»
-    if starts_with_delete_marker(text):
-        await _handle_delete(update, user_row, text)
-        return
-
-    # Изменить задачу: «Изменить задачу 2 на Купить хлеб»
-    if starts_with_edit_marker(text):
-        await _handle_edit(update, user_row, text)
-        return
+    elif intent == "delete":
+        await _handle_delete(update, user_row, payload)
+    elif intent == "edit":
+        await _handle_edit(update, user_row, payload)
+    elif intent == "reschedule":
+        await _handle_reschedule(update, user_row, payload)
+    elif intent == "uncomplete":
+        await _handle_uncomplete(update, user_row, payload)
+    elif intent == "complete":
+        await _handle_complete(update, user_row, payload)
+    else:
+        # «Добавь …» или сообщение без явной команды — записываем как задачу.
+        await _save_one_task_and_reply(update, user_row, payload)
 
-    # Перенести задачу: «Перенеси задачу 3 на завтра»
-    if starts_with_reschedule_marker(text):
-        await _handle_reschedule(update, user_row, text)
-        return
 
-    # Отменить выполнение: «отменить выполнение 1», «вернуть задачу 2»
-    if _match_synonym(text, SYN_UNCOMPLETE):
-        await _handle_uncomplete(update, user_row, text)
-        return
-
-    # Выполнение: «отметь 3», «выполни купить молоко»
-    if starts_with_done_marker(text):
-        await _handle_complete(update, user_row, text)
-        return
+async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_row = await _get_user_row(update)
+    text = (update.message.text or "").strip()
 
-    # Фраза вида «Добавь ...» / «Создай ...» / «Запиши ...»
-    if starts_with_add_marker(text):
-        task_text = extract_task_text(text)
-        await _save_one_task_and_reply(update, user_row, task_text)
+    if not text:
+        await _reply(update, "Напиши текст задачи или используй «Добавь [задача]».")
         return
-
-    # По умолчанию: нет явной команды — записываем как задачу
-    await _save_one_task_and_reply(update, user_row, text)
+    await _handle_message_text(update, context, user_row, text)
 
 
 async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    user = update.effective_user
-    user_row = db.get_or_create_user(user.id, user.first_name or "")
+    user_row = await _get_user_row(update)
 
     voice = update.message.voice
     if not voice:
@@ -1665,7 +1547,7 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     try:
         file = await context.bot.get_file(voice.file_id)
         voice_bytes = await file.download_as_bytearray()
-        text = ai_module.transcribe_voice(bytes(voice_bytes))
+        text = await bot_updates.run_voice(ai_module.transcribe_voice, bytes(voice_bytes))
     except Exception as e:
         logger.exception("v2: ошибка распознавания голоса: %s", e)
         await _reply(update, "⚠️ Не удалось распознать голос. Попробуй ещё раз или напиши текстом.")
@@ -1676,104 +1558,8 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         return
 
     text = text.strip()
-    await update.message.reply_text(f"🎤 Распознано: «{text[:200]}{'…' if len(text) > 200 else ''}»")
-
-    if _awaiting_done.pop(user.id, False):
-        if text.isdigit():
-            await _handle_complete(update, user_row, f"отметь {text}")
-        else:
-            await _handle_complete(update, user_row, f"выполни {text}")
-        return
-
-    if _awaiting_task.pop(user.id, False):
-        await _save_one_task_and_reply(update, user_row, text)
-        return
-
-    if _match_synonym(text, SYN_HELP):
-        await cmd_help(update, context)
-        return
-
-    if _match_synonym(text, SYN_LIST_TASKS):
-        uid = user_row["id"]
-        db.transfer_overdue_tasks(uid)
-        tasks = _active_tasks_display_order(uid)
-        await _reply(update, _format_task_list(tasks))
-        return
-
-    if _match_synonym(text, SYN_TODAY):
-        uid = user_row["id"]
-        db.transfer_overdue_tasks(uid)
-        ordered = _active_tasks_display_order(uid)
-        today_tasks = db.get_today_tasks(uid)
-        today_ids = {t["id"] for t in today_tasks}
-        ordered_today = [(i, t) for i, t in enumerate(ordered, start=1) if t["id"] in today_ids]
-        msg = _format_today_list(ordered_today) if ordered_today else "_На сегодня задач нет._"
-        await _reply(update, msg)
-        return
-
-    if _match_synonym(text, SYN_ROUTINES):
-        await cmd_routines(update, context)
-        return
-
-    if _match_synonym(text, SYN_DONE_TODAY):
-        uid = user_row["id"]
-        tasks = db.get_done_tasks_today(uid)
-        db.attach_project_labels(uid, tasks)
-        tz_name = (user_row.get("timezone") or "Europe/Moscow").strip() or "Europe/Moscow"
-        sched = db.list_routines_due_today(uid)
-        await _reply(update, _format_done_report_today(tasks, tz_name, routines_scheduled=sched))
-        return
-
-    if _match_synonym(text, SYN_DONE_WEEK):
-        uid = user_row["id"]
-        tasks, mon, sun, start_utc, end_utc = db.get_done_tasks_calendar_week(uid)
-        db.attach_project_labels(uid, tasks)
-        tz_name = (user_row.get("timezone") or "Europe/Moscow").strip() or "Europe/Moscow"
-        raw_h = db.routine_completions_raw_between(uid, start_utc, end_utc)
-        await _reply(
-            update,
-            _format_done_report_week(
-                tasks,
-                tz_name,
-                week_mon=mon,
-                week_sun=sun,
-                habit_completion_rows=raw_h,
-                user_id=uid,
-            ),
-        )
-        return
-
-    if _match_synonym(text, SYN_ADD_TASK):
-        _awaiting_task[user.id] = True
-        await _reply(update, "Напиши или надиктуй задачу — *следующее* сообщение я сохраню как задачу.")
-        return
-
-    if starts_with_delete_marker(text):
-        await _handle_delete(update, user_row, text)
-        return
-
-    if starts_with_edit_marker(text):
-        await _handle_edit(update, user_row, text)
-        return
-
-    if starts_with_reschedule_marker(text):
-        await _handle_reschedule(update, user_row, text)
-        return
-
-    if _match_synonym(text, SYN_UNCOMPLETE):
-        await _handle_uncomplete(update, user_row, text)
-        return
-
-    if starts_with_done_marker(text):
-        await _handle_complete(update, user_row, text)
-        return
-
-    if starts_with_add_marker(text):
-        task_text = extract_task_text(text)
-        await _save_one_task_and_reply(update, user_row, task_text)
-        return
-
-    await _save_one_task_and_reply(update, user_row, text)
+    await _reply(update, f"🎤 Распознано: «{text[:200]}{'…' if len(text) > 200 else ''}»", parse_mode=None)
+    await _handle_message_text(update, context, user_row, text)
 
 
 # ─── Меню и запуск ─────────────────────────────────────────────────────────
@@ -1790,13 +1576,64 @@ def _set_menu_commands_sync() -> None:
         logger.warning("Не удалось установить меню при старте: %s", e)
 
 
-def main() -> None:
-    if not BOT_TOKEN or BOT_TOKEN == "YOUR_BOT_TOKEN":
-        print("Задайте TELEGRAM_BOT_TOKEN.")
-        return
+async def _post_init(application: Application) -> None:
+    try:
+        await application.bot.delete_my_commands()
+        await application.bot.set_my_commands([BotCommand(cmd, desc) for cmd, desc in BOT_COMMANDS])
+        logger.info("v2: меню установлено (%d пунктов)", len(BOT_COMMANDS))
+    except Exception as e:
+        logger.exception("v2: ошибка установки меню: %s", e)
+    # Изменения из бота сразу видны открытым вкладкам веба (и наоборот — сброс кешей).
+    if db.USE_PG:
+        events.start_pg_bridge(db.DATABASE_URL, on_remote=db.note_external_change)
+    try:
+        await reminders.start(application)
+    except Exception as e:
+        logger.exception("v2: напоминания не запущены: %s", e)
+
+
+async def _post_shutdown(application: Application) -> None:
+    await reminders.stop()
+
+
+async def _on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Логирует полный traceback и контекст апдейта для быстрой диагностики в проде."""
+    update_type = type(update).__name__
+    user_id = None
+    chat_id = None
+    message_text = None
+    callback_data = None
+    if isinstance(update, Update):
+        if update.effective_user:
+            user_id = update.effective_user.id
+        if update.effective_chat:
+            chat_id = update.effective_chat.id
+        if update.message:
+            message_text = (update.message.text or "").strip()
+        if update.callback_query:
+            callback_data = update.callback_query.data
+
+    logger.exception(
+        "Ошибка обработчика: %s | update_type=%s user_id=%s chat_id=%s text=%r callback=%r",
+        context.error,
+        update_type,
+        user_id,
+        chat_id,
+        message_text,
+        callback_data,
+    )
+    if isinstance(context.error, (TimedOut, NetworkError)):
+        logger.warning("Сетевая ошибка (будет ретрай/повтор): %s", context.error)
+
+    if isinstance(update, Update) and update.message:
+        await _reply(update, "⚠️ Произошла ошибка. Попробуй ещё раз через пару секунд.", parse_mode=None)
 
-    _set_menu_commands_sync()
 
+def build_application() -> Application:
+    """
+    Application бота со всеми обработчиками. Запуск — run_polling в main() или
+    webhook внутри веб-приложения (web/telegram_webhook.py).
+    """
     builder = (
         Application.builder()
         .token(BOT_TOKEN)
@@ -1808,15 +1645,9 @@ def main() -> None:
         builder = builder.proxy(PROXY_URL).get_updates_proxy(PROXY_URL)
         logger.info("Прокси: %s", PROXY_URL.split("@")[-1] if "@" in PROXY_URL else PROXY_URL)
 
-    async def post_init(application: Application) -> None:
-        try:
-            await application.bot.delete_my_commands()
-            await application.bot.set_my_commands([BotCommand(cmd, desc) for cmd, desc in BOT_COMMANDS])
-            logger.info("v2: меню установлено (%d пунктов)", len(BOT_COMMANDS))
-        except Exception as e:
-            logger.exception("v2: ошибка установки меню: %s", e)
-
-    app = builder.post_init(post_init).build()
+    # Апдейты разных чатов — параллельно, одного чата — по порядку (bot_updates).
+    builder = builder.concurrent_updates(bot_updates.ChatOrderedUpdateProcessor())
+    app = builder.post_init(_post_init).post_shutdown(_post_shutdown).build()
 
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("help", cmd_help))
@@ -1829,43 +1660,22 @@ def main() -> None:
     app.add_handler(CommandHandler("done_week", cmd_done_week))
     app.add_handler(MessageHandler(filters.VOICE, handle_voice))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+    app.add_error_handler(_on_error)
+    return app
 
-    async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Логирует полный traceback и контекст апдейта для быстрой диагностики в проде."""
-        update_type = type(update).__name__
-        user_id = None
-        chat_id = None
-        message_text = None
-        callback_data = None
-        if isinstance(update, Update):
-            if update.effective_user:
-                user_id = update.effective_user.id
-            if update.effective_chat:
-                chat_id = update.effective_chat.id
-            if update.message:
-                message_text = (update.message.text or "").strip()
-            if update.callback_query:
-                callback_data = update.callback_query.data
-
-        logger.exception(
-            "Ошибка обработчика: %s | update_type=%s user_id=%s chat_id=%s text=%r callback=%r",
-            context.error,
-            update_type,
-            user_id,
-            chat_id,
-            message_text,
-            callback_data,
-        )
-        if isinstance(context.error, (TimedOut, NetworkError)):
-            logger.warning("Сетевая ошибка (будет ретрай/повтор): %s", context.error)
 
-        if isinstance(update, Update) and update.message:
-            try:
-                await update.message.reply_text("⚠️ Произошла ошибка. Попробуй ещё раз через пару секунд.")
-            except Exception:
-                pass
+def main() -> None:
+    if not BOT_TOKEN or BOT_TOKEN == "YOUR_BOT_TOKEN":
+        print("Задайте TELEGRAM_BOT_TOKEN.")
+        return
+    if os.environ.get("TELEGRAM_WEBHOOK_URL", "").strip():
+        # run_polling снял бы webhook, и бот с вебом перетягивали бы апдейты друг у друга.
+        logger.info("Задан TELEGRAM_WEBHOOK_URL: бот работает внутри веб-приложения, polling не запускаем.")
+        return
+
+    _set_menu_commands_sync()
 
-    app.add_error_handler(on_error)
+    app = build_application()
     logger.info("Бот v2 запущен (без LLM, только Whisper для голоса).")
 
     # Python 3.12+: в main thread loop может отсутствовать.
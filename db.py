@@ -5,12 +5,21 @@
 Многопользовательская изоляция: все запросы фильтруются по user_id.
 """
 
+import functools
+import json
+import inspect
 import os
 import random
 import logging
+import threading
+import time as _time
+from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
 from itertools import combinations
 
+import events
+import fuzzy_match
+
 try:
     from zoneinfo import ZoneInfo
 except ImportError:
@@ -30,6 +39,62 @@ else:
 _conn = None
 # Для SQLite: какой путь открыт в _conn (переподключение при смене BOT_DB_PATH в процессе).
 _SQLITE_OPEN_PATH: str | None = None
+# SQLite: одно общее соединение на процесс, операции над ним сериализуются.
+_sqlite_lock = threading.RLock()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, "") or default)
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, "") or default)
+    except ValueError:
+        return default
+
+
+# ── Пул PG-подключений ──────────────────────────────────────────────────
+# Веб (uvicorn, threadpool) и бот обращаются к БД из нескольких потоков:
+# каждое обращение берёт своё соединение из пула и возвращает его обратно.
+DB_POOL_MIN = max(0, _env_int("DB_POOL_MIN", 1))
+DB_POOL_MAX = max(1, _env_int("DB_POOL_MAX", 8))
+# Сколько ждать свободное соединение, прежде чем отдать ошибку.
+DB_POOL_TIMEOUT_SEC = _env_float("DB_POOL_TIMEOUT_SEC", 10.0)
+# Соединение, пролежавшее в пуле дольше этого, перед выдачей проверяется SELECT 1
+# (0 — проверять при каждой выдаче).
+DB_POOL_PING_IDLE_SEC = _env_float("DB_POOL_PING_IDLE_SEC", 30.0)
+
+
+class PoolTimeoutError(RuntimeError):
+    """Все соединения пула заняты дольше DB_POOL_TIMEOUT_SEC."""
+
+
+_pool_lock = threading.Lock()
+_pool_ready = False
+_pool_slots: threading.BoundedSemaphore | None = None
+# Поколение пула: _drop_conn и новая инициализация его меняют. Выданное соединение
+# помнит семафор и поколение, из которых взято: вернувшись после сброса пула, оно
+# закрывается и освобождает слот старого семафора, а не нового.
+_pool_generation = 0
+_pool_out: dict[int, tuple] = {}
+# Свободные соединения: (conn, monotonic-время возврата в пул). Выдаём LIFO —
+# самое «тёплое» соединение реже оказывается разорванным.
+_pool_idle: list[tuple] = []
+_pool_metrics = {
+    "checkouts": 0,
+    "waits": 0,
+    "wait_ms_total": 0.0,
+    "timeouts": 0,
+    "created": 0,
+    "discarded": 0,
+    "pings": 0,
+    "in_use": 0,
+    "peak_in_use": 0,
+}
 
 
 def _sqlite_db_path() -> str:
@@ -38,70 +103,212 @@ def _sqlite_db_path() -> str:
 
 # ── Подключение ─────────────────────────────────────────────────────────
 
-def _get_conn():
-    """
-    Возвращает PG/SQLite-подключение. Для PG соединение ленивое — мы НЕ
-    пингуем его на каждый вызов (это +1 SQL на каждое обращение к БД).
-    Если соединение оборвалось, переподключаемся при следующей реальной
-    операции (см. _fetchone/_fetchall/_execute — они ловят исключение
-    и пробуют ещё раз).
-    """
-    global _conn, _SQLITE_OPEN_PATH
-    if USE_PG:
-        if _conn is None or getattr(_conn, "closed", 0) != 0:
-            _conn = psycopg2.connect(DATABASE_URL, sslmode="require")
-            _conn.autocommit = True
-            _init_tables_pg()
-            logger.info("PostgreSQL connected")
-    else:
-        path = _sqlite_db_path()
-        if _conn is not None and _SQLITE_OPEN_PATH != path:
+def _pg_connect():
+    conn = psycopg2.connect(DATABASE_URL, sslmode="require")
+    conn.autocommit = True
+    return conn
+
+
+def _pg_pool_init() -> None:
+    """Ленивая инициализация пула: схема проверяется один раз на процесс."""
+    global _pool_ready, _pool_slots, _pool_generation
+    if _pool_ready:
+        return
+    with _pool_lock:
+        if _pool_ready:
+            return
+        conn = _pg_connect()
+        _migrate(conn)
+        now = _time.monotonic()
+        idle = [(conn, now)]
+        for _ in range(DB_POOL_MIN - 1):
             try:
-                _conn.close()
+                idle.append((_pg_connect(), now))
             except Exception:
-                pass
-            _conn = None
-            _SQLITE_OPEN_PATH = None
-        if _conn is None:
-            _conn = sqlite3.connect(path, check_same_thread=False)
-            _SQLITE_OPEN_PATH = path
-            _conn.row_factory = sqlite3.Row
-            _conn.execute("PRAGMA journal_mode=WAL")
-            _conn.execute("PRAGMA foreign_keys=ON")
-            _init_tables_sqlite()
-        _ensure_routine_completions_table_sqlite()
-    return _conn
+                logger.exception("DB pool: не удалось открыть резервное соединение")
+                break
+        _pool_metrics["created"] += len(idle)
+        _pool_idle[:] = idle
+        _pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+        _pool_generation += 1
+        _pool_ready = True
+        logger.info("PostgreSQL pool ready (min=%s, max=%s)", DB_POOL_MIN, DB_POOL_MAX)
 
 
-def _ensure_routine_completions_table_sqlite() -> None:
-    """Миграция: таблица журнала рутин для уже существующих SQLite-файлов."""
-    if USE_PG or _conn is None:
-        return
+def _close_quietly(conn) -> None:
     try:
-        _conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS routine_completions (
-                id              INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id         INTEGER NOT NULL REFERENCES users(id),
-                task_id         INTEGER NOT NULL REFERENCES tasks(id),
-                completed_at    TEXT NOT NULL
-            )
-            """
-        )
-        _conn.execute(
-            "CREATE INDEX IF NOT EXISTS idx_rc_user_time ON routine_completions(user_id, completed_at)"
-        )
-        _conn.execute(
-            "CREATE INDEX IF NOT EXISTS idx_rc_user_task ON routine_completions(user_id, task_id)"
-        )
-        _conn.commit()
+        conn.close()
     except Exception:
         pass
 
 
-def _init_tables_pg() -> None:
-    cur = _conn.cursor()
-    cur.execute("""
+def _pg_conn_alive(conn) -> bool:
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.fetchone()
+        cur.close()
+        return True
+    except Exception:
+        return False
+
+
+def _pg_checkout():
+    """Берёт соединение из пула (ждёт не дольше DB_POOL_TIMEOUT_SEC)."""
+    _pg_pool_init()
+    with _pool_lock:
+        slots, generation = _pool_slots, _pool_generation
+    if not slots.acquire(blocking=False):
+        t0 = _time.monotonic()
+        got = slots.acquire(timeout=DB_POOL_TIMEOUT_SEC)
+        with _pool_lock:
+            _pool_metrics["waits"] += 1
+            _pool_metrics["wait_ms_total"] += (_time.monotonic() - t0) * 1000.0
+            if not got:
+                _pool_metrics["timeouts"] += 1
+        if not got:
+            raise PoolTimeoutError(
+                f"Нет свободных соединений с БД за {DB_POOL_TIMEOUT_SEC:g} с (max={DB_POOL_MAX})"
+            )
+    try:
+        while True:
+            with _pool_lock:
+                item = _pool_idle.pop() if _pool_idle else None
+            if item is None:
+                conn = _pg_connect()
+                with _pool_lock:
+                    _pool_metrics["created"] += 1
+                break
+            conn, idle_since = item
+            if getattr(conn, "closed", 0) != 0:
+                with _pool_lock:
+                    _pool_metrics["discarded"] += 1
+                continue
+            if _time.monotonic() - idle_since >= DB_POOL_PING_IDLE_SEC:
+                with _pool_lock:
+                    _pool_metrics["pings"] += 1
+                if not _pg_conn_alive(conn):
+                    _close_quietly(conn)
+                    with _pool_lock:
+                        _pool_metrics["discarded"] += 1
+                    continue
+            break
+    except Exception:
+        slots.release()
+        raise
+    with _pool_lock:
+        _pool_out[id(conn)] = (slots, generation)
+        _pool_metrics["checkouts"] += 1
+        _pool_metrics["in_use"] += 1
+        if _pool_metrics["in_use"] > _pool_metrics["peak_in_use"]:
+            _pool_metrics["peak_in_use"] = _pool_metrics["in_use"]
+    return conn
+
+
+def _pg_checkin(conn, discard: bool = False) -> None:
+    """Возвращает соединение в пул; разорванное или «грязное» — закрывает."""
+    if not discard and getattr(conn, "closed", 0) == 0:
+        try:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except Exception:
+            discard = True
+    else:
+        discard = True
+    with _pool_lock:
+        slots, generation = _pool_out.pop(id(conn), (None, None))
+        if generation != _pool_generation:
+            # Пул сбросили, пока соединение было выдано: в новый пул его не кладём.
+            discard = True
+        _pool_metrics["in_use"] -= 1
+        if discard:
+            _pool_metrics["discarded"] += 1
+        else:
+            _pool_idle.append((conn, _time.monotonic()))
+    if discard:
+        _close_quietly(conn)
+    if slots is not None:
+        slots.release()
+
+
+def pool_stats() -> dict:
+    """Метрики пула PG-соединений (для логов и /healthz)."""
+    with _pool_lock:
+        stats = dict(_pool_metrics)
+        stats["idle"] = len(_pool_idle)
+    stats["min"] = DB_POOL_MIN
+    stats["max"] = DB_POOL_MAX
+    stats["backend"] = "postgres" if USE_PG else "sqlite"
+    return stats
+
+
+def _get_conn():
+    """
+    Общее SQLite-подключение процесса (переоткрывается при смене BOT_DB_PATH).
+    Схема проверяется один раз при открытии. Для PG соединения берутся из пула
+    через _connection().
+    """
+    global _conn, _SQLITE_OPEN_PATH
+    path = _sqlite_db_path()
+    if _conn is not None and _SQLITE_OPEN_PATH != path:
+        _close_quietly(_conn)
+        _conn = None
+        _SQLITE_OPEN_PATH = None
+        _reset_data_caches()
+    if _conn is None:
+        _conn = sqlite3.connect(path, check_same_thread=False)
+        _SQLITE_OPEN_PATH = path
+        _conn.row_factory = sqlite3.Row
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA foreign_keys=ON")
+        _migrate(_conn)
+    return _conn
+
+
+# Открытая в этом потоке транзакция: conn — закреплённое соединение, depth — вложенность.
+_tx_local = threading.local()
+
+
+def _tx_conn():
+    return getattr(_tx_local, "conn", None)
+
+
+@contextmanager
+def _connection():
+    """
+    Подключение на время одной операции. PG — соединение из пула
+    (при обрыве связи оно выбрасывается, а не возвращается), SQLite — общее
+    соединение под блокировкой. Внутри transaction() — её соединение.
+    """
+    pinned = _tx_conn()
+    if pinned is not None:
+        yield pinned
+        return
+    if not USE_PG:
+        with _sqlite_lock:
+            yield _get_conn()
+        return
+    conn = _pg_checkout()
+    broken = False
+    try:
+        yield conn
+    except Exception as exc:
+        broken = _is_pg_connection_error(exc)
+        raise
+    finally:
+        _pg_checkin(conn, discard=broken)
+
+
+# ── Схема и миграции ────────────────────────────────────────────────────
+# Каждая миграция — (номер, описание, список SQL). Номера только растут;
+# применённые записываются в schema_version и больше не выполняются, поэтому
+# при (пере)подключении проверяется только текущая версия. Новые изменения
+# схемы — новой записью в конце списка, старые записи не редактировать.
+#
+# Базы, созданные до появления schema_version, проходят все миграции с нуля:
+# ошибки «колонка/индекс уже есть» при этом считаются успешным применением.
+
+_BASE_SCHEMA_PG = """
     CREATE TABLE IF NOT EXISTS users (
         id              SERIAL PRIMARY KEY,
         telegram_id     BIGINT UNIQUE NOT NULL,
@@ -176,42 +383,9 @@ def _init_tables_pg() -> None:
     );
     CREATE INDEX IF NOT EXISTS idx_dps_user_date ON daily_plan_slots(user_id, plan_date);
     CREATE UNIQUE INDEX IF NOT EXISTS idx_dps_unique ON daily_plan_slots(user_id, plan_date, task_id);
-    """)
-    for col_sql in (
-        "ALTER TABLE tasks ADD COLUMN is_routine BOOLEAN DEFAULT FALSE",
-        "ALTER TABLE tasks ADD COLUMN repeat_day TEXT",
-        "ALTER TABLE tasks ADD COLUMN last_completed_at TIMESTAMPTZ",
-        "ALTER TABLE categories ADD COLUMN keywords TEXT DEFAULT ''",
-        "ALTER TABLE tasks ADD COLUMN project_id INTEGER REFERENCES projects(id) ON DELETE SET NULL",
-        "ALTER TABLE tasks ADD COLUMN color TEXT DEFAULT ''",
-        "ALTER TABLE tasks ADD COLUMN color_sort INTEGER DEFAULT 0",
-        "ALTER TABLE tasks ADD COLUMN estimate_min INTEGER DEFAULT 0",
-        "ALTER TABLE tasks ADD COLUMN today_sort INTEGER DEFAULT 0",
-        "ALTER TABLE projects ADD COLUMN sort_mode TEXT DEFAULT 'hybrid'",
-        "ALTER TABLE projects ADD COLUMN archived_at TIMESTAMPTZ",
-        "ALTER TABLE users ALTER COLUMN telegram_id DROP NOT NULL",
-        "ALTER TABLE users ADD COLUMN email TEXT",
-        "ALTER TABLE users ADD COLUMN password_hash TEXT",
-        "ALTER TABLE users ADD COLUMN password_algo TEXT DEFAULT 'argon2'",
-        "ALTER TABLE users ADD COLUMN password_reset_token_hash TEXT",
-        "ALTER TABLE users ADD COLUMN password_reset_expires_at TIMESTAMPTZ",
-        "ALTER TABLE users ADD COLUMN user_role TEXT DEFAULT 'user'",
-        "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email_lower "
-        "ON users (lower(email)) WHERE email IS NOT NULL",
-        "CREATE INDEX IF NOT EXISTS idx_tasks_proj_color "
-        "ON tasks(user_id, project_id, color, color_sort, due_date) "
-        "WHERE status = 'active'",
-    ):
-        try:
-            cur.execute(col_sql)
-        except Exception:
-            if _conn and not _conn.closed:
-                _conn.rollback()
-    cur.close()
-
+    """
 
-def _init_tables_sqlite() -> None:
-    _conn.executescript("""
+_BASE_SCHEMA_SQLITE = """
     CREATE TABLE IF NOT EXISTS users (
         id              INTEGER PRIMARY KEY AUTOINCREMENT,
         telegram_id     INTEGER UNIQUE,
@@ -283,37 +457,304 @@ def _init_tables_sqlite() -> None:
     );
     CREATE INDEX IF NOT EXISTS idx_dps_user_date ON daily_plan_slots(user_id, plan_date);
     CREATE UNIQUE INDEX IF NOT EXISTS idx_dps_unique ON daily_plan_slots(user_id, plan_date, task_id);
-    """)
-    _conn.commit()
-    for col_sql in (
-        "ALTER TABLE tasks ADD COLUMN is_routine BOOLEAN DEFAULT FALSE",
-        "ALTER TABLE tasks ADD COLUMN repeat_day TEXT",
-        "ALTER TABLE tasks ADD COLUMN last_completed_at TEXT",
-        "ALTER TABLE categories ADD COLUMN keywords TEXT DEFAULT ''",
-        "ALTER TABLE tasks ADD COLUMN project_id INTEGER REFERENCES projects(id)",
-        "ALTER TABLE tasks ADD COLUMN color TEXT DEFAULT ''",
-        "ALTER TABLE tasks ADD COLUMN color_sort INTEGER DEFAULT 0",
-        "ALTER TABLE tasks ADD COLUMN estimate_min INTEGER DEFAULT 0",
-        "ALTER TABLE tasks ADD COLUMN today_sort INTEGER DEFAULT 0",
-        "ALTER TABLE projects ADD COLUMN sort_mode TEXT DEFAULT 'hybrid'",
-        "ALTER TABLE projects ADD COLUMN archived_at TEXT",
-        "ALTER TABLE users ADD COLUMN email TEXT",
-        "ALTER TABLE users ADD COLUMN password_hash TEXT",
-        "ALTER TABLE users ADD COLUMN password_algo TEXT DEFAULT 'argon2'",
-        "ALTER TABLE users ADD COLUMN password_reset_token_hash TEXT",
-        "ALTER TABLE users ADD COLUMN password_reset_expires_at TEXT",
-        "ALTER TABLE users ADD COLUMN user_role TEXT DEFAULT 'user'",
-        "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email_lower "
-        "ON users (lower(email)) WHERE email IS NOT NULL",
-        "CREATE INDEX IF NOT EXISTS idx_tasks_proj_color "
-        "ON tasks(user_id, project_id, color, color_sort, due_date) "
-        "WHERE status = 'active'",
-    ):
-        try:
-            _conn.execute(col_sql)
-            _conn.commit()
-        except Exception:
-            pass
+    """
+
+_MIGRATIONS_PG: list[tuple[int, str, list]] = [
+    (1, "базовая схема", [_BASE_SCHEMA_PG]),
+    (
+        2,
+        "рутины, проекты, цвета, сортировки, email-авторизация",
+        [
+            "ALTER TABLE tasks ADD COLUMN is_routine BOOLEAN DEFAULT FALSE",
+            "ALTER TABLE tasks ADD COLUMN repeat_day TEXT",
+            "ALTER TABLE tasks ADD COLUMN last_completed_at TIMESTAMPTZ",
+            "ALTER TABLE categories ADD COLUMN keywords TEXT DEFAULT ''",
+            "ALTER TABLE tasks ADD COLUMN project_id INTEGER REFERENCES projects(id) ON DELETE SET NULL",
+            "ALTER TABLE tasks ADD COLUMN color TEXT DEFAULT ''",
+            "ALTER TABLE tasks ADD COLUMN color_sort INTEGER DEFAULT 0",
+            "ALTER TABLE tasks ADD COLUMN estimate_min INTEGER DEFAULT 0",
+            "ALTER TABLE tasks ADD COLUMN today_sort INTEGER DEFAULT 0",
+            "ALTER TABLE projects ADD COLUMN sort_mode TEXT DEFAULT 'hybrid'",
+            "ALTER TABLE projects ADD COLUMN archived_at TIMESTAMPTZ",
+            "ALTER TABLE users ALTER COLUMN telegram_id DROP NOT NULL",
+            "ALTER TABLE users ADD COLUMN email TEXT",
+            "ALTER TABLE users ADD COLUMN password_hash TEXT",
+            "ALTER TABLE users ADD COLUMN password_algo TEXT DEFAULT 'argon2'",
+            "ALTER TABLE users ADD COLUMN password_reset_token_hash TEXT",
+            "ALTER TABLE users ADD COLUMN password_reset_expires_at TIMESTAMPTZ",
+            "ALTER TABLE users ADD COLUMN user_role TEXT DEFAULT 'user'",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email_lower "
+            "ON users (lower(email)) WHERE email IS NOT NULL",
+            "CREATE INDEX IF NOT EXISTS idx_tasks_proj_color "
+            "ON tasks(user_id, project_id, color, color_sort, due_date) "
+            "WHERE status = 'active'",
+        ],
+    ),
+    (
+        3,
+        "скомпилированное расписание рутин (repeat_mask / repeat_every / repeat_anchor)",
+        [
+            "ALTER TABLE tasks ADD COLUMN repeat_mask INTEGER",
+            "ALTER TABLE tasks ADD COLUMN repeat_every INTEGER DEFAULT 0",
+            "ALTER TABLE tasks ADD COLUMN repeat_anchor INTEGER DEFAULT 0",
+            "CREATE INDEX IF NOT EXISTS idx_tasks_routine_sched "
+            "ON tasks(user_id, is_routine, repeat_every, repeat_mask) "
+            "WHERE status = 'active'",
+            lambda conn: _backfill_repeat_schedule(conn),
+        ],
+    ),
+    (
+        4,
+        "полнотекстовый индекс по тексту задач",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_tasks_text_fts "
+            "ON tasks USING GIN (to_tsvector('simple', COALESCE(text, '')))",
+        ],
+    ),
+    (5, "триграммный индекс по тексту задач", [lambda conn: _create_pg_trgm(conn)]),
+    (
+        6,
+        "фоновые задачи веба",
+        [
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                result TEXT,
+                created_at TIMESTAMPTZ DEFAULT NOW(),
+                updated_at TIMESTAMPTZ DEFAULT NOW()
+            )""",
+            "CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at)",
+        ],
+    ),
+    (
+        7,
+        "время напоминания по задаче (remind_at_utc)",
+        [
+            "ALTER TABLE tasks ADD COLUMN remind_at_utc TIMESTAMPTZ",
+            "CREATE INDEX IF NOT EXISTS idx_tasks_remind_at ON tasks(remind_at_utc) "
+            "WHERE remind_at_utc IS NOT NULL AND status = 'active'",
+            lambda conn: _backfill_remind_at(conn),
+        ],
+    ),
+]
+
+_MIGRATIONS_SQLITE: list[tuple[int, str, list]] = [
+    (1, "базовая схема", [_BASE_SCHEMA_SQLITE]),
+    (
+        2,
+        "рутины, проекты, цвета, сортировки, email-авторизация",
+        [
+            "ALTER TABLE tasks ADD COLUMN is_routine BOOLEAN DEFAULT FALSE",
+            "ALTER TABLE tasks ADD COLUMN repeat_day TEXT",
+            "ALTER TABLE tasks ADD COLUMN last_completed_at TEXT",
+            "ALTER TABLE categories ADD COLUMN keywords TEXT DEFAULT ''",
+            "ALTER TABLE tasks ADD COLUMN project_id INTEGER REFERENCES projects(id)",
+            "ALTER TABLE tasks ADD COLUMN color TEXT DEFAULT ''",
+            "ALTER TABLE tasks ADD COLUMN color_sort INTEGER DEFAULT 0",
+            "ALTER TABLE tasks ADD COLUMN estimate_min INTEGER DEFAULT 0",
+            "ALTER TABLE tasks ADD COLUMN today_sort INTEGER DEFAULT 0",
+            "ALTER TABLE projects ADD COLUMN sort_mode TEXT DEFAULT 'hybrid'",
+            "ALTER TABLE projects ADD COLUMN archived_at TEXT",
+            "ALTER TABLE users ADD COLUMN email TEXT",
+            "ALTER TABLE users ADD COLUMN password_hash TEXT",
+            "ALTER TABLE users ADD COLUMN password_algo TEXT DEFAULT 'argon2'",
+            "ALTER TABLE users ADD COLUMN password_reset_token_hash TEXT",
+            "ALTER TABLE users ADD COLUMN password_reset_expires_at TEXT",
+            "ALTER TABLE users ADD COLUMN user_role TEXT DEFAULT 'user'",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email_lower "
+            "ON users (lower(email)) WHERE email IS NOT NULL",
+            "CREATE INDEX IF NOT EXISTS idx_tasks_proj_color "
+            "ON tasks(user_id, project_id, color, color_sort, due_date) "
+            "WHERE status = 'active'",
+        ],
+    ),
+    (
+        3,
+        "скомпилированное расписание рутин (repeat_mask / repeat_every / repeat_anchor)",
+        [
+            "ALTER TABLE tasks ADD COLUMN repeat_mask INTEGER",
+            "ALTER TABLE tasks ADD COLUMN repeat_every INTEGER DEFAULT 0",
+            "ALTER TABLE tasks ADD COLUMN repeat_anchor INTEGER DEFAULT 0",
+            "CREATE INDEX IF NOT EXISTS idx_tasks_routine_sched "
+            "ON tasks(user_id, is_routine, repeat_every, repeat_mask) "
+            "WHERE status = 'active'",
+            lambda conn: _backfill_repeat_schedule(conn),
+        ],
+    ),
+    (4, "полнотекстовый индекс по тексту задач", [lambda conn: _create_sqlite_fts(conn)]),
+    # Нечёткий поиск на SQLite — триграммный индекс в процессе (fuzzy_match), схема не меняется.
+    (5, "триграммный индекс по тексту задач", []),
+    (
+        6,
+        "фоновые задачи веба",
+        [
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                user_id INTEGER REFERENCES users(id),
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                result TEXT,
+                created_at TEXT DEFAULT (datetime('now')),
+                updated_at TEXT DEFAULT (datetime('now'))
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at);""",
+        ],
+    ),
+    (
+        7,
+        "время напоминания по задаче (remind_at_utc)",
+        [
+            "ALTER TABLE tasks ADD COLUMN remind_at_utc TEXT",
+            "CREATE INDEX IF NOT EXISTS idx_tasks_remind_at ON tasks(remind_at_utc) "
+            "WHERE remind_at_utc IS NOT NULL AND status = 'active'",
+            lambda conn: _backfill_remind_at(conn),
+        ],
+    ),
+]
+
+def _create_pg_trgm(conn) -> None:
+    """Миграция v5 (PG): без прав на CREATE EXTENSION нечёткий поиск идёт по индексу в процессе."""
+    cur = conn.cursor()
+    try:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_tasks_text_trgm ON tasks USING GIN (text gin_trgm_ops)"
+        )
+    except Exception as exc:
+        logger.warning("pg_trgm unavailable, fuzzy search uses in-process index: %s", exc)
+    finally:
+        cur.close()
+
+
+# FTS5 — внешняя таблица над tasks.text, синхронизируется триггерами.
+_SQLITE_FTS_TRIGGERS = """
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_ai AFTER INSERT ON tasks BEGIN
+        INSERT INTO tasks_fts(rowid, text) VALUES (new.id, new.text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_ad AFTER DELETE ON tasks BEGIN
+        INSERT INTO tasks_fts(tasks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_au AFTER UPDATE OF text ON tasks BEGIN
+        INSERT INTO tasks_fts(tasks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO tasks_fts(rowid, text) VALUES (new.id, new.text);
+    END;
+    """
+
+
+def _create_sqlite_fts(conn) -> None:
+    """Миграция v4 (SQLite): без FTS5 в сборке sqlite поиск остаётся полным просмотром."""
+    try:
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts "
+            "USING fts5(text, content='tasks', content_rowid='id')"
+        )
+    except sqlite3.OperationalError as exc:
+        logger.warning("FTS5 unavailable, task search falls back to scan: %s", exc)
+        return
+    conn.executescript(_SQLITE_FTS_TRIGGERS)
+    conn.execute("INSERT INTO tasks_fts(tasks_fts) VALUES ('rebuild')")
+    conn.commit()
+
+
+# Миграции до этого номера повторяют прежний init таблиц: ошибка любого шага
+# (например, уникальный индекс на базе с дублями email) логируется и пропускается.
+_LEGACY_MIGRATION_MAX = 2
+
+# Произвольный ключ advisory-lock: бот и веб могут стартовать одновременно.
+_PG_MIGRATION_LOCK_KEY = 72_450_301
+
+
+def _is_already_applied_error(exc: Exception) -> bool:
+    """Ошибка «объект уже существует» — шаг миграции на старой базе уже сделан."""
+    code = getattr(exc, "pgcode", None)
+    if code in ("42701", "42P07", "42710"):  # duplicate column / table / object
+        return True
+    msg = str(exc).lower()
+    return "duplicate column" in msg or "already exists" in msg
+
+
+def _schema_version(conn) -> int | None:
+    """Текущая версия схемы; None — таблицы schema_version ещё нет."""
+    try:
+        if USE_PG:
+            cur = conn.cursor()
+            cur.execute("SELECT MAX(version) FROM schema_version")
+            row = cur.fetchone()
+            cur.close()
+        else:
+            row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    except Exception:
+        return None
+    return int(row[0] or 0)
+
+
+def _run_migration_step(conn, step, tolerant: bool) -> None:
+    """Шаг миграции — SQL-строка или функция(conn) для переноса данных."""
+    try:
+        if callable(step):
+            step(conn)
+        elif USE_PG:
+            cur = conn.cursor()
+            cur.execute(step)
+            cur.close()
+        else:
+            conn.executescript(step)
+    except Exception as exc:
+        if _is_already_applied_error(exc):
+            logger.debug("migration step already applied: %s", exc)
+            return
+        if not tolerant:
+            raise
+        logger.warning("migration step skipped: %s", exc)
+
+
+def _migrate(conn) -> None:
+    """Доводит схему до последней версии. На актуальной базе — один SELECT."""
+    migrations = _MIGRATIONS_PG if USE_PG else _MIGRATIONS_SQLITE
+    latest = migrations[-1][0]
+    current = _schema_version(conn)
+    if current is not None and current >= latest:
+        return
+    if USE_PG:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_lock(%s)", (_PG_MIGRATION_LOCK_KEY,))
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "version INTEGER PRIMARY KEY, description TEXT, "
+            "applied_at TIMESTAMPTZ DEFAULT NOW())"
+        )
+        cur.close()
+    else:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "version INTEGER PRIMARY KEY, description TEXT, "
+            "applied_at TEXT DEFAULT (datetime('now')))"
+        )
+        conn.commit()
+    try:
+        # Пока ждали lock, миграции мог применить другой процесс.
+        current = _schema_version(conn) or 0
+        for version, description, steps in migrations:
+            if version <= current:
+                continue
+            for step in steps:
+                _run_migration_step(conn, step, tolerant=version <= _LEGACY_MIGRATION_MAX)
+            sql = _query("INSERT INTO schema_version (version, description) VALUES (%s, %s)")
+            if USE_PG:
+                cur = conn.cursor()
+                cur.execute(sql, (version, description))
+                cur.close()
+            else:
+                conn.execute(sql, (version, description))
+                conn.commit()
+            logger.info("schema migrated to v%s: %s", version, description)
+    finally:
+        if USE_PG:
+            cur = conn.cursor()
+            cur.execute("SELECT pg_advisory_unlock(%s)", (_PG_MIGRATION_LOCK_KEY,))
+            cur.close()
 
 
 # ── Универсальные хелперы ────────────────────────────────────────────────
@@ -330,16 +771,100 @@ def _query(sql: str) -> str:
     return sql
 
 
+@contextmanager
+def transaction():
+    """
+    Группирует несколько запросов в одну транзакцию: один COMMIT в конце,
+    ROLLBACK при исключении. Все _fetch*/_execute внутри блока идут через одно
+    соединение. Вложенный transaction() — SAVEPOINT: его ошибку можно поймать,
+    не теряя внешнюю транзакцию.
+
+        with db.transaction():
+            _execute(...)
+            _execute(...)
+    """
+    conn = _tx_conn()
+    if conn is not None:
+        _tx_local.depth += 1
+        name = f"sp_{_tx_local.depth}"
+        _tx_exec(conn, f"SAVEPOINT {name}")
+        try:
+            yield
+        except BaseException:
+            _tx_exec(conn, f"ROLLBACK TO SAVEPOINT {name}")
+            raise
+        else:
+            _tx_exec(conn, f"RELEASE SAVEPOINT {name}")
+        finally:
+            _tx_local.depth -= 1
+        return
+
+    with _connection() as conn:
+        if USE_PG:
+            conn.autocommit = False
+        else:
+            conn.execute("BEGIN")
+        _tx_local.conn = conn
+        _tx_local.depth = 0
+        _tx_local.pending_bumps = set()
+        try:
+            yield
+        except BaseException:
+            try:
+                conn.rollback()
+            except Exception:
+                logger.exception("transaction rollback failed")
+            raise
+        else:
+            conn.commit()
+        finally:
+            _tx_local.conn = None
+            pending = _tx_local.pending_bumps
+            _tx_local.pending_bumps = set()
+            if USE_PG:
+                try:
+                    conn.autocommit = True
+                except Exception:
+                    pass
+            # Версии поднимаем после COMMIT/ROLLBACK: иначе параллельный читатель
+            # мог бы закешировать ещё не зафиксированные данные под новой версией.
+            for uid in pending:
+                bump_user_version(uid)
+
+
+def _tx_exec(conn, sql: str) -> None:
+    if USE_PG:
+        cur = conn.cursor()
+        cur.execute(sql)
+        cur.close()
+    else:
+        conn.execute(sql)
+
+
+def in_transaction() -> bool:
+    return _tx_conn() is not None
+
+
+def _commit_unless_tx(conn) -> None:
+    """SQLite: коммит после одиночного запроса, но не внутри transaction()."""
+    if _tx_conn() is None:
+        conn.commit()
+
+
 def _drop_conn() -> None:
-    """Помечает PG-соединение как невалидное, чтобы _get_conn() переподключился."""
-    global _conn, _SQLITE_OPEN_PATH
+    """Закрывает все открытые подключения: следующее обращение откроет их заново."""
+    global _conn, _SQLITE_OPEN_PATH, _pool_ready, _pool_generation
     if _conn is not None:
-        try:
-            _conn.close()
-        except Exception:
-            pass
+        _close_quietly(_conn)
         _conn = None
     _SQLITE_OPEN_PATH = None
+    with _pool_lock:
+        idle = list(_pool_idle)
+        _pool_idle.clear()
+        _pool_ready = False
+        _pool_generation += 1
+    for conn, _ in idle:
+        _close_quietly(conn)
 
 
 def _is_pg_connection_error(exc: Exception) -> bool:
@@ -350,90 +875,226 @@ def _is_pg_connection_error(exc: Exception) -> bool:
     )
 
 
-def _fetchone(sql: str, params: tuple = ()) -> dict | None:
-    sql_q = _query(sql)
+def _with_retry(op):
+    """
+    Выполняет op(conn) на соединении из _connection(). Если PG-соединение
+    оборвалось, оно выбрасывается из пула и операция повторяется один раз
+    (внутри transaction() повтор невозможен — ошибка уходит наружу).
+    """
+    if _tx_conn() is not None:
+        return op(_tx_conn())
     for attempt in (0, 1):
-        conn = _get_conn()
         try:
-            if USE_PG:
-                cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-                cur.execute(sql_q, params)
-                row = cur.fetchone()
-                cur.close()
-                return dict(row) if row else None
-            else:
-                row = conn.execute(sql_q, params).fetchone()
-                return dict(row) if row else None
+            with _connection() as conn:
+                return op(conn)
         except Exception as exc:
             if attempt == 0 and _is_pg_connection_error(exc):
-                _drop_conn()
                 continue
             raise
 
 
+def _fetchone(sql: str, params: tuple = ()) -> dict | None:
+    sql_q = _query(sql)
+
+    def op(conn):
+        if USE_PG:
+            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cur.execute(sql_q, params)
+            row = cur.fetchone()
+            cur.close()
+        else:
+            row = conn.execute(sql_q, params).fetchone()
+        return dict(row) if row else None
+
+    return _with_retry(op)
+
+
 def _fetchall(sql: str, params: tuple = ()) -> list[dict]:
     sql_q = _query(sql)
-    for attempt in (0, 1):
-        conn = _get_conn()
-        try:
-            if USE_PG:
-                cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-                cur.execute(sql_q, params)
-                rows = cur.fetchall()
-                cur.close()
-                return [dict(r) for r in rows]
-            else:
-                rows = conn.execute(sql_q, params).fetchall()
-                return [dict(r) for r in rows]
-        except Exception as exc:
-            if attempt == 0 and _is_pg_connection_error(exc):
-                _drop_conn()
-                continue
-            raise
+
+    def op(conn):
+        if USE_PG:
+            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cur.execute(sql_q, params)
+            rows = cur.fetchall()
+            cur.close()
+        else:
+            rows = conn.execute(sql_q, params).fetchall()
+        return [dict(r) for r in rows]
+
+    return _with_retry(op)
 
 
 def _execute(sql: str, params: tuple = ()) -> int:
     sql_q = _query(sql)
-    for attempt in (0, 1):
-        conn = _get_conn()
-        try:
-            if USE_PG:
-                cur = conn.cursor()
-                cur.execute(sql_q, params)
-                n = cur.rowcount
-                cur.close()
-                return n
-            else:
-                n = conn.execute(sql_q, params).rowcount
-                conn.commit()
-                return n
-        except Exception as exc:
-            if attempt == 0 and _is_pg_connection_error(exc):
-                _drop_conn()
-                continue
-            raise
-    return 0
+
+    def op(conn):
+        if USE_PG:
+            cur = conn.cursor()
+            cur.execute(sql_q, params)
+            n = cur.rowcount
+            cur.close()
+            return n
+        n = conn.execute(sql_q, params).rowcount
+        _commit_unless_tx(conn)
+        return n
+
+    return _with_retry(op) or 0
+
+
+def _executemany(sql: str, seq_params: list[tuple]) -> None:
+    """Один и тот же запрос с разными параметрами (execute_batch / executemany)."""
+    if not seq_params:
+        return
+    sql_q = _query(sql)
+
+    def op(conn):
+        if USE_PG:
+            cur = conn.cursor()
+            psycopg2.extras.execute_batch(cur, sql_q, seq_params)
+            cur.close()
+        else:
+            conn.executemany(sql_q, seq_params)
+            _commit_unless_tx(conn)
+
+    _with_retry(op)
 
 
 def _insert_returning(sql: str, params: tuple = ()) -> dict | None:
     """INSERT ... RETURNING * для PG, двухшаговый для SQLite."""
-    conn = _get_conn()
-    if USE_PG:
-        sql = _query(sql)
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cur.execute(sql, params)
-        row = cur.fetchone()
-        cur.close()
-        return dict(row) if row else None
-    else:
-        sql_clean = sql.replace("RETURNING *", "")
-        sql_clean = _query(sql_clean)
+    with _connection() as conn:
+        if USE_PG:
+            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cur.execute(_query(sql), params)
+            row = cur.fetchone()
+            cur.close()
+            return dict(row) if row else None
+        sql_clean = _query(sql.replace("RETURNING *", ""))
+        table = sql_clean.split("INTO", 1)[1].split("(", 1)[0].strip()
         cur = conn.execute(sql_clean, params)
-        conn.commit()
-        row = conn.execute("SELECT * FROM tasks WHERE id = ?", (cur.lastrowid,)).fetchone()
+        _commit_unless_tx(conn)
+        row = conn.execute(f"SELECT * FROM {table} WHERE id = ?", (cur.lastrowid,)).fetchone()
         return dict(row) if row else None
 
 
+# ── Версия данных пользователя и снимок активных задач ─────────────────
+# Каждая мутирующая функция (декоратор _mutates_user_data) поднимает
+# монотонную версию данных пользователя. Снимок активных задач кешируется
+# под версией и строится заново только после изменения. Производные списки
+# (сегодня, упорядоченный, рутины, счётчики) считаются из снимка в Python —
+# это убирает повторные SELECT * FROM tasks в пределах одной страницы и
+# между запросами.
+#
+# Версия живёт в памяти процесса: записи другого процесса (бот и веб
+# отдельно) сюда не попадают, поэтому снимок дополнительно живёт не дольше
+# DB_SNAPSHOT_TTL_SEC. 0 — кеш выключен.
+DB_SNAPSHOT_TTL_SEC = _env_float("DB_SNAPSHOT_TTL_SEC", 10.0)
+_SNAPSHOT_MAX_USERS = 2000
+
+_versions_lock = threading.Lock()
+_user_versions: dict[int, int] = {}
+# Мутации без user_id (например complete_task(task_id)) поднимают общую версию:
+# версия пользователя = его счётчик + общий, обе части только растут.
+_global_version = 0
+_snapshot_cache: dict[int, tuple[int, float, list[dict]]] = {}
+# Триграммные индексы по тем же снимкам (см. find_tasks_fuzzy).
+_trigram_cache: dict[int, tuple[int, float, fuzzy_match.TrigramIndex]] = {}
+
+
+def user_data_version(user_id: int) -> int:
+    """Монотонная версия данных пользователя в этом процессе."""
+    return _user_versions.get(int(user_id), 0) + _global_version
+
+
+def bump_user_version(user_id: int | None) -> None:
+    """Отмечает изменение данных пользователя (None — неизвестно чьих: всех) и публикует событие."""
+    pending = getattr(_tx_local, "pending_bumps", None)
+    if _tx_conn() is not None and pending is not None:
+        pending.add(None if user_id is None else int(user_id))
+        return
+    note_external_change(user_id)
+    events.publish(user_id)
+
+
+def note_external_change(user_id: int | None) -> None:
+    """Данные изменил другой процесс (событие моста events): сбросить кеши без публикации."""
+    global _global_version
+    with _versions_lock:
+        if user_id is None:
+            _global_version += 1
+            _snapshot_cache.clear()
+        else:
+            uid = int(user_id)
+            _user_versions[uid] = _user_versions.get(uid, 0) + 1
+            _snapshot_cache.pop(uid, None)
+
+
+def _reset_data_caches() -> None:
+    """Другая база (смена BOT_DB_PATH): всё закешированное недействительно."""
+    global _global_version, _sqlite_fts_ready
+    with _versions_lock:
+        _global_version += 1
+        _snapshot_cache.clear()
+        _trigram_cache.clear()
+    _user_row_cache.clear()
+    _sqlite_fts_ready = None
+
+
+def _mutates_user_data(fn):
+    """Декоратор мутирующих функций: по завершении поднимает версию данных user_id."""
+    sig = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            try:
+                uid = sig.bind_partial(*args, **kwargs).arguments.get("user_id")
+            except TypeError:
+                uid = None
+            bump_user_version(uid)
+
+    return wrapper
+
+
+def _active_tasks_snapshot(user_id: int) -> list[dict]:
+    """Все активные задачи пользователя (ORDER BY id). Возвращает копии строк."""
+    if DB_SNAPSHOT_TTL_SEC <= 0 or _tx_conn() is not None:
+        return _fetchall(
+            "SELECT * FROM tasks WHERE user_id = %s AND status = 'active' ORDER BY id",
+            (user_id,),
+        )
+    uid = int(user_id)
+    # Версию читаем ДО запроса: если запись успеет проскочить, снимок просто
+    # окажется под устаревшей версией и будет перечитан.
+    version = user_data_version(uid)
+    now = _time.monotonic()
+    cached = _snapshot_cache.get(uid)
+    if cached and cached[0] == version and now - cached[1] < DB_SNAPSHOT_TTL_SEC:
+        rows = cached[2]
+    else:
+        rows = _fetchall(
+            "SELECT * FROM tasks WHERE user_id = %s AND status = 'active' ORDER BY id",
+            (uid,),
+        )
+        with _versions_lock:
+            if len(_snapshot_cache) >= _SNAPSHOT_MAX_USERS:
+                _snapshot_cache.clear()
+            _snapshot_cache[uid] = (version, now, rows)
+    return [dict(r) for r in rows]
+
+
+def _priority_desc(rows: list[dict]) -> list[dict]:
+    """ORDER BY priority_score DESC (при равенстве — по id)."""
+    return sorted(rows, key=lambda t: -float(t.get("priority_score") or 0))
+
+
+def _is_routine_row(t: dict) -> bool:
+    """Та же семантика, что is_routine = TRUE в SQL (PG bool / SQLite 0-1)."""
+    return t.get("is_routine") == 1
+
+
 # ── Users ────────────────────────────────────────────────────────────────
 
 DEFAULT_CATEGORIES = [
@@ -469,11 +1130,12 @@ def get_or_create_user(telegram_id: int, name: str = "") -> dict:
 
     existing = _fetchone("SELECT COUNT(*) AS cnt FROM categories WHERE user_id = %s", (user_id,))
     if existing and existing["cnt"] == 0:
-        for i, (emoji, cat_name) in enumerate(DEFAULT_CATEGORIES):
-            _execute(
-                "INSERT INTO categories (user_id, emoji, name, sort_order) VALUES (%s, %s, %s, %s)",
-                (user_id, emoji, cat_name, i),
-            )
+        with transaction():
+            for i, (emoji, cat_name) in enumerate(DEFAULT_CATEGORIES):
+                _execute(
+                    "INSERT INTO categories (user_id, emoji, name, sort_order) VALUES (%s, %s, %s, %s)",
+                    (user_id, emoji, cat_name, i),
+                )
     return user
 
 
@@ -486,9 +1148,39 @@ def get_user_by_id(user_id: int) -> dict | None:
     return _fetchone("SELECT * FROM users WHERE id = %s", (user_id,))
 
 
+# Короткий TTL-кеш строк users для веба: строка пользователя нужна на каждой
+# странице (сессия, роль admin), а меняется редко. Все записи в users из этого
+# модуля сбрасывают кеш; изменения из другого процесса видны не позже чем через TTL.
+_USER_ROW_TTL_SEC = max(0.0, _env_float("DB_USER_ROW_TTL_SEC", 30.0))
+_user_row_cache: dict[int, tuple[float, dict]] = {}
+
+
+def get_user_by_id_cached(user_id: int) -> dict | None:
+    """Как get_user_by_id, но через TTL-кеш; возвращает копию строки."""
+    uid = int(user_id)
+    now = _time.monotonic()
+    cached = _user_row_cache.get(uid)
+    if cached and now - cached[0] < _USER_ROW_TTL_SEC:
+        return dict(cached[1])
+    row = get_user_by_id(uid)
+    if row is None or _USER_ROW_TTL_SEC <= 0:
+        return row
+    if len(_user_row_cache) > 5000:
+        _user_row_cache.clear()
+    _user_row_cache[uid] = (now, row)
+    return dict(row)
+
+
+def invalidate_user_row_cache(user_id: int | None = None) -> None:
+    if user_id is None:
+        _user_row_cache.clear()
+    else:
+        _user_row_cache.pop(int(user_id), None)
+
+
 def get_single_user_if_exactly_one() -> dict | None:
     """Если в таблице users ровно одна запись — вернуть её (для веба без WEB_INTERNAL_USER_ID)."""
-    rows = _fetchall("SELECT * FROM users ORDER BY id")
+    rows = _fetchall("SELECT * FROM users ORDER BY id LIMIT 2")
     if len(rows) == 1:
         return rows[0]
     return None
@@ -522,11 +1214,13 @@ def is_admin_user(user_row: dict | None) -> bool:
     return (str(user_row.get("user_role") or "user")).strip().lower() == "admin"
 
 
+@_mutates_user_data
 def set_user_role(user_id: int, role: str) -> bool:
     r = (role or "user").strip().lower()
     if r not in ("user", "admin"):
         return False
     _execute("UPDATE users SET user_role = %s WHERE id = %s", (r, int(user_id)))
+    invalidate_user_row_cache(user_id)
     return True
 
 
@@ -566,6 +1260,7 @@ def sync_admin_roles() -> None:
             _execute("UPDATE users SET user_role = %s WHERE id = %s", (role, uid))
         except Exception:
             pass
+    invalidate_user_row_cache()
 
 
 def _next_synthetic_telegram_id() -> int:
@@ -597,30 +1292,27 @@ def create_user_with_email(email: str, password_hash: str, name: str = "") -> di
             "INSERT INTO users (telegram_id, name, email, password_hash, password_algo) "
             "VALUES (NULL, %s, %s, %s, 'argon2') RETURNING *"
         )
-        cur = _get_conn().cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cur.execute(sql, (name_norm, email_norm, password_hash))
-        row = cur.fetchone()
-        cur.close()
-        user = dict(row) if row else None
+        user = _insert_returning(sql, (name_norm, email_norm, password_hash))
     else:
         # SQLite: пробуем NULL, если ограничение не позволяет — синтетический id.
-        try:
-            cur = _get_conn().execute(
-                "INSERT INTO users (telegram_id, name, email, password_hash, password_algo) "
-                "VALUES (NULL, ?, ?, ?, 'argon2')",
-                (name_norm, email_norm, password_hash),
-            )
-            _get_conn().commit()
-            new_id = cur.lastrowid
-        except sqlite3.IntegrityError:
-            tg = _next_synthetic_telegram_id()
-            cur = _get_conn().execute(
-                "INSERT INTO users (telegram_id, name, email, password_hash, password_algo) "
-                "VALUES (?, ?, ?, ?, 'argon2')",
-                (tg, name_norm, email_norm, password_hash),
-            )
-            _get_conn().commit()
-            new_id = cur.lastrowid
+        with _connection() as conn:
+            try:
+                cur = conn.execute(
+                    "INSERT INTO users (telegram_id, name, email, password_hash, password_algo) "
+                    "VALUES (NULL, ?, ?, ?, 'argon2')",
+                    (name_norm, email_norm, password_hash),
+                )
+                _commit_unless_tx(conn)
+                new_id = cur.lastrowid
+            except sqlite3.IntegrityError:
+                tg = _next_synthetic_telegram_id()
+                cur = conn.execute(
+                    "INSERT INTO users (telegram_id, name, email, password_hash, password_algo) "
+                    "VALUES (?, ?, ?, ?, 'argon2')",
+                    (tg, name_norm, email_norm, password_hash),
+                )
+                _commit_unless_tx(conn)
+                new_id = cur.lastrowid
         user = _fetchone("SELECT * FROM users WHERE id = %s", (new_id,))
 
     if not user:
@@ -631,12 +1323,13 @@ def create_user_with_email(email: str, password_hash: str, name: str = "") -> di
         "SELECT COUNT(*) AS cnt FROM categories WHERE user_id = %s", (user_id,)
     )
     if existing and existing["cnt"] == 0:
-        for i, (emoji, cat_name) in enumerate(DEFAULT_CATEGORIES):
-            _execute(
-                "INSERT INTO categories (user_id, emoji, name, sort_order) "
-                "VALUES (%s, %s, %s, %s)",
-                (user_id, emoji, cat_name, i),
-            )
+        with transaction():
+            for i, (emoji, cat_name) in enumerate(DEFAULT_CATEGORIES):
+                _execute(
+                    "INSERT INTO categories (user_id, emoji, name, sort_order) "
+                    "VALUES (%s, %s, %s, %s)",
+                    (user_id, emoji, cat_name, i),
+                )
     return user
 
 
@@ -645,10 +1338,12 @@ def set_password_hash(user_id: int, password_hash: str) -> None:
         "UPDATE users SET password_hash = %s, password_algo = 'argon2' WHERE id = %s",
         (password_hash, user_id),
     )
+    invalidate_user_row_cache(user_id)
 
 
 def increment_tips(telegram_id: int) -> int:
     _execute("UPDATE users SET tips_shown = tips_shown + 1 WHERE telegram_id = %s", (telegram_id,))
+    invalidate_user_row_cache()
     row = _fetchone("SELECT tips_shown FROM users WHERE telegram_id = %s", (telegram_id,))
     return row["tips_shown"] if row else 0
 
@@ -666,6 +1361,7 @@ def get_user_timezone(user_id: int) -> str:
     return "Europe/Moscow"
 
 
+@_mutates_user_data
 def set_user_timezone(user_id: int, tz_name: str) -> bool:
     """IANA-идентификатор часового пояса (Europe/Berlin и т.д.). Пустое или невалидное — False."""
     raw = (tz_name or "").strip()
@@ -681,6 +1377,9 @@ def set_user_timezone(user_id: int, tz_name: str) -> bool:
         (raw, user_id),
     )
     _invalidate_user_timezone_cache(user_id)
+    invalidate_user_row_cache(user_id)
+    if n > 0:
+        refresh_user_reminders(user_id)
     return n > 0
 
 
@@ -707,6 +1406,7 @@ def get_settings(user_id: int) -> dict:
     return merged
 
 
+@_mutates_user_data
 def update_settings(user_id: int, **kwargs) -> dict:
     import json as _json
     current = get_settings(user_id)
@@ -715,6 +1415,7 @@ def update_settings(user_id: int, **kwargs) -> dict:
         "UPDATE users SET settings_json = %s WHERE id = %s",
         (_json.dumps(current, ensure_ascii=False), user_id),
     )
+    invalidate_user_row_cache(user_id)
     return current
 
 
@@ -748,6 +1449,7 @@ def get_category_by_id(category_id: int, user_id: int) -> dict | None:
     )
 
 
+@_mutates_user_data
 def update_category_row(
     user_id: int,
     category_id: int,
@@ -769,6 +1471,7 @@ def update_category_row(
     return get_category_by_id(category_id, user_id)
 
 
+@_mutates_user_data
 def add_category_row(user_id: int, emoji: str, name: str, keywords: str = "") -> dict | None:
     name = (name or "").strip()
     if not name:
@@ -785,6 +1488,7 @@ def add_category_row(user_id: int, emoji: str, name: str, keywords: str = "") ->
     )
 
 
+@_mutates_user_data
 def delete_category_row(user_id: int, category_id: int) -> bool:
     """Удаляет строку категории, если на неё нет ссылок в активных задачах."""
     row = get_category_by_id(category_id, user_id)
@@ -833,6 +1537,7 @@ def get_project(user_id: int, project_id: int) -> dict | None:
     )
 
 
+@_mutates_user_data
 def archive_project(user_id: int, project_id: int, complete_active: bool = True) -> dict:
     """Архивирует проект. Если complete_active — отмечает все активные задачи как выполненные.
 
@@ -844,39 +1549,40 @@ def archive_project(user_id: int, project_id: int, complete_active: bool = True)
     if proj.get("archived_at"):
         return {"ok": False, "message": "Проект уже в архиве.", "completed_count": 0}
     now = datetime.now(timezone.utc).isoformat()
-    completed_count = 0
-    _execute(
-        "UPDATE tasks SET project_id = NULL "
-        "WHERE user_id = %s AND project_id = %s "
-        "AND COALESCE(is_routine, FALSE) = TRUE",
-        (user_id, project_id),
-    )
-    if complete_active:
-        rows = _fetchall(
-            "SELECT id FROM tasks WHERE user_id = %s AND project_id = %s "
-            "AND status = 'active' AND COALESCE(is_routine, FALSE) = FALSE",
+    with transaction():
+        completed_count = 0
+        _execute(
+            "UPDATE tasks SET project_id = NULL "
+            "WHERE user_id = %s AND project_id = %s "
+            "AND COALESCE(is_routine, FALSE) = TRUE",
             (user_id, project_id),
         )
-        if rows:
-            ids = [int(r["id"]) for r in rows]
-            if USE_PG:
-                _execute(
-                    "UPDATE tasks SET status = 'done', completed_at = %s "
-                    "WHERE id = ANY(%s) AND user_id = %s AND status = 'active'",
-                    (now, ids, user_id),
-                )
-            else:
-                ph = ",".join("?" for _ in ids)
-                _execute(
-                    f"UPDATE tasks SET status = 'done', completed_at = %s "
-                    f"WHERE id IN ({ph}) AND user_id = %s AND status = 'active'",
-                    (now, *ids, user_id),
-                )
-            completed_count = len(ids)
-    _execute(
-        "UPDATE projects SET archived_at = %s WHERE id = %s AND user_id = %s",
-        (now, project_id, user_id),
-    )
+        if complete_active:
+            rows = _fetchall(
+                "SELECT id FROM tasks WHERE user_id = %s AND project_id = %s "
+                "AND status = 'active' AND COALESCE(is_routine, FALSE) = FALSE",
+                (user_id, project_id),
+            )
+            if rows:
+                ids = [int(r["id"]) for r in rows]
+                if USE_PG:
+                    _execute(
+                        "UPDATE tasks SET status = 'done', completed_at = %s "
+                        "WHERE id = ANY(%s) AND user_id = %s AND status = 'active'",
+                        (now, ids, user_id),
+                    )
+                else:
+                    ph = ",".join("?" for _ in ids)
+                    _execute(
+                        f"UPDATE tasks SET status = 'done', completed_at = %s "
+                        f"WHERE id IN ({ph}) AND user_id = %s AND status = 'active'",
+                        (now, *ids, user_id),
+                    )
+                completed_count = len(ids)
+        _execute(
+            "UPDATE projects SET archived_at = %s WHERE id = %s AND user_id = %s",
+            (now, project_id, user_id),
+        )
     return {
         "ok": True,
         "message": (
@@ -888,6 +1594,7 @@ def archive_project(user_id: int, project_id: int, complete_active: bool = True)
     }
 
 
+@_mutates_user_data
 def unarchive_project(user_id: int, project_id: int) -> dict:
     proj = get_project(user_id, project_id)
     if not proj:
@@ -901,6 +1608,7 @@ def unarchive_project(user_id: int, project_id: int) -> dict:
     return {"ok": True, "message": "Проект восстановлен."}
 
 
+@_mutates_user_data
 def create_project(user_id: int, title: str, emoji: str = "📁") -> dict | None:
     t = (title or "").strip()
     if not t:
@@ -912,6 +1620,7 @@ def create_project(user_id: int, title: str, emoji: str = "📁") -> dict | None
     )
 
 
+@_mutates_user_data
 def update_project(user_id: int, project_id: int, title: str, emoji: str) -> dict | None:
     """Обновляет название и эмодзи проекта. Пустое название — не допускается."""
     t = (title or "").strip()
@@ -927,14 +1636,16 @@ def update_project(user_id: int, project_id: int, title: str, emoji: str) -> dic
     return get_project(user_id, project_id) if n else None
 
 
+@_mutates_user_data
 def delete_project(user_id: int, project_id: int) -> bool:
     if not get_project(user_id, project_id):
         return False
-    _execute(
-        "UPDATE tasks SET project_id = NULL WHERE user_id = %s AND project_id = %s",
-        (user_id, project_id),
-    )
-    n = _execute("DELETE FROM projects WHERE id = %s AND user_id = %s", (project_id, user_id))
+    with transaction():
+        _execute(
+            "UPDATE tasks SET project_id = NULL WHERE user_id = %s AND project_id = %s",
+            (user_id, project_id),
+        )
+        n = _execute("DELETE FROM projects WHERE id = %s AND user_id = %s", (project_id, user_id))
     return n > 0
 
 
@@ -967,46 +1678,22 @@ def count_active_tasks_by_project(user_id: int) -> dict[int, int]:
 
 
 def count_active_tasks(user_id: int) -> int:
-    row = _fetchone(
-        "SELECT COUNT(*) AS c FROM tasks WHERE user_id = %s AND status = 'active'",
-        (user_id,),
-    )
-    return int(row["c"]) if row and row.get("c") is not None else 0
+    return len(_active_tasks_snapshot(user_id))
 
 
 def count_active_routines(user_id: int) -> int:
-    row = _fetchone(
-        "SELECT COUNT(*) AS c FROM tasks WHERE user_id = %s AND status = 'active' AND is_routine = TRUE",
-        (user_id,),
-    )
-    return int(row["c"]) if row and row.get("c") is not None else 0
+    return sum(1 for t in _active_tasks_snapshot(user_id) if _is_routine_row(t))
 
 
 def home_counts(user_id: int) -> dict[str, int]:
     """
-    Один запрос на главную: возвращает дешёвые счётчики для дашборда.
-    n_tasks — все активные, n_routines — активные рутины. count_active_tasks
-    уже включает рутины, как и в исходной логике.
+    Дешёвые счётчики для дашборда: n_tasks — все активные (включая рутины),
+    n_routines — активные рутины. Считаются по снимку активных задач.
     """
-    row = _fetchone(
-        "SELECT "
-        "  COUNT(*) FILTER (WHERE status = 'active') AS n_tasks, "
-        "  COUNT(*) FILTER (WHERE status = 'active' AND is_routine = TRUE) AS n_routines "
-        "FROM tasks WHERE user_id = %s",
-        (user_id,),
-    ) if USE_PG else None
-    if row is None:
-        # SQLite не поддерживает FILTER (WHERE …), используем CASE.
-        row = _fetchone(
-            "SELECT "
-            "  SUM(CASE WHEN status = 'active' THEN 1 ELSE 0 END) AS n_tasks, "
-            "  SUM(CASE WHEN status = 'active' AND is_routine = 1 THEN 1 ELSE 0 END) AS n_routines "
-            "FROM tasks WHERE user_id = %s",
-            (user_id,),
-        )
+    rows = _active_tasks_snapshot(user_id)
     return {
-        "n_tasks": int((row or {}).get("n_tasks") or 0),
-        "n_routines": int((row or {}).get("n_routines") or 0),
+        "n_tasks": len(rows),
+        "n_routines": sum(1 for t in rows if _is_routine_row(t)),
     }
 
 
@@ -1051,6 +1738,7 @@ def get_project_sort_mode(user_id: int, project_id: int) -> str:
     return m if m in ("hybrid", "manual") else "hybrid"
 
 
+@_mutates_user_data
 def set_project_sort_mode(user_id: int, project_id: int, mode: str) -> bool:
     m = (mode or "").strip().lower()
     if m not in ("hybrid", "manual"):
@@ -1070,20 +1758,55 @@ def _project_tasks_hybrid_ordered(user_id: int, project_id: int) -> list[dict]:
     )
 
 
+_ORDER_COLUMNS = frozenset({"color_sort", "today_sort"})
+
+
+def _order_pairs(task_ids: list[int], step: int = 10) -> list[tuple[int, int]]:
+    """[id, …] → [(id, 10), (id, 20), …] — позиции с шагом для вставок между."""
+    return [(int(tid), (i + 1) * step) for i, tid in enumerate(task_ids)]
+
+
+def _bulk_set_order(user_id: int, column: str, pairs: list[tuple[int, int]]) -> None:
+    """
+    Записывает целый порядок (task_id → значение column) за один запрос:
+    PG — UPDATE … FROM (VALUES …), SQLite — executemany в одной транзакции.
+    """
+    if column not in _ORDER_COLUMNS:
+        raise ValueError(f"unknown order column: {column}")
+    if not pairs:
+        return
+    if USE_PG:
+        values = ",".join(["(%s, %s)"] * len(pairs))
+        params: list = []
+        for tid, pos in pairs:
+            params.extend([int(tid), int(pos)])
+        _execute(
+            f"UPDATE tasks AS t SET {column} = v.pos "
+            f"FROM (VALUES {values}) AS v(id, pos) "
+            f"WHERE t.id = v.id AND t.user_id = %s",
+            (*params, user_id),
+        )
+        return
+    with transaction():
+        _executemany(
+            f"UPDATE tasks SET {column} = %s WHERE id = %s AND user_id = %s",
+            [(int(pos), int(tid), user_id) for tid, pos in pairs],
+        )
+
+
+@_mutates_user_data
 def migrate_project_to_manual_order(user_id: int, project_id: int) -> None:
     """Текущий гибридный порядок → color_sort, проект в режиме manual."""
-    rows = _project_tasks_hybrid_ordered(user_id, project_id)
-    for i, r in enumerate(rows):
+    with transaction():
+        rows = _project_tasks_hybrid_ordered(user_id, project_id)
+        _bulk_set_order(user_id, "color_sort", _order_pairs([r["id"] for r in rows]))
         _execute(
-            "UPDATE tasks SET color_sort = %s WHERE id = %s AND user_id = %s",
-            ((i + 1) * 10, int(r["id"]), user_id),
+            "UPDATE projects SET sort_mode = 'manual' WHERE id = %s AND user_id = %s",
+            (project_id, user_id),
         )
-    _execute(
-        "UPDATE projects SET sort_mode = 'manual' WHERE id = %s AND user_id = %s",
-        (project_id, user_id),
-    )
 
 
+@_mutates_user_data
 def append_color_sort_new_project_task(user_id: int, project_id: int, task_id: int) -> None:
     """Новая задача в проекте: вниз бездатных (hybrid) или вниз списка (manual)."""
     mode = get_project_sort_mode(user_id, project_id)
@@ -1157,6 +1880,7 @@ def today_bucket_task_lists(user_id: int) -> dict[str, list[dict]]:
     return buckets
 
 
+@_mutates_user_data
 def ensure_today_sort_tail(user_id: int, task_id: int) -> None:
     """После смены блока дня — в конец этого блока по today_sort."""
     task = get_active_task_by_id(user_id, task_id)
@@ -1173,6 +1897,7 @@ def ensure_today_sort_tail(user_id: int, task_id: int) -> None:
     )
 
 
+@_mutates_user_data
 def move_task_in_today_order(user_id: int, task_id: int, direction: str) -> dict:
     """Стрелки вверх/вниз внутри блока «Сегодня»."""
     d = (direction or "").strip().lower()
@@ -1192,35 +1917,28 @@ def move_task_in_today_order(user_id: int, task_id: int, direction: str) -> dict
     rows = [{"id": int(t["id"]), "today_sort": int(t.get("today_sort") or 0)} for t in loc_list]
     if len(rows) < 2:
         return {"ok": False, "message": "В блоке одна задача."}
-    ts_vals = {r["today_sort"] for r in rows}
-    needs_norm = len(ts_vals) < len(rows) or (len(rows) > 1 and all(r["today_sort"] == 0 for r in rows))
-    if needs_norm:
-        for i, r in enumerate(rows):
-            ns = (i + 1) * 10
-            _execute(
-                "UPDATE tasks SET today_sort = %s WHERE id = %s AND user_id = %s",
-                (ns, r["id"], user_id),
-            )
-            r["today_sort"] = ns
     idx = next((i for i, r in enumerate(rows) if r["id"] == tid), -1)
     if idx < 0:
         return {"ok": False, "message": "Задача не найдена."}
     swap_i = idx - 1 if d == "up" else idx + 1
     if swap_i < 0 or swap_i >= len(rows):
         return {"ok": False, "message": "Уже на краю блока."}
-    a, b = rows[idx], rows[swap_i]
-    a_ts, b_ts = a["today_sort"], b["today_sort"]
-    _execute(
-        "UPDATE tasks SET today_sort = %s WHERE id = %s AND user_id = %s",
-        (b_ts, a["id"], user_id),
-    )
-    _execute(
-        "UPDATE tasks SET today_sort = %s WHERE id = %s AND user_id = %s",
-        (a_ts, b["id"], user_id),
-    )
+    ts_vals = {r["today_sort"] for r in rows}
+    needs_norm = len(ts_vals) < len(rows) or (len(rows) > 1 and all(r["today_sort"] == 0 for r in rows))
+    if needs_norm:
+        # Дубли/нули: перенумеровываем весь блок сразу в новом порядке.
+        ids = [r["id"] for r in rows]
+        ids[idx], ids[swap_i] = ids[swap_i], ids[idx]
+        _bulk_set_order(user_id, "today_sort", _order_pairs(ids))
+    else:
+        a, b = rows[idx], rows[swap_i]
+        _bulk_set_order(
+            user_id, "today_sort", [(a["id"], b["today_sort"]), (b["id"], a["today_sort"])]
+        )
     return {"ok": True, "message": "Порядок обновлён."}
 
 
+@_mutates_user_data
 def sync_today_bucket_orders(
     user_id: int,
     orders_utro: str = "",
@@ -1246,6 +1964,8 @@ def sync_today_bucket_orders(
 
     buckets = today_bucket_task_lists(user_id)
     mapping = {"утро": _parse(orders_utro), "день": _parse(orders_den), "вечер": _parse(orders_vecher)}
+    # Сначала проверяем все блоки: неверный список в одном не должен оставить
+    # другие блоки наполовину пересортированными.
     for bk, maybe in mapping.items():
         if maybe is None:
             continue
@@ -1253,20 +1973,19 @@ def sync_today_bucket_orders(
         got = sorted(int(x) for x in maybe)
         if valid_ids != got:
             return {"ok": False, "message": f"Неверный список задач для «{bk}»."}
-        for i, tid in enumerate(maybe):
-            _execute(
-                "UPDATE tasks SET today_sort = %s WHERE id = %s AND user_id = %s",
-                ((i + 1) * 10, int(tid), user_id),
-            )
+    pairs: list[tuple[int, int]] = []
+    for maybe in mapping.values():
+        if maybe is not None:
+            pairs.extend(_order_pairs(maybe))
+    _bulk_set_order(user_id, "today_sort", pairs)
     return {"ok": True, "message": "Порядок сохранён."}
 
 
+@_mutates_user_data
 def reorder_project_tasks(user_id: int, project_id: int, ordered_task_ids: list[int]) -> dict:
     """Порядок после drag-and-drop на странице проекта."""
     if not get_project(user_id, project_id):
         return {"ok": False, "message": "Проект не найден."}
-    if get_project_sort_mode(user_id, project_id) == "hybrid":
-        migrate_project_to_manual_order(user_id, project_id)
     cur = _fetchall(
         "SELECT id FROM tasks WHERE user_id = %s AND project_id = %s AND status = 'active' ORDER BY id",
         (user_id, project_id),
@@ -1275,11 +1994,13 @@ def reorder_project_tasks(user_id: int, project_id: int, ordered_task_ids: list[
     got = sorted(int(x) for x in ordered_task_ids)
     if cur_ids != got:
         return {"ok": False, "message": "Список не совпадает с задачами проекта."}
-    for i, tid in enumerate(ordered_task_ids):
-        _execute(
-            "UPDATE tasks SET color_sort = %s WHERE id = %s AND user_id = %s",
-            ((i + 1) * 10, int(tid), user_id),
-        )
+    with transaction():
+        if get_project_sort_mode(user_id, project_id) == "hybrid":
+            _execute(
+                "UPDATE projects SET sort_mode = 'manual' WHERE id = %s AND user_id = %s",
+                (project_id, user_id),
+            )
+        _bulk_set_order(user_id, "color_sort", _order_pairs(ordered_task_ids))
     return {"ok": True, "message": "Порядок сохранён."}
 
 
@@ -1318,6 +2039,7 @@ def get_active_tasks_for_project(
     )
 
 
+@_mutates_user_data
 def move_task_in_project(user_id: int, task_id: int, direction: str) -> dict:
     """Вверх/вниз в проекте; при режиме hybrid сначала фиксируем порядок в manual."""
     d = (direction or "").strip().lower()
@@ -1331,45 +2053,40 @@ def move_task_in_project(user_id: int, task_id: int, direction: str) -> dict:
     if not task or task.get("project_id") is None:
         return {"ok": False, "message": "Задача не найдена в проекте."}
     pid = int(task["project_id"])
-    if get_project_sort_mode(user_id, pid) == "hybrid":
-        migrate_project_to_manual_order(user_id, pid)
-    rows = _fetchall(
-        "SELECT id, COALESCE(color_sort, 0) AS color_sort FROM tasks "
-        "WHERE user_id = %s AND project_id = %s AND status = 'active' "
-        "ORDER BY COALESCE(color_sort, 0), id",
-        (user_id, pid),
-    )
-    if len(rows) < 2:
-        return {"ok": False, "message": "В проекте только одна задача."}
-    cs_values = {int(r["color_sort"]) for r in rows}
-    needs_norm = len(cs_values) < len(rows) or 0 in cs_values
-    if needs_norm:
-        for i, r in enumerate(rows):
-            new_cs = (i + 1) * 10
-            _execute(
-                "UPDATE tasks SET color_sort = %s WHERE id = %s AND user_id = %s",
-                (new_cs, int(r["id"]), user_id),
+    with transaction():
+        if get_project_sort_mode(user_id, pid) == "hybrid":
+            migrate_project_to_manual_order(user_id, pid)
+        rows = _fetchall(
+            "SELECT id, COALESCE(color_sort, 0) AS color_sort FROM tasks "
+            "WHERE user_id = %s AND project_id = %s AND status = 'active' "
+            "ORDER BY COALESCE(color_sort, 0), id",
+            (user_id, pid),
+        )
+        if len(rows) < 2:
+            return {"ok": False, "message": "В проекте только одна задача."}
+        idx = next((i for i, r in enumerate(rows) if int(r["id"]) == int(task_id)), -1)
+        if idx < 0:
+            return {"ok": False, "message": "Задача не найдена в порядке."}
+        swap_idx = idx - 1 if d == "up" else idx + 1
+        if swap_idx < 0 or swap_idx >= len(rows):
+            return {"ok": False, "message": "Уже на крайней позиции."}
+        cs_values = {int(r["color_sort"]) for r in rows}
+        needs_norm = len(cs_values) < len(rows) or 0 in cs_values
+        if needs_norm:
+            ids = [int(r["id"]) for r in rows]
+            ids[idx], ids[swap_idx] = ids[swap_idx], ids[idx]
+            _bulk_set_order(user_id, "color_sort", _order_pairs(ids))
+        else:
+            a, b = rows[idx], rows[swap_idx]
+            _bulk_set_order(
+                user_id,
+                "color_sort",
+                [(int(a["id"]), int(b["color_sort"])), (int(b["id"]), int(a["color_sort"]))],
             )
-            r["color_sort"] = new_cs
-    idx = next((i for i, r in enumerate(rows) if int(r["id"]) == int(task_id)), -1)
-    if idx < 0:
-        return {"ok": False, "message": "Задача не найдена в порядке."}
-    swap_idx = idx - 1 if d == "up" else idx + 1
-    if swap_idx < 0 or swap_idx >= len(rows):
-        return {"ok": False, "message": "Уже на крайней позиции."}
-    a, b = rows[idx], rows[swap_idx]
-    a_cs, b_cs = int(a["color_sort"]), int(b["color_sort"])
-    _execute(
-        "UPDATE tasks SET color_sort = %s WHERE id = %s AND user_id = %s",
-        (b_cs, int(a["id"]), user_id),
-    )
-    _execute(
-        "UPDATE tasks SET color_sort = %s WHERE id = %s AND user_id = %s",
-        (a_cs, int(b["id"]), user_id),
-    )
     return {"ok": True, "message": "Порядок обновлён."}
 
 
+@_mutates_user_data
 def set_task_color(user_id: int, task_id: int, color: str) -> bool:
     """Устанавливает цвет задачи. Допустимые значения см. VALID_TASK_COLORS."""
     c = (color or "").strip().lower()
@@ -1427,6 +2144,7 @@ def attach_project_labels(user_id: int, tasks: list[dict]) -> None:
 
 # ── Tasks ────────────────────────────────────────────────────────────────
 
+@_mutates_user_data
 def add_task(
     user_id: int,
     text: str,
@@ -1458,18 +2176,28 @@ def add_task(
         repeat_day = random.choice(_ROUTINE_DAY_CODES)
         logger.info("add_task: assigned random weekday for weekly routine: %s", repeat_day)
     score = _calc_score(priority_value, priority_urgency, priority_risk, priority_size)
+    # Якорь N_DAYS/BIWEEK — дата создания; created_at в БД ставится по UTC, как и здесь.
+    if is_routine:
+        repeat_mask, repeat_every, repeat_anchor = compile_repeat_day(
+            repeat_day, datetime.now(timezone.utc).date().isoformat()
+        )
+    else:
+        repeat_mask, repeat_every, repeat_anchor = None, 0, 0
+    remind_at = None if is_routine else compute_remind_at(user_id, due_date, due_time, time_of_day)
     result = _insert_returning(
         """INSERT INTO tasks
            (user_id, text, category_emoji, category_name,
             due_date, due_time, time_of_day,
             priority_value, priority_urgency, priority_risk, priority_size, priority_score,
-            is_routine, repeat_day, project_id)
-           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            is_routine, repeat_day, project_id,
+            repeat_mask, repeat_every, repeat_anchor, remind_at_utc)
+           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
            RETURNING *""",
         (user_id, text, category_emoji, category_name,
          due_date, due_time, time_of_day,
          priority_value, priority_urgency, priority_risk, priority_size, score,
-         is_routine, repeat_day, project_id),
+         is_routine, repeat_day, project_id,
+         repeat_mask, repeat_every, repeat_anchor, remind_at),
     )
     if result:
         logger.info("add_task OK: id=%s is_routine=%s", result.get("id"), result.get("is_routine"))
@@ -1477,10 +2205,7 @@ def add_task(
 
 
 def get_active_tasks(user_id: int) -> list[dict]:
-    return _fetchall(
-        "SELECT * FROM tasks WHERE user_id = %s AND status = 'active' ORDER BY priority_score DESC",
-        (user_id,),
-    )
+    return _priority_desc(_active_tasks_snapshot(user_id))
 
 
 def get_active_task_by_id(user_id: int, task_id: int) -> dict | None:
@@ -1491,24 +2216,249 @@ def get_active_task_by_id(user_id: int, task_id: int) -> dict | None:
     )
 
 
+# ── Постраничные выборки для API (/api/v1) ───────────────────────────────
+# Keyset-пагинация: курсор — ключ сортировки последней строки страницы, следующая
+# страница начинается строго после него. В отличие от OFFSET, страницы не
+# «съезжают» при вставках и удалениях, а цена запроса не растёт с номером страницы.
+API_TASK_FIELDS = (
+    "id", "text", "status", "due_date", "due_time", "time_of_day",
+    "is_routine", "repeat_day", "project_id", "category_emoji", "category_name",
+    "color", "estimate_min", "priority_score", "created_at", "completed_at",
+    "last_completed_at",
+)
+_TASK_SORT_SQL = (
+    "COALESCE(CAST(due_date AS TEXT), '9999-12-31')",
+    "COALESCE(CAST(due_time AS TEXT), '')",
+)
+
+
+def _api_task_columns(fields) -> str:
+    cols = [f for f in API_TASK_FIELDS if not fields or f in fields or f == "id"]
+    return ", ".join(cols)
+
+
+def list_tasks_page(
+    user_id: int,
+    *,
+    status: str = "active",
+    is_routine: bool | None = None,
+    after: tuple[str, str, int] | None = None,
+    limit: int = 50,
+    fields=None,
+) -> tuple[list[dict], tuple[str, str, int] | None]:
+    """
+    Страница задач в порядке (due_date, due_time, id) — как в списке задач.
+    after — курсор предыдущей страницы; fields — подмножество API_TASK_FIELDS
+    (id всегда). Возвращает (строки, курсор следующей страницы или None).
+    """
+    where = ["user_id = %s", "status = %s"]
+    params: list = [user_id, status]
+    if is_routine is not None:
+        where.append("COALESCE(is_routine, FALSE) = %s")
+        params.append(bool(is_routine))
+    if after is not None:
+        where.append(f"({_TASK_SORT_SQL[0]}, {_TASK_SORT_SQL[1]}, id) > (%s, %s, %s)")
+        params.extend([str(after[0]), str(after[1]), int(after[2])])
+    params.append(int(limit) + 1)
+    rows = _fetchall(
+        f"SELECT {_api_task_columns(fields)}, {_TASK_SORT_SQL[0]} AS _k_date, "
+        f"{_TASK_SORT_SQL[1]} AS _k_time FROM tasks WHERE {' AND '.join(where)} "
+        f"ORDER BY _k_date, _k_time, id LIMIT %s",
+        tuple(params),
+    )
+    next_after = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_after = (last["_k_date"], last["_k_time"], int(last["id"]))
+    for r in rows:
+        r.pop("_k_date", None)
+        r.pop("_k_time", None)
+    return rows, next_after
+
+
+def get_task_fields(user_id: int, task_id: int, fields=None) -> dict | None:
+    """Задача пользователя в любом статусе, только выбранные поля API."""
+    return _fetchone(
+        f"SELECT {_api_task_columns(fields)} FROM tasks WHERE id = %s AND user_id = %s",
+        (task_id, user_id),
+    )
+
+
+def list_completions_page(
+    user_id: int,
+    *,
+    since: str | None = None,
+    until: str | None = None,
+    before: tuple[str, str, int] | None = None,
+    limit: int = 50,
+) -> tuple[list[dict], tuple[str, str, int] | None]:
+    """
+    Журнал выполнений, новые сверху: разовые задачи (kind=task, по completed_at)
+    и отметки рутин из routine_completions (kind=routine). Курсор — (completed_at, kind, id)
+    последней строки. since/until — границы completed_at в UTC (ISO), until не включительно.
+    """
+    where = ["1 = 1"]
+    params: list = [user_id, user_id]
+    if since:
+        where.append("c.completed_at >= %s")
+        params.append(since)
+    if until:
+        where.append("c.completed_at < %s")
+        params.append(until)
+    if before is not None:
+        where.append("(c.completed_at, c.kind, c.id) < (%s, %s, %s)")
+        params.extend([before[0], before[1], int(before[2])])
+    params.append(int(limit) + 1)
+    rows = _fetchall(
+        "SELECT c.kind, c.id, c.task_id, c.text, c.completed_at FROM ("
+        "  SELECT 'task' AS kind, id, id AS task_id, text, completed_at FROM tasks"
+        "  WHERE user_id = %s AND status = 'done' AND completed_at IS NOT NULL"
+        "  UNION ALL"
+        "  SELECT 'routine' AS kind, rc.id, rc.task_id, t.text, rc.completed_at"
+        "  FROM routine_completions rc JOIN tasks t ON t.id = rc.task_id AND t.user_id = rc.user_id"
+        "  WHERE rc.user_id = %s"
+        f") c WHERE {' AND '.join(where)} "
+        "ORDER BY c.completed_at DESC, c.kind DESC, c.id DESC LIMIT %s",
+        tuple(params),
+    )
+    next_before = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        completed = last["completed_at"]
+        if hasattr(completed, "isoformat"):
+            completed = completed.isoformat()
+        next_before = (str(completed), last["kind"], int(last["id"]))
+    return rows, next_before
+
+
+# ── Окна страницы /tasks ─────────────────────────────────────────────────
+# Разделы страницы: даты по возрастанию, «Без срока», «Рутины». Внутри раздела и
+# для сквозной нумерации — порядок bot_v2._active_tasks_display_order
+# (due_date, due_time, id; задачи без даты первыми), поэтому номер строки
+# совпадает с номером для «выполни N» и complete_task_numbers.
+_DISPLAY_SORT_SQL = (
+    "COALESCE(CAST(due_date AS TEXT), '')",
+    "COALESCE(CAST(due_time AS TEXT), '')",
+)
+_TASKS_SECTION_SQL = (
+    "CASE WHEN COALESCE(is_routine, FALSE) = TRUE THEN 'routine' "
+    "WHEN COALESCE(CAST(due_date AS TEXT), '') = '' THEN 'nodate' "
+    "ELSE 'date:' || CAST(due_date AS TEXT) END"
+)
+# Порядок разделов: даты по возрастанию, затем «Без срока», затем «Рутины». Числовой
+# ранг, а не сравнение строк: в локалях en_US/ru_RU знаки препинания при сравнении
+# не учитываются, и порядок '~…' после 'date:…' держится только в C-collation.
+_TASKS_SECTION_ORDER_SQL = (
+    "CASE n.section WHEN 'routine' THEN 2 WHEN 'nodate' THEN 1 ELSE 0 END, "
+    "CASE WHEN n.section IN ('routine', 'nodate') THEN '' ELSE n._k_date END"
+)
+
+
+def _tasks_windowed_sql() -> str:
+    """Активные задачи с ключами сортировки, разделом и сквозным номером num."""
+    return (
+        "SELECT w.*, ROW_NUMBER() OVER (ORDER BY w._k_date, w._k_time, w.id) AS num FROM ("
+        f"  SELECT tasks.*, {_DISPLAY_SORT_SQL[0]} AS _k_date, {_DISPLAY_SORT_SQL[1]} AS _k_time,"
+        f"         {_TASKS_SECTION_SQL} AS section"
+        "  FROM tasks WHERE user_id = %s AND status = 'active'"
+        ") w"
+    )
+
+
+def _strip_window_keys(rows: list[dict]) -> tuple[str, str, int] | None:
+    """Убирает служебные ключи; возвращает ключ последней строки (курсор)."""
+    last = None
+    for r in rows:
+        last = (r.pop("_k_date"), r.pop("_k_time"), int(r["id"]))
+        for k in ("section_rank", "section_pos"):
+            r.pop(k, None)
+    return last
+
+
+def tasks_page_sections(user_id: int, rows_per_section: int, eager_sections: int) -> list[dict]:
+    """
+    Разделы /tasks одним запросом: [{key, count, rows, next_after}].
+    Первые eager_sections разделов получают до rows_per_section строк, остальные —
+    только счётчик (строки догружаются list_tasks_section). next_after — курсор
+    продолжения или None, если раздел выдан целиком.
+    """
+    rows = _fetchall(
+        "SELECT * FROM ("
+        "  SELECT n.*,"
+        "         ROW_NUMBER() OVER (PARTITION BY n.section ORDER BY n._k_date, n._k_time, n.id) AS section_pos,"
+        "         COUNT(*) OVER (PARTITION BY n.section) AS section_count,"
+        f"        DENSE_RANK() OVER (ORDER BY {_TASKS_SECTION_ORDER_SQL}) AS section_rank"
+        f"  FROM ({_tasks_windowed_sql()}) n"
+        ") s WHERE s.section_pos <= CASE WHEN s.section_rank <= %s THEN %s ELSE 1 END "
+        "ORDER BY s.section_rank, s.section_pos",
+        (user_id, int(eager_sections), int(rows_per_section)),
+    )
+    sections: list[dict] = []
+    for r in rows:
+        if not sections or sections[-1]["key"] != r["section"]:
+            sections.append(
+                {
+                    "key": r["section"],
+                    "count": int(r["section_count"]),
+                    "rows": [],
+                    "eager": int(r["section_rank"]) <= eager_sections,
+                }
+            )
+        if sections[-1]["eager"]:
+            sections[-1]["rows"].append(r)
+    for sec in sections:
+        del sec["eager"]
+        last = _strip_window_keys(sec["rows"])
+        for r in sec["rows"]:
+            r.pop("section", None)
+            r.pop("section_count", None)
+        # Раздел без строк (не из первых eager_sections) догружается с начала: курсор None.
+        sec["next_after"] = last if sec["count"] > len(sec["rows"]) else None
+    return sections
+
+
+def list_tasks_section(
+    user_id: int,
+    section: str,
+    after: tuple[str, str, int] | None = None,
+    limit: int = 50,
+) -> tuple[list[dict], tuple[str, str, int] | None]:
+    """Следующая страница раздела /tasks (keyset после after) со сквозными номерами."""
+    where = ["w.section = %s"]
+    params: list = [user_id, section]
+    if after is not None:
+        where.append("(w._k_date, w._k_time, w.id) > (%s, %s, %s)")
+        params.extend([str(after[0]), str(after[1]), int(after[2])])
+    params.append(int(limit) + 1)
+    rows = _fetchall(
+        f"SELECT * FROM ({_tasks_windowed_sql()}) w WHERE {' AND '.join(where)} "
+        "ORDER BY w._k_date, w._k_time, w.id LIMIT %s",
+        tuple(params),
+    )
+    more = len(rows) > limit
+    rows = rows[:limit]
+    last = _strip_window_keys(rows)
+    for r in rows:
+        r.pop("section", None)
+    return rows, (last if more else None)
+
+
 def get_active_tasks_ordered(user_id: int) -> list[dict]:
     """Активные задачи в порядке для списка: по дате, времени, id (стабильная нумерация)."""
-    try:
-        # Универсальная сортировка для mixed-схем (TEXT/DATE/TIMESTAMP в старых БД):
-        # сравниваем по текстовому представлению даты, чтобы не падать на несовместимых типах.
-        rows = _fetchall(
-            "SELECT * FROM tasks WHERE user_id = %s AND status = 'active' "
-            "ORDER BY COALESCE(CAST(due_date AS TEXT), '9999-12-31'), COALESCE(CAST(due_time AS TEXT), ''), id",
-            (user_id,),
-        )
-        return rows
-    except Exception as e:
-        logger.warning("get_active_tasks_ordered fallback due to query error: %s", e)
-        return _fetchall(
-            "SELECT * FROM tasks WHERE user_id = %s AND status = 'active' ORDER BY id",
-            (user_id,),
+    # Сравниваем текстовое представление даты/времени (как CAST(... AS TEXT) в SQL),
+    # чтобы не зависеть от типа колонки в старых БД (TEXT/DATE/TIMESTAMP).
+    def _key(t: dict) -> tuple:
+        dd, dt = t.get("due_date"), t.get("due_time")
+        return (
+            "9999-12-31" if dd is None else str(dd),
+            "" if dt is None else str(dt),
+            int(t["id"]),
         )
 
+    return sorted(_active_tasks_snapshot(user_id), key=_key)
+
 
 def get_active_tasks_for_plan_sidebar(user_id: int, exclude_ids: set[int]) -> list[dict]:
     """Не-рутины для блока «другие задачи» на /plan без загрузки всего списка задач."""
@@ -1548,6 +2498,8 @@ def transfer_overdue_tasks(user_id: int) -> int:
     )
     if n and n > 0:
         logger.info("transfer_overdue_tasks: user_id=%s moved %s tasks to %s", user_id, n, today_str)
+        refresh_user_reminders(user_id)
+        bump_user_version(user_id)
     return n or 0
 
 
@@ -1559,18 +2511,96 @@ def _normalize_search(s: str) -> str:
     return re.sub(r"\s+", " ", (s or "").strip().lower())
 
 
+# Полнотекстовый поиск: индекс находит задачи, где слова запроса стоят в начале слов,
+# и упорядочивает их по релевантности. Сами совпадения (подстрока, все слова) всегда
+# проверяются по всем активным задачам — «сервис» в «автосервис» индекс не найдёт, —
+# а ранг индекса только поднимает такие задачи выше.
+_FTS_MAX_CANDIDATES = 200
+_sqlite_fts_ready: bool | None = None
+
+
+def _fts_terms(search_norm: str) -> list[str]:
+    import re
+
+    terms: list[str] = []
+    for w in re.findall(r"[^\W_]+", search_norm):
+        if len(w) >= 2 and w not in terms:
+            terms.append(w)
+    return terms
+
+
+def _sqlite_has_fts() -> bool:
+    global _sqlite_fts_ready
+    if _sqlite_fts_ready is None:
+        row = _fetchone(
+            "SELECT 1 AS ok FROM sqlite_master WHERE type = 'table' AND name = 'tasks_fts'"
+        )
+        _sqlite_fts_ready = bool(row)
+    return _sqlite_fts_ready
+
+
+def _fts_candidates(user_id: int, search_norm: str) -> list[dict] | None:
+    """Активные задачи, где встречается хоть одно слово запроса, по убыванию релевантности.
+
+    None — индексом воспользоваться нельзя (нет FTS5, в запросе нет слов, ошибка запроса);
+    тогда порядок остаётся прежним.
+    """
+    terms = _fts_terms(search_norm)
+    if not terms:
+        return None
+    try:
+        if USE_PG:
+            q = " | ".join(f"{t}:*" for t in terms)
+            return _fetchall(
+                "SELECT * FROM tasks WHERE user_id = %s AND status = 'active' "
+                "AND to_tsvector('simple', COALESCE(text, '')) @@ to_tsquery('simple', %s) "
+                "ORDER BY ts_rank(to_tsvector('simple', COALESCE(text, '')), "
+                "to_tsquery('simple', %s)) DESC, id LIMIT %s",
+                (user_id, q, q, _FTS_MAX_CANDIDATES),
+            )
+        if not _sqlite_has_fts():
+            return None
+        q = " OR ".join('"%s"*' % t for t in terms)
+        return _fetchall(
+            "SELECT t.* FROM tasks_fts JOIN tasks t ON t.id = tasks_fts.rowid "
+            "WHERE tasks_fts MATCH %s AND t.user_id = %s AND t.status = 'active' "
+            "ORDER BY tasks_fts.rank, t.id LIMIT %s",
+            (q, user_id, _FTS_MAX_CANDIDATES),
+        )
+    except Exception as e:
+        logger.warning("full-text task search failed, falling back to scan: %s", e)
+        return None
+
+
 def find_tasks_matching_text(user_id: int, search: str) -> list[dict]:
     """
     Все активные задачи, в тексте которых встречается search.
     Поддерживает: подстроку, все слова, частичное вхождение (любое слово из запроса),
     fallback по последним 2–4 словам (если запрос длинный и нет точного совпадения).
+    Найденные — по релевантности полнотекстового индекса (если он есть).
     """
     search_norm = _normalize_search(search)
     if not search_norm:
         return []
-    tasks = get_active_tasks_ordered(user_id)
     words = [w for w in search_norm.split() if w]
+    found = _match_tasks_text(get_active_tasks_ordered(user_id), search_norm, words)
+    return _rank_by_fts(user_id, search_norm, found)
+
+
+def _rank_by_fts(user_id: int, search_norm: str, tasks: list[dict]) -> list[dict]:
+    """tasks в порядке релевантности индекса; не найденные индексом — следом, как были."""
+    if len(tasks) < 2:
+        return tasks
+    candidates = _fts_candidates(user_id, search_norm)
+    if not candidates:
+        return tasks
+    rank = {int(t["id"]): i for i, t in enumerate(candidates)}
+    return sorted(tasks, key=lambda t: rank.get(int(t["id"]), len(rank)))
 
+
+def _match_tasks_text(
+    tasks: list[dict], search_norm: str, words: list[str], exact_only: bool = False
+) -> list[dict]:
     def _match(query: str, qwords: list[str]) -> list[dict]:
         out = []
         for t in tasks:
@@ -1584,33 +2614,134 @@ def find_tasks_matching_text(user_id: int, search: str) -> list[dict]:
                 out.append(t)
         return out
 
-    # 1. Точное совпадение (подстрока или все слова)
-    out = _match(search_norm, words)
-    if out:
-        return out
+    # 1. Точное совпадение (подстрока или все слова)
+    out = _match(search_norm, words)
+    if out or exact_only:
+        return out
+
+    # 2. Частичное: хотя бы 2 слова из запроса входят в задачу (для длинных фраз)
+    if len(words) >= 3:
+        matches = []
+        for t in tasks:
+            task_text = _normalize_search(t.get("text") or "")
+            if not task_text:
+                continue
+            hits = sum(1 for w in words if w in task_text)
+            if hits >= 2:
+                matches.append(t)
+        if matches:
+            return matches
+
+    # 3. Fallback: последние 2–4 слова (часто это суть задачи)
+    if len(words) >= 4:
+        for n in (4, 3, 2):
+            tail = " ".join(words[-n:])
+            out = _match(tail, words[-n:])
+            if out:
+                return out
+
+    return []
+
+
+# Нечёткий поиск (опечатки распознавания речи): pg_trgm на PG, иначе триграммный
+# индекс в процессе поверх снимка активных задач, перестраиваемый при смене версии данных.
+FUZZY_MATCH_THRESHOLD = _env_float("FUZZY_MATCH_THRESHOLD", 0.6)
+# Насколько лучший кандидат должен опережать второго, чтобы считаться однозначным.
+_FUZZY_MARGIN = 0.1
+_pg_trgm_ready: bool | None = None
+
+
+def _pg_has_trgm() -> bool:
+    global _pg_trgm_ready
+    if _pg_trgm_ready is None:
+        try:
+            _pg_trgm_ready = bool(
+                _fetchone("SELECT 1 AS ok FROM pg_extension WHERE extname = 'pg_trgm'")
+            )
+        except Exception as e:
+            logger.warning("pg_trgm check failed: %s", e)
+            _pg_trgm_ready = False
+    return _pg_trgm_ready
+
+
+def _user_trigram_index(user_id: int, tasks: list[dict]) -> fuzzy_match.TrigramIndex:
+    uid = int(user_id)
+    version = user_data_version(uid)
+    now = _time.monotonic()
+    cached = _trigram_cache.get(uid)
+    if cached and cached[0] == version and now - cached[1] < max(DB_SNAPSHOT_TTL_SEC, 0):
+        return cached[2]
+    index = fuzzy_match.TrigramIndex((int(t["id"]), t.get("text") or "") for t in tasks)
+    with _versions_lock:
+        if len(_trigram_cache) >= _SNAPSHOT_MAX_USERS:
+            _trigram_cache.clear()
+        _trigram_cache[uid] = (version, now, index)
+    return index
+
+
+def find_tasks_fuzzy(
+    user_id: int, search: str, threshold: float | None = None, limit: int = 5
+) -> list[dict]:
+    """Активные задачи, похожие на search с точностью до опечаток, по убыванию сходства.
+
+    У каждой задачи поле match_score (0..1) — доля триграмм запроса, найденных в тексте.
+    """
+    search_norm = _normalize_search(search)
+    if not search_norm:
+        return []
+    thr = FUZZY_MATCH_THRESHOLD if threshold is None else float(threshold)
+    found = _pg_fuzzy(user_id, search_norm, thr, limit)
+    if found is not None:
+        return found
+    return _index_fuzzy(user_id, _active_tasks_snapshot(user_id), search_norm, thr, limit)
+
+
+def _pg_fuzzy(user_id: int, search_norm: str, thr: float, limit: int) -> list[dict] | None:
+    """Поиск через pg_trgm; None — расширения нет (или не PG), искать индексом в процессе."""
+    if not (USE_PG and _pg_has_trgm()):
+        return None
+    try:
+        with transaction():
+            _fetchone(
+                "SELECT set_config('pg_trgm.word_similarity_threshold', %s, true) AS v",
+                (str(thr),),
+            )
+            return _fetchall(
+                "SELECT *, word_similarity(%s, text) AS match_score FROM tasks "
+                "WHERE user_id = %s AND status = 'active' AND %s <%% text "
+                "ORDER BY match_score DESC, id LIMIT %s",
+                (search_norm, user_id, search_norm, limit),
+            )
+    except Exception as e:
+        logger.warning("pg_trgm search failed, using in-process index: %s", e)
+        return None
+
 
-    # 2. Частичное: хотя бы 2 слова из запроса входят в задачу (для длинных фраз)
-    if len(words) >= 3:
-        matches = []
-        for t in tasks:
-            task_text = _normalize_search(t.get("text") or "")
-            if not task_text:
-                continue
-            hits = sum(1 for w in words if w in task_text)
-            if hits >= 2:
-                matches.append(t)
-        if matches:
-            return matches
+def _index_fuzzy(
+    user_id: int, tasks: list[dict], search_norm: str, thr: float, limit: int
+) -> list[dict]:
+    by_id = {int(t["id"]): t for t in tasks}
+    out = []
+    for task_id, score in _user_trigram_index(user_id, tasks).search(search_norm, thr, limit):
+        t = by_id.get(task_id)
+        if t is not None:
+            t["match_score"] = score
+            out.append(t)
+    return out
 
-    # 3. Fallback: последние 2–4 слова (часто это суть задачи)
-    if len(words) >= 4:
-        for n in (4, 3, 2):
-            tail = " ".join(words[-n:])
-            out = _match(tail, words[-n:])
-            if out:
-                return out
 
-    return []
+def _unique_fuzzy(found: list[dict]) -> dict | None:
+    """Первый кандидат, если второй отстаёт от него больше чем на _FUZZY_MARGIN."""
+    if not found:
+        return None
+    if len(found) > 1 and found[1]["match_score"] > found[0]["match_score"] - _FUZZY_MARGIN:
+        return None
+    return found[0]
+
+
+def find_task_fuzzy_unique(user_id: int, search: str) -> dict | None:
+    """Лучшее нечёткое совпадение, если оно однозначно (второе заметно хуже), иначе None."""
+    return _unique_fuzzy(find_tasks_fuzzy(user_id, search, limit=2))
 
 
 # Маленький TTL-кеш timezone пользователя: нужная функциональность вызывается
@@ -1618,8 +2749,6 @@ def find_tasks_matching_text(user_id: int, search: str) -> list[dict]:
 # просроченных и т.д.) и каждый раз делала отдельный SELECT — это лишние
 # round-trip к БД. TTL 60 секунд достаточно: смена tz пользователем — редкий
 # случай, повторных гонок с задачами нет.
-import time as _time
-
 _TZ_CACHE_TTL_SEC = 60.0
 _tz_cache: dict[int, tuple[float, str]] = {}
 
@@ -1877,11 +3006,126 @@ def _routine_matches_today(task: dict, today_weekday: int, today_str: str) -> bo
     return False
 
 
+# Расписание рутины в виде трёх чисел (колонки repeat_mask / repeat_every / repeat_anchor):
+# mask — биты дней недели (бит 0 = пн), every — период в днях (0 = каждую неделю по маске),
+# anchor — date.toordinal() опорного дня. Рутина приходится на дату D, если
+# бит D.weekday() взведён и (every = 0 или D >= anchor и (D - anchor) % every = 0).
+# Так фильтр «рутины на дату» считается в SQL без разбора строк repeat_day.
+REPEAT_MASK_ALL = 0b1111111
+
+
+def compile_repeat_day(repeat_day: str | None, created_at=None) -> tuple[int, int, int]:
+    """Переводит repeat_day в (mask, every, anchor); результат совпадает с _routine_matches_today."""
+    from datetime import date
+
+    repeat = (repeat_day or "").strip()
+    if not repeat or repeat.lower() == "ежедневно":
+        return REPEAT_MASK_ALL, 0, 0
+    try:
+        anchor_d = date.fromisoformat(str(created_at or "")[:10])
+    except ValueError:
+        anchor_d = None
+    if repeat.upper().startswith("N_DAYS:"):
+        try:
+            n = int(repeat.split(":", 1)[1].strip())
+        except (ValueError, IndexError):
+            return 0, 0, 0
+        if n < 2:
+            return 0, 0, 0
+        if anchor_d is None:
+            return REPEAT_MASK_ALL, 0, 0
+        return REPEAT_MASK_ALL, n, anchor_d.toordinal()
+    if repeat.upper().startswith("BIWEEK:"):
+        wd = _ROUTINE_DAY_MAP.get(repeat.split(":", 1)[1].strip().lower())
+        if wd is None or wd < 0:
+            return 0, 0, 0
+        if anchor_d is None:
+            # Без даты создания чётность недели считается от самой даты — то есть каждую неделю.
+            return 1 << wd, 0, 0
+        # Нужный день недели в опорной неделе; период 14 дней, якорь по модулю 14,
+        # чтобы D >= anchor выполнялось для любой даты.
+        monday = anchor_d.toordinal() - anchor_d.weekday()
+        return 1 << wd, 14, (monday + wd) % 14
+    mask = 0
+    for code in repeat.split(","):
+        wd = _ROUTINE_DAY_MAP.get(code.strip().lower())
+        if wd == -1:
+            mask = REPEAT_MASK_ALL
+        elif wd is not None:
+            mask |= 1 << wd
+    return mask, 0, 0
+
+
+def _routine_due_on(task: dict, weekday: int, date_str: str) -> bool:
+    """Приходится ли рутина на дату: по скомпилированным колонкам, для старых строк — по repeat_day."""
+    mask = task.get("repeat_mask")
+    if mask is None:
+        return _routine_matches_today(task, weekday, date_str)
+    if not (int(mask) >> weekday) & 1:
+        return False
+    every = int(task.get("repeat_every") or 0)
+    if every <= 0:
+        return True
+    from datetime import date
+
+    try:
+        day = date.fromisoformat(date_str).toordinal()
+    except ValueError:
+        return False
+    anchor = int(task.get("repeat_anchor") or 0)
+    return day >= anchor and (day - anchor) % every == 0
+
+
+def _routine_due_sql() -> str:
+    """SQL-условие «рутина приходится на дату»; параметры: (бит дня, ordinal, ordinal).
+
+    Строки без repeat_mask (не прошедшие компиляцию) пропускаются — их досматривает _routine_due_on.
+    """
+    mod = "%%" if USE_PG else "%"
+    return (
+        "(repeat_mask IS NULL OR ((repeat_mask & %s) <> 0 AND (COALESCE(repeat_every, 0) = 0 "
+        f"OR (%s >= repeat_anchor AND (%s - repeat_anchor) {mod} repeat_every = 0))))"
+    )
+
+
+def _routine_due_params(date_str: str) -> tuple[int, int, int]:
+    from datetime import date
+
+    d = date.fromisoformat(date_str)
+    return 1 << d.weekday(), d.toordinal(), d.toordinal()
+
+
+def _backfill_repeat_schedule(conn) -> None:
+    """Миграция v3: компилирует repeat_day уже существующих рутин."""
+    select_sql = (
+        "SELECT id, repeat_day, created_at FROM tasks "
+        "WHERE COALESCE(is_routine, FALSE) = TRUE AND repeat_mask IS NULL"
+    )
+    update_sql = _query(
+        "UPDATE tasks SET repeat_mask = %s, repeat_every = %s, repeat_anchor = %s WHERE id = %s"
+    )
+    if USE_PG:
+        cur = conn.cursor()
+        cur.execute(select_sql)
+        rows = cur.fetchall()
+        params = [(*compile_repeat_day(rd, ca), tid) for tid, rd, ca in rows]
+        if params:
+            psycopg2.extras.execute_batch(cur, update_sql, params)
+        cur.close()
+    else:
+        rows = conn.execute(select_sql).fetchall()
+        params = [(*compile_repeat_day(r[1], r[2]), r[0]) for r in rows]
+        if params:
+            conn.executemany(update_sql, params)
+        conn.commit()
+    if params:
+        logger.info("repeat schedule compiled for %d routines", len(params))
+
+
 def get_today_tasks(user_id: int) -> list[dict]:
     """Задачи на сегодня: дата в ЧП пользователя; рутины по repeat_day; рутины, уже выполненные сегодня, не показываем."""
     today_str, today_weekday = _get_today_in_user_tz(user_id)
-    row = _fetchone("SELECT timezone FROM users WHERE id = %s", (user_id,))
-    tz_name = (row.get("timezone") or "Europe/Moscow").strip() or "Europe/Moscow"
+    tz_name = _get_user_timezone(user_id)
     if ZoneInfo is not None:
         try:
             tz = ZoneInfo(tz_name)
@@ -1898,16 +3142,17 @@ def get_today_tasks(user_id: int) -> list[dict]:
         start_utc = today_str + "T00:00:00+00:00"
         end_dt = datetime.strptime(today_str, "%Y-%m-%d") + timedelta(days=1)
         end_utc = end_dt.strftime("%Y-%m-%d") + "T00:00:00+00:00"
-    rows = _fetchall(
-        "SELECT * FROM tasks WHERE user_id = %s AND status = 'active' "
-        "AND (due_date = %s OR due_date IS NULL) "
-        "ORDER BY priority_score DESC",
-        (user_id, today_str),
+    rows = _priority_desc(
+        [
+            t
+            for t in _active_tasks_snapshot(user_id)
+            if t.get("due_date") is None or str(t["due_date"]) == today_str
+        ]
     )
     result = []
     for t in rows:
         if t.get("is_routine"):
-            if not _routine_matches_today(t, today_weekday, today_str):
+            if not _routine_due_on(t, today_weekday, today_str):
                 continue
             lc = t.get("last_completed_at") or ""
             if lc:
@@ -1928,13 +3173,17 @@ def get_today_tasks(user_id: int) -> list[dict]:
 def list_routines_due_today(user_id: int) -> list[dict]:
     """Все активные рутины, для которых сегодня есть слот по repeat_day (включая уже сделанные)."""
     today_str, today_weekday = _get_today_in_user_tz(user_id)
-    out: list[dict] = []
-    for t in get_routine_tasks(user_id):
-        if _routine_matches_today(t, today_weekday, today_str):
-            out.append(t)
-    return out
+    rows = _priority_desc(
+        _fetchall(
+            "SELECT * FROM tasks WHERE user_id = %s AND status = 'active' "
+            "AND COALESCE(is_routine, FALSE) = TRUE AND " + _routine_due_sql(),
+            (user_id, *_routine_due_params(today_str)),
+        )
+    )
+    return [t for t in rows if _routine_due_on(t, today_weekday, today_str)]
 
 
+@_mutates_user_data
 def complete_task(task_id: int, user_id: int | None = None, task: dict | None = None) -> bool:
     """
     Отмечает задачу выполненной.
@@ -1945,34 +3194,37 @@ def complete_task(task_id: int, user_id: int | None = None, task: dict | None =
     if task is None and user_id is not None:
         task = _fetchone("SELECT id, is_routine FROM tasks WHERE id = %s AND user_id = %s", (task_id, user_id))
     is_routine = task and task.get("is_routine")
-    if is_routine:
-        if user_id is not None:
-            n = _execute(
-                "UPDATE tasks SET last_completed_at = %s WHERE id = %s AND user_id = %s AND status = 'active'",
-                (now, task_id, user_id),
-            )
-        else:
-            n = _execute(
-                "UPDATE tasks SET last_completed_at = %s WHERE id = %s AND status = 'active'",
-                (now, task_id),
-            )
-    else:
-        if user_id is not None:
-            n = _execute(
-                "UPDATE tasks SET status = 'done', completed_at = %s WHERE id = %s AND user_id = %s AND status = 'active'",
-                (now, task_id, user_id),
-            )
+    with transaction():
+        if is_routine:
+            if user_id is not None:
+                n = _execute(
+                    "UPDATE tasks SET last_completed_at = %s WHERE id = %s AND user_id = %s AND status = 'active'",
+                    (now, task_id, user_id),
+                )
+            else:
+                n = _execute(
+                    "UPDATE tasks SET last_completed_at = %s WHERE id = %s AND status = 'active'",
+                    (now, task_id),
+                )
         else:
-            n = _execute(
-                "UPDATE tasks SET status = 'done', completed_at = %s WHERE id = %s AND status = 'active'",
-                (now, task_id),
-            )
-    logger.info("complete_task: task_id=%s user_id=%s is_routine=%s rows_updated=%s", task_id, user_id, is_routine, n)
-    if n > 0 and is_routine and user_id is not None:
-        try:
-            log_routine_completion(user_id, task_id, now)
-        except Exception as e:
-            logger.warning("log_routine_completion failed: %s", e)
+            if user_id is not None:
+                n = _execute(
+                    "UPDATE tasks SET status = 'done', completed_at = %s WHERE id = %s AND user_id = %s AND status = 'active'",
+                    (now, task_id, user_id),
+                )
+            else:
+                n = _execute(
+                    "UPDATE tasks SET status = 'done', completed_at = %s WHERE id = %s AND status = 'active'",
+                    (now, task_id),
+                )
+        logger.info("complete_task: task_id=%s user_id=%s is_routine=%s rows_updated=%s", task_id, user_id, is_routine, n)
+        if n > 0 and is_routine and user_id is not None:
+            try:
+                # SAVEPOINT: сбой журнала не откатывает саму отметку.
+                with transaction():
+                    log_routine_completion(user_id, task_id, now)
+            except Exception as e:
+                logger.warning("log_routine_completion failed: %s", e)
     return n > 0
 
 
@@ -1998,14 +3250,14 @@ def get_tasks_for_date(user_id: int, date_str: str) -> list[dict]:
 
     rows = _fetchall(
         "SELECT * FROM tasks WHERE user_id = %s AND status = 'active' "
-        "AND (due_date = %s OR COALESCE(is_routine, FALSE) = TRUE) "
+        "AND (due_date = %s OR (COALESCE(is_routine, FALSE) = TRUE AND " + _routine_due_sql() + ")) "
         "ORDER BY id",
-        (user_id, date_str),
+        (user_id, date_str, *_routine_due_params(date_str)),
     )
     out: list[dict] = []
     for t in rows:
         if t.get("is_routine"):
-            if not _routine_matches_today(t, weekday, date_str):
+            if not _routine_due_on(t, weekday, date_str):
                 continue
             lc = t.get("last_completed_at") or ""
             if lc:
@@ -2123,6 +3375,7 @@ def is_task_done_on_local_date(user_id: int, date_str: str, task: dict) -> bool:
     return False
 
 
+@_mutates_user_data
 def delete_plan_slots_for_task_on_date(
     user_id: int, task_id: int, date_str: str
 ) -> int:
@@ -2133,6 +3386,7 @@ def delete_plan_slots_for_task_on_date(
     )
 
 
+@_mutates_user_data
 def refresh_plan_slots_for_task_on_date(user_id: int, task_id: int, date_str: str) -> None:
     """Удаляет слоты задачи на дату и заново создаёт по актуальным полям (блок суток, время)."""
     raw = (date_str or "").strip()
@@ -2171,6 +3425,7 @@ def get_plan_slots(user_id: int, date_str: str) -> list[dict]:
     return rows
 
 
+@_mutates_user_data
 def add_plan_slot(
     user_id: int,
     date_str: str,
@@ -2457,6 +3712,7 @@ def ensure_plan_slots_from_due_time(
     return created
 
 
+@_mutates_user_data
 def update_plan_slot(
     user_id: int, slot_id: int, start_min: int, duration_min: int
 ) -> dict:
@@ -2474,6 +3730,7 @@ def update_plan_slot(
     return {"ok": n > 0, "message": "Слот обновлён." if n > 0 else "Слот не найден."}
 
 
+@_mutates_user_data
 def remove_plan_slot(user_id: int, slot_id: int) -> dict:
     n = _execute(
         "DELETE FROM daily_plan_slots WHERE id = %s AND user_id = %s",
@@ -2482,6 +3739,7 @@ def remove_plan_slot(user_id: int, slot_id: int) -> dict:
     return {"ok": n > 0, "message": "Убрано из плана." if n > 0 else "Слот не найден."}
 
 
+@_mutates_user_data
 def set_task_estimate(user_id: int, task_id: int, minutes: int) -> bool:
     """Устанавливает estimate_min задачи. minutes >= 0; 0 = без оценки."""
     m = int(minutes or 0)
@@ -2494,6 +3752,7 @@ def set_task_estimate(user_id: int, task_id: int, minutes: int) -> bool:
     return n > 0
 
 
+@_mutates_user_data
 def complete_tasks_bulk(user_id: int, task_ids: list[int]) -> tuple[list[dict], list[int]]:
     """Массовая отметка выполненными.
 
@@ -2527,52 +3786,55 @@ def complete_tasks_bulk(user_id: int, task_ids: list[int]) -> tuple[list[dict],
     normal_ids = [int(r["id"]) for r in rows if not r.get("is_routine")]
     routine_ids = [int(r["id"]) for r in rows if r.get("is_routine")]
 
-    if normal_ids:
-        if USE_PG:
-            _execute(
-                "UPDATE tasks SET status = 'done', completed_at = %s "
-                "WHERE id = ANY(%s) AND user_id = %s AND status = 'active'",
-                (now, normal_ids, user_id),
-            )
-        else:
-            ph = ",".join("?" for _ in normal_ids)
-            _execute(
-                f"UPDATE tasks SET status = 'done', completed_at = %s "
-                f"WHERE id IN ({ph}) AND user_id = %s AND status = 'active'",
-                (now, *normal_ids, user_id),
-            )
+    with transaction():
+        if normal_ids:
+            if USE_PG:
+                _execute(
+                    "UPDATE tasks SET status = 'done', completed_at = %s "
+                    "WHERE id = ANY(%s) AND user_id = %s AND status = 'active'",
+                    (now, normal_ids, user_id),
+                )
+            else:
+                ph = ",".join("?" for _ in normal_ids)
+                _execute(
+                    f"UPDATE tasks SET status = 'done', completed_at = %s "
+                    f"WHERE id IN ({ph}) AND user_id = %s AND status = 'active'",
+                    (now, *normal_ids, user_id),
+                )
 
-    if routine_ids:
-        if USE_PG:
-            _execute(
-                "UPDATE tasks SET last_completed_at = %s "
-                "WHERE id = ANY(%s) AND user_id = %s AND status = 'active'",
-                (now, routine_ids, user_id),
-            )
-            try:
-                values = ",".join(["(%s, %s, %s)"] * len(routine_ids))
-                params: list = []
-                for tid in routine_ids:
-                    params.extend([user_id, tid, now])
+        if routine_ids:
+            if USE_PG:
                 _execute(
-                    f"INSERT INTO routine_completions (user_id, task_id, completed_at) "
-                    f"VALUES {values}",
-                    tuple(params),
+                    "UPDATE tasks SET last_completed_at = %s "
+                    "WHERE id = ANY(%s) AND user_id = %s AND status = 'active'",
+                    (now, routine_ids, user_id),
                 )
-            except Exception as e:
-                logger.warning("log_routine_completion bulk failed: %s", e)
-        else:
-            ph = ",".join("?" for _ in routine_ids)
-            _execute(
-                f"UPDATE tasks SET last_completed_at = %s "
-                f"WHERE id IN ({ph}) AND user_id = %s AND status = 'active'",
-                (now, *routine_ids, user_id),
-            )
-            for tid in routine_ids:
                 try:
-                    log_routine_completion(user_id, tid, now)
+                    values = ",".join(["(%s, %s, %s)"] * len(routine_ids))
+                    params: list = []
+                    for tid in routine_ids:
+                        params.extend([user_id, tid, now])
+                    with transaction():
+                        _execute(
+                            f"INSERT INTO routine_completions (user_id, task_id, completed_at) "
+                            f"VALUES {values}",
+                            tuple(params),
+                        )
                 except Exception as e:
-                    logger.warning("log_routine_completion failed: %s", e)
+                    logger.warning("log_routine_completion bulk failed: %s", e)
+            else:
+                ph = ",".join("?" for _ in routine_ids)
+                _execute(
+                    f"UPDATE tasks SET last_completed_at = %s "
+                    f"WHERE id IN ({ph}) AND user_id = %s AND status = 'active'",
+                    (now, *routine_ids, user_id),
+                )
+                for tid in routine_ids:
+                    try:
+                        with transaction():
+                            log_routine_completion(user_id, tid, now)
+                    except Exception as e:
+                        logger.warning("log_routine_completion failed: %s", e)
 
     logger.info(
         "complete_tasks_bulk: user_id=%s normal=%s routine=%s missing=%s",
@@ -2581,6 +3843,7 @@ def complete_tasks_bulk(user_id: int, task_ids: list[int]) -> tuple[list[dict],
     return list(rows), missing
 
 
+@_mutates_user_data
 def uncomplete_task(task_id: int, user_id: int) -> bool:
     """Отменяет выполнение задачи: status='active', completed_at и last_completed_at очищаются."""
     n = _execute(
@@ -2600,49 +3863,111 @@ def uncomplete_task(task_id: int, user_id: int) -> bool:
             except Exception as e:
                 logger.warning("delete_last_routine_completion failed: %s", e)
     logger.info("uncomplete_task: task_id=%s user_id=%s rows_updated=%s", task_id, user_id, n)
+    if n > 0:
+        row = _fetchone("SELECT * FROM tasks WHERE id = %s AND user_id = %s", (task_id, user_id))
+        if row is not None:
+            _sync_task_reminder(user_id, row)
     return n > 0
 
 
 def find_task_by_text(user_id: int, search: str) -> dict | None:
-    search_lower = search.lower().strip()
+    """Самая релевантная активная задача, содержащая фразу целиком или все её слова."""
+    search_lower = _normalize_search(search)
     if not search_lower:
         return None
-    # Точное вхождение фразы — пытаемся срезать в БД (одна задача, не загружая все).
-    pattern = f"%{search_lower}%"
-    if USE_PG:
-        row = _fetchone(
-            "SELECT * FROM tasks WHERE user_id = %s AND status = 'active' "
-            "AND text ILIKE %s ORDER BY id LIMIT 1",
-            (user_id, pattern),
-        )
-    else:
-        row = _fetchone(
-            "SELECT * FROM tasks WHERE user_id = %s AND status = 'active' "
-            "AND lower(text) LIKE %s ORDER BY id LIMIT 1",
-            (user_id, pattern),
-        )
-    if row:
-        return row
-    # Fallback: все слова входят в текст (для перестановки и опечаток оставим
-    # старую, чуть более «умную» эвристику; на длинных списках выгрузка всё
-    # ещё дешевле, чем ничего не вернуть).
-    tasks = get_active_tasks(user_id)
     words = search_lower.split()
-    for t in tasks:
-        if all(w in (t.get("text") or "").lower() for w in words):
+    tasks = get_active_tasks(user_id)
+    texts = [(t, (t.get("text") or "").lower()) for t in tasks]
+    matched = [t for t, text in texts if search_lower in text or all(w in text for w in words)]
+    return _first_task_with_text(_rank_by_fts(user_id, search_lower, matched), search_lower, words)
+
+
+def _first_task_with_text(tasks: list[dict], search_lower: str, words: list[str]) -> dict | None:
+    texts = [(t, (t.get("text") or "").lower()) for t in tasks]
+    for t, text in texts:
+        if search_lower in text:
+            return t
+    for t, text in texts:
+        if all(w in text for w in words):
             return t
     return None
 
 
+def resolve_tasks_by_texts(user_id: int, searches: list[str]) -> list[tuple[str, dict | None]]:
+    """Сопоставляет несколько фраз с активными задачами за один проход.
+
+    Активные задачи загружаются один раз (снимок), для каждой фразы собираются кандидаты:
+    фраза целиком в тексте > все слова фразы в тексте > нечёткое совпадение по триграммам
+    (pg_trgm или индекс в процессе; только однозначное, как в find_task_fuzzy_unique —
+    иначе фраза остаётся ненайденной). Затем пары «фраза — задача» раздаются жадно от
+    самых сильных; одна задача достаётся только одной фразе, при равной силе — фразе
+    с меньшим числом вариантов. Если у фразы без точного вхождения остаются две
+    свободные задачи одного уровня, не различимые по сходству (ближе _FUZZY_MARGIN),
+    фраза не сопоставляется: «полит цветы» при «…в спальне» и «…в зале» не должно
+    закрывать случайную из них.
+    Результат детерминирован: [(фраза, задача или None)] в порядке searches.
+    """
+    tasks = _active_tasks_snapshot(user_id)
+    texts = [(t, _normalize_search(t.get("text") or "")) for t in tasks]
+    by_id = {int(t["id"]): t for t in tasks}
+    edges: list[tuple[int, float, int, int]] = []
+    n_candidates: list[int] = []
+    phrase_cands: list[dict[int, tuple[int, float]]] = []
+    for i, search in enumerate(searches):
+        q = _normalize_search(search)
+        cands: dict[int, tuple[int, float]] = {}
+        if q:
+            words = q.split()
+            for t, text in texts:
+                if q in text:
+                    cands[int(t["id"])] = (2, 1.0)
+                elif all(w in text for w in words):
+                    cands[int(t["id"])] = (1, 1.0)
+            if not cands:
+                found = _pg_fuzzy(user_id, q, FUZZY_MATCH_THRESHOLD, 2)
+                if found is None:
+                    found = _index_fuzzy(user_id, tasks, q, FUZZY_MATCH_THRESHOLD, 2)
+                best = _unique_fuzzy(found)
+                if best is not None:
+                    by_id.setdefault(int(best["id"]), best)
+                    cands[int(best["id"])] = (0, float(best["match_score"]))
+        n_candidates.append(len(cands))
+        phrase_cands.append(cands)
+        for task_id, (tier, score) in cands.items():
+            edges.append((tier, score, i, task_id))
+    edges.sort(key=lambda e: (-e[0], -e[1], n_candidates[e[2]], e[2], e[3]))
+    assigned: dict[int, dict] = {}
+    claimed: set[int] = set()
+    ambiguous: set[int] = set()
+    for tier, score, i, task_id in edges:
+        if i in assigned or i in ambiguous or task_id in claimed:
+            continue
+        if tier < 2 and any(
+            other != task_id and other not in claimed
+            and o_tier == tier and o_score > score - _FUZZY_MARGIN
+            for other, (o_tier, o_score) in phrase_cands[i].items()
+        ):
+            ambiguous.add(i)
+            continue
+        assigned[i] = by_id[task_id]
+        claimed.add(task_id)
+    return [(search, assigned.get(i)) for i, search in enumerate(searches)]
+
+
 def find_tasks_by_texts(user_id: int, searches: list[str]) -> list[dict]:
-    found = []
-    seen_ids = set()
-    for search in searches:
-        task = find_task_by_text(user_id, search)
-        if task and task["id"] not in seen_ids:
-            found.append(task)
-            seen_ids.add(task["id"])
-    return found
+    """Задачи по нескольким фразам (без повторов), в порядке фраз."""
+    return [t for _, t in resolve_tasks_by_texts(user_id, searches) if t is not None]
+
+
+def complete_tasks_by_texts(user_id: int, searches: list[str]) -> tuple[list[dict], list[str]]:
+    """Отмечает выполненными задачи по фразам. Возвращает (выполненные, ненайденные фразы)."""
+    resolved = resolve_tasks_by_texts(user_id, searches)
+    not_found = [s for s, t in resolved if t is None]
+    ids = [int(t["id"]) for _, t in resolved if t is not None]
+    completed, _missing = complete_tasks_bulk(user_id, ids)
+    order = {task_id: k for k, task_id in enumerate(ids)}
+    completed.sort(key=lambda r: order.get(int(r["id"]), len(order)))
+    return completed, not_found
 
 
 def get_done_tasks(user_id: int, days: int = 7) -> list[dict]:
@@ -2759,6 +4084,7 @@ def count_done_tasks_in_project_week_and_all(
     return int(wk) if wk is not None else 0, int(ac) if ac is not None else 0
 
 
+@_mutates_user_data
 def log_routine_completion(user_id: int, task_id: int, at_iso: str) -> None:
     _execute(
         "INSERT INTO routine_completions (user_id, task_id, completed_at) VALUES (%s, %s, %s)",
@@ -2766,6 +4092,7 @@ def log_routine_completion(user_id: int, task_id: int, at_iso: str) -> None:
     )
 
 
+@_mutates_user_data
 def delete_last_routine_completion(user_id: int, task_id: int) -> None:
     row = _fetchone(
         "SELECT id FROM routine_completions WHERE user_id = %s AND task_id = %s ORDER BY completed_at DESC LIMIT 1",
@@ -2823,6 +4150,7 @@ def get_tasks_by_category(user_id: int, category_name: str) -> list[dict]:
     )
 
 
+@_mutates_user_data
 def update_task(task_id: int, user_id: int, **kwargs) -> dict | None:
     allowed = {
         "text", "due_date", "due_time", "time_of_day",
@@ -2853,6 +4181,16 @@ def update_task(task_id: int, user_id: int, **kwargs) -> dict | None:
         ps = fields.get("priority_size", current["priority_size"])
         fields["priority_score"] = _calc_score(pv, pu, pr, ps)
 
+    if fields.keys() & {"repeat_day", "is_routine"}:
+        current = _fetchone(
+            "SELECT repeat_day, created_at FROM tasks WHERE id = %s AND user_id = %s",
+            (task_id, user_id),
+        )
+        if current:
+            rd = fields.get("repeat_day", current.get("repeat_day"))
+            (fields["repeat_mask"], fields["repeat_every"],
+             fields["repeat_anchor"]) = compile_repeat_day(rd, current.get("created_at"))
+
     set_parts = []
     params = []
     for col, val in fields.items():
@@ -2888,9 +4226,13 @@ def update_task(task_id: int, user_id: int, **kwargs) -> dict | None:
         for ds in dates:
             refresh_plan_slots_for_task_on_date(user_id, task_id, ds)
 
+    if row is not None and (plan_touch or "is_routine" in fields):
+        _sync_task_reminder(user_id, row)
+
     return row
 
 
+@_mutates_user_data
 def delete_task(task_id: int, user_id: int) -> bool:
     n = _execute(
         "UPDATE tasks SET status = 'cancelled' WHERE id = %s AND user_id = %s AND status = 'active'",
@@ -2939,11 +4281,7 @@ def get_weekly_stats(user_id: int) -> dict:
 
 def get_routine_tasks(user_id: int) -> list[dict]:
     try:
-        result = _fetchall(
-            "SELECT * FROM tasks WHERE user_id = %s AND status = 'active' "
-            "AND is_routine = TRUE ORDER BY priority_score DESC",
-            (user_id,),
-        )
+        result = _priority_desc([t for t in _active_tasks_snapshot(user_id) if _is_routine_row(t)])
     except Exception as e:
         logger.warning("get_routine_tasks fallback due to query error: %s", e)
         return []
@@ -2975,3 +4313,263 @@ def get_recent_messages(user_id: int, limit: int = 20) -> list[dict]:
         (user_id, limit),
     )
     return list(reversed(rows))
+
+
+# ── Напоминания (reminders.py) ───────────────────────────────────────────
+# remind_at_utc — момент напоминания по задаче с датой и временем (due_time или
+# блок суток). Считается при записи задачи в TZ пользователя, сбрасывается в
+# NULL, когда напоминание отправлено (claim_reminder). На SQLite колонка TEXT и
+# сравнивается как строка, поэтому значение всегда пишется через _remind_iso.
+
+
+def _remind_iso(dt: datetime) -> str:
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+00:00")
+
+
+def parse_remind_at(value) -> datetime | None:
+    """remind_at_utc из строки БД (datetime на PG, ISO-строка на SQLite) → aware datetime."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    try:
+        dt = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def _remind_at_local(
+    tz_name: str,
+    due_date,
+    due_time: str | None,
+    time_of_day: str | None,
+    now: datetime | None = None,
+) -> str | None:
+    ds = (str(due_date).strip()[:10] if due_date is not None else "")
+    if len(ds) != 10:
+        return None
+    minutes = _due_time_to_start_min(due_time)
+    if minutes is None:
+        minutes = _time_of_day_default_start_min(time_of_day)
+    if minutes is None:
+        return None
+    try:
+        y, m, d = map(int, ds.split("-"))
+        local = datetime(y, m, d, minutes // 60, minutes % 60)
+    except ValueError:
+        return None
+    tz = timezone.utc
+    if ZoneInfo is not None:
+        try:
+            tz = ZoneInfo(tz_name)
+        except Exception:
+            pass
+    at = local.replace(tzinfo=tz)
+    # Время уже прошло (задачу добавили «на 10:00» в 10:05) — напоминать не о чем.
+    if at <= (now or datetime.now(timezone.utc)):
+        return None
+    return _remind_iso(at)
+
+
+def compute_remind_at(
+    user_id: int,
+    due_date,
+    due_time: str | None,
+    time_of_day: str | None,
+    now: datetime | None = None,
+) -> str | None:
+    """Момент напоминания (UTC ISO) для даты/времени задачи в TZ пользователя; прошедшее — None."""
+    if not due_date:
+        return None
+    return _remind_at_local(_get_user_timezone(user_id), due_date, due_time, time_of_day, now)
+
+
+def _sync_task_reminder(user_id: int, task: dict) -> None:
+    """Пересчитывает remind_at_utc задачи после правки даты/времени (пишет, только если изменилось)."""
+    remind_at = None
+    if task.get("status") == "active" and not task.get("is_routine"):
+        remind_at = compute_remind_at(
+            user_id, task.get("due_date"), task.get("due_time"), task.get("time_of_day")
+        )
+    current = parse_remind_at(task.get("remind_at_utc"))
+    if (current and _remind_iso(current)) == remind_at:
+        return
+    _execute(
+        "UPDATE tasks SET remind_at_utc = %s WHERE id = %s AND user_id = %s",
+        (remind_at, task["id"], user_id),
+    )
+    task["remind_at_utc"] = remind_at
+
+
+def refresh_user_reminders(user_id: int) -> int:
+    """Пересчёт напоминаний пользователя (смена часового пояса, перенос просроченных)."""
+    today_str = user_local_date_offset(user_id, -1)
+    rows = _fetchall(
+        "SELECT id, status, is_routine, due_date, due_time, time_of_day, remind_at_utc "
+        "FROM tasks WHERE user_id = %s AND status = 'active' "
+        "AND COALESCE(is_routine, FALSE) = FALSE AND due_date >= %s",
+        (user_id, today_str),
+    )
+    changed = 0
+    for row in rows:
+        before = row.get("remind_at_utc")
+        _sync_task_reminder(user_id, row)
+        if row.get("remind_at_utc") is not before:
+            changed += 1
+    return changed
+
+
+def _backfill_remind_at(conn) -> None:
+    """Миграция v7: напоминания для уже запланированных задач (только будущее время)."""
+    since = (datetime.now(timezone.utc) - timedelta(days=1)).date().isoformat()
+    select_sql = _query(
+        "SELECT t.id, t.due_date, t.due_time, t.time_of_day, u.timezone "
+        "FROM tasks t JOIN users u ON u.id = t.user_id "
+        "WHERE t.status = 'active' AND COALESCE(t.is_routine, FALSE) = FALSE "
+        "AND t.due_date IS NOT NULL AND t.due_date >= %s"
+    )
+    update_sql = _query("UPDATE tasks SET remind_at_utc = %s WHERE id = %s")
+    now = datetime.now(timezone.utc)
+
+    def _params(rows):
+        out = []
+        for tid, dd, dt, tod, tz_name in rows:
+            at = _remind_at_local((tz_name or "").strip() or "Europe/Moscow", dd, dt, tod, now)
+            if at is not None:
+                out.append((at, tid))
+        return out
+
+    if USE_PG:
+        cur = conn.cursor()
+        cur.execute(select_sql, (since,))
+        params = _params(cur.fetchall())
+        if params:
+            psycopg2.extras.execute_batch(cur, update_sql, params)
+        cur.close()
+    else:
+        params = _params(conn.execute(select_sql, (since,)).fetchall())
+        if params:
+            conn.executemany(update_sql, params)
+        conn.commit()
+    if params:
+        logger.info("reminders scheduled for %d tasks", len(params))
+
+
+def list_reminders_between(after, until, user_id: int | None = None) -> list[dict]:
+    """
+    Напоминания с after < remind_at_utc <= until (aware datetime) по возрастанию
+    времени — по индексу idx_tasks_remind_at, без обхода пользователей. Только
+    пользователи с Telegram (иначе отправлять некуда; синтетические
+    отрицательные telegram_id веб-аккаунтов на старых SQLite — тоже мимо).
+    """
+    sql = (
+        "SELECT t.id AS task_id, t.user_id, t.remind_at_utc "
+        "FROM tasks t JOIN users u ON u.id = t.user_id "
+        "WHERE t.remind_at_utc IS NOT NULL AND t.status = 'active' "
+        "AND t.remind_at_utc > %s AND t.remind_at_utc <= %s AND u.telegram_id > 0"
+    )
+    params: list = [_remind_iso(after), _remind_iso(until)]
+    if user_id is not None:
+        sql += " AND t.user_id = %s"
+        params.append(int(user_id))
+    rows = _fetchall(sql + " ORDER BY t.remind_at_utc", tuple(params))
+    for row in rows:
+        row["remind_at_utc"] = _remind_iso(parse_remind_at(row["remind_at_utc"]))
+    return rows
+
+
+def claim_reminder(task_id: int, remind_at: str) -> dict | None:
+    """
+    Забирает напоминание к отправке: сбрасывает remind_at_utc, если задача всё
+    ещё активна и время не менялось. Вернёт задачу с telegram_id владельца или
+    None (задачу закрыли/перенесли, напоминание уже отправил другой процесс).
+    """
+    with transaction():
+        n = _execute(
+            "UPDATE tasks SET remind_at_utc = NULL "
+            "WHERE id = %s AND remind_at_utc = %s AND status = 'active'",
+            (task_id, remind_at),
+        )
+        if not n:
+            return None
+        return _fetchone(
+            "SELECT t.id, t.user_id, t.text, t.due_date, t.due_time, t.time_of_day, u.telegram_id "
+            "FROM tasks t JOIN users u ON u.id = t.user_id WHERE t.id = %s",
+            (task_id,),
+        )
+
+
+# ── Фоновые задачи веба (web/jobs.py) ────────────────────────────────────
+# Статусы: queued → running → done | error. result — JSON с ответом обработчика.
+JOB_STATUSES = ("queued", "running", "done", "error")
+
+
+def create_job(job_id: str, user_id: int, kind: str) -> None:
+    # Время — в том же формате, что пишет set_job_status: на SQLite это строки,
+    # и fail_interrupted_jobs сравнивает их как строки.
+    now = datetime.now(timezone.utc).isoformat()
+    _execute(
+        "INSERT INTO jobs (id, user_id, kind, status, created_at, updated_at) "
+        "VALUES (%s, %s, %s, 'queued', %s, %s)",
+        (job_id, user_id, kind, now, now),
+    )
+
+
+def set_job_status(job_id: str, status: str, result: dict | None = None) -> None:
+    if status not in JOB_STATUSES:
+        raise ValueError(f"unknown job status: {status}")
+    payload = json.dumps(result, ensure_ascii=False) if result is not None else None
+    _execute(
+        "UPDATE jobs SET status = %s, result = COALESCE(%s, result), updated_at = %s WHERE id = %s",
+        (status, payload, datetime.now(timezone.utc).isoformat(), job_id),
+    )
+
+
+def claim_job(job_id: str) -> bool:
+    """queued → running; False — задачу уже забрали или пометили ошибкой."""
+    n = _execute(
+        "UPDATE jobs SET status = 'running', updated_at = %s WHERE id = %s AND status = 'queued'",
+        (datetime.now(timezone.utc).isoformat(), job_id),
+    )
+    return bool(n)
+
+
+def get_job(job_id: str, user_id: int) -> dict | None:
+    """Задача пользователя с разобранным result (чужие и несуществующие — None)."""
+    row = _fetchone(
+        "SELECT id, kind, status, result FROM jobs WHERE id = %s AND user_id = %s",
+        (job_id, user_id),
+    )
+    if not row:
+        return None
+    raw = row.get("result")
+    try:
+        row["result"] = json.loads(raw) if raw else None
+    except (TypeError, ValueError):
+        row["result"] = None
+    return row
+
+
+def fail_interrupted_jobs(stale_after_sec: float, keep_days: int = 2) -> int:
+    """
+    При старте: незавершённые задачи, не обновлявшиеся дольше stale_after_sec
+    (таймаут задачи в web/jobs.py), — в error; старые записи удаляются. Более
+    свежие могут принадлежать другому живому процессу (несколько воркеров
+    uvicorn, перезапуск по одному) — их не трогаем: выполняющуюся задачу её
+    воркер регулярно отмечает, а ждущую в очереди сам отклонит по таймауту.
+    """
+    now = datetime.now(timezone.utc)
+    n = _execute(
+        "UPDATE jobs SET status = 'error', result = %s, updated_at = %s "
+        "WHERE status IN ('queued', 'running') AND updated_at < %s",
+        (
+            json.dumps({"ok": False, "message": "Прервано перезапуском сервера. Повторите действие."},
+                       ensure_ascii=False),
+            now.isoformat(),
+            (now - timedelta(seconds=stale_after_sec)).isoformat(),
+        ),
+    )
+    cutoff = (now - timedelta(days=keep_days)).isoformat()
+    _execute("DELETE FROM jobs WHERE updated_at < %s", (cutoff,))
+    return n or 0
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Асинхронное зеркало «горячего» API db для веб-приложения.
+
+Обработчики FastAPI — async def, а db работает синхронно (psycopg2 / sqlite3):
+прямой вызов db.* из обработчика блокирует event loop uvicorn на всё время
+SQL round-trip, и медленный запрос одного пользователя задерживает страницы
+всем остальным. Здесь каждый вызов уходит в отдельный пул потоков, размер
+которого согласован с пулом PG-соединений (DB_POOL_MAX), поэтому потоки не
+простаивают в ожидании свободного соединения.
+
+Асинхронные драйверы (asyncpg / aiosqlite) сознательно не используются:
+тогда пришлось бы держать вторую копию всех SQL-запросов с другим синтаксисом
+плейсхолдеров и своей логикой миграций. Поведение функций совпадает с db.*.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def _workers() -> int:
+    raw = (os.environ.get("DB_ASYNC_WORKERS") or "").strip()
+    if raw:
+        try:
+            return max(1, int(raw))
+        except ValueError:
+            pass
+    # SQLite всё равно сериализует операции на одном соединении.
+    return db.DB_POOL_MAX if db.USE_PG else 4
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=_workers(), thread_name_prefix="db-async"
+                )
+    return _executor
+
+
+async def run(fn, *args, **kwargs):
+    """Выполняет синхронную функцию (обычно db.* или хелпер поверх него) вне event loop."""
+    loop = asyncio.get_running_loop()
+    # Контекст запроса (метка вкладки для events) переносится в поток, как в asyncio.to_thread.
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_get_executor(), functools.partial(ctx.run, fn, *args, **kwargs))
+
+
+# ── Задачи ───────────────────────────────────────────────────────────────
+
+async def get_today_tasks(user_id: int) -> list[dict]:
+    return await run(db.get_today_tasks, user_id)
+
+
+async def get_active_tasks_ordered(user_id: int) -> list[dict]:
+    return await run(db.get_active_tasks_ordered, user_id)
+
+
+async def get_routine_tasks(user_id: int) -> list[dict]:
+    return await run(db.get_routine_tasks, user_id)
+
+
+async def get_tasks_for_date(user_id: int, date_str: str) -> list[dict]:
+    return await run(db.get_tasks_for_date, user_id, date_str)
+
+
+async def list_routines_due_today(user_id: int) -> list[dict]:
+    return await run(db.list_routines_due_today, user_id)
+
+
+async def attach_project_labels(user_id: int, tasks: list[dict]) -> None:
+    await run(db.attach_project_labels, user_id, tasks)
+
+
+async def transfer_overdue_tasks(user_id: int) -> int:
+    return await run(db.transfer_overdue_tasks, user_id)
+
+
+# ── План дня ─────────────────────────────────────────────────────────────
+
+async def get_plan_slots(user_id: int, date_str: str) -> list[dict]:
+    return await run(db.get_plan_slots, user_id, date_str)
+
+
+async def ensure_plan_slots_from_due_time(user_id: int, date_str: str, grid_start_min: int) -> None:
+    await run(db.ensure_plan_slots_from_due_time, user_id, date_str, grid_start_min)
+
+
+# ── Отчёты ───────────────────────────────────────────────────────────────
+
+async def get_done_tasks_between(user_id: int, start_utc: str, end_utc: str) -> list[dict]:
+    return await run(db.get_done_tasks_between, user_id, start_utc, end_utc)
+
+
+async def get_done_tasks_today(user_id: int) -> list[dict]:
+    return await run(db.get_done_tasks_today, user_id)
+
+
+async def get_done_tasks_calendar_week(user_id: int):
+    return await run(db.get_done_tasks_calendar_week, user_id)
+
+
+async def routine_completions_raw_between(user_id: int, start_utc: str, end_utc: str) -> list[dict]:
+    return await run(db.routine_completions_raw_between, user_id, start_utc, end_utc)
+
+
+# ── Счётчики ─────────────────────────────────────────────────────────────
+
+async def home_counts(user_id: int) -> dict:
+    return await run(db.home_counts, user_id)
+
+
+async def count_done_tasks_today(user_id: int) -> int:
+    return await run(db.count_done_tasks_today, user_id)
+
+
+async def count_user_projects(user_id: int) -> int:
+    return await run(db.count_user_projects, user_id)
+
+
+async def count_active_tasks_by_project(user_id: int) -> dict[int, int]:
+    return await run(db.count_active_tasks_by_project, user_id)
+
+
+async def count_archived_projects(user_id: int) -> int:
+    return await run(db.count_archived_projects, user_id)
+
+
+# ── Справочники ──────────────────────────────────────────────────────────
+
+async def list_projects(user_id: int) -> list[dict]:
+    return await run(db.list_projects, user_id)
+
+
+async def get_categories(user_id: int) -> list[dict]:
+    return await run(db.get_categories, user_id)
+
+
+async def get_settings(user_id: int) -> dict:
+    return await run(db.get_settings, user_id)
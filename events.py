@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Уведомления об изменении данных пользователя (веб-вкладки узнают о задачах,
+добавленных или закрытых из Telegram, без ручной перезагрузки).
+
+Источник — db.bump_user_version: каждая мутирующая функция db после записи
+(а внутри транзакции — после COMMIT) вызывает publish(user_id). Подписчики —
+SSE-соединения веба (GET /events), по одному на открытую вкладку.
+
+Событие несёт только «у пользователя что-то изменилось» и origin — метку
+вкладки, чьё действие его вызвало (заголовок X-Tab-Id, см. set_origin):
+вкладка уже обновила свою строку сама и своё эхо пропускает. Непрочитанные
+события подписчика схлопываются в последнее — десять правок подряд дают одно
+обновление страницы, а не десять.
+
+Бот и веб — разные процессы. На PostgreSQL их связывает LISTEN/NOTIFY
+(start_pg_bridge): события уходят в канал helper_events, чужие — доставляются
+локальным подписчикам и сбрасывают кеши снимков этого процесса. На SQLite
+моста нет: там бот и веб обычно живут в одном процессе разработчика.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import secrets
+import select
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+PG_CHANNEL = "helper_events"
+# Метка процесса: свои NOTIFY, вернувшиеся из канала, не доставляем повторно.
+_INSTANCE = f"{os.getpid()}-{secrets.token_hex(3)}"
+
+_origin: ContextVar[str | None] = ContextVar("events_origin", default=None)
+
+
+def set_origin(origin: str | None):
+    """Помечает события текущего контекста (запроса) меткой вкладки; вернёт токен для reset_origin."""
+    return _origin.set(origin or None)
+
+
+def reset_origin(token) -> None:
+    _origin.reset(token)
+
+
+class Subscription:
+    """Подписка одного потребителя (SSE-соединения) в своём event loop."""
+
+    def __init__(self, user_id: int, loop: asyncio.AbstractEventLoop):
+        self.user_id = int(user_id)
+        self._loop = loop
+        self._pending: dict | None = None
+        self._ready = asyncio.Event()
+
+    def _push(self, event: dict) -> None:
+        # Только из потока loop: новое событие вытесняет непрочитанное.
+        self._pending = event
+        self._ready.set()
+
+    async def get(self, timeout: float | None = None) -> dict | None:
+        """Следующее событие или None, если за timeout секунд ничего не случилось."""
+        if self._pending is None:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        event, self._pending = self._pending, None
+        self._ready.clear()
+        return event
+
+
+_subs_lock = threading.Lock()
+_subs: dict[int, set[Subscription]] = {}
+
+
+@contextmanager
+def subscribe(user_id: int):
+    """with subscribe(uid) as sub: ... await sub.get(timeout) — вызывать из event loop."""
+    sub = Subscription(user_id, asyncio.get_running_loop())
+    with _subs_lock:
+        _subs.setdefault(sub.user_id, set()).add(sub)
+    try:
+        yield sub
+    finally:
+        with _subs_lock:
+            group = _subs.get(sub.user_id)
+            if group is not None:
+                group.discard(sub)
+                if not group:
+                    _subs.pop(sub.user_id, None)
+
+
+def subscribers_count() -> int:
+    with _subs_lock:
+        return sum(len(group) for group in _subs.values())
+
+
+# Слушатели всех событий процесса (планировщик напоминаний): вызываются в потоке
+# публикации, поэтому должны только быстро передать событие в свой loop.
+_listeners: list = []
+
+
+def add_listener(fn) -> None:
+    """fn(event) на каждое событие — своё или пришедшее по мосту."""
+    with _subs_lock:
+        _listeners.append(fn)
+
+
+def remove_listener(fn) -> None:
+    with _subs_lock:
+        if fn in _listeners:
+            _listeners.remove(fn)
+
+
+def _deliver(user_id: int | None, event: dict) -> None:
+    with _subs_lock:
+        if user_id is None:
+            targets = [sub for group in _subs.values() for sub in group]
+        else:
+            targets = list(_subs.get(int(user_id), ()))
+        listeners = list(_listeners)
+    for sub in targets:
+        try:
+            sub._loop.call_soon_threadsafe(sub._push, event)
+        except RuntimeError:
+            # loop уже закрыт (остановка приложения) — подписка умрёт вместе с ним.
+            pass
+    for fn in listeners:
+        try:
+            fn(event)
+        except Exception:
+            logger.exception("events: ошибка слушателя")
+
+
+def publish(user_id: int | None) -> None:
+    """Данные пользователя изменились (None — неизвестно чьи: всех). Можно звать из любого потока."""
+    uid = None if user_id is None else int(user_id)
+    event = {"user_id": uid, "origin": _origin.get()}
+    _deliver(uid, event)
+    bridge = _bridge
+    if bridge is not None:
+        bridge.send(event)
+
+
+# ── Мост LISTEN/NOTIFY ───────────────────────────────────────────────────
+
+class _PgBridge(threading.Thread):
+    """
+    Отдельное соединение PG в фоновом потоке: отправляет NOTIFY со своими
+    событиями и слушает чужие. Мутации не ждут лишнего round-trip — publish
+    лишь кладёт событие в очередь и будит поток через pipe.
+    """
+
+    def __init__(self, dsn: str, on_remote=None):
+        super().__init__(name="events-pg-bridge", daemon=True)
+        self._dsn = dsn
+        self._on_remote = on_remote
+        self._outbox: list[dict] = []
+        self._lock = threading.Lock()
+        self._wake_r, self._wake_w = os.pipe()
+        # Пока мост переподключается, pipe никто не читает: при полном буфере
+        # publish не должен вставать в потоке БД. Хватит и одного ждущего байта.
+        os.set_blocking(self._wake_w, False)
+        self._stop = threading.Event()
+
+    def send(self, event: dict) -> None:
+        with self._lock:
+            self._outbox.append(event)
+        try:
+            os.write(self._wake_w, b"\0")
+        except OSError:
+            # BlockingIOError: буфер полон — поток и так проснётся.
+            pass
+
+    def stop(self) -> None:
+        self._stop.set()
+        try:
+            os.write(self._wake_w, b"\0")
+        except OSError:
+            # BlockingIOError: буфер полон — поток и так проснётся.
+            pass
+
+    def _connect(self):
+        import psycopg2
+
+        conn = psycopg2.connect(self._dsn)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {PG_CHANNEL}")
+        return conn
+
+    def _flush(self, conn) -> None:
+        with self._lock:
+            batch, self._outbox = self._outbox, []
+        if not batch:
+            return
+        with conn.cursor() as cur:
+            for event in batch:
+                payload = json.dumps(
+                    {"u": event["user_id"], "o": event["origin"], "i": _INSTANCE},
+                    separators=(",", ":"),
+                )
+                cur.execute("SELECT pg_notify(%s, %s)", (PG_CHANNEL, payload))
+
+    def _receive(self, conn) -> None:
+        conn.poll()
+        while conn.notifies:
+            note = conn.notifies.pop(0)
+            try:
+                data = json.loads(note.payload)
+            except ValueError:
+                continue
+            if data.get("i") == _INSTANCE:
+                continue
+            uid = data.get("u")
+            if self._on_remote is not None:
+                try:
+                    self._on_remote(uid)
+                except Exception:
+                    logger.exception("events: on_remote failed")
+            _deliver(uid, {"user_id": uid, "origin": data.get("o")})
+
+    def run(self) -> None:
+        conn = None
+        while not self._stop.is_set():
+            try:
+                if conn is None:
+                    conn = self._connect()
+                    logger.info("events: LISTEN %s", PG_CHANNEL)
+                    # Пока соединения не было, чужие события могли потеряться:
+                    # сбрасываем кеши всех пользователей.
+                    if self._on_remote is not None:
+                        self._on_remote(None)
+                    _deliver(None, {"user_id": None, "origin": None})
+                self._flush(conn)
+                readable, _, _ = select.select([conn, self._wake_r], [], [], 30.0)
+                if self._wake_r in readable:
+                    os.read(self._wake_r, 4096)
+                self._receive(conn)
+            except Exception as exc:
+                logger.warning("events: мост PG прерван (%s), переподключение", exc)
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                conn = None
+                self._stop.wait(5.0)
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+_bridge: _PgBridge | None = None
+_bridge_lock = threading.Lock()
+
+
+def start_pg_bridge(dsn: str, on_remote=None) -> bool:
+    """
+    Запускает мост LISTEN/NOTIFY (один на процесс). on_remote(user_id) вызывается
+    из потока моста на каждое чужое событие. EVENTS_PG_BRIDGE=0 — не запускать.
+    """
+    global _bridge
+    if not dsn or os.environ.get("EVENTS_PG_BRIDGE", "1").strip().lower() in ("0", "false", "no"):
+        return False
+    with _bridge_lock:
+        if _bridge is None:
+            _bridge = _PgBridge(dsn, on_remote)
+            _bridge.start()
+    return True
+
+
+def stop_pg_bridge() -> None:
+    global _bridge
+    with _bridge_lock:
+        bridge, _bridge = _bridge, None
+    if bridge is not None:
+        bridge.stop()
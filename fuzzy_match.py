@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Нечёткий поиск задач по символьным триграммам (устойчив к опечаткам распознавания речи).
+Используется в db для SQLite; на PostgreSQL то же самое делает расширение pg_trgm.
+
+Триграммы строятся как в pg_trgm: текст в нижнем регистре режется на слова,
+каждое слово дополняется двумя пробелами слева и одним справа.
+Оценка совпадения — доля триграмм запроса, найденных в тексте задачи
+(близко к word_similarity(запрос, текст) в pg_trgm): «купить малоко» уверенно
+находит «Купить молоко и хлеб», а длинный текст задачи не штрафуется.
+"""
+from __future__ import annotations
+
+import re
+
+_WORD_RE = re.compile(r"[^\W_]+")
+
+
+def trigrams(text: str) -> set[str]:
+    """Множество триграмм текста (ё приравнивается к е)."""
+    out: set[str] = set()
+    for word in _WORD_RE.findall((text or "").lower().replace("ё", "е")):
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            out.add(padded[i:i + 3])
+    return out
+
+
+def word_similarity(query: str, text: str) -> float:
+    """Доля триграмм query, встречающихся в text (0..1)."""
+    q = trigrams(query)
+    if not q:
+        return 0.0
+    return len(q & trigrams(text)) / len(q)
+
+
+class TrigramIndex:
+    """Инвертированный индекс триграмма → id; оцениваются только тексты с общими триграммами."""
+
+    def __init__(self, items=()):
+        self._postings: dict[str, set[int]] = {}
+        for item_id, text in items:
+            self.add(item_id, text)
+
+    def add(self, item_id: int, text: str) -> None:
+        for gram in trigrams(text):
+            self._postings.setdefault(gram, set()).add(item_id)
+
+    def search(self, query: str, threshold: float = 0.5, limit: int = 5) -> list[tuple[int, float]]:
+        """[(id, оценка)] с оценкой ≥ threshold: по убыванию оценки, при равенстве — по id."""
+        q = trigrams(query)
+        if not q:
+            return []
+        hits: dict[int, int] = {}
+        for gram in q:
+            for item_id in self._postings.get(gram, ()):
+                hits[item_id] = hits.get(item_id, 0) + 1
+        scored = [(item_id, n / len(q)) for item_id, n in hits.items() if n / len(q) >= threshold]
+        scored.sort(key=lambda x: (-x[1], x[0]))
+        return scored[:limit]
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Разбор намерения текстового/голосового сообщения бота одним проходом.
+
+Раньше handle_text и handle_voice проверяли сообщение цепочкой из ~15 условий:
+синонимы команд (SYN_*) — вхождением подстроки, маркеры действий
+(task_parsing.*_PREFIXES) — началом строки; каждое условие заново делало
+strip().lower() и сканировало текст. Здесь все фразы собраны в один автомат
+Ахо–Корасик: текст нормализуется один раз и проходится один раз, а из всех
+найденных фраз побеждает та, чья проверка стояла в цепочке раньше, — порядок
+и результат прежние (см. route_linear и tests/test_intent_router.py).
+
+route(text) → Route(intent, payload): payload — строка для обработчика
+(для «Добавь …» — уже выделенный текст задачи).
+"""
+from __future__ import annotations
+
+from typing import NamedTuple
+
+from task_parsing import (
+    ADD_PREFIXES_LOWER,
+    DELETE_PREFIXES_LOWER,
+    DONE_PREFIXES_LOWER,
+    EDIT_PREFIXES_LOWER,
+    RESCHEDULE_PREFIXES_LOWER,
+    extract_task_text,
+)
+
+# Синонимы для текстовых/голосовых команд (без слэша)
+SYN_LIST_TASKS = (
+    "покажи список задач", "список задач", "все задачи", "мои задачи",
+    "покажи список", "что в списке", "план", "задачи",
+    "покажи задачи", "покажи все задачи", "покажи мои задачи",
+)
+SYN_TODAY = (
+    "план на сегодня", "задачи на сегодня", "что на сегодня", "на сегодня",
+    "покажи задачи на сегодня", "покажи план на сегодня", "что на сегодня сделать",
+)
+SYN_ADD_TASK = (
+    "добавить задачу", "новая задача", "добавить новую задачу", "создать задачу",
+)
+SYN_DONE_TODAY = (
+    "что сделала сегодня", "что сделал сегодня", "мои достижения сегодня",
+    "сделано сегодня", "выполнено сегодня", "отчёт за день",
+    "покажи отчёт за сегодня", "отчёт за сегодня", "покажи сделанное сегодня",
+)
+SYN_DONE_WEEK = (
+    "отчёт за неделю", "сделано за неделю", "выполнено за неделю",
+    "что сделала за неделю", "что сделал за неделю", "мои достижения за неделю",
+    "покажи отчёт за неделю", "покажи сделанное за неделю",
+)
+SYN_ROUTINES = (
+    "рутины", "мои рутины", "покажи рутины", "список рутин", "регулярные дела",
+)
+SYN_UNCOMPLETE = (
+    "отменить выполнение задачи номер",
+    "отменить выполнение задачи",
+    "отменить выполнение",
+    "вернуть в список",
+    "вернуть задачу",
+)
+SYN_HELP = (
+    "помощь", "справка", "как пользоваться", "что умеешь", "команды",
+    "покажи помощь", "покажи справку",
+)
+
+# Правила в порядке приоритета (как шли проверки в if-цепочке):
+# (намерение, фразы, True — фраза где угодно в тексте / False — только в начале).
+RULES: tuple[tuple[str, tuple[str, ...], bool], ...] = (
+    ("help", SYN_HELP, True),
+    ("list_tasks", SYN_LIST_TASKS, True),
+    ("today", SYN_TODAY, True),
+    ("routines", SYN_ROUTINES, True),
+    ("done_today", SYN_DONE_TODAY, True),
+    ("done_week", SYN_DONE_WEEK, True),
+    ("await_task", SYN_ADD_TASK, True),
+    ("delete", tuple(DELETE_PREFIXES_LOWER), False),
+    ("edit", tuple(EDIT_PREFIXES_LOWER), False),
+    ("reschedule", tuple(RESCHEDULE_PREFIXES_LOWER), False),
+    ("uncomplete", SYN_UNCOMPLETE, True),
+    ("complete", tuple(DONE_PREFIXES_LOWER), False),
+    ("add", tuple(ADD_PREFIXES_LOWER), False),
+)
+DEFAULT_INTENT = "add_text"
+
+
+class Route(NamedTuple):
+    intent: str
+    payload: str
+
+
+def _normalize(text: str) -> str:
+    return (text or "").strip().lower()
+
+
+class _Automaton:
+    """
+    Автомат Ахо–Корасик над фразами правил. Узел хранит минимальный номер
+    правила среди фраз, оканчивающихся в нём (с учётом суффиксных ссылок),
+    отдельно для фраз «где угодно» и «в начале текста».
+    """
+
+    def __init__(self, rules):
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        self.depth: list[int] = [0]
+        inf = len(rules)
+        self.anywhere: list[int] = [inf]
+        # Для фраз «в начале»: номер правила, если фраза кончается ровно в этом узле.
+        self.prefix: list[int] = [inf]
+        self.none = inf
+        for rank, (_intent, phrases, anywhere) in enumerate(rules):
+            for phrase in phrases:
+                node = self._insert(phrase.lower())
+                if anywhere:
+                    self.anywhere[node] = min(self.anywhere[node], rank)
+                else:
+                    self.prefix[node] = min(self.prefix[node], rank)
+        self._link()
+
+    def _insert(self, phrase: str) -> int:
+        node = 0
+        for ch in phrase:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.depth.append(self.depth[node] + 1)
+                self.anywhere.append(self.none)
+                self.prefix.append(self.none)
+            node = nxt
+        return node
+
+    def _link(self) -> None:
+        queue = list(self.goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(ch, 0)
+                self.fail[child] = target if target != child else 0
+                # Фраза, оканчивающаяся в суффиксе, тоже найдена.
+                self.anywhere[child] = min(self.anywhere[child], self.anywhere[self.fail[child]])
+
+    def best_rank(self, lower: str) -> int:
+        goto, fail, anywhere, prefix, depth = self.goto, self.fail, self.anywhere, self.prefix, self.depth
+        best = self.none
+        node = 0
+        for i, ch in enumerate(lower):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            rank = anywhere[node]
+            if rank < best:
+                best = rank
+            if depth[node] == i + 1:
+                # Путь от корня без откатов — узел совпадает с началом текста.
+                rank = prefix[node]
+                if rank < best:
+                    best = rank
+            if best == 0:
+                break
+        return best
+
+
+_automaton = _Automaton(RULES)
+
+
+def route(text: str) -> Route:
+    """Намерение сообщения и строка для его обработчика."""
+    rank = _automaton.best_rank(_normalize(text))
+    if rank >= len(RULES):
+        return Route(DEFAULT_INTENT, text)
+    intent = RULES[rank][0]
+    if intent == "add":
+        return Route(intent, extract_task_text(text))
+    return Route(intent, text)
+
+
+def route_linear(text: str) -> Route:
+    """Прежняя последовательная проверка правил — эталон для тестов и бенчмарка."""
+    for intent, phrases, anywhere in RULES:
+        lower = _normalize(text)
+        if anywhere:
+            hit = any(p in lower or lower == p for p in phrases)
+        else:
+            hit = any(lower.startswith(p) for p in phrases)
+        if hit:
+            if intent == "add":
+                return Route(intent, extract_task_text(text))
+            return Route(intent, text)
+    return Route(DEFAULT_INTENT, text)
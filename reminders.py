@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Напоминания в Telegram о задачах с датой и временем.
+
+Момент напоминания хранится в tasks.remind_at_utc (см. db.compute_remind_at):
+due_date + due_time (или блок суток «утро/день/вечер/ночь») в часовом поясе
+пользователя, переведённые в UTC при записи задачи. Отправленное напоминание
+сбрасывается в NULL (db.claim_reminder), поэтому после перезапуска ничего не
+дублируется, а пропущенное за время простоя (не старше REMINDERS_GRACE_MIN)
+уходит сразу.
+
+В памяти — min-heap (fire_at, task_id, user_id) только на ближайшее окно
+REMINDERS_WINDOW_MIN: окно подгружается одним запросом по индексу
+idx_tasks_remind_at, без обхода пользователей; раз в REMINDERS_RESYNC_SEC окно
+перечитывается целиком. Правки задач приходят событиями events (свои и по
+мосту PG от веба): у пользователя перечитываются только его напоминания окна.
+Удаление из кучи ленивое — устаревшая запись пропускается при извлечении, так
+что добавление, перенос и закрытие задачи стоят O(log n).
+
+Таймер на ближайшее напоминание — JobQueue бота, если PTB установлен с
+job-queue, иначе loop.call_later того же event loop.
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import logging
+import os
+import time
+import warnings
+from datetime import datetime, timezone
+
+import db
+import db_async
+import events
+import tg_outbox
+
+logger = logging.getLogger(__name__)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, "") or default)
+    except ValueError:
+        return default
+
+
+REMINDERS_ENABLED = os.environ.get("REMINDERS_ENABLED", "1").strip() != "0"
+# Насколько вперёд напоминания держатся в памяти.
+REMINDERS_WINDOW_MIN = max(1.0, _env_float("REMINDERS_WINDOW_MIN", 60.0))
+# Полная перечитка окна: подхватывает правки других процессов, если моста PG нет.
+REMINDERS_RESYNC_SEC = max(10.0, _env_float("REMINDERS_RESYNC_SEC", 300.0))
+# После простоя отправляем пропущенные напоминания не старше этого.
+REMINDERS_GRACE_MIN = max(0.0, _env_float("REMINDERS_GRACE_MIN", 30.0))
+
+
+def _ts(iso: str) -> float:
+    return db.parse_remind_at(iso).timestamp()
+
+
+class ReminderQueue:
+    """Min-heap напоминаний окна с ленивым удалением."""
+
+    def __init__(self):
+        self._heap: list[tuple[float, int, int]] = []
+        # task_id → (fire_at, remind_at_utc, user_id) — актуальная запись задачи.
+        self._entries: dict[int, tuple[float, str, int]] = {}
+        self._by_user: dict[int, set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def put(self, task_id: int, user_id: int, remind_at: str) -> None:
+        task_id, user_id = int(task_id), int(user_id)
+        current = self._entries.get(task_id)
+        if current is not None and current[1] == remind_at:
+            return
+        fire_at = _ts(remind_at)
+        self._entries[task_id] = (fire_at, remind_at, user_id)
+        self._by_user.setdefault(user_id, set()).add(task_id)
+        heapq.heappush(self._heap, (fire_at, task_id, user_id))
+        if len(self._heap) > 2 * len(self._entries) + 1024:
+            self._compact()
+
+    def discard(self, task_id: int) -> None:
+        entry = self._entries.pop(int(task_id), None)
+        if entry is not None:
+            group = self._by_user.get(entry[2])
+            if group is not None:
+                group.discard(int(task_id))
+                if not group:
+                    del self._by_user[entry[2]]
+
+    def replace_user(self, user_id: int, rows: list[dict]) -> None:
+        """Напоминания пользователя в окне — ровно rows (после правки его задач)."""
+        fresh = {int(r["task_id"]) for r in rows}
+        for task_id in list(self._by_user.get(int(user_id), ())):
+            if task_id not in fresh:
+                self.discard(task_id)
+        for r in rows:
+            self.put(r["task_id"], r["user_id"], r["remind_at_utc"])
+
+    def replace_all(self, rows: list[dict]) -> None:
+        fresh = {int(r["task_id"]) for r in rows}
+        for task_id in [t for t in self._entries if t not in fresh]:
+            self.discard(task_id)
+        for r in rows:
+            self.put(r["task_id"], r["user_id"], r["remind_at_utc"])
+
+    def _stale(self, item: tuple[float, int, int]) -> bool:
+        entry = self._entries.get(item[1])
+        return entry is None or entry[0] != item[0]
+
+    def peek_time(self) -> float | None:
+        heap = self._heap
+        while heap and self._stale(heap[0]):
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def pop_due(self, now: float) -> list[tuple[int, int, str]]:
+        """Наступившие напоминания: [(task_id, user_id, remind_at_utc)] по времени."""
+        out = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            item = heapq.heappop(heap)
+            if self._stale(item):
+                continue
+            remind_at = self._entries[item[1]][1]
+            self.discard(item[1])
+            out.append((item[1], item[2], remind_at))
+        return out
+
+    def _compact(self) -> None:
+        self._heap = [(e[0], tid, e[2]) for tid, e in self._entries.items()]
+        heapq.heapify(self._heap)
+
+
+def reminder_text(task: dict) -> str:
+    when = (task.get("due_time") or task.get("time_of_day") or "").strip()
+    suffix = f" — _{when}_" if when else ""
+    return f"⏰ *Напоминание:* {task.get('text') or ''}{suffix}"
+
+
+class ReminderScheduler:
+    """Куча окна + таймер на ближайшее напоминание; всё — в event loop бота."""
+
+    def __init__(
+        self,
+        bot,
+        job_queue=None,
+        clock=time.time,
+        window_sec: float = REMINDERS_WINDOW_MIN * 60.0,
+        resync_sec: float = REMINDERS_RESYNC_SEC,
+        grace_sec: float = REMINDERS_GRACE_MIN * 60.0,
+        run_db=db_async.run,
+        send=tg_outbox.send,
+    ):
+        self.queue = ReminderQueue()
+        self._bot = bot
+        self._job_queue = job_queue
+        self._clock = clock
+        self._window = window_sec
+        self._resync_every = resync_sec
+        self._grace = grace_sec
+        self._run_db = run_db
+        self._send = send
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loaded_until = 0.0
+        self._next_resync = 0.0
+        self._dirty: set[int | None] = set()
+        self._busy = False
+        self._again = False
+        self._timer = None
+        self._job = None
+        self._tasks: set[asyncio.Task] = set()
+        self._metrics = {"fired": 0, "skipped": 0, "resyncs": 0, "user_reloads": 0}
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        events.add_listener(self._on_event)
+        await self.tick()
+
+    def stop(self) -> None:
+        events.remove_listener(self._on_event)
+        self._cancel_timer()
+        for task in list(self._tasks):
+            task.cancel()
+
+    def stats(self) -> dict:
+        out = dict(self._metrics)
+        out["pending"] = len(self.queue)
+        nxt = self.queue.peek_time()
+        out["next_in_sec"] = round(max(0.0, nxt - self._clock()), 1) if nxt is not None else None
+        return out
+
+    # ── События и таймер ─────────────────────────────────────────────────
+
+    def _on_event(self, event: dict) -> None:
+        # Поток публикации (воркер БД, мост PG) — дальше только в своём loop.
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self._mark_dirty, event.get("user_id"))
+        except RuntimeError:
+            pass
+
+    def _mark_dirty(self, user_id: int | None) -> None:
+        self._dirty.add(user_id)
+        self._kick()
+
+    def _kick(self) -> None:
+        if self._busy:
+            self._again = True
+            return
+        task = asyncio.ensure_future(self.tick())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _on_job(self, context) -> None:
+        self._kick()
+
+    def _cancel_timer(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._job is not None:
+            self._job.schedule_removal()
+            self._job = None
+
+    def _arm(self) -> None:
+        self._cancel_timer()
+        now = self._clock()
+        wake = self._next_resync
+        nxt = self.queue.peek_time()
+        if nxt is not None:
+            wake = min(wake, nxt)
+        delay = max(0.0, wake - now)
+        if self._job_queue is not None:
+            self._job = self._job_queue.run_once(self._on_job, when=delay, name="reminders")
+        elif self._loop is not None:
+            self._timer = self._loop.call_later(delay, self._kick)
+
+    # ── Основной шаг ─────────────────────────────────────────────────────
+
+    async def tick(self) -> None:
+        """Обновляет окно/изменённых пользователей и отправляет наступившие напоминания."""
+        if self._busy:
+            self._again = True
+            return
+        self._busy = True
+        try:
+            while True:
+                self._again = False
+                await self._refresh()
+                await self._fire_due()
+                if not self._again:
+                    break
+        except Exception:
+            logger.exception("reminders: ошибка шага планировщика")
+        finally:
+            self._busy = False
+            self._arm()
+
+    async def _refresh(self) -> None:
+        now = self._clock()
+        dirty, self._dirty = self._dirty, set()
+        after = datetime.fromtimestamp(now - self._grace, timezone.utc)
+        if now >= self._next_resync or None in dirty:
+            until = now + self._window
+            rows = await self._run_db(
+                db.list_reminders_between, after, datetime.fromtimestamp(until, timezone.utc)
+            )
+            self.queue.replace_all(rows)
+            self._loaded_until = until
+            self._next_resync = now + self._resync_every
+            self._metrics["resyncs"] += 1
+            return
+        until = datetime.fromtimestamp(self._loaded_until, timezone.utc)
+        for user_id in dirty:
+            rows = await self._run_db(db.list_reminders_between, after, until, user_id)
+            self.queue.replace_user(user_id, rows)
+            self._metrics["user_reloads"] += 1
+
+    async def _fire_due(self) -> None:
+        for task_id, _user_id, remind_at in self.queue.pop_due(self._clock()):
+            task = await self._run_db(db.claim_reminder, task_id, remind_at)
+            if not task or not task.get("telegram_id"):
+                self._metrics["skipped"] += 1
+                continue
+            self._metrics["fired"] += 1
+            # Отправка — в фоне: сотни напоминаний на 09:00 уходят с темпом очереди tg_outbox.
+            send = asyncio.ensure_future(
+                self._send(self._bot, int(task["telegram_id"]), reminder_text(task))
+            )
+            self._tasks.add(send)
+            send.add_done_callback(self._tasks.discard)
+
+
+_scheduler: ReminderScheduler | None = None
+
+
+async def start(application) -> ReminderScheduler | None:
+    """Запуск из post_init бота (polling или webhook внутри веба)."""
+    global _scheduler
+    if not REMINDERS_ENABLED or _scheduler is not None:
+        return _scheduler
+    with warnings.catch_warnings():
+        # Без python-telegram-bot[job-queue] PTB предупреждает и возвращает None.
+        warnings.simplefilter("ignore")
+        job_queue = application.job_queue
+    scheduler = ReminderScheduler(application.bot, job_queue=job_queue)
+    await scheduler.start()
+    _scheduler = scheduler
+    logger.info("reminders: запущены, в окне %d", len(scheduler.queue))
+    return scheduler
+
+
+async def stop() -> None:
+    global _scheduler
+    scheduler, _scheduler = _scheduler, None
+    if scheduler is not None:
+        scheduler.stop()
+
+
+def stats() -> dict:
+    return _scheduler.stats() if _scheduler is not None else {}
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Микробенчмарк разбора намерения сообщения бота.
+
+Сравнивает прежнюю цепочку проверок (intent_router.route_linear — синонимы
+вхождением, маркеры началом строки, по одной проверке за раз) с автоматом
+Ахо–Корасик (intent_router.route) на корпусе scripts/intent_corpus.txt.
+Перед замером проверяет, что оба варианта дают одинаковый результат.
+
+Использование:
+    python scripts/bench_intent_router.py            # 2000 проходов по корпусу
+    python scripts/bench_intent_router.py -n 5000
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import intent_router  # noqa: E402
+
+CORPUS = Path(__file__).resolve().parent / "intent_corpus.txt"
+
+
+def load_corpus(path: Path = CORPUS) -> list[str]:
+    lines = path.read_text(encoding="utf-8").splitlines()
+    return [ln.strip() for ln in lines if ln.strip() and not ln.lstrip().startswith("#")]
+
+
+def _run(fn, corpus: list[str], n: int) -> float:
+    for text in corpus:  # прогрев
+        fn(text)
+    start = time.perf_counter()
+    for _ in range(n):
+        for text in corpus:
+            fn(text)
+    return (time.perf_counter() - start) / (n * len(corpus)) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", type=int, default=2000, help="проходов по корпусу")
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    mismatches = [t for t in corpus if intent_router.route(t) != intent_router.route_linear(t)]
+    if mismatches:
+        sys.exit(f"Результаты расходятся: {mismatches[:5]}")
+
+    variants = {
+        "цепочка проверок (было)": intent_router.route_linear,
+        "Ахо–Корасик (стало)": intent_router.route,
+    }
+    results = {name: _run(fn, corpus, args.n) for name, fn in variants.items()}
+    base = next(iter(results.values()))
+    print(f"корпус: {len(corpus)} сообщений")
+    for name, us in results.items():
+        print(f"{name:<26} {us:6.2f} мкс/сообщение  ({base / us:4.1f}×)")
+
+
+if __name__ == "__main__":
+    main()
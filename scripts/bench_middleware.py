@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Микробенчмарк накладных расходов middleware веба на один запрос.
+
+Сравнивает прежние реализации на BaseHTTPMiddleware (CSRF по Origin и флаг
+admin) с текущими ASGI-версиями из web.app. Запросы идут прямо в ASGI-стек
+(без сети и без сессии), конечное приложение отвечает пустым 200 — поэтому
+разница целиком приходится на сами middleware.
+
+Использование:
+    python scripts/bench_middleware.py            # 20000 запросов на вариант
+    python scripts/bench_middleware.py -n 50000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("BOT_DB_PATH", str(Path(tempfile.gettempdir()) / "bench_middleware.sqlite3"))
+os.environ.pop("DATABASE_URL", None)
+
+from starlette.middleware.base import BaseHTTPMiddleware  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+from starlette.responses import JSONResponse  # noqa: E402
+
+import db  # noqa: E402
+from web import app as web_app  # noqa: E402
+from web import auth as web_auth  # noqa: E402
+
+
+class _LegacyOriginCsrf(BaseHTTPMiddleware):
+    """Реализация до перехода на ASGI (WEB_ALLOWED_HOSTS разбирается на каждый POST)."""
+
+    SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+    async def dispatch(self, request: Request, call_next):
+        if request.method in self.SAFE_METHODS:
+            return await call_next(request)
+        host = request.headers.get("host", "").split(":")[0].lower()
+        origin = request.headers.get("origin", "")
+        referer = request.headers.get("referer", "")
+        if not origin and not referer:
+            return await call_next(request)
+        allowed_hosts = {host} if host else set()
+        for h in os.environ.get("WEB_ALLOWED_HOSTS", "").split(","):
+            h = h.strip().lower()
+            if h:
+                allowed_hosts.add(h)
+        from urllib.parse import urlparse
+
+        if (urlparse(origin or referer).hostname or "").lower() in allowed_hosts:
+            return await call_next(request)
+        return JSONResponse({"ok": False, "message": "Forbidden (origin)"}, status_code=403)
+
+
+class _LegacyAdminFlag(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        request.state.is_admin = False
+        row = web_auth.get_current_user_row(request)
+        if row:
+            request.state.is_admin = db.is_admin_user(row)
+        return await call_next(request)
+
+
+async def _endpoint(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-length", b"0")]})
+    await send({"type": "http.response.body", "body": b""})
+
+
+class _FakeSession:
+    """Подставляет пустую сессию, как это делает SessionMiddleware для анонима."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        scope["session"] = {}
+        await self.app(scope, receive, send)
+
+
+def _stack(csrf_cls, admin_cls):
+    return _FakeSession(csrf_cls(admin_cls(_endpoint)))
+
+
+def _scope(method: str) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": "/tasks/done_id",
+        "raw_path": b"/tasks/done_id",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"host", b"helper.example.com"),
+            (b"origin", b"https://helper.example.com"),
+            (b"content-length", b"0"),
+        ],
+        "client": ("127.0.0.1", 50000),
+        "server": ("helper.example.com", 443),
+    }
+
+
+async def _run(app, method: str, n: int) -> float:
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(_message):
+        pass
+
+    for _ in range(200):  # прогрев
+        await app(_scope(method), receive, send)
+    start = time.perf_counter()
+    for _ in range(n):
+        await app(_scope(method), receive, send)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", type=int, default=20000, help="запросов на вариант")
+    args = parser.parse_args()
+
+    variants = {
+        "BaseHTTPMiddleware (было)": _stack(_LegacyOriginCsrf, _LegacyAdminFlag),
+        "чистый ASGI (стало)": _stack(web_app._OriginCsrfMiddleware, web_app._AdminFlagMiddleware),
+    }
+    for method in ("GET", "POST"):
+        results = {name: asyncio.run(_run(app, method, args.n)) for name, app in variants.items()}
+        base = next(iter(results.values()))
+        for name, us in results.items():
+            print(f"{method:<4} {name:<28} {us:8.1f} мкс/запрос  ({base / us:4.1f}×)")
+
+
+if __name__ == "__main__":
+    main()
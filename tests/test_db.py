@@ -0,0 +1,598 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты слоя db: пул PG-соединений (на фиктивных соединениях), SQLite-хелперы.
+"""
+import sys
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+
+@pytest.fixture
+def db_mod(tmp_path, monkeypatch):
+    monkeypatch.setenv("BOT_DB_PATH", str(tmp_path / "db_test.sqlite"))
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    sys.modules.pop("db", None)
+    import db
+
+    yield db
+    db._drop_conn()
+
+
+class _FakeCursor:
+    rowcount = 0
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=()):
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection")
+        self.conn.statements.append(sql)
+
+    def fetchone(self):
+        return (1,)
+
+    def close(self):
+        pass
+
+
+class _FakePgConn:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.statements = []
+
+    def cursor(self, **kwargs):
+        return _FakeCursor(self)
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def fake_pool(db_mod, monkeypatch):
+    """Пул поверх фиктивных соединений: проверяем только логику выдачи/возврата."""
+    created = []
+
+    def connect():
+        conn = _FakePgConn()
+        created.append(conn)
+        return conn
+
+    monkeypatch.setattr(db_mod, "psycopg2", psycopg2, raising=False)
+    monkeypatch.setattr(db_mod, "USE_PG", True)
+    monkeypatch.setattr(db_mod, "_pg_connect", connect)
+    monkeypatch.setattr(db_mod, "_migrate", lambda conn: None)
+    monkeypatch.setattr(db_mod, "DB_POOL_MIN", 1)
+    monkeypatch.setattr(db_mod, "DB_POOL_MAX", 2)
+    monkeypatch.setattr(db_mod, "DB_POOL_TIMEOUT_SEC", 0.2)
+    monkeypatch.setattr(db_mod, "DB_POOL_PING_IDLE_SEC", 3600.0)
+    db_mod._drop_conn()
+    return db_mod, created
+
+
+class TestPgPool:
+    def test_checkout_reuses_returned_connection(self, fake_pool):
+        db, created = fake_pool
+        c1 = db._pg_checkout()
+        db._pg_checkin(c1)
+        c2 = db._pg_checkout()
+        db._pg_checkin(c2)
+        assert c1 is c2
+        assert len(created) == 1
+        stats = db.pool_stats()
+        assert stats["checkouts"] == 2
+        assert stats["in_use"] == 0
+        assert stats["idle"] == 1
+
+    def test_exhausted_pool_times_out(self, fake_pool):
+        db, _ = fake_pool
+        held = [db._pg_checkout(), db._pg_checkout()]
+        with pytest.raises(db.PoolTimeoutError):
+            db._pg_checkout()
+        for c in held:
+            db._pg_checkin(c)
+        assert db.pool_stats()["timeouts"] == 1
+        assert db.pool_stats()["peak_in_use"] == 2
+
+    def test_waiter_gets_connection_after_release(self, fake_pool):
+        db, _ = fake_pool
+        db.DB_POOL_TIMEOUT_SEC = 5.0
+        held = [db._pg_checkout(), db._pg_checkout()]
+        got = []
+        waiting = threading.Event()
+        slots = db._pool_slots
+
+        class _Slots:
+            # Сигналит, что поток дошёл до ожидания слота: освобождаем только после.
+            def acquire(self, blocking=True, timeout=None):
+                if blocking:
+                    waiting.set()
+                return slots.acquire(blocking, timeout)
+
+            def release(self):
+                slots.release()
+
+        db._pool_slots = _Slots()
+
+        def worker():
+            c = db._pg_checkout()
+            got.append(c)
+            db._pg_checkin(c)
+
+        t = threading.Thread(target=worker)
+        t.start()
+        assert waiting.wait(timeout=5)
+        db._pg_checkin(held.pop())
+        t.join(timeout=5)
+        assert len(got) == 1
+        db._pg_checkin(held.pop())
+        assert db.pool_stats()["waits"] == 1
+
+    def test_checkin_after_pool_reset_does_not_overrelease(self, fake_pool):
+        db, _ = fake_pool
+        old = db._pg_checkout()
+        db._drop_conn()
+        fresh = db._pg_checkout()
+        # Соединение старого пула закрывается и освобождает свой, старый слот.
+        db._pg_checkin(old)
+        db._pg_checkin(fresh)
+        assert old.closed and not fresh.closed
+        held = [db._pg_checkout(), db._pg_checkout()]
+        with pytest.raises(db.PoolTimeoutError):
+            db._pg_checkout()
+        for c in held:
+            db._pg_checkin(c)
+
+    def test_stale_idle_connection_is_replaced(self, fake_pool):
+        db, created = fake_pool
+        c1 = db._pg_checkout()
+        db._pg_checkin(c1)
+        c1.broken = True
+        db.DB_POOL_PING_IDLE_SEC = 0.0
+        c2 = db._pg_checkout()
+        db._pg_checkin(c2)
+        assert c2 is not c1
+        assert c1.closed
+        assert db.pool_stats()["discarded"] == 1
+
+    def test_broken_connection_not_returned_to_pool(self, fake_pool):
+        db, created = fake_pool
+        with pytest.raises(psycopg2.OperationalError):
+            with db._connection() as conn:
+                conn.broken = True
+                conn.cursor().execute("SELECT 1")
+        assert created[0].closed
+        assert db.pool_stats()["idle"] == 0
+
+
+class TestSqliteHelpers:
+    def test_insert_returning_reads_back_from_target_table(self, db_mod):
+        user = db_mod.create_user_with_email("a@example.com", "h", "A")
+        proj = db_mod.create_project(user["id"], "Ремонт")
+        assert proj["title"] == "Ремонт"
+        assert proj["user_id"] == user["id"]
+
+
+class TestDbAsync:
+    def test_mirror_runs_off_event_loop_and_matches_sync(self, db_mod):
+        import asyncio
+
+        sys.modules.pop("db_async", None)
+        import db_async
+
+        user = db_mod.create_user_with_email("async@example.com", "h", "")
+        uid = int(user["id"])
+        db_mod.add_task(uid, "Позвонить маме")
+
+        async def go():
+            counts = await db_async.home_counts(uid)
+            thread_name = await db_async.run(lambda: threading.current_thread().name)
+            return counts, thread_name
+
+        counts, thread_name = asyncio.run(go())
+        assert counts == db_mod.home_counts(uid)
+        assert thread_name.startswith("db-async")
+
+
+class TestMigrations:
+    def test_fresh_db_records_all_versions(self, db_mod):
+        db_mod.count_users()
+        rows = db_mod._fetchall("SELECT version FROM schema_version ORDER BY version")
+        assert [r["version"] for r in rows] == [m[0] for m in db_mod._MIGRATIONS_SQLITE]
+
+    def test_reconnect_only_checks_version(self, db_mod, monkeypatch):
+        db_mod.count_users()
+        db_mod._drop_conn()
+
+        def fail(*args, **kwargs):
+            raise AssertionError("миграция не должна выполняться повторно")
+
+        monkeypatch.setattr(db_mod, "_run_migration_step", fail)
+        assert db_mod.count_users() == 0
+
+    def test_legacy_db_without_schema_version_is_upgraded(self, db_mod):
+        import sqlite3
+
+        path = db_mod._sqlite_db_path()
+        conn = sqlite3.connect(path)
+        conn.executescript(db_mod._BASE_SCHEMA_SQLITE)
+        conn.execute("ALTER TABLE tasks ADD COLUMN is_routine BOOLEAN DEFAULT FALSE")
+        conn.commit()
+        conn.close()
+
+        user = db_mod.create_user_with_email("legacy@example.com", "h", "")
+        row = db_mod.add_task(int(user["id"]), "Полить цветы", is_routine=True, repeat_day="ежедневно")
+        assert row["is_routine"]
+        latest = db_mod._MIGRATIONS_SQLITE[-1][0]
+        assert db_mod._schema_version(db_mod._get_conn()) == latest
+
+
+class TestTransaction:
+    def _user(self, db):
+        return int(db.create_user_with_email("tx@example.com", "h", "")["id"])
+
+    def test_rollback_on_error(self, db_mod):
+        uid = self._user(db_mod)
+        t = db_mod.add_task(uid, "Купить хлеб")
+        with pytest.raises(RuntimeError):
+            with db_mod.transaction():
+                db_mod._execute("UPDATE tasks SET text = %s WHERE id = %s", ("изменено", t["id"]))
+                raise RuntimeError("boom")
+        row = db_mod._fetchone("SELECT text FROM tasks WHERE id = %s", (t["id"],))
+        assert row["text"] == "Купить хлеб"
+        assert not db_mod.in_transaction()
+
+    def test_single_commit_per_block(self, db_mod):
+        uid = self._user(db_mod)
+        ids = [db_mod.add_task(uid, f"Задача {i}")["id"] for i in range(5)]
+        statements = []
+        conn = db_mod._get_conn()
+        conn.set_trace_callback(statements.append)
+        try:
+            with db_mod.transaction():
+                for i, tid in enumerate(ids):
+                    db_mod._execute("UPDATE tasks SET today_sort = %s WHERE id = %s", (i, tid))
+        finally:
+            conn.set_trace_callback(None)
+        assert sum(1 for st in statements if st.strip().upper() == "COMMIT") == 1
+        rows = db_mod._fetchall("SELECT today_sort FROM tasks WHERE user_id = %s ORDER BY id", (uid,))
+        assert [r["today_sort"] for r in rows] == [0, 1, 2, 3, 4]
+
+    def test_nested_block_is_savepoint(self, db_mod):
+        uid = self._user(db_mod)
+        t = db_mod.add_task(uid, "Полить цветы")
+        with db_mod.transaction():
+            db_mod._execute("UPDATE tasks SET estimate_min = 15 WHERE id = %s", (t["id"],))
+            try:
+                with db_mod.transaction():
+                    db_mod._execute("UPDATE tasks SET text = 'x' WHERE id = %s", (t["id"],))
+                    raise ValueError
+            except ValueError:
+                pass
+        row = db_mod._fetchone("SELECT text, estimate_min FROM tasks WHERE id = %s", (t["id"],))
+        assert row["estimate_min"] == 15
+        assert row["text"] == "Полить цветы"
+
+    def test_invalid_bucket_order_leaves_other_buckets_untouched(self, db_mod):
+        uid = self._user(db_mod)
+        today = db_mod.user_local_date_offset(uid, 0)
+        a = db_mod.add_task(uid, "Зарядка", due_date=today, time_of_day="утро")
+        b = db_mod.add_task(uid, "Пробежка", due_date=today, time_of_day="утро")
+        res = db_mod.sync_today_bucket_orders(uid, f"{b['id']},{a['id']}", "999", "")
+        assert res["ok"] is False
+        rows = db_mod._fetchall("SELECT today_sort FROM tasks WHERE user_id = %s", (uid,))
+        assert all(int(r["today_sort"] or 0) == 0 for r in rows)
+
+
+class TestBulkOrder:
+    def test_pg_writes_whole_order_in_one_statement(self, fake_pool):
+        db, created = fake_pool
+        db._bulk_set_order(7, "color_sort", db._order_pairs([5, 3, 9]))
+        stmts = created[0].statements
+        assert len(stmts) == 1
+        assert "FROM (VALUES (%s, %s),(%s, %s),(%s, %s))" in stmts[0]
+
+    def test_unknown_column_rejected(self, db_mod):
+        with pytest.raises(ValueError):
+            db_mod._bulk_set_order(1, "text", [(1, 10)])
+
+    def test_reorder_project_tasks(self, db_mod):
+        uid = int(db_mod.create_user_with_email("bulk@example.com", "h", "")["id"])
+        proj = db_mod.create_project(uid, "Переезд")
+        ids = [
+            db_mod.add_task(uid, f"Коробка {i}", project_id=proj["id"])["id"] for i in range(4)
+        ]
+        new_order = [ids[2], ids[0], ids[3], ids[1]]
+        res = db_mod.reorder_project_tasks(uid, proj["id"], new_order)
+        assert res["ok"]
+        got = db_mod.get_active_tasks_for_project(uid, proj["id"], sort="manual")
+        assert [t["id"] for t in got] == new_order
+        assert db_mod.get_project_sort_mode(uid, proj["id"]) == "manual"
+
+    def test_move_in_today_order_normalizes_and_swaps(self, db_mod):
+        uid = int(db_mod.create_user_with_email("today@example.com", "h", "")["id"])
+        today = db_mod.user_local_date_offset(uid, 0)
+        ids = [
+            db_mod.add_task(uid, f"Дело {i}", due_date=today, time_of_day="утро")["id"]
+            for i in range(3)
+        ]
+        assert db_mod.move_task_in_today_order(uid, ids[2], "up")["ok"]
+        got = [t["id"] for t in db_mod.today_bucket_task_lists(uid)["утро"]]
+        assert got == [ids[0], ids[2], ids[1]]
+
+
+class TestTasksSections:
+    def test_sections_ordered_by_rank_then_date(self, db_mod):
+        uid = int(db_mod.create_user_with_email("sections@example.com", "h", "")["id"])
+        d1, d2 = db_mod.user_local_date_offset(uid, 1), db_mod.user_local_date_offset(uid, 2)
+        db_mod.add_task(uid, "Зарядка", is_routine=True, repeat_day="ежедневно", due_date=d2)
+        db_mod.add_task(uid, "Растяжка", is_routine=True, repeat_day="ежедневно", due_date=d1)
+        db_mod.add_task(uid, "Когда-нибудь")
+        db_mod.add_task(uid, "Послезавтра", due_date=d2)
+        db_mod.add_task(uid, "Завтра", due_date=d1)
+        sections = db_mod.tasks_page_sections(uid, 10, 2)
+        assert [s["key"] for s in sections] == [f"date:{d1}", f"date:{d2}", "nodate", "routine"]
+        # Рутины с разными датами — один раздел (и он не из первых eager_sections).
+        assert sections[-1]["count"] == 2 and sections[-1]["rows"] == []
+
+
+class TestActiveSnapshot:
+    def _count_task_scans(self, db, fn):
+        statements = []
+        conn = db._get_conn()
+        conn.set_trace_callback(statements.append)
+        try:
+            fn()
+        finally:
+            conn.set_trace_callback(None)
+        return sum(1 for st in statements if st.startswith("SELECT * FROM tasks"))
+
+    def test_derived_views_share_one_scan(self, db_mod):
+        uid = int(db_mod.create_user_with_email("snap@example.com", "h", "")["id"])
+        db_mod.add_task(uid, "Купить молоко")
+        db_mod.add_task(uid, "Зарядка", is_routine=True, repeat_day="ежедневно")
+
+        def render():
+            db_mod.get_active_tasks_ordered(uid)
+            db_mod.get_today_tasks(uid)
+            db_mod.get_routine_tasks(uid)
+            db_mod.home_counts(uid)
+
+        assert self._count_task_scans(db_mod, render) == 1
+        assert self._count_task_scans(db_mod, render) == 0
+
+    def test_mutation_invalidates_snapshot(self, db_mod):
+        uid = int(db_mod.create_user_with_email("snap2@example.com", "h", "")["id"])
+        t = db_mod.add_task(uid, "Позвонить врачу")
+        assert [x["id"] for x in db_mod.get_active_tasks_ordered(uid)] == [t["id"]]
+        v = db_mod.user_data_version(uid)
+        db_mod.complete_task(t["id"], uid)
+        assert db_mod.user_data_version(uid) > v
+        assert db_mod.get_active_tasks_ordered(uid) == []
+
+    def test_returned_rows_are_copies(self, db_mod):
+        uid = int(db_mod.create_user_with_email("snap3@example.com", "h", "")["id"])
+        db_mod.add_task(uid, "Оплатить счёт")
+        db_mod.get_active_tasks(uid)[0]["text"] = "испорчено"
+        assert db_mod.get_active_tasks(uid)[0]["text"] == "Оплатить счёт"
+
+    def test_bump_inside_transaction_waits_for_commit(self, db_mod):
+        uid = int(db_mod.create_user_with_email("snap4@example.com", "h", "")["id"])
+        v = db_mod.user_data_version(uid)
+        with db_mod.transaction():
+            db_mod.add_task(uid, "Вынести мусор")
+            assert db_mod.user_data_version(uid) == v
+        assert db_mod.user_data_version(uid) > v
+
+    def test_ordered_matches_sql_order(self, db_mod):
+        uid = int(db_mod.create_user_with_email("snap5@example.com", "h", "")["id"])
+        db_mod.add_task(uid, "Без даты")
+        db_mod.add_task(uid, "Позже", due_date="2030-01-02", due_time="09:00")
+        db_mod.add_task(uid, "Раньше", due_date="2030-01-01")
+        db_mod.add_task(uid, "Тот же день, утро", due_date="2030-01-02", due_time="08:00")
+        sql = db_mod._fetchall(
+            "SELECT id FROM tasks WHERE user_id = %s AND status = 'active' "
+            "ORDER BY COALESCE(CAST(due_date AS TEXT), '9999-12-31'), "
+            "COALESCE(CAST(due_time AS TEXT), ''), id",
+            (uid,),
+        )
+        assert [t["id"] for t in db_mod.get_active_tasks_ordered(uid)] == [r["id"] for r in sql]
+
+
+class TestRepeatSchedule:
+    REPEATS = [
+        None, "", "ежедневно", "пн", "пн, ср, пт", "сб,вс", "ежедневно, пн", "абв",
+        "N_DAYS:2", "N_DAYS:3", "N_DAYS:1", "N_DAYS:x",
+        "BIWEEK:чт", "BIWEEK:пн", "BIWEEK:ежедневно", "BIWEEK:",
+    ]
+    CREATED = ["2024-02-28 10:00:00", "2024-03-04T00:00:00+00:00", "", None]
+
+    def test_compiled_matches_parser(self, db_mod):
+        from datetime import date, timedelta
+
+        start = date(2024, 2, 20)
+        for repeat in self.REPEATS:
+            for created in self.CREATED:
+                mask, every, anchor = db_mod.compile_repeat_day(repeat, created)
+                compiled = {"repeat_mask": mask, "repeat_every": every, "repeat_anchor": anchor}
+                legacy = {"repeat_day": repeat, "created_at": created}
+                for i in range(60):
+                    d = start + timedelta(days=i)
+                    ds = d.isoformat()
+                    assert db_mod._routine_due_on(compiled, d.weekday(), ds) == \
+                        db_mod._routine_matches_today(legacy, d.weekday(), ds), (repeat, created, ds)
+
+    def test_sql_filter_matches_python(self, db_mod):
+        from datetime import date, timedelta
+
+        uid = int(db_mod.create_user_with_email("rep@example.com", "h", "")["id"])
+        for repeat in self.REPEATS:
+            db_mod.add_task(uid, f"Рутина {repeat}", is_routine=True, repeat_day=repeat)
+        routines = db_mod.get_routine_tasks(uid)
+        start = date.today()
+        for i in range(21):
+            ds = (start + timedelta(days=i)).isoformat()
+            got = {t["id"] for t in db_mod.get_tasks_for_date(uid, ds)}
+            want = {
+                t["id"] for t in routines
+                if db_mod._routine_matches_today(t, date.fromisoformat(ds).weekday(), ds)
+            }
+            assert got == want, ds
+
+    def test_update_recompiles(self, db_mod):
+        uid = int(db_mod.create_user_with_email("rep2@example.com", "h", "")["id"])
+        t = db_mod.add_task(uid, "Зарядка", is_routine=True, repeat_day="пн")
+        assert t["repeat_mask"] == 1
+        row = db_mod.update_task(t["id"], uid, repeat_day="ср, пт")
+        assert (row["repeat_mask"], row["repeat_every"]) == (0b10100, 0)
+
+    def test_migration_backfills_existing_routines(self, db_mod):
+        uid = int(db_mod.create_user_with_email("rep3@example.com", "h", "")["id"])
+        t = db_mod.add_task(uid, "Полив", is_routine=True, repeat_day="N_DAYS:3")
+        db_mod._execute("UPDATE tasks SET repeat_mask = NULL WHERE id = %s", (t["id"],))
+        db_mod._backfill_repeat_schedule(db_mod._get_conn())
+        row = db_mod._fetchone("SELECT * FROM tasks WHERE id = %s", (t["id"],))
+        assert (row["repeat_mask"], row["repeat_every"]) == (127, 3)
+
+
+class TestTextSearch:
+    def _user(self, db_mod, email):
+        uid = int(db_mod.create_user_with_email(email, "h", "")["id"])
+        ids = {
+            text: db_mod.add_task(uid, text)["id"]
+            for text in ("Купить молоко и хлеб", "Позвонить маме", "Купить подарок Оле", "Оплатить интернет")
+        }
+        return uid, ids
+
+    def test_search_uses_index(self, db_mod):
+        uid, ids = self._user(db_mod, "fts@example.com")
+        assert db_mod._fts_candidates(uid, "молоко") is not None
+        assert [t["id"] for t in db_mod.find_tasks_matching_text(uid, "купить молоко")] == [
+            ids["Купить молоко и хлеб"]
+        ]
+        assert {t["id"] for t in db_mod.find_tasks_matching_text(uid, "купить")} == {
+            ids["Купить молоко и хлеб"], ids["Купить подарок Оле"]
+        }
+        assert db_mod.find_task_by_text(uid, "маме")["id"] == ids["Позвонить маме"]
+        assert db_mod.find_task_by_text(uid, "интернет оплатить")["id"] == ids["Оплатить интернет"]
+        assert db_mod.find_task_by_text(uid, "пылесос") is None
+
+    def test_index_follows_updates_and_users(self, db_mod):
+        uid, ids = self._user(db_mod, "fts2@example.com")
+        other, _ = self._user(db_mod, "fts3@example.com")
+        tid = ids["Позвонить маме"]
+        db_mod.update_task(tid, uid, text="Позвонить бабушке")
+        assert db_mod.find_task_by_text(uid, "маме") is None
+        assert db_mod.find_task_by_text(uid, "бабушке")["id"] == tid
+        db_mod.complete_task(tid, uid)
+        assert db_mod.find_task_by_text(uid, "бабушке") is None
+        assert all(t["user_id"] == other for t in db_mod.find_tasks_matching_text(other, "купить"))
+
+    def test_mid_word_match_found_by_scan(self, db_mod):
+        uid, _ids = self._user(db_mod, "fts5@example.com")
+        tid = db_mod.add_task(uid, "Записаться в автосервис")["id"]
+        # Индекс ищет слова по началу: «сервис» в «автосервис» находит только просмотр.
+        assert db_mod.find_task_by_text(uid, "сервис")["id"] == tid
+        assert [t["id"] for t in db_mod.find_tasks_matching_text(uid, "сервис")] == [tid]
+        assert [t["id"] for t in db_mod.find_tasks_matching_text(uid, "записаться сервис")] == [tid]
+
+    def test_prefix_match_does_not_hide_mid_word_match(self, db_mod):
+        uid, _ids = self._user(db_mod, "fts6@example.com")
+        laptop = db_mod.add_task(uid, "Сервис ноутбука")["id"]
+        car = db_mod.add_task(uid, "Записаться в автосервис")["id"]
+        found = [t["id"] for t in db_mod.find_tasks_matching_text(uid, "сервис")]
+        # Оба варианта — бот переспросит, а не закроет первый попавшийся.
+        assert sorted(found) == sorted([laptop, car])
+        assert found[0] == laptop
+        assert db_mod.find_task_by_text(uid, "сервис")["id"] == laptop
+        assert db_mod.find_task_by_text(uid, "автосервис")["id"] == car
+
+    def test_long_phrase_tail_fallback(self, db_mod):
+        uid, ids = self._user(db_mod, "fts4@example.com")
+        found = db_mod.find_tasks_matching_text(uid, "слушай а можно оплатить интернет")
+        assert [t["id"] for t in found] == [ids["Оплатить интернет"]]
+
+
+class TestFuzzySearch:
+    def test_typo_resolves_uniquely(self, db_mod):
+        uid = int(db_mod.create_user_with_email("fz@example.com", "h", "")["id"])
+        milk = db_mod.add_task(uid, "Купить молоко и хлеб")
+        db_mod.add_task(uid, "Позвонить маме")
+        assert db_mod.find_task_by_text(uid, "купить малоко") is None
+        found = db_mod.find_task_fuzzy_unique(uid, "купить малоко")
+        assert found["id"] == milk["id"] and found["match_score"] >= db_mod.FUZZY_MATCH_THRESHOLD
+        assert [t["id"] for t in db_mod.find_tasks_by_texts(uid, ["купить малоко"])] == [milk["id"]]
+
+    def test_ambiguous_returns_none(self, db_mod):
+        uid = int(db_mod.create_user_with_email("fz2@example.com", "h", "")["id"])
+        db_mod.add_task(uid, "Полить цветы в спальне")
+        db_mod.add_task(uid, "Полить цветы в зале")
+        assert len(db_mod.find_tasks_fuzzy(uid, "полит цветы")) == 2
+        assert db_mod.find_task_fuzzy_unique(uid, "полит цветы") is None
+
+    def test_index_rebuilt_after_change(self, db_mod):
+        uid = int(db_mod.create_user_with_email("fz3@example.com", "h", "")["id"])
+        t = db_mod.add_task(uid, "Оплатить интернет")
+        assert db_mod.find_task_fuzzy_unique(uid, "оплатит интеренет")["id"] == t["id"]
+        db_mod.delete_task(t["id"], uid)
+        assert db_mod.find_tasks_fuzzy(uid, "оплатит интеренет") == []
+
+
+class TestBatchResolve:
+    def test_one_task_per_phrase(self, db_mod):
+        uid = int(db_mod.create_user_with_email("br@example.com", "h", "")["id"])
+        milk = db_mod.add_task(uid, "Купить молоко")
+        milk_bread = db_mod.add_task(uid, "Купить молоко и хлеб")
+        mom = db_mod.add_task(uid, "Позвонить маме")
+        got = db_mod.resolve_tasks_by_texts(uid, ["купить молоко", "молоко и хлеб", "позвонит маме", "пылесос"])
+        assert [t["id"] if t else None for _, t in got] == [milk["id"], milk_bread["id"], mom["id"], None]
+
+    def test_scarce_phrase_gets_its_only_candidate(self, db_mod):
+        uid = int(db_mod.create_user_with_email("br2@example.com", "h", "")["id"])
+        a = db_mod.add_task(uid, "Полить цветы")
+        b = db_mod.add_task(uid, "Полить цветы на балконе")
+        got = db_mod.resolve_tasks_by_texts(uid, ["полить", "на балконе"])
+        assert [t["id"] for _, t in got] == [a["id"], b["id"]]
+
+    def test_ambiguous_fuzzy_phrase_stays_unresolved(self, db_mod):
+        uid = int(db_mod.create_user_with_email("br5@example.com", "h", "")["id"])
+        db_mod.add_task(uid, "Полить цветы в спальне")
+        db_mod.add_task(uid, "Полить цветы в зале")
+        milk = db_mod.add_task(uid, "Купить молоко и хлеб")
+        # «полит» — часть слова «полить» (уровень «все слова»), «цвиты» — опечатка (триграммы).
+        got = db_mod.resolve_tasks_by_texts(uid, ["полит цветы", "полит цвиты", "купить малоко"])
+        assert [t["id"] if t else None for _, t in got] == [None, None, milk["id"]]
+        done, not_found = db_mod.complete_tasks_by_texts(uid, ["полит цветы"])
+        assert done == [] and not_found == ["полит цветы"]
+
+    def test_single_snapshot_load(self, db_mod, monkeypatch):
+        uid = int(db_mod.create_user_with_email("br3@example.com", "h", "")["id"])
+        for text in ("Купить хлеб", "Вынести мусор", "Оплатить интернет"):
+            db_mod.add_task(uid, text)
+        calls = []
+        real = db_mod._active_tasks_snapshot
+        monkeypatch.setattr(db_mod, "_active_tasks_snapshot", lambda u: calls.append(u) or real(u))
+        found = db_mod.find_tasks_by_texts(uid, ["хлеб", "мусор", "интернет", "хлеб"])
+        assert len(found) == 3 and len(calls) == 1
+
+    def test_complete_by_texts(self, db_mod):
+        uid = int(db_mod.create_user_with_email("br4@example.com", "h", "")["id"])
+        db_mod.add_task(uid, "Купить хлеб")
+        db_mod.add_task(uid, "Вынести мусор")
+        done, not_found = db_mod.complete_tasks_by_texts(uid, ["мусор", "хлеб", "собаку"])
+        assert [t["text"] for t in done] == ["Вынести мусор", "Купить хлеб"]
+        assert not_found == ["собаку"]
+        assert db_mod.get_active_tasks(uid) == []
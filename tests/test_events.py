@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты уведомлений об изменениях (events): подписка, схлопывание, метка вкладки,
+публикация из мутаций db (после COMMIT транзакции).
+"""
+import asyncio
+import sys
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest
+
+import events
+
+
+@pytest.fixture
+def db_mod(tmp_path, monkeypatch):
+    monkeypatch.setenv("BOT_DB_PATH", str(tmp_path / "events_test.sqlite"))
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    sys.modules.pop("db", None)
+    import db
+
+    yield db
+    db._drop_conn()
+
+
+def test_publish_reaches_only_own_user():
+    async def scenario():
+        with events.subscribe(1) as mine, events.subscribe(2) as other:
+            events.publish(1)
+            assert (await mine.get(timeout=1)) == {"user_id": 1, "origin": None}
+            assert await other.get(timeout=0.05) is None
+            # None — изменение «неизвестно чьё»: получают все.
+            events.publish(None)
+            assert (await other.get(timeout=1))["user_id"] is None
+        assert events.subscribers_count() == 0
+
+    asyncio.run(scenario())
+
+
+def test_unread_events_coalesce_to_last():
+    async def scenario():
+        with events.subscribe(5) as sub:
+            token = events.set_origin("tab1")
+            try:
+                for _ in range(10):
+                    events.publish(5)
+            finally:
+                events.reset_origin(token)
+            events.publish(5)
+            await asyncio.sleep(0)
+            assert await sub.get(timeout=1) == {"user_id": 5, "origin": None}
+            assert await sub.get(timeout=0.05) is None
+
+    asyncio.run(scenario())
+
+
+def test_publish_from_other_thread():
+    async def scenario():
+        with events.subscribe(7) as sub:
+            t = threading.Thread(target=events.publish, args=(7,))
+            t.start()
+            t.join()
+            assert (await sub.get(timeout=1))["user_id"] == 7
+
+    asyncio.run(scenario())
+
+
+def test_db_mutation_publishes_after_commit(db_mod):
+    uid = int(db_mod.create_user_with_email("events@example.com", "h", "")["id"])
+    seen = []
+
+    async def scenario():
+        with events.subscribe(uid) as sub:
+            await asyncio.to_thread(db_mod.add_task, uid, "Из бота")
+            seen.append(await sub.get(timeout=1))
+
+            def in_tx():
+                with db_mod.transaction():
+                    db_mod.add_task(uid, "Первая")
+                    db_mod.add_task(uid, "Вторая")
+                    # До COMMIT подписчик ничего не получает.
+                    seen.append(sub._pending)
+
+            await asyncio.to_thread(in_tx)
+            seen.append(await sub.get(timeout=1))
+
+    asyncio.run(scenario())
+    assert seen[0] == {"user_id": uid, "origin": None}
+    assert seen[1] is None
+    assert seen[2] == {"user_id": uid, "origin": None}
+
+
+def test_external_change_resets_version_without_publishing(db_mod, monkeypatch):
+    published = []
+    monkeypatch.setattr(events, "publish", published.append)
+    before = db_mod.user_data_version(9)
+    db_mod.note_external_change(9)
+    assert db_mod.user_data_version(9) > before
+    assert published == []
+
+
+class _FakeNotify:
+    def __init__(self, payload):
+        self.payload = payload
+
+
+class _FakeListenConn:
+    def __init__(self, payloads):
+        self.notifies = [_FakeNotify(p) for p in payloads]
+
+    def poll(self):
+        pass
+
+
+def test_pg_bridge_delivers_foreign_notifications():
+    remote = []
+    bridge = events._PgBridge("postgres://unused", on_remote=remote.append)
+    own = '{"u":3,"o":null,"i":"%s"}' % events._INSTANCE
+    foreign = '{"u":3,"o":"tab9","i":"other-1"}'
+
+    async def scenario():
+        with events.subscribe(3) as sub:
+            bridge._receive(_FakeListenConn([own, "not json", foreign]))
+            return await sub.get(timeout=1)
+
+    assert asyncio.run(scenario()) == {"user_id": 3, "origin": "tab9"}
+    assert remote == [3]
+
+
+def test_pg_bridge_wake_does_not_block_when_pipe_full():
+    bridge = events._PgBridge("postgres://unused")
+    # Поток не запущен и pipe не читает: буфер (обычно 64 КБ) переполняется, send не виснет.
+    for _ in range(200_000):
+        bridge.send({"user_id": 1})
+    assert len(bridge._outbox) == 200_000
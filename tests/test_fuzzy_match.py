@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Юнит-тесты триграммного нечёткого поиска (fuzzy_match).
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fuzzy_match import TrigramIndex, trigrams, word_similarity
+
+
+class TestTrigrams:
+    def test_padding_like_pg_trgm(self):
+        assert trigrams("Кот") == {"  к", " ко", "кот", "от "}
+
+    def test_case_and_yo_folded(self):
+        assert trigrams("Ёлка") == trigrams("елка")
+
+    def test_empty(self):
+        assert trigrams("") == set()
+        assert word_similarity("", "что угодно") == 0.0
+
+
+class TestWordSimilarity:
+    def test_typo_scores_high(self):
+        assert word_similarity("купить малоко", "Купить молоко и хлеб") > 0.7
+
+    def test_long_task_text_not_penalized(self):
+        assert word_similarity("домен", "Зарегистрировать домен для сайта") == 1.0
+
+    def test_unrelated_scores_low(self):
+        assert word_similarity("молоко", "Позвонить маме") < 0.3
+
+
+class TestTrigramIndex:
+    def test_ranked_with_threshold(self):
+        idx = TrigramIndex([(1, "Купить молоко и хлеб"), (2, "Позвонить маме"), (3, "Купить молока")])
+        found = idx.search("купить малоко", threshold=0.6)
+        assert [i for i, _ in found][:2] in ([1, 3], [3, 1])
+        assert 2 not in [i for i, _ in found]
+
+    def test_limit_and_tie_order(self):
+        idx = TrigramIndex([(5, "полить цветы"), (4, "полить цветы")])
+        assert idx.search("полить цветы", limit=1) == [(4, 1.0)]
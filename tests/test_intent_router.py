@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты разбора намерения (intent_router): автомат даёт тот же результат, что и
+прежняя цепочка проверок, на корпусе и на сгенерированных вариантах фраз.
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest
+
+import intent_router
+from intent_router import Route, route, route_linear
+
+CORPUS = Path(__file__).resolve().parent.parent / "scripts" / "intent_corpus.txt"
+
+
+def _corpus():
+    lines = CORPUS.read_text(encoding="utf-8").splitlines()
+    return [ln.strip() for ln in lines if ln.strip() and not ln.startswith("#")]
+
+
+def _variants():
+    for _intent, phrases, _anywhere in intent_router.RULES:
+        for p in phrases:
+            yield p
+            yield p.upper()
+            yield "  " + p.capitalize() + "  "
+            yield p + " купить молоко"
+            yield "ну " + p
+            yield "Вот " + p + " и всё"
+            yield p[:-1]
+
+
+@pytest.mark.parametrize("text", _corpus())
+def test_corpus_matches_linear(text):
+    assert route(text) == route_linear(text)
+
+
+def test_generated_variants_match_linear():
+    mismatches = [t for t in _variants() if route(t) != route_linear(t)]
+    assert mismatches == []
+
+
+def test_priority_follows_rule_order():
+    # «план» (список) стоит раньше «на сегодня» — как в прежней цепочке.
+    assert route("План на сегодня").intent == "list_tasks"
+    assert route("Что на сегодня").intent == "today"
+    assert route("Добавить задачу").intent == "await_task"
+    assert route("Отменить выполнение купить молоко").intent == "uncomplete"
+    assert route("Удали задачу 3").intent == "delete"
+
+
+def test_prefix_markers_only_at_start():
+    assert route("Выполни купить молоко").intent == "complete"
+    assert route("Купить молоко и выполни зарядку").intent == "add_text"
+
+
+def test_add_payload_and_default():
+    r = route("Добавь купить хлеб")
+    assert r.intent == "add"
+    assert r.payload == route_linear("Добавь купить хлеб").payload
+    assert "хлеб" in r.payload.lower()
+    assert route("Купить молоко") == Route("add_text", "Купить молоко")
+    assert route("") == Route("add_text", "")
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты напоминаний: remind_at_utc в TZ пользователя и его синхронизация при
+правках задачи, куча с ленивым удалением, шаг планировщика (отправка один раз).
+"""
+import asyncio
+import sys
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest
+
+import events
+
+
+@pytest.fixture
+def db_mod(tmp_path, monkeypatch):
+    monkeypatch.setenv("BOT_DB_PATH", str(tmp_path / "reminders_test.sqlite"))
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    sys.modules.pop("db", None)
+    sys.modules.pop("reminders", None)
+    import db
+
+    yield db
+    db._drop_conn()
+    sys.modules.pop("reminders", None)
+
+
+def _tomorrow() -> str:
+    return (date.today() + timedelta(days=2)).isoformat()
+
+
+def test_remind_at_respects_user_timezone(db_mod):
+    uid = int(db_mod.get_or_create_user(5001, "Аня")["id"])
+    db_mod.set_user_timezone(uid, "Asia/Tokyo")
+    day = _tomorrow()
+    at = db_mod.compute_remind_at(uid, day, "09:30", None)
+    assert at == f"{day}T00:30:00+00:00"
+    # Без точного времени — якорь блока суток.
+    assert db_mod.compute_remind_at(uid, day, None, "вечер") == f"{day}T09:00:00+00:00"
+    assert db_mod.compute_remind_at(uid, day, None, None) is None
+    assert db_mod.compute_remind_at(uid, "2000-01-01", "10:00", None) is None
+
+
+def test_task_writes_keep_remind_at_in_sync(db_mod):
+    uid = int(db_mod.get_or_create_user(5002, "Боря")["id"])
+    db_mod.set_user_timezone(uid, "UTC")
+    day = _tomorrow()
+    task = db_mod.add_task(uid, "Позвонить", due_date=day, due_time="10:00")
+    assert task["remind_at_utc"] == f"{day}T10:00:00+00:00"
+    routine = db_mod.add_task(uid, "Зарядка", due_date=day, due_time="07:00", is_routine=True, repeat_day="daily")
+    assert routine["remind_at_utc"] is None
+
+    row = db_mod.update_task(task["id"], uid, due_time="15:00")
+    assert row["remind_at_utc"] == f"{day}T15:00:00+00:00"
+
+    # Смена часового пояса пересчитывает будущие напоминания.
+    db_mod.set_user_timezone(uid, "Europe/Moscow")
+    lo = datetime.now(timezone.utc)
+    hi = lo + timedelta(days=5)
+    rows = db_mod.list_reminders_between(lo, hi)
+    assert [(r["task_id"], r["remind_at_utc"]) for r in rows] == [(task["id"], f"{day}T12:00:00+00:00")]
+    db_mod.complete_task(task["id"], uid)
+    assert db_mod.list_reminders_between(lo, hi) == []
+    db_mod.uncomplete_task(task["id"], uid)
+    assert [r["task_id"] for r in db_mod.list_reminders_between(lo, hi, uid)] == [task["id"]]
+
+
+def test_claim_is_single_use_and_skips_web_only_users(db_mod):
+    uid = int(db_mod.get_or_create_user(5003, "Вера")["id"])
+    web_uid = int(db_mod.create_user_with_email("web@example.com", "h", "")["id"])
+    day = _tomorrow()
+    task = db_mod.add_task(uid, "Купить молоко", due_date=day, due_time="10:00")
+    db_mod.add_task(web_uid, "Без телеграма", due_date=day, due_time="10:00")
+    lo = datetime.now(timezone.utc)
+    rows = db_mod.list_reminders_between(lo, lo + timedelta(days=5))
+    assert [r["user_id"] for r in rows] == [uid]
+
+    claimed = db_mod.claim_reminder(task["id"], rows[0]["remind_at_utc"])
+    assert claimed["telegram_id"] == 5003 and claimed["text"] == "Купить молоко"
+    assert db_mod.claim_reminder(task["id"], rows[0]["remind_at_utc"]) is None
+
+
+def test_queue_lazy_updates(db_mod):
+    import reminders
+
+    q = reminders.ReminderQueue()
+    q.put(1, 10, "2030-01-01T10:00:00+00:00")
+    q.put(2, 10, "2030-01-01T09:00:00+00:00")
+    q.put(3, 20, "2030-01-01T11:00:00+00:00")
+    # Перенос — новая запись, старая пропускается при извлечении.
+    q.put(2, 10, "2030-01-01T12:00:00+00:00")
+    q.discard(3)
+    t = datetime(2030, 1, 1, 10, 30, tzinfo=timezone.utc).timestamp()
+    assert q.peek_time() == datetime(2030, 1, 1, 10, tzinfo=timezone.utc).timestamp()
+    assert q.pop_due(t) == [(1, 10, "2030-01-01T10:00:00+00:00")]
+    q.replace_user(10, [])
+    assert len(q) == 0 and q.peek_time() is None
+
+
+def test_scheduler_sends_due_reminder_once(db_mod):
+    import reminders
+
+    uid = int(db_mod.get_or_create_user(5004, "Гоша")["id"])
+    db_mod.set_user_timezone(uid, "UTC")
+    day = _tomorrow()
+    task = db_mod.add_task(uid, "Встреча", due_date=day, due_time="10:00")
+    fire_at = db_mod.parse_remind_at(task["remind_at_utc"]).timestamp()
+    clock = {"now": fire_at - 3600}
+    sent = []
+
+    async def run_db(fn, *args):
+        return fn(*args)
+
+    async def send(bot, chat_id, text):
+        sent.append((chat_id, text))
+        return True
+
+    async def scenario():
+        sched = reminders.ReminderScheduler(
+            bot=None, clock=lambda: clock["now"], window_sec=7200, run_db=run_db, send=send
+        )
+        await sched.start()
+        try:
+            assert len(sched.queue) == 1
+            clock["now"] = fire_at + 1
+            await sched.tick()
+            await asyncio.sleep(0)
+            await sched.tick()
+            await asyncio.sleep(0)
+            return sched.stats()
+        finally:
+            sched.stop()
+
+    stats = asyncio.run(scenario())
+    assert sent == [(5004, "⏰ *Напоминание:* Встреча — _10:00_")]
+    assert stats["fired"] == 1 and stats["pending"] == 0
+    assert events._listeners == []
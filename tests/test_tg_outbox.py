@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты очереди отправки (tg_outbox): порядок и склейка сообщений чата, лимиты,
+429 retry_after, откат с Markdown на простой текст.
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TimedOut
+
+import tg_outbox
+
+
+class _Clock:
+    """Виртуальное время: sleep двигает часы, не ожидая по-настоящему."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, sec):
+        self.sleeps.append(sec)
+        self.now += sec
+        await asyncio.sleep(0)
+
+
+class _Bot:
+    def __init__(self, clock, errors=None):
+        self.clock = clock
+        self.errors = list(errors or [])
+        self.sent = []
+
+    async def send_message(self, chat_id, text, parse_mode=None, reply_markup=None):
+        if self.errors:
+            err = self.errors.pop(0)
+            if err is not None:
+                raise err
+        self.sent.append((self.clock.now, chat_id, text, parse_mode))
+
+
+def _outbox(clock, **kw):
+    return tg_outbox.Outbox(clock=clock, sleep=clock.sleep, **kw)
+
+
+def test_token_bucket_reserves_in_order():
+    b = tg_outbox.TokenBucket(rate=2.0, capacity=2.0, now=0.0)
+    assert [b.reserve(0.0) for _ in range(4)] == [0.0, 0.0, 0.5, 1.0]
+    assert b.reserve(10.0) == 0.0
+
+
+def test_pending_messages_to_one_chat_coalesce():
+    clock = _Clock()
+    bot = _Bot(clock)
+    box = _outbox(clock, chat_burst=1)
+
+    async def scenario():
+        return await asyncio.gather(*(box.send(bot, 10, f"ответ {i}") for i in range(4)))
+
+    assert asyncio.run(scenario()) == [True] * 4
+    texts = [t for _, _, t, _ in bot.sent]
+    assert "".join(texts).replace("\n\n", "") == "ответ 0ответ 1ответ 2ответ 3"
+    assert len(texts) < 4
+    assert box.stats()["coalesced"] == 4 - len(texts)
+
+
+def test_chat_and_global_rate_limits():
+    clock = _Clock()
+    bot = _Bot(clock)
+    box = _outbox(clock, global_per_sec=2, chat_per_sec=1, chat_burst=1)
+
+    async def scenario():
+        # Разметка разная — сообщения не склеиваются.
+        await asyncio.gather(
+            box.send(bot, 1, "a", parse_mode=None),
+            box.send(bot, 1, "b"),
+            *(box.send(bot, cid, "x") for cid in (2, 3, 4, 5)),
+        )
+
+    asyncio.run(scenario())
+    times = {}
+    for at, cid, text, _ in bot.sent:
+        times.setdefault(cid, []).append(at)
+    # В один чат — не чаще раза в секунду.
+    assert times[1][1] - times[1][0] >= 1.0
+    # Всего — не больше 2 в секунду (ёмкость 2): 6 сообщений не раньше чем за 2 с.
+    assert max(at for at, *_ in bot.sent) >= 2.0
+    assert [t for _, c, t, _ in bot.sent if c == 1] == ["a", "b"]
+
+
+def test_retry_after_pauses_chat_and_resends():
+    clock = _Clock()
+    bot = _Bot(clock, errors=[RetryAfter(7)])
+    box = _outbox(clock)
+
+    assert asyncio.run(box.send(bot, 42, "привет")) is True
+    assert bot.sent[0][0] >= 7.0
+    st = box.stats()
+    assert st["retry_after"] == 1 and st["sent"] == 1 and st["failed"] == 0
+
+
+def test_markdown_error_falls_back_to_plain_text():
+    clock = _Clock()
+    bot = _Bot(clock, errors=[BadRequest("Can't parse entities")])
+    box = _outbox(clock)
+
+    assert asyncio.run(box.send(bot, 1, "текст_с_подчёркиванием")) is True
+    assert bot.sent[0][3] is None
+    assert box.stats()["plain_fallback"] == 1
+
+
+def test_network_retries_then_gives_up():
+    clock = _Clock()
+    bot = _Bot(clock, errors=[TimedOut()] * 10)
+    box = _outbox(clock, max_retries=2)
+
+    assert asyncio.run(box.send(bot, 1, "x")) is False
+    assert clock.sleeps == [1, 2]
+    assert box.stats()["failed"] == 1
+
+
+def test_forbidden_is_not_retried():
+    clock = _Clock()
+    bot = _Bot(clock, errors=[Forbidden("bot was blocked by the user"), None])
+    box = _outbox(clock)
+
+    async def scenario():
+        first = await box.send(bot, 1, "x")
+        second = await box.send(bot, 1, "y")
+        return first, second
+
+    assert asyncio.run(scenario()) == (False, True)
+    assert [t for _, _, t, _ in bot.sent] == ["y"]
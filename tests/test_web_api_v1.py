@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""JSON API /api/v1: авторизация, keyset-пагинация, выборочные поля, массовые операции."""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest
+from starlette.testclient import TestClient
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setenv("WEB_SESSION_SECRET", "x" * 32)
+    monkeypatch.setenv("WEB_DB_PATH", str(tmp_path / "t.db"))
+    monkeypatch.setenv("BOT_DB_PATH", str(tmp_path / "t.db"))
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    monkeypatch.setenv("RENDER", "")
+    monkeypatch.setenv("WEB_HTTPS_ONLY", "")
+    for mod in ("web", "web.app", "web.auth", "web.api_v1", "db", "db_async", "bot_v2", "task_commands", "categories"):
+        sys.modules.pop(mod, None)
+    from web.app import app as fastapi_app
+
+    return TestClient(fastapi_app)
+
+
+def _login(client, email="api@example.com"):
+    r = client.post(
+        "/signup",
+        data={"email": email, "password": "very-secret-1", "password2": "very-secret-1", "name": ""},
+        follow_redirects=False,
+    )
+    assert r.status_code in (302, 303)
+
+
+def _collect(client, url, limit):
+    items, cursor, pages = [], None, 0
+    while True:
+        sep = "&" if "?" in url else "?"
+        r = client.get(f"{url}{sep}limit={limit}" + (f"&cursor={cursor}" if cursor else ""))
+        assert r.status_code == 200, r.text
+        data = r.json()
+        items.extend(data["items"])
+        pages += 1
+        cursor = data["next_cursor"]
+        if not cursor:
+            return items, pages
+
+
+def test_requires_session(client):
+    r = client.get("/api/v1/tasks")
+    assert r.status_code == 401
+    assert r.json()["ok"] is False
+
+
+def test_tasks_keyset_pagination_and_fields(client):
+    _login(client)
+    specs = [
+        {"text": "Без срока"},
+        {"text": "Поздно", "due_date": "2030-01-02", "due_time": "18:00"},
+        {"text": "Рано", "due_date": "2030-01-02", "due_time": "09:00"},
+        {"text": "Раньше всех", "due_date": "2030-01-01"},
+        {"text": "Ещё без срока"},
+    ]
+    r = client.post("/api/v1/tasks/bulk", json={"tasks": specs})
+    assert r.status_code == 201
+    created = r.json()["items"]
+    assert [t["text"] for t in created] == [s["text"] for s in specs]
+
+    items, pages = _collect(client, "/api/v1/tasks?fields=text,due_date", 2)
+    assert pages == 3
+    assert [t["text"] for t in items] == ["Раньше всех", "Рано", "Поздно", "Без срока", "Ещё без срока"]
+    assert all(set(t) == {"id", "text", "due_date"} for t in items)
+
+    # Вставка между страницами не дублирует и не теряет строки.
+    r = client.get("/api/v1/tasks?limit=2")
+    first = r.json()
+    client.post("/api/v1/tasks", json={"text": "Вставка в начало", "due_date": "2029-12-31"})
+    rest, _ = _collect(client, f"/api/v1/tasks?cursor={first['next_cursor']}", 2)
+    texts = [t["text"] for t in first["items"] + rest]
+    assert len(texts) == len(set(texts)) == 5
+
+
+def test_bad_params(client):
+    _login(client)
+    assert client.get("/api/v1/tasks?fields=password_hash").status_code == 400
+    assert client.get("/api/v1/tasks?cursor=zzz").status_code == 400
+    assert client.get("/api/v1/tasks?limit=1000").status_code == 400
+    assert client.get("/api/v1/plan?date=31.12.2030").status_code == 400
+    assert client.get("/api/v1/completions?since=foo").status_code == 400
+    assert client.get("/api/v1/completions?until=2026-13-01").status_code == 400
+    assert client.post("/api/v1/tasks", json={"text": ""}).status_code == 422
+    for bad in ({"due_date": "2026-02-30"}, {"due_time": "99:99"}, {"repeat_day": "garbage"}):
+        assert client.post("/api/v1/tasks", json={"text": "Задача", **bad}).status_code == 422
+    task = client.post("/api/v1/tasks", json={"text": "Задача"}).json()["task"]
+    assert client.patch(f"/api/v1/tasks/{task['id']}", json={"due_time": "24:00"}).status_code == 422
+    assert client.get("/api/v1/tasks").json()["items"] == [task]
+
+
+def test_patch_delete_and_isolation(client):
+    _login(client)
+    task = client.post("/api/v1/tasks", json={"text": "Купить хлеб"}).json()["task"]
+    r = client.patch(
+        f"/api/v1/tasks/{task['id']}",
+        json={"text": "Купить хлеб и молоко", "color": "green", "estimate_min": 15},
+    )
+    assert r.status_code == 200
+    t = r.json()["task"]
+    assert (t["text"], t["color"], t["estimate_min"]) == ("Купить хлеб и молоко", "green", 15)
+    assert client.patch(f"/api/v1/tasks/{task['id']}", json={"color": "pink"}).status_code == 400
+
+    client.cookies.clear()
+    _login(client, "other@example.com")
+    assert client.get(f"/api/v1/tasks/{task['id']}").status_code == 404
+    assert client.delete(f"/api/v1/tasks/{task['id']}").status_code == 404
+
+
+def test_bulk_complete_and_completions(client):
+    _login(client)
+    a = client.post("/api/v1/tasks", json={"text": "Разовая"}).json()["task"]
+    routine = client.post(
+        "/api/v1/tasks", json={"text": "Зарядка", "is_routine": True, "repeat_day": "ежедневно"}
+    ).json()["task"]
+    r = client.post("/api/v1/tasks/complete", json={"ids": [a["id"], routine["id"], 999999]})
+    data = r.json()
+    assert sorted(data["completed"]) == sorted([a["id"], routine["id"]])
+    assert data["not_found"] == [999999]
+
+    items, _ = _collect(client, "/api/v1/completions", 1)
+    assert sorted((c["kind"], c["task_id"]) for c in items) == sorted(
+        [("task", a["id"]), ("routine", routine["id"])]
+    )
+    # Границы в любом поясе приводятся к UTC, как хранится completed_at.
+    url = "/api/v1/completions?since=2000-01-01T03:00:00%2B03:00"
+    assert len(client.get(url).json()["items"]) == 2
+    assert client.get("/api/v1/completions?since=2999-01-01T00:00:00Z").json()["items"] == []
+    assert client.get("/api/v1/completions?until=2000-01-01").json()["items"] == []
+    done = client.get("/api/v1/tasks?status=done").json()["items"]
+    assert [t["id"] for t in done] == [a["id"]]
+    assert [t["id"] for t in client.get("/api/v1/routines").json()["items"]] == [routine["id"]]
+
+    r = client.post("/api/v1/tasks/delete", json={"ids": [routine["id"], 999999]})
+    assert r.json()["deleted"] == [routine["id"]]
+    assert client.get("/api/v1/projects").json() == {"ok": True, "items": []}
+    assert client.get("/api/v1/plan").json()["items"] == []
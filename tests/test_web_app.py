@@ -18,9 +18,11 @@ def client(monkeypatch, tmp_path):
     monkeypatch.delenv("DATABASE_URL", raising=False)
     monkeypatch.setenv("RENDER", "")
     monkeypatch.setenv("WEB_HTTPS_ONLY", "")
+    sys.modules.pop("web", None)
     sys.modules.pop("web.app", None)
     sys.modules.pop("web.auth", None)
-    sys.modules.pop("db", None)
+    for mod in ("db", "db_async", "bot_v2", "task_commands", "categories"):
+        sys.modules.pop(mod, None)
     from web.app import app as fastapi_app
 
     c = TestClient(fastapi_app)
@@ -287,3 +289,458 @@ def test_ensure_plan_keeps_routine_slot_when_completed(monkeypatch, tmp_path):
             "last_completed_at": slots[0].get("last_completed_at"),
         },
     )
+
+
+def _wait_job(client, job_id, timeout=5.0):
+    import time
+
+    deadline = time.monotonic() + timeout
+    while True:
+        st = client.get(f"/jobs/{job_id}").json()
+        if st.get("status") in ("done", "error") or time.monotonic() > deadline:
+            return st
+        time.sleep(0.02)
+
+
+def test_voice_upload_transcribed_in_background_job(client, monkeypatch):
+    import ai_module
+
+    seen = {}
+
+    async def fake_transcribe(body, suffix=".ogg"):
+        seen["len"], seen["suffix"] = len(body), suffix
+        return "Купить хлеб"
+
+    def blocking_transcribe(*_a, **_kw):
+        raise AssertionError("синхронный вызов Whisper из обработчика")
+
+    monkeypatch.setattr(ai_module, "transcribe_voice_async", fake_transcribe)
+    monkeypatch.setattr(ai_module, "transcribe_voice", blocking_transcribe)
+    with client:
+        assert _signup(client).status_code in (302, 303)
+        r = client.post(
+            "/tasks/voice",
+            files={"file": ("rec.webm", b"x" * 200_000, "audio/webm")},
+            headers={"Accept": "application/json"},
+        )
+        assert r.status_code == 202, r.text
+        job = r.json()
+        assert job["status_url"] == f"/jobs/{job['job_id']}"
+        st = _wait_job(client, job["job_id"])
+    assert st["status"] == "done" and st["ok"] is True
+    assert st["transcript"] == "Купить хлеб"
+    assert seen == {"len": 200_000, "suffix": ".webm"}
+
+
+def test_job_status_is_private(client):
+    import db
+
+    with client:
+        assert _signup(client).status_code in (302, 303)
+        other = db.create_user_with_email("other@example.com", "h", "")
+        db.create_job("foreignjob", int(other["id"]), "voice")
+        assert client.get("/jobs/foreignjob").status_code == 404
+        assert client.get("/jobs/nope").status_code == 404
+
+
+def test_plan_auto_place_json_runs_as_job(client):
+    import db
+
+    with client:
+        _signup(client)
+        _promote_session_user_admin()
+        uid = int(db.find_user_by_email("user@example.com")["id"])
+        tid = int(db.add_task(uid, "Разобрать почту", due_date="2026-05-05")["id"])
+        r = client.post(
+            "/plan/auto_place",
+            data={"date": "2026-05-05"},
+            headers={"Accept": "application/json"},
+        )
+        assert r.status_code == 202
+        st = _wait_job(client, r.json()["job_id"])
+    assert st["status"] == "done" and st["ok"] is True
+    assert st["redirect"] == "/plan?date=2026-05-05"
+    assert [int(x["task_id"]) for x in db.get_plan_slots(uid, "2026-05-05")] == [tid]
+
+
+def test_interrupted_jobs_marked_failed_on_restart(client):
+    import db
+
+    with client:
+        assert _signup(client).status_code in (302, 303)
+        uid = int(db.find_user_by_email("user@example.com")["id"])
+        db.create_job("stuck", uid, "plan_auto_place")
+        db.create_job("live", uid, "plan_auto_place")
+    # «stuck» брошен давно, «live» только что поставлен соседним процессом.
+    db._execute("UPDATE jobs SET updated_at = %s WHERE id = 'stuck'", ("2020-01-01T00:00:00+00:00",))
+    assert db.fail_interrupted_jobs(600) == 1
+    job = db.get_job("stuck", uid)
+    assert job["status"] == "error" and job["result"]["ok"] is False
+    assert db.get_job("live", uid)["status"] == "queued"
+
+
+def test_job_outliving_timeout_keeps_running_until_done(client, monkeypatch):
+    import asyncio
+    import time
+
+    import db
+    from web import jobs as web_jobs
+
+    monkeypatch.setattr(web_jobs, "job_timeout_sec", lambda: 0.2)
+
+    def slow_archive(uid):
+        time.sleep(0.5)
+        return {"message": "Готово", "task_id": db.add_task(uid, "Записано после таймаута")["id"]}
+
+    async def scenario(uid):
+        job_id = await web_jobs.submit(uid, "project_archive", slow_archive, uid)
+        await asyncio.sleep(0.35)
+        # Таймаут прошёл, но работа ещё идёт: не «ошибка», и чистка при старте
+        # соседнего процесса её не трогает — воркер отмечает задачу в БД.
+        during = await web_jobs.get_status(job_id, uid)
+        stale = await asyncio.to_thread(db.fail_interrupted_jobs, 0.2)
+        await web_jobs.drain()
+        await web_jobs.shutdown()
+        return job_id, during, stale
+
+    assert _signup(client).status_code in (302, 303)
+    uid = int(db.find_user_by_email("user@example.com")["id"])
+    job_id, during, stale = asyncio.run(scenario(uid))
+    assert during["status"] == "running" and stale == 0
+    job = db.get_job(job_id, uid)
+    assert job["status"] == "done" and job["result"]["ok"] is True
+    assert db.get_task_fields(uid, job["result"]["task_id"], ("id",))
+
+
+def test_job_waiting_past_timeout_is_not_started(client, monkeypatch):
+    import asyncio
+    import time
+
+    import db
+    from web import jobs as web_jobs
+
+    monkeypatch.setenv("WEB_JOB_WORKERS", "1")
+    monkeypatch.setattr(web_jobs, "job_timeout_sec", lambda: 0.2)
+    calls = []
+
+    def busy():
+        time.sleep(0.4)
+
+    async def scenario(uid):
+        first = await web_jobs.submit(uid, "plan_auto_place", busy)
+        second = await web_jobs.submit(uid, "plan_auto_place", calls.append, "ran")
+        await web_jobs.drain()
+        await web_jobs.shutdown()
+        return first, second
+
+    assert _signup(client).status_code in (302, 303)
+    uid = int(db.find_user_by_email("user@example.com")["id"])
+    first, second = asyncio.run(scenario(uid))
+    assert db.get_job(first, uid)["status"] == "done"
+    job = db.get_job(second, uid)
+    assert job["status"] == "error" and job["result"]["ok"] is False
+    assert calls == []
+
+
+def test_voice_upload_over_limit_rejected(client, monkeypatch):
+    monkeypatch.setenv("WEB_MAX_VOICE_BYTES", "1000")
+    assert _signup(client).status_code in (302, 303)
+    r = client.post(
+        "/tasks/voice",
+        files={"file": ("rec.ogg", b"x" * 5000, "audio/ogg")},
+        headers={"Accept": "application/json"},
+    )
+    assert r.status_code == 413
+
+
+def test_user_row_loaded_once_per_request_and_cached(client):
+    import db
+
+    assert _signup(client).status_code in (302, 303)
+    statements: list[str] = []
+    conn = db._get_conn()
+    conn.set_trace_callback(statements.append)
+    try:
+        assert client.get("/today").status_code == 200
+        first = [q for q in statements if q.startswith("SELECT * FROM users")]
+        statements.clear()
+        assert client.get("/tasks").status_code == 200
+        second = [q for q in statements if q.startswith("SELECT * FROM users")]
+        uid = int(db.find_user_by_email("user@example.com")["id"])
+        db.set_user_role(uid, "admin")
+        statements.clear()
+        assert client.get("/today").status_code == 200
+        after_change = [q for q in statements if q.startswith("SELECT * FROM users")]
+    finally:
+        conn.set_trace_callback(None)
+    assert len(first) <= 1
+    assert second == []
+    assert len(after_change) == 1
+
+
+def test_cross_origin_post_rejected(client, monkeypatch):
+    assert _signup(client).status_code in (302, 303)
+    r = client.post(
+        "/tasks/add",
+        data={"text": "Чужой сайт"},
+        headers={"Origin": "https://evil.example.org"},
+        follow_redirects=False,
+    )
+    assert r.status_code == 403
+    assert r.json()["message"] == "Forbidden (origin)"
+
+    r = client.post(
+        "/tasks/add",
+        data={"text": "Свой сайт"},
+        headers={"Origin": "http://testserver"},
+        follow_redirects=False,
+    )
+    assert r.status_code != 403
+
+
+def test_tasks_page_conditional_get(client, monkeypatch):
+    import db
+
+    assert _signup(client).status_code in (302, 303)
+    calls = []
+    real = db.tasks_page_sections
+    monkeypatch.setattr(db, "tasks_page_sections", lambda uid, *a: calls.append(uid) or real(uid, *a))
+
+    r = client.get("/tasks")
+    assert r.status_code == 200
+    etag = r.headers["etag"]
+    assert etag.startswith('W/"')
+    assert r.headers["cache-control"] == "private, no-cache"
+    assert calls
+
+    calls.clear()
+    r = client.get("/tasks", headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.content == b""
+    assert calls == []
+
+    # Другой query — другая страница.
+    assert client.get("/tasks?x=1").headers["etag"] != etag
+
+    # Любое изменение данных пользователя меняет ETag.
+    u = db.find_user_by_email("user@example.com")
+    db.add_task(int(u["id"]), "Новая задача")
+    r = client.get("/tasks", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert "Новая задача" in r.text
+    assert r.headers["etag"] != etag
+
+
+def test_env_float_tolerates_garbage(monkeypatch, capsys):
+    import web.app as web_app
+
+    monkeypatch.setenv("WEB_ETAG_TTL_SEC", "10s")
+    assert web_app._env_float("WEB_ETAG_TTL_SEC", 10.0) == 10.0
+    assert "WEB_ETAG_TTL_SEC" in capsys.readouterr().err
+    monkeypatch.setenv("WEB_ETAG_TTL_SEC", "0")
+    assert web_app._env_float("WEB_ETAG_TTL_SEC", 10.0) == 0.0
+
+
+def test_flash_page_is_not_cached(client):
+    assert _signup(client).status_code in (302, 303)
+    etag = client.get("/tasks").headers["etag"]
+    r = client.post(
+        "/tasks/add",
+        data={"text": "Флеш"},
+        headers={"referer": "http://testserver/tasks"},
+        follow_redirects=False,
+    )
+    assert r.status_code in (302, 303)
+    r = client.get("/tasks", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert "etag" not in r.headers
+
+
+def _json_post(client, url, data):
+    return client.post(url, data=data, headers={"Accept": "application/json"})
+
+
+def test_task_action_returns_row_fragment(client):
+    import db
+
+    assert _signup(client).status_code in (302, 303)
+    uid = int(db.find_user_by_email("user@example.com")["id"])
+    task = db.add_task(uid, "Позвонить маме")
+
+    r = _json_post(client, "/tasks/set_color", {"task_id": task["id"], "next": "/tasks", "color": "red"})
+    data = r.json()
+    assert data["ok"] is True
+    assert data["section"] == "nodate"
+    assert f'data-task-id="{task["id"]}"' in data["row_html"]
+    assert "color-red" in data["row_html"]
+    assert "Позвонить маме" in data["row_html"]
+
+    # Перенос на завтра: на /today строка исчезает, на /tasks — уходит в раздел даты.
+    r = _json_post(client, "/tasks/reschedule_id", {"task_id": task["id"], "next": "/today", "preset": "tomorrow"})
+    assert r.json()["removed"] is True
+    r = _json_post(client, "/tasks/reschedule_id", {"task_id": task["id"], "next": "/tasks", "preset": "tomorrow"})
+    assert r.json()["section"] == f"date:{db.user_local_date_offset(uid, 1)}"
+
+    # Страницы без частичного обновления получают только ok/message.
+    r = _json_post(client, "/tasks/set_color", {"task_id": task["id"], "next": "/routines", "color": ""})
+    assert "row_html" not in r.json() and "removed" not in r.json()
+
+    r = _json_post(client, "/tasks/delete_id", {"task_id": task["id"], "next": "/tasks"})
+    assert r.json() == {"ok": True, "message": r.json()["message"], "removed": True}
+
+
+def test_tasks_row_fragment_keeps_display_number(client):
+    import db
+
+    assert _signup(client).status_code in (302, 303)
+    uid = int(db.find_user_by_email("user@example.com")["id"])
+    db.add_task(uid, "Без даты")
+    dated = db.add_task(uid, "С датой", due_date=db.user_local_date_offset(uid, 1))
+
+    # Нумерация как у «выполни N»: задачи без даты — первыми.
+    r = _json_post(client, "/tasks/set_color", {"task_id": dated["id"], "next": "/tasks", "color": "red"})
+    html = r.json()["row_html"]
+    assert 'data-task-num="2"' in html
+    assert "выполни 2" in html
+
+
+def test_complete_json_lists_completed_ids(client):
+    import db
+
+    assert _signup(client).status_code in (302, 303)
+    uid = int(db.find_user_by_email("user@example.com")["id"])
+    a = db.add_task(uid, "Первая")
+    r = client.post(
+        "/tasks/complete?next=/today",
+        data={"task_id": [str(a["id"]), "999999"]},
+        headers={"Accept": "application/json"},
+    )
+    data = r.json()
+    assert data["ok"] is True
+    assert data["completed_ids"] == [a["id"]]
+
+
+def test_tasks_page_windowed_sections(client, monkeypatch):
+    import json
+    import re
+
+    import db
+    import web.app as web_app
+    from bot_v2 import _active_tasks_display_order
+
+    monkeypatch.setattr(web_app, "_TASKS_SECTION_ROWS", 2)
+    monkeypatch.setattr(web_app, "_TASKS_EAGER_SECTIONS", 1)
+    assert _signup(client).status_code in (302, 303)
+    uid = int(db.find_user_by_email("user@example.com")["id"])
+    for i in range(5):
+        db.add_task(uid, f"Срочная {i}", due_date="2030-01-01", due_time=f"1{i}:00")
+    for i in range(3):
+        db.add_task(uid, f"Когда-нибудь {i}")
+
+    html = client.get("/tasks").text
+    assert html.count('class="task-line ') == 2
+    assert 'data-load-more="date:2030-01-01"' in html
+    assert 'data-load-more="nodate"' in html and "Показать задачи (3)" in html
+
+    # Догружаем раздел даты до конца; номера совпадают с нумерацией бота.
+    numbers = {t["id"]: i for i, t in enumerate(_active_tasks_display_order(uid), start=1)}
+    m = html.split('data-load-more="date:2030-01-01" data-cursor="', 1)[1]
+    cursor = m.split('"', 1)[0].replace("&#34;", '"').replace("&quot;", '"')
+    seen = []
+    while True:
+        data = client.get("/tasks/section", params={"key": "date:2030-01-01", "cursor": cursor}).json()
+        page = re.findall(r'<li [^>]*data-task-id="(\d+)"[^>]*data-task-num="(\d+)"', data["html"])
+        assert page and all(numbers[int(tid)] == int(num) for tid, num in page)
+        seen += [int(tid) for tid, _num in page]
+        if not data["has_more"]:
+            break
+        cursor = data["cursor"]
+        json.loads(cursor)
+    assert [numbers[t] for t in seen] == sorted(numbers[t] for t in seen)
+    assert len(seen) == 3
+
+    assert client.get("/tasks/section", params={"key": "nodate", "cursor": "oops"}).status_code == 400
+
+
+def test_events_stream_pushes_changes(client, monkeypatch):
+    import threading
+
+    import db
+    import web.app as web_app
+
+    assert _signup(client).status_code in (302, 303)
+    uid = int(db.find_user_by_email("user@example.com")["id"])
+    monkeypatch.setattr(web_app, "_EVENTS_MAX_SEC", 1.0)
+
+    timer = threading.Timer(0.3, db.add_task, args=(uid, "Из телеграма"))
+    timer.start()
+    r = client.get("/events")
+    timer.join()
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/event-stream")
+    hello, changed = r.text.split("\n\n")[:2]
+    assert "event: hello" in hello
+    assert "event: changed" in changed
+    assert 'data: {"origin":null}' in changed
+    last_id = changed.split("\n")[0].removeprefix("id: ")
+
+    # Переподключение с устаревшим Last-Event-ID — сразу changed; с актуальным — hello.
+    r = client.get("/events", headers={"Last-Event-ID": "old.0"})
+    assert r.text.split("\n\n")[0].endswith('event: changed\ndata: {"origin":null}')
+    r = client.get("/events", headers={"Last-Event-ID": last_id})
+    assert "event: hello" in r.text.split("\n\n")[0]
+
+
+def test_events_stream_requires_login(client):
+    assert client.get("/events").status_code == 401
+
+
+def test_action_events_carry_tab_id(client, monkeypatch):
+    import events
+
+    assert _signup(client).status_code in (302, 303)
+    origins = []
+    real = events.publish
+    monkeypatch.setattr(events, "publish", lambda uid: origins.append(events._origin.get()) or real(uid))
+    r = client.post(
+        "/tasks/add",
+        data={"text": "Из вкладки"},
+        headers={"referer": "http://testserver/tasks", "X-Tab-Id": "tab42"},
+        follow_redirects=False,
+    )
+    assert r.status_code in (302, 303)
+    assert origins and set(origins) == {"tab42"}
+
+
+def test_telegram_webhook_checks_secret(client, monkeypatch):
+    import asyncio
+    from types import SimpleNamespace
+
+    from web import telegram_webhook
+
+    payload = {"update_id": 7, "message": {"message_id": 1, "date": 0, "chat": {"id": 5, "type": "private"}, "text": "Купить хлеб"}}
+    assert client.post("/telegram/webhook", json=payload).status_code == 404
+
+    fake = SimpleNamespace(update_queue=asyncio.Queue(), bot=None)
+    monkeypatch.setattr(telegram_webhook, "_application", fake)
+    monkeypatch.setattr(telegram_webhook, "_secret", "s3cret")
+    r = client.post("/telegram/webhook", json=payload, headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+    assert r.status_code == 403
+    assert fake.update_queue.empty()
+
+    r = client.post("/telegram/webhook", json=payload, headers={"X-Telegram-Bot-Api-Secret-Token": "s3cret"})
+    assert r.status_code == 200
+    update = fake.update_queue.get_nowait()
+    assert update.update_id == 7
+    assert update.message.text == "Купить хлеб"
+
+
+def test_telegram_webhook_settings(monkeypatch):
+    from web import telegram_webhook
+
+    monkeypatch.setenv("TELEGRAM_BOT_TOKEN", "123:abc")
+    monkeypatch.setenv("TELEGRAM_WEBHOOK_URL", "https://example.org/")
+    monkeypatch.setenv("TELEGRAM_WEBHOOK_SECRET", "bad secret")
+    assert telegram_webhook.webhook_settings() is None
+    monkeypatch.setenv("TELEGRAM_WEBHOOK_SECRET", "good_secret-1")
+    assert telegram_webhook.webhook_settings() == ("https://example.org/telegram/webhook", "good_secret-1")
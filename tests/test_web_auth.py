@@ -35,7 +35,7 @@ def client(monkeypatch, tmp_path):
     monkeypatch.setenv("GROQ_API_KEY", "")
     monkeypatch.setenv("DEEPSEEK_API_KEY", "")
 
-    for mod in ("db", "web", "web.app", "web.auth"):
+    for mod in ("db", "db_async", "bot_v2", "task_commands", "categories", "web", "web.app", "web.auth"):
         sys.modules.pop(mod, None)
 
     from web.app import app
@@ -136,3 +136,50 @@ def test_logout_clears_session(client):
     r = client.get("/today", follow_redirects=False)
     assert r.status_code in (302, 303)
     assert r.headers["location"].startswith("/login")
+
+
+def test_password_hashing_runs_in_bounded_pool(client):
+    import threading
+
+    import web.auth as web_auth
+
+    seen: list[str] = []
+    real = web_auth.hash_password
+
+    def _spy(plain):
+        seen.append(threading.current_thread().name)
+        return real(plain)
+
+    web_auth.hash_password = _spy
+    try:
+        r = client.post(
+            "/signup",
+            data={
+                "email": "erin@example.com",
+                "password": "very-secret-1",
+                "password2": "very-secret-1",
+                "name": "",
+            },
+            follow_redirects=False,
+        )
+    finally:
+        web_auth.hash_password = real
+    assert r.status_code in (302, 303)
+    assert seen and seen[0].startswith("argon2")
+    stats = web_auth.hash_pool_stats()
+    assert stats["inflight"] == 0 and stats["completed"] >= 1
+
+
+def test_login_rejected_when_hash_pool_saturated(client, monkeypatch):
+    import web.auth as web_auth
+
+    monkeypatch.setitem(
+        web_auth._hash_metrics, "inflight", web_auth.AUTH_HASH_WORKERS + web_auth.AUTH_HASH_QUEUE_MAX
+    )
+    r = client.post(
+        "/login",
+        data={"email": "frank@example.com", "password": "very-secret-1"},
+        follow_redirects=False,
+    )
+    assert r.status_code == 429
+    assert web_auth.hash_pool_stats()["rejected"] >= 1
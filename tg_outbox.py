@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Очередь исходящих сообщений бота с учётом лимитов Telegram.
+
+Раньше каждый _reply сам повторял отправку с паузой 2**attempt и ничего не
+знал о флуд-лимитах: рассылка или дайджест на сотни чатов упёрлись бы в 429
+(Too Many Requests), и часть сообщений потерялась бы. Здесь все отправки идут
+через одну очередь:
+
+- token bucket на чат (BOT_SEND_CHAT_PER_SEC, всплеск BOT_SEND_CHAT_BURST;
+  для групп — BOT_SEND_GROUP_PER_MIN) и общий на бота (BOT_SEND_GLOBAL_PER_SEC);
+- 429 с retry_after — чат ставится на паузу на указанное время, сообщение
+  отправляется повторно (остальные чаты продолжают получать сообщения);
+- TimedOut/NetworkError — повтор с паузой 2**attempt, как было в _reply;
+- ошибка разметки Markdown — повтор простым текстом;
+- несколько сообщений, ожидающих отправки в один чат, склеиваются в одно
+  (до 4096 символов) — меньше запросов и меньше шансов на 429.
+
+Сообщения одного чата уходят в порядке вызова send(). send() ждёт доставки и
+возвращает True/False, исключений не бросает.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import timedelta
+
+from telegram.constants import MessageLimit, ParseMode
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError, TimedOut
+
+logger = logging.getLogger(__name__)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, "") or default)
+    except ValueError:
+        return default
+
+
+# Telegram: не больше ~30 сообщений в секунду на бота, ~1 в секунду в чат
+# (кратковременно больше), 20 в минуту в группу.
+BOT_SEND_GLOBAL_PER_SEC = max(0.1, _env_float("BOT_SEND_GLOBAL_PER_SEC", 25.0))
+BOT_SEND_CHAT_PER_SEC = max(0.01, _env_float("BOT_SEND_CHAT_PER_SEC", 1.0))
+BOT_SEND_CHAT_BURST = max(1.0, _env_float("BOT_SEND_CHAT_BURST", 3.0))
+BOT_SEND_GROUP_PER_MIN = max(1.0, _env_float("BOT_SEND_GROUP_PER_MIN", 20.0))
+
+MAX_TEXT_LEN = MessageLimit.MAX_TEXT_LENGTH
+_COALESCE_SEP = "\n\n"
+# Сколько раз подряд выполнять просьбу Telegram подождать (429), прежде чем сдаться.
+_MAX_RETRY_AFTER = 5
+# Больше стольких бакетов чатов — выбрасываем простаивающие (полные).
+_MAX_IDLE_BUCKETS = 10000
+
+
+class TokenBucket:
+    """
+    Ведро токенов с резервированием: reserve() сразу списывает токен (баланс
+    может уйти в минус) и возвращает, сколько секунд подождать. Так очередь
+    ожидающих получает слоты строго по порядку, без замков.
+    """
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = now
+
+    def _refill(self, now: float) -> None:
+        if now > self.stamp:
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+
+    def reserve(self, now: float) -> float:
+        self._refill(now)
+        self.tokens -= 1.0
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Pending:
+    __slots__ = ("bot", "text", "parse_mode", "reply_markup", "future")
+
+    def __init__(self, bot, text, parse_mode, reply_markup, future):
+        self.bot = bot
+        self.text = text
+        self.parse_mode = parse_mode
+        self.reply_markup = reply_markup
+        self.future = future
+
+
+def _seconds(value) -> float:
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class Outbox:
+    """Очередь отправки; clock/sleep подменяются в тестах."""
+
+    def __init__(
+        self,
+        global_per_sec: float = BOT_SEND_GLOBAL_PER_SEC,
+        chat_per_sec: float = BOT_SEND_CHAT_PER_SEC,
+        chat_burst: float = BOT_SEND_CHAT_BURST,
+        group_per_min: float = BOT_SEND_GROUP_PER_MIN,
+        max_retries: int = 3,
+        clock=time.monotonic,
+        sleep=asyncio.sleep,
+    ):
+        self._clock = clock
+        self._sleep = sleep
+        self._chat_rate = chat_per_sec
+        self._chat_burst = chat_burst
+        self._group_rate = group_per_min / 60.0
+        self._max_retries = max_retries
+        self._global = TokenBucket(global_per_sec, max(1.0, global_per_sec), clock())
+        self._buckets: dict[int, TokenBucket] = {}
+        self._queues: dict[int, deque[_Pending]] = {}
+        self._paused_until: dict[int, float] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._metrics = {
+            "sent": 0,
+            "coalesced": 0,
+            "failed": 0,
+            "retry_after": 0,
+            "retry_after_sec": 0.0,
+            "retries": 0,
+            "plain_fallback": 0,
+        }
+
+    # ── Публичное API ────────────────────────────────────────────────────
+
+    async def send(
+        self,
+        bot,
+        chat_id: int,
+        text: str,
+        parse_mode: str | None = ParseMode.MARKDOWN,
+        reply_markup=None,
+    ) -> bool:
+        """Ставит сообщение в очередь чата и ждёт отправки. True — доставлено."""
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+            task = asyncio.create_task(self._drain(chat_id, queue))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        queue.append(_Pending(bot, text, parse_mode, reply_markup, future))
+        return await asyncio.shield(future)
+
+    def stats(self) -> dict:
+        out = dict(self._metrics)
+        out["retry_after_sec"] = round(out["retry_after_sec"], 1)
+        out["queued"] = sum(len(q) for q in self._queues.values())
+        out["chats_queued"] = len(self._queues)
+        now = self._clock()
+        out["chats_paused"] = sum(1 for t in self._paused_until.values() if t > now)
+        return out
+
+    # ── Очередь чата ─────────────────────────────────────────────────────
+
+    async def _drain(self, chat_id: int, queue: deque[_Pending]) -> None:
+        try:
+            while queue:
+                await self._wait_turn(chat_id)
+                # Пока ждали слот, в очередь могли прийти ещё ответы — уйдут одним сообщением.
+                batch = self._take_batch(queue)
+                first = batch[0]
+                text = _COALESCE_SEP.join(p.text for p in batch)
+                ok = await self._deliver(first.bot, chat_id, text, first.parse_mode, first.reply_markup)
+                if len(batch) > 1:
+                    self._metrics["coalesced"] += len(batch) - 1
+                for p in batch:
+                    if not p.future.done():
+                        p.future.set_result(ok)
+        finally:
+            if self._queues.get(chat_id) is queue:
+                del self._queues[chat_id]
+            # Задачу отменили (остановка бота) — ожидающим отвечаем «не доставлено».
+            while queue:
+                p = queue.popleft()
+                if not p.future.done():
+                    p.future.set_result(False)
+
+    @staticmethod
+    def _take_batch(queue: deque[_Pending]) -> list[_Pending]:
+        first = queue.popleft()
+        batch = [first]
+        if first.reply_markup is not None:
+            return batch
+        size = len(first.text)
+        while queue:
+            nxt = queue[0]
+            if (
+                nxt.bot is not first.bot
+                or nxt.parse_mode != first.parse_mode
+                or nxt.reply_markup is not None
+                or size + len(_COALESCE_SEP) + len(nxt.text) > MAX_TEXT_LEN
+            ):
+                break
+            size += len(_COALESCE_SEP) + len(nxt.text)
+            batch.append(queue.popleft())
+        return batch
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= _MAX_IDLE_BUCKETS:
+                self._prune_buckets(now)
+            if chat_id < 0:
+                bucket = TokenBucket(self._group_rate, 1.0, now)
+            else:
+                bucket = TokenBucket(self._chat_rate, self._chat_burst, now)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _prune_buckets(self, now: float) -> None:
+        for cid in [c for c, b in self._buckets.items() if c not in self._queues and b.is_full(now)]:
+            del self._buckets[cid]
+        for cid in [c for c, t in self._paused_until.items() if t <= now]:
+            del self._paused_until[cid]
+
+    async def _wait_turn(self, chat_id: int) -> None:
+        now = self._clock()
+        wait = max(
+            self._paused_until.get(chat_id, 0.0) - now,
+            self._chat_bucket(chat_id, now).reserve(now),
+        )
+        if wait > 0:
+            await self._sleep(wait)
+        wait = self._global.reserve(self._clock())
+        if wait > 0:
+            await self._sleep(wait)
+
+    async def _deliver(self, bot, chat_id: int, text: str, parse_mode, reply_markup) -> bool:
+        attempt = 0
+        flood_waits = 0
+        while True:
+            try:
+                await bot.send_message(
+                    chat_id=chat_id, text=text, parse_mode=parse_mode, reply_markup=reply_markup
+                )
+                self._metrics["sent"] += 1
+                return True
+            except RetryAfter as e:
+                delay = _seconds(e.retry_after)
+                flood_waits += 1
+                self._metrics["retry_after"] += 1
+                self._metrics["retry_after_sec"] += delay
+                self._paused_until[chat_id] = self._clock() + delay
+                if flood_waits > _MAX_RETRY_AFTER:
+                    logger.warning("outbox: chat=%s 429 подряд %s раз, сообщение не отправлено", chat_id, flood_waits)
+                    break
+                logger.warning("outbox: 429 chat=%s, пауза %.1fс", chat_id, delay)
+                await self._sleep(delay)
+            except BadRequest as e:
+                if parse_mode is None:
+                    logger.warning("outbox: ошибка отправки chat=%s: %s", chat_id, e)
+                    break
+                # Чаще всего — непарная * или _ в тексте задачи: отправляем как есть.
+                self._metrics["plain_fallback"] += 1
+                parse_mode = None
+            except (TimedOut, NetworkError) as e:
+                if attempt >= self._max_retries:
+                    logger.warning("outbox: не удалось отправить после %s попыток: %s", attempt + 1, e)
+                    break
+                wait = 2 ** attempt
+                attempt += 1
+                self._metrics["retries"] += 1
+                logger.info("outbox: retry %s/%s через %sс (%s)", attempt, self._max_retries, wait, type(e).__name__)
+                await self._sleep(wait)
+            except TelegramError as e:
+                # Forbidden (бот заблокирован) и т.п. — повторять бессмысленно.
+                logger.warning("outbox: ошибка отправки chat=%s: %s", chat_id, e)
+                break
+            except Exception:
+                logger.exception("outbox: ошибка отправки chat=%s", chat_id)
+                break
+        self._metrics["failed"] += 1
+        return False
+
+
+_outbox: Outbox | None = None
+
+
+def get_outbox() -> Outbox:
+    global _outbox
+    if _outbox is None:
+        _outbox = Outbox()
+    return _outbox
+
+
+async def send(bot, chat_id: int, text: str, parse_mode: str | None = ParseMode.MARKDOWN, reply_markup=None) -> bool:
+    """Отправка через общую очередь процесса (см. Outbox.send)."""
+    return await get_outbox().send(bot, chat_id, text, parse_mode=parse_mode, reply_markup=reply_markup)
+
+
+def stats() -> dict:
+    return get_outbox().stats()
@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+"""
+JSON API веба, версия 1: /api/v1/… — для лёгких клиентов и интеграций без
+разбора HTML и без затрат на рендер шаблонов.
+
+Авторизация — та же cookie-сессия, что у сайта (POST /login); без неё 401.
+Изменяющие запросы проходят ту же проверку Origin, что и формы.
+
+Формат ответов как у остального веба: {"ok": true, ...} или
+{"ok": false, "message": "..."} с кодом 4xx. Неверное тело запроса — 422
+в стандартном формате FastAPI ({"detail": [...]}).
+
+Списки постраничные (keyset): в ответе items и next_cursor; следующую страницу
+запрашивают с ?cursor=<next_cursor>, пока next_cursor не станет null. Курсор
+непрозрачный. Задачи идут в порядке (due_date, due_time, id), журнал
+выполнений — от новых к старым. ?limit=1..200 (по умолчанию 50).
+?fields=id,text,due_date — только нужные поля задачи (id приходит всегда).
+
+  GET    /api/v1/tasks            ?status=active|done&cursor&limit&fields
+  GET    /api/v1/tasks/{id}       ?fields
+  POST   /api/v1/tasks            {"text", "due_date"?, "due_time"?, ...}
+  PATCH  /api/v1/tasks/{id}       любые поля из TaskPatch
+  DELETE /api/v1/tasks/{id}
+  POST   /api/v1/tasks/bulk       {"tasks": [...]} — до 100 задач одной транзакцией
+  POST   /api/v1/tasks/complete   {"ids": [...]} → completed, not_found
+  POST   /api/v1/tasks/delete     {"ids": [...]} → deleted, not_found
+  GET    /api/v1/routines         ?cursor&limit&fields
+  GET    /api/v1/projects         ?archived=1 — вместе с архивными
+  GET    /api/v1/plan             ?date=ГГГГ-ММ-ДД (по умолчанию сегодня)
+  GET    /api/v1/completions      ?since&until&cursor&limit (ISO 8601; без пояса — UTC)
+"""
+from __future__ import annotations
+
+import base64
+import json
+
+from fastapi import APIRouter, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field, field_validator
+
+import db
+import db_async
+from task_commands import _normalize_web_repeat_day
+from web import auth as web_auth
+
+router = APIRouter(prefix="/api/v1")
+
+API_MAX_LIMIT = 200
+API_DEFAULT_LIMIT = 50
+API_MAX_BULK = 100
+
+_DATE_RE = r"^\d{4}-\d{2}-\d{2}$"
+_TIME_RE = r"^\d{2}:\d{2}$"
+
+
+class _TaskValidators(BaseModel):
+    """Проверки полей задачи: настоящая дата и время, расписание — как в формах сайта."""
+
+    @field_validator("due_date", check_fields=False)
+    @classmethod
+    def _check_due_date(cls, value: str | None) -> str | None:
+        if value is not None and not _valid_date(value):
+            raise ValueError("due_date: несуществующая дата")
+        return value
+
+    @field_validator("due_time", check_fields=False)
+    @classmethod
+    def _check_due_time(cls, value: str | None) -> str | None:
+        if value is not None and not _valid_time(value):
+            raise ValueError("due_time: ЧЧ:ММ от 00:00 до 23:59")
+        return value
+
+    @field_validator("repeat_day", check_fields=False)
+    @classmethod
+    def _check_repeat_day(cls, value: str | None) -> str | None:
+        if value is None:
+            return None
+        normalized = _normalize_web_repeat_day(value)
+        if not normalized:
+            raise ValueError("repeat_day: ежедневно, пн…вс через запятую, N_DAYS:n или BIWEEK:день")
+        return normalized
+
+
+class TaskIn(_TaskValidators):
+    text: str = Field(min_length=1, max_length=1000)
+    due_date: str | None = Field(default=None, pattern=_DATE_RE)
+    due_time: str | None = Field(default=None, pattern=_TIME_RE)
+    time_of_day: str | None = None
+    is_routine: bool = False
+    repeat_day: str | None = None
+    project_id: int | None = None
+    category_name: str = ""
+    category_emoji: str = ""
+
+
+class TaskPatch(_TaskValidators):
+    text: str | None = Field(default=None, min_length=1, max_length=1000)
+    due_date: str | None = Field(default=None, pattern=_DATE_RE)
+    due_time: str | None = Field(default=None, pattern=_TIME_RE)
+    time_of_day: str | None = None
+    is_routine: bool | None = None
+    repeat_day: str | None = None
+    project_id: int | None = None
+    category_name: str | None = None
+    category_emoji: str | None = None
+    color: str | None = None
+    estimate_min: int | None = Field(default=None, ge=0, le=24 * 60)
+
+
+class TasksBulkIn(BaseModel):
+    tasks: list[TaskIn] = Field(min_length=1, max_length=API_MAX_BULK)
+
+
+class IdsIn(BaseModel):
+    ids: list[int] = Field(min_length=1, max_length=API_MAX_BULK)
+
+
+class _BadRequest(ValueError):
+    pass
+
+
+def _error(message: str, status_code: int) -> JSONResponse:
+    return JSONResponse({"ok": False, "message": message}, status_code=status_code)
+
+
+def _ok(**payload) -> JSONResponse:
+    return JSONResponse(jsonable_encoder({"ok": True, **payload}))
+
+
+def _encode_cursor(key: tuple | None) -> str | None:
+    if key is None:
+        return None
+    raw = json.dumps(list(key), ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str | None) -> tuple | None:
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key = json.loads(raw.decode("utf-8"))
+        if not isinstance(key, list) or len(key) != 3:
+            raise ValueError
+        return str(key[0]), str(key[1]), int(key[2])
+    except (ValueError, TypeError):
+        raise _BadRequest("Неверный cursor.") from None
+
+
+def _parse_limit(raw: str | None) -> int:
+    if not raw:
+        return API_DEFAULT_LIMIT
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise _BadRequest("limit должен быть числом.") from None
+    if not 1 <= limit <= API_MAX_LIMIT:
+        raise _BadRequest(f"limit: от 1 до {API_MAX_LIMIT}.")
+    return limit
+
+
+def _parse_fields(raw: str | None) -> frozenset[str] | None:
+    if not raw:
+        return None
+    fields = frozenset(f.strip() for f in raw.split(",") if f.strip())
+    unknown = fields - set(db.API_TASK_FIELDS)
+    if unknown:
+        raise _BadRequest(
+            f"Неизвестные поля: {', '.join(sorted(unknown))}. "
+            f"Доступны: {', '.join(db.API_TASK_FIELDS)}."
+        )
+    return fields
+
+
+def _valid_date(value: str) -> bool:
+    from datetime import date
+
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        return False
+    return len(value) == 10
+
+
+def _parse_utc(raw: str | None, name: str) -> str | None:
+    """ISO 8601 → строка UTC в формате completed_at (datetime.isoformat); без пояса — UTC."""
+    from datetime import datetime, timezone
+
+    if not raw:
+        return None
+    try:
+        value = datetime.fromisoformat(raw.strip())
+    except ValueError:
+        raise _BadRequest(f"{name}: дата и время в ISO 8601.") from None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat()
+
+
+def _valid_time(value: str) -> bool:
+    from datetime import time
+
+    try:
+        time.fromisoformat(value)
+    except ValueError:
+        return False
+    return len(value) == 5
+
+
+def _api_user_id(request: Request) -> int | None:
+    return web_auth.current_user_id(request)
+
+
+def _unauthorized() -> JSONResponse:
+    return _error("Требуется вход.", 401)
+
+
+async def _tasks_page(request: Request, *, status: str, is_routine: bool | None) -> JSONResponse:
+    uid = _api_user_id(request)
+    if uid is None:
+        return _unauthorized()
+    q = request.query_params
+    try:
+        after = _decode_cursor(q.get("cursor"))
+        limit = _parse_limit(q.get("limit"))
+        fields = _parse_fields(q.get("fields"))
+    except _BadRequest as exc:
+        return _error(str(exc), 400)
+    rows, next_after = await db_async.run(
+        db.list_tasks_page,
+        uid,
+        status=status,
+        is_routine=is_routine,
+        after=after,
+        limit=limit,
+        fields=fields,
+    )
+    return _ok(items=rows, next_cursor=_encode_cursor(next_after))
+
+
+def _check_project(uid: int, project_id: int | None) -> None:
+    if project_id is not None and not db.get_project(uid, project_id):
+        raise _BadRequest(f"Проект {project_id} не найден.")
+
+
+def _create_tasks(uid: int, items: list[TaskIn]) -> list[dict]:
+    with db.transaction():
+        for item in items:
+            _check_project(uid, item.project_id)
+        rows = [db.add_task(uid, **item.model_dump()) for item in items]
+    return [{k: row.get(k) for k in db.API_TASK_FIELDS} for row in rows]
+
+
+def _patch_task(uid: int, task_id: int, patch: TaskPatch) -> dict | None:
+    changes = patch.model_dump(exclude_unset=True)
+    for key in ("text", "is_routine"):
+        if changes.get(key, "") is None:
+            del changes[key]
+    color = changes.pop("color", None)
+    estimate = changes.pop("estimate_min", None)
+    if color is not None and color.strip().lower() not in db.VALID_TASK_COLORS:
+        raise _BadRequest(f"color: одно из {', '.join(c for c in db.VALID_TASK_COLORS if c)} или пусто.")
+    with db.transaction():
+        if not db.get_task_fields(uid, task_id, ("id",)):
+            return None
+        _check_project(uid, changes.get("project_id"))
+        if changes:
+            db.update_task(task_id, uid, **changes)
+        if color is not None:
+            db.set_task_color(uid, task_id, color)
+        if estimate is not None:
+            db.set_task_estimate(uid, task_id, estimate)
+    return db.get_task_fields(uid, task_id)
+
+
+def _delete_tasks(uid: int, ids: list[int]) -> tuple[list[int], list[int]]:
+    deleted: list[int] = []
+    missing: list[int] = []
+    with db.transaction():
+        for task_id in dict.fromkeys(ids):
+            (deleted if db.delete_task(task_id, uid) else missing).append(task_id)
+    return deleted, missing
+
+
+# ── Задачи ───────────────────────────────────────────────────────────────
+
+@router.get("/tasks")
+async def api_tasks(request: Request):
+    status = request.query_params.get("status") or "active"
+    if status not in ("active", "done"):
+        return _error("status: active или done.", 400)
+    return await _tasks_page(request, status=status, is_routine=None)
+
+
+@router.get("/tasks/{task_id}")
+async def api_task(request: Request, task_id: int):
+    uid = _api_user_id(request)
+    if uid is None:
+        return _unauthorized()
+    try:
+        fields = _parse_fields(request.query_params.get("fields"))
+    except _BadRequest as exc:
+        return _error(str(exc), 400)
+    row = await db_async.run(db.get_task_fields, uid, task_id, fields)
+    if row is None:
+        return _error("Задача не найдена.", 404)
+    return _ok(task=row)
+
+
+@router.post("/tasks")
+async def api_task_create(request: Request, body: TaskIn):
+    uid = _api_user_id(request)
+    if uid is None:
+        return _unauthorized()
+    try:
+        (row,) = await db_async.run(_create_tasks, uid, [body])
+    except _BadRequest as exc:
+        return _error(str(exc), 400)
+    return JSONResponse(jsonable_encoder({"ok": True, "task": row}), status_code=201)
+
+
+@router.patch("/tasks/{task_id}")
+async def api_task_update(request: Request, task_id: int, body: TaskPatch):
+    uid = _api_user_id(request)
+    if uid is None:
+        return _unauthorized()
+    try:
+        row = await db_async.run(_patch_task, uid, task_id, body)
+    except _BadRequest as exc:
+        return _error(str(exc), 400)
+    if row is None:
+        return _error("Задача не найдена.", 404)
+    return _ok(task=row)
+
+
+@router.delete("/tasks/{task_id}")
+async def api_task_delete(request: Request, task_id: int):
+    uid = _api_user_id(request)
+    if uid is None:
+        return _unauthorized()
+    if not await db_async.run(db.delete_task, task_id, uid):
+        return _error("Задача не найдена.", 404)
+    return _ok()
+
+
+@router.post("/tasks/bulk")
+async def api_tasks_bulk_create(request: Request, body: TasksBulkIn):
+    uid = _api_user_id(request)
+    if uid is None:
+        return _unauthorized()
+    try:
+        rows = await db_async.run(_create_tasks, uid, body.tasks)
+    except _BadRequest as exc:
+        return _error(str(exc), 400)
+    return JSONResponse(jsonable_encoder({"ok": True, "items": rows}), status_code=201)
+
+
+@router.post("/tasks/complete")
+async def api_tasks_complete(request: Request, body: IdsIn):
+    uid = _api_user_id(request)
+    if uid is None:
+        return _unauthorized()
+    completed, missing = await db_async.run(db.complete_tasks_bulk, uid, body.ids)
+    return _ok(completed=[int(r["id"]) for r in completed], not_found=missing)
+
+
+@router.post("/tasks/delete")
+async def api_tasks_delete(request: Request, body: IdsIn):
+    uid = _api_user_id(request)
+    if uid is None:
+        return _unauthorized()
+    deleted, missing = await db_async.run(_delete_tasks, uid, body.ids)
+    return _ok(deleted=deleted, not_found=missing)
+
+
+# ── Рутины, проекты, план, выполнения ────────────────────────────────────
+
+@router.get("/routines")
+async def api_routines(request: Request):
+    return await _tasks_page(request, status="active", is_routine=True)
+
+
+@router.get("/projects")
+async def api_projects(request: Request):
+    uid = _api_user_id(request)
+    if uid is None:
+        return _unauthorized()
+    archived = request.query_params.get("archived") in ("1", "true")
+    rows = await db_async.run(db.list_projects, uid, archived)
+    counts = await db_async.count_active_tasks_by_project(uid)
+    items = [
+        {
+            "id": int(p["id"]),
+            "title": p.get("title") or "",
+            "emoji": p.get("emoji") or "",
+            "archived_at": p.get("archived_at"),
+            "active_tasks": counts.get(int(p["id"]), 0),
+        }
+        for p in rows
+    ]
+    return _ok(items=items)
+
+
+@router.get("/plan")
+async def api_plan(request: Request):
+    uid = _api_user_id(request)
+    if uid is None:
+        return _unauthorized()
+    date_str = request.query_params.get("date") or ""
+    if not date_str:
+        date_str = await db_async.run(db.user_local_date_offset, uid, 0)
+    elif not _valid_date(date_str):
+        return _error("date: ГГГГ-ММ-ДД.", 400)
+    slots = await db_async.get_plan_slots(uid, date_str)
+    return _ok(date=date_str, items=slots)
+
+
+@router.get("/completions")
+async def api_completions(request: Request):
+    uid = _api_user_id(request)
+    if uid is None:
+        return _unauthorized()
+    q = request.query_params
+    try:
+        before = _decode_cursor(q.get("cursor"))
+        if before is not None:
+            stamp = _parse_utc(before[0], "cursor")
+            if stamp is None:
+                raise _BadRequest("Неверный cursor.")
+            before = (stamp, before[1], before[2])
+        limit = _parse_limit(q.get("limit"))
+        since = _parse_utc(q.get("since"), "since")
+        until = _parse_utc(q.get("until"), "until")
+    except _BadRequest as exc:
+        return _error(str(exc), 400)
+    rows, next_before = await db_async.run(
+        db.list_completions_page,
+        uid,
+        since=since,
+        until=until,
+        before=before,
+        limit=limit,
+    )
+    return _ok(items=rows, next_cursor=_encode_cursor(next_before))
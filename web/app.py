@@ -5,20 +5,26 @@
 from __future__ import annotations
 
 import asyncio
+import hashlib
+import json
 import os
+import secrets
 import sys
+import time
 from contextlib import asynccontextmanager
 from pathlib import Path
 
 from fastapi import Depends, FastAPI, File, Form, HTTPException, Request, UploadFile
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import Headers
 
 import ai_module
 import db
+import db_async
+import events
 from bot_v2 import HELP_TEXT
 from web.web_copy import (
     FUTURE_WEEK_VIEW,
@@ -35,7 +41,10 @@ from web.web_copy import (
 )
 from categories import builtin_keywords_for_name, keywords_text_to_json
 from web.report_html import report_text_to_html
+from web import api_v1
 from web import auth as web_auth
+from web import jobs as web_jobs
+from web import telegram_webhook
 from task_commands import (
     add_project_task_from_text,
     add_task_from_text,
@@ -60,6 +69,18 @@ from task_commands import (
 ROOT = Path(__file__).resolve().parent.parent
 templates = Jinja2Templates(directory=str(ROOT / "web" / "templates"))
 
+
+def _env_float(name: str, default: float) -> float:
+    """Число из окружения; пусто или мусор — default (с предупреждением), а не падение при импорте."""
+    raw = (os.environ.get(name, "") or "").strip()
+    if not raw:
+        return default
+    try:
+        return float(raw)
+    except ValueError:
+        print(f"[env] {name}={raw!r} — не число, используется {default:g}", file=sys.stderr)
+        return default
+
 # Не гонять transfer_overdue_tasks на каждый GET (дорого при PostgreSQL и большом списке задач).
 _transfer_overdue_last: dict[int, float] = {}
 _TRANSFER_OVERDUE_INTERVAL = float(os.environ.get("WEB_TRANSFER_OVERDUE_INTERVAL_SEC", "90"))
@@ -179,6 +200,7 @@ def _bootstrap_password_from_env() -> None:
             "WHERE id = %s",
             (email, pwd_hash, "argon2", user_id),
         )
+        db.invalidate_user_row_cache(user_id)
         print(
             f"[bootstrap] OK: user_id={user_id} email={email} пароль установлен. "
             "Удалите WEB_BOOTSTRAP_EMAIL/PASSWORD из переменных окружения.",
@@ -198,6 +220,16 @@ async def _app_lifespan(_app: FastAPI):
         _bootstrap_password_from_env()
     except Exception as exc:
         print(f"[bootstrap] неожиданная ошибка: {exc}", file=sys.stderr)
+    try:
+        db.fail_interrupted_jobs(web_jobs.job_timeout_sec())
+    except Exception as exc:
+        print(f"[jobs] fail_interrupted_jobs: {exc}", file=sys.stderr)
+    if db.USE_PG:
+        events.start_pg_bridge(db.DATABASE_URL, on_remote=db.note_external_change)
+    try:
+        await telegram_webhook.start()
+    except Exception as exc:
+        print(f"[telegram] webhook не запущен: {exc}", file=sys.stderr)
 
     base, interval = _self_ping_url_and_interval()
     task = None
@@ -218,6 +250,9 @@ async def _app_lifespan(_app: FastAPI):
 
         task = asyncio.create_task(_ping_loop())
     yield
+    await telegram_webhook.stop()
+    await web_jobs.shutdown()
+    events.stop_pg_bridge()
     if task:
         task.cancel()
         try:
@@ -256,59 +291,199 @@ _in_prod = os.environ.get("RENDER", "").lower() == "true" or os.environ.get(
 
 # Сначала добавляются middleware, которые должны выполняться ВНУТРИ session
 # (т.к. add_middleware идёт в обратном порядке).
-class _OriginCsrfMiddleware(BaseHTTPMiddleware):
+# Оба middleware — «чистые» ASGI: BaseHTTPMiddleware оборачивает каждый запрос
+# и ответ в лишние задачи и потоки, а здесь нужно лишь посмотреть заголовки.
+def _parse_allowed_hosts(raw: str) -> frozenset[str]:
+    return frozenset(h.strip().lower() for h in (raw or "").split(",") if h.strip())
+
+
+def _host_of(url: str) -> str:
+    from urllib.parse import urlparse
+
+    try:
+        return (urlparse(url).hostname or "").lower()
+    except Exception:
+        return ""
+
+
+class _OriginCsrfMiddleware:
     """
     Защита от CSRF: state-changing методы должны иметь Origin/Referer того же
     хоста, что и сам запрос. Браузеры всегда шлют Origin при кросс-сайтовых
     POST/PUT/DELETE, поэтому проверки достаточно для типичных сценариев.
+    WEB_ALLOWED_HOSTS читается один раз при сборке приложения.
     """
 
-    SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+    SAFE_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
 
-    async def dispatch(self, request: Request, call_next):
-        if request.method in self.SAFE_METHODS:
-            return await call_next(request)
-        host = request.headers.get("host", "").split(":")[0].lower()
-        origin = request.headers.get("origin", "")
-        referer = request.headers.get("referer", "")
+    def __init__(self, app, allowed_hosts: str | None = None):
+        self.app = app
+        if allowed_hosts is None:
+            allowed_hosts = os.environ.get("WEB_ALLOWED_HOSTS", "")
+        self.allowed_hosts = _parse_allowed_hosts(allowed_hosts)
+
+    def _allowed(self, scope) -> bool:
+        headers = Headers(scope=scope)
+        origin = headers.get("origin", "")
+        referer = headers.get("referer", "")
         if not origin and not referer:
             # Нет Origin/Referer — вероятно, тулинг (curl, тесты, healthcheck).
             # Браузеры всегда шлют Origin на cross-site POST, поэтому CSRF
             # из браузера всё равно будет пойман ниже.
-            return await call_next(request)
+            return True
+        check = _host_of(origin or referer)
+        host = headers.get("host", "").split(":")[0].lower()
+        return bool(check) and (check == host or check in self.allowed_hosts)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in self.SAFE_METHODS or self._allowed(scope):
+            await self.app(scope, receive, send)
+            return
+        response = JSONResponse({"ok": False, "message": "Forbidden (origin)"}, status_code=403)
+        await response(scope, receive, send)
 
-        allowed_hosts = {host} if host else set()
-        for h in os.environ.get("WEB_ALLOWED_HOSTS", "").split(","):
-            h = h.strip().lower()
-            if h:
-                allowed_hosts.add(h)
 
-        from urllib.parse import urlparse
+class _AdminFlagMiddleware:
+    def __init__(self, app):
+        self.app = app
 
-        def _host_of(url: str) -> str:
-            try:
-                return (urlparse(url).hostname or "").lower()
-            except Exception:
-                return ""
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not scope["path"].startswith("/static/"):
+            request = Request(scope)
+            request.state.is_admin = False
+            row = web_auth.get_current_user_row(request)
+            if row:
+                request.state.is_admin = db.is_admin_user(row)
+        await self.app(scope, receive, send)
 
-        check = origin or referer
-        if _host_of(check) in allowed_hosts:
-            return await call_next(request)
 
-        return JSONResponse(
-            {"ok": False, "message": "Forbidden (origin)"}, status_code=403
-        )
+# Условный GET для страниц, целиком построенных из данных пользователя.
+# ETag = версия данных (db.user_data_version) + путь и query + всё, что ещё
+# попадает в HTML: роль, CSRF-токен сессии, локальные дата и час. Совпал
+# If-None-Match — отвечаем 304 до любых запросов к БД.
+# Версия живёт в памяти процесса: в ETag входит токен запуска (новый деплой —
+# новые шаблоны) и окно WEB_ETAG_TTL_SEC, за которое успевают проявиться
+# записи бота из другого процесса, если мост events (PG LISTEN/NOTIFY) не
+# работает. 0 — ETag выключен.
+_ETAG_TTL_SEC = _env_float("WEB_ETAG_TTL_SEC", 10.0)
+_ETAG_PATHS = frozenset({"/today", "/tasks", "/routines", "/projects", "/projects/archive"})
+_BOOT_TOKEN = secrets.token_hex(4)
+
+
+def _etag_applies(path: str) -> bool:
+    return path in _ETAG_PATHS or path.startswith("/reports/")
+
+
+def _local_date_hour(tz_name: str) -> str:
+    from datetime import datetime
+
+    try:
+        from zoneinfo import ZoneInfo
+
+        now = datetime.now(ZoneInfo((tz_name or "Europe/Moscow").strip() or "Europe/Moscow"))
+    except Exception:
+        now = datetime.now()
+    return now.strftime("%Y-%m-%dT%H")
 
 
-class _AdminFlagMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        request.state.is_admin = False
-        row = web_auth.get_current_user_row(request)
-        if row:
-            request.state.is_admin = db.is_admin_user(row)
-        return await call_next(request)
+def _page_etag(request: Request) -> str | None:
+    """Слабый ETag страницы или None, если страницу нужно отдать целиком."""
+    if request.session.get("flash_msg"):
+        return None
+    row = web_auth.get_current_user_row(request)
+    if not row:
+        return None
+    uid = int(row["id"])
+    parts = (
+        _BOOT_TOKEN,
+        str(int(time.time() // _ETAG_TTL_SEC)),
+        str(uid),
+        str(db.user_data_version(uid)),
+        "a" if getattr(request.state, "is_admin", False) else "u",
+        str(request.session.get("csrf", "")),
+        _local_date_hour(row.get("timezone") or ""),
+        request.url.path,
+        request.url.query,
+    )
+    digest = hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tag = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == tag:
+            return True
+    return False
+
+
+class _ConditionalGetMiddleware:
+    """ETag/304 для страниц из _ETAG_PATHS; стоит внутри сессии и флага admin."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            _ETAG_TTL_SEC <= 0
+            or scope["type"] != "http"
+            or scope["method"] not in ("GET", "HEAD")
+            or not _etag_applies(scope["path"])
+        ):
+            await self.app(scope, receive, send)
+            return
+        request = Request(scope)
+        etag = _page_etag(request)
+        if etag is None:
+            await self.app(scope, receive, send)
+            return
+        cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if _etag_matches(request.headers.get("if-none-match", ""), etag):
+            await Response(status_code=304, headers=cache_headers)(scope, receive, send)
+            return
+
+        async def send_with_etag(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                headers = Headers(raw=message["headers"])
+                if "etag" not in headers and headers.get("content-type", "").startswith("text/html"):
+                    message["headers"] = list(message["headers"]) + [
+                        (k.lower().encode("latin-1"), v.encode("latin-1"))
+                        for k, v in cache_headers.items()
+                    ]
+            await send(message)
 
+        await self.app(scope, receive, send_with_etag)
 
+
+class _EventOriginMiddleware:
+    """
+    Заголовок X-Tab-Id (его шлёт app.js) становится меткой origin событий,
+    вызванных запросом: вкладка не перерисовывает страницу из-за своего же действия.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+        tab_id = Headers(scope=scope).get("x-tab-id", "")
+        if not (0 < len(tab_id) <= 32 and tab_id.isalnum()):
+            await self.app(scope, receive, send)
+            return
+        token = events.set_origin(tab_id)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            events.reset_origin(token)
+
+
+app.add_middleware(_EventOriginMiddleware)
+app.add_middleware(_ConditionalGetMiddleware)
 app.add_middleware(_AdminFlagMiddleware)
 app.add_middleware(_OriginCsrfMiddleware)
 app.add_middleware(
@@ -329,6 +504,9 @@ def _consume_flash(request: Request) -> dict:
 
 
 templates.env.globals["consume_flash"] = _consume_flash
+# Страницы, которые app.js обновляет по событиям GET /events (те же, что с ETag:
+# повторная загрузка без изменений стоит один 304).
+templates.env.globals["live_updates"] = _etag_applies
 
 
 def _csrf_token_for_template(request: Request) -> str:
@@ -362,15 +540,22 @@ def resolve_web_user_row(request: Request | None = None) -> dict:
     4) иначе RuntimeError (новый пользователь должен зарегистрироваться).
     """
     if request is not None:
-        uid = web_auth.current_user_id(request)
-        if uid is not None:
-            u = db.get_user_by_id(uid)
-            if u:
-                return u
+        u = web_auth.get_current_user_row(request)
+        if u:
+            return u
+        legacy = getattr(request.state, "legacy_user_row", None)
+        if legacy is not None:
+            return legacy
+        u = _resolve_legacy_user_row()
+        request.state.legacy_user_row = u
+        return u
+    return _resolve_legacy_user_row()
+
 
+def _resolve_legacy_user_row() -> dict:
     wid = os.environ.get("WEB_INTERNAL_USER_ID", "").strip()
     if wid:
-        u = db.get_user_by_id(int(wid))
+        u = db.get_user_by_id_cached(int(wid))
         if not u:
             raise RuntimeError(
                 f"WEB_INTERNAL_USER_ID={wid}: пользователь не найден. "
@@ -457,9 +642,21 @@ async def login_post(
         )
 
     user = db.find_user_by_email(email_norm)
-    if not user or not user.get("password_hash") or not web_auth.verify_password(
-        user["password_hash"], password
-    ):
+    try:
+        password_ok = bool(user and user.get("password_hash")) and await web_auth.verify_password_async(
+            user["password_hash"], password
+        )
+    except web_auth.HashPoolBusy:
+        return templates.TemplateResponse(
+            request,
+            "login.html",
+            {
+                "error": "Слишком много попыток входа. Подождите минуту.",
+                "email": email_norm,
+            },
+            status_code=429,
+        )
+    if not password_ok:
         return templates.TemplateResponse(
             request,
             "login.html",
@@ -469,7 +666,7 @@ async def login_post(
 
     if web_auth.needs_rehash(user["password_hash"]):
         try:
-            db.set_password_hash(user["id"], web_auth.hash_password(password))
+            db.set_password_hash(user["id"], await web_auth.hash_password_async(password))
         except Exception:
             pass
 
@@ -533,7 +730,19 @@ async def signup_post(
             status_code=409,
         )
 
-    pwd_hash = web_auth.hash_password(password)
+    try:
+        pwd_hash = await web_auth.hash_password_async(password)
+    except web_auth.HashPoolBusy:
+        return templates.TemplateResponse(
+            request,
+            "signup.html",
+            {
+                "error": "Слишком много попыток. Попробуйте через минуту.",
+                "email": email_norm,
+                "name": name_norm,
+            },
+            status_code=429,
+        )
     try:
         user = db.create_user_with_email(email_norm, pwd_hash, name_norm)
     except Exception as exc:
@@ -714,15 +923,17 @@ async def page_home(request: Request):
 
     user_row = get_user_row(request)
     uid = user_row["id"]
-    _maybe_transfer_overdue(uid)
+    await db_async.run(_maybe_transfer_overdue, uid)
     # Без _active_tasks_display_order: на главной нужны только числа (COUNT / len «сегодня»).
-    today_tasks = db.get_today_tasks(uid)
+    today_tasks, counts, n_done_today, n_projects = await asyncio.gather(
+        db_async.get_today_tasks(uid),
+        db_async.home_counts(uid),
+        db_async.count_done_tasks_today(uid),
+        db_async.count_user_projects(uid),
+    )
     n_today = len(today_tasks)
-    counts = db.home_counts(uid)
     n_tasks = counts["n_tasks"]
     n_routines = counts["n_routines"]
-    n_done_today = db.count_done_tasks_today(uid)
-    n_projects = db.count_user_projects(uid)
     name = (user_row.get("first_name") or "").strip() or "друг"
     return templates.TemplateResponse(
         request,
@@ -793,19 +1004,134 @@ def _task_row_project_id(t: dict) -> int | None:
         return None
 
 
+def _today_row(t: dict, bucket: str) -> dict:
+    """Строка задачи на /today (partials/today_row.html); флаги порядка ставит вызывающий."""
+    from bot_v2 import _format_time_human
+
+    time_part = ""
+    if t.get("due_time"):
+        time_part = f"в {_format_time_human(t['due_time'])}"
+    pl = ""
+    if t.get("project_title"):
+        pe = (t.get("project_emoji") or "📁").strip() or "📁"
+        pl = f"{pe} {t['project_title']}".strip()
+    rd = (t.get("repeat_day") or "").strip()
+    repeat_label = db.format_repeat_day_display(t.get("repeat_day")) if t.get("is_routine") else ""
+    return {
+        "emoji": _task_row_emoji(t),
+        "text": t["text"],
+        "time_part": time_part,
+        "task_id": t["id"],
+        "bucket_key": bucket,
+        "is_routine": bool(t.get("is_routine")),
+        "category_name": (t.get("category_name") or "").strip(),
+        "color": (t.get("color") or "").strip().lower(),
+        "estimate_min": int(t.get("estimate_min") or 0),
+        "repeat_day": rd,
+        "repeat_label": repeat_label,
+        "repeat_day_codes": _repeat_day_codes(rd),
+        "repeat_interval": _repeat_interval_for_row(rd),
+        "project_label": pl,
+        "project_id": _task_row_project_id(t),
+        "kebab_remove_from_plan": bool(t.get("is_routine")),
+        "show_move_today": True,
+        "can_move_up_today": False,
+        "can_move_down_today": False,
+    }
+
+
+def _tasks_section_key(t: dict) -> str:
+    """Раздел /tasks, в который попадает задача: date:ГГГГ-ММ-ДД, nodate или routine."""
+    if t.get("is_routine"):
+        return "routine"
+    if t.get("due_date"):
+        return f"date:{t['due_date']}"
+    return "nodate"
+
+
+# /tasks отдаётся окнами: первые _TASKS_EAGER_SECTIONS разделов — по
+# _TASKS_SECTION_ROWS строк, остальное догружается кнопкой «Показать ещё».
+_TASKS_SECTION_ROWS = max(1, int(_env_float("WEB_TASKS_SECTION_ROWS", 50)))
+_TASKS_EAGER_SECTIONS = max(1, int(_env_float("WEB_TASKS_EAGER_SECTIONS", 10)))
+
+
+def _tasks_section_title(key: str) -> str:
+    from bot_v2 import _format_date_human
+
+    if key == "routine":
+        return "Рутины"
+    if key == "nodate":
+        return "Без срока"
+    return _format_date_human(key.partition(":")[2])
+
+
+def _tasks_cursor(after: tuple | None) -> str:
+    return json.dumps(list(after), ensure_ascii=False) if after else ""
+
+
+def _parse_tasks_cursor(raw: str) -> tuple[str, str, int] | None:
+    if not raw:
+        return None
+    try:
+        k_date, k_time, task_id = json.loads(raw)
+        return str(k_date), str(k_time), int(task_id)
+    except (TypeError, ValueError) as exc:
+        raise ValueError(raw) from exc
+
+
+def _tasks_row(t: dict) -> dict:
+    """Строка задачи на /tasks (partials/tasks_row.html)."""
+    from bot_v2 import _format_date_human, _format_time_human
+
+    time_part = ""
+    if t.get("due_time"):
+        time_part = f"в {_format_time_human(t['due_time'])}"
+    dd = t.get("due_date")
+    date_human = ""
+    if dd and not t.get("is_routine"):
+        date_human = _format_date_human(dd)
+    right_bits = [x for x in (time_part, date_human) if x]
+    pl = ""
+    if t.get("project_title"):
+        pe = (t.get("project_emoji") or "📁").strip() or "📁"
+        pl = f"{pe} {t['project_title']}".strip()
+    rd = (t.get("repeat_day") or "").strip()
+    return {
+        "task_id": t["id"],
+        "emoji": _task_row_emoji(t),
+        "text": t["text"],
+        "date_right": " · ".join(right_bits),
+        "is_routine": bool(t.get("is_routine")),
+        "category_name": (t.get("category_name") or "").strip(),
+        "color": (t.get("color") or "").strip().lower(),
+        "estimate_min": int(t.get("estimate_min") or 0),
+        "repeat_day": rd,
+        "repeat_day_codes": _repeat_day_codes(rd),
+        "repeat_interval": _repeat_interval_for_row(rd),
+        "project_label": pl,
+        "has_project": bool(pl),
+        "project_id": _task_row_project_id(t),
+        "num": t.get("num"),
+    }
+
+
 @app.get("/today", response_class=HTMLResponse)
 async def page_today(request: Request):
     if not _is_authenticated(request):
         return RedirectResponse("/login", status_code=302)
-    from bot_v2 import _active_tasks_display_order, _format_time_human
+    from bot_v2 import _active_tasks_display_order
 
     user_row = get_user_row(request)
     uid = user_row["id"]
     tz_name = (user_row.get("timezone") or "Europe/Moscow").strip() or "Europe/Moscow"
     local_hour = _user_local_hour(tz_name)
-    _maybe_transfer_overdue(uid)
-    ordered = _active_tasks_display_order(uid)
-    today_tasks = db.get_today_tasks(uid)
+    await db_async.run(_maybe_transfer_overdue, uid)
+    ordered, today_tasks, category_choices, project_choices = await asyncio.gather(
+        db_async.run(_active_tasks_display_order, uid),
+        db_async.get_today_tasks(uid),
+        db_async.run(_category_choices, uid),
+        db_async.run(_composer_projects, uid),
+    )
     today_ids = {t["id"] for t in today_tasks}
     ordered_today = [(i, t) for i, t in enumerate(ordered, start=1) if t["id"] in today_ids]
 
@@ -838,42 +1164,10 @@ async def page_today(request: Request):
             n_in_bucket = len(pairs)
             rows = []
             for bi, (_num, t) in enumerate(pairs):
-                emoji = _task_row_emoji(t)
-                time_part = ""
-                if t.get("due_time"):
-                    time_part = f"в {_format_time_human(t['due_time'])}"
-                pl = ""
-                if t.get("project_title"):
-                    pe = (t.get("project_emoji") or "📁").strip() or "📁"
-                    pl = f"{pe} {t['project_title']}".strip()
-                rd = (t.get("repeat_day") or "").strip()
-                repeat_label = (
-                    db.format_repeat_day_display(t.get("repeat_day"))
-                    if t.get("is_routine")
-                    else ""
-                )
-                rows.append(
-                    {
-                        "emoji": emoji,
-                        "text": t["text"],
-                        "time_part": time_part,
-                        "task_id": t["id"],
-                        "is_routine": bool(t.get("is_routine")),
-                        "category_name": (t.get("category_name") or "").strip(),
-                        "color": (t.get("color") or "").strip().lower(),
-                        "estimate_min": int(t.get("estimate_min") or 0),
-                        "repeat_day": rd,
-                        "repeat_label": repeat_label,
-                        "repeat_day_codes": _repeat_day_codes(rd),
-                        "repeat_interval": _repeat_interval_for_row(rd),
-                        "project_label": pl,
-                        "project_id": _task_row_project_id(t),
-                        "kebab_remove_from_plan": bool(t.get("is_routine")),
-                        "show_move_today": n_in_bucket >= 1,
-                        "can_move_up_today": n_in_bucket > 1 and bi > 0,
-                        "can_move_down_today": n_in_bucket > 1 and bi < n_in_bucket - 1,
-                    }
-                )
+                row = _today_row(t, bucket)
+                row["can_move_up_today"] = n_in_bucket > 1 and bi > 0
+                row["can_move_down_today"] = n_in_bucket > 1 and bi < n_in_bucket - 1
+                rows.append(row)
             if not _show_today_bucket(bucket, local_hour, len(rows)):
                 continue
             sections.append(
@@ -892,10 +1186,10 @@ async def page_today(request: Request):
             sections=sections,
             empty=len(ordered_today) == 0,
             next_url="/today",
-            category_choices=_category_choices(uid),
+            category_choices=category_choices,
             color_choices=TASK_COLOR_CHOICES,
             kebab_hide_schedule=True,
-            project_choices=_composer_projects(uid),
+            project_choices=project_choices,
         ),
     )
 
@@ -904,88 +1198,27 @@ async def page_today(request: Request):
 async def page_tasks(request: Request):
     if not _is_authenticated(request):
         return RedirectResponse("/login", status_code=302)
-    from bot_v2 import _active_tasks_display_order, _format_date_human, _format_time_human
-
     uid = get_user_row(request)["id"]
-    _maybe_transfer_overdue(uid)
-    tasks = _active_tasks_display_order(uid)
-    numbered = list(enumerate(tasks, start=1))
-
-    def _row_dict(num: int, t: dict) -> dict:
-        emoji = _task_row_emoji(t)
-        time_part = ""
-        if t.get("due_time"):
-            time_part = f"в {_format_time_human(t['due_time'])}"
-        dd = t.get("due_date")
-        date_human = ""
-        if dd and not t.get("is_routine"):
-            date_human = _format_date_human(dd)
-        right_bits = [x for x in (time_part, date_human) if x]
-        date_right = " · ".join(right_bits)
-        pl = ""
-        if t.get("project_title"):
-            pe = (t.get("project_emoji") or "📁").strip() or "📁"
-            pl = f"{pe} {t['project_title']}".strip()
-        rd = (t.get("repeat_day") or "").strip()
-        return {
-            "task_id": t["id"],
-            "emoji": emoji,
-            "text": t["text"],
-            "date_right": date_right,
-            "is_routine": bool(t.get("is_routine")),
-            "category_name": (t.get("category_name") or "").strip(),
-            "color": (t.get("color") or "").strip().lower(),
-            "estimate_min": int(t.get("estimate_min") or 0),
-            "repeat_day": rd,
-            "repeat_day_codes": _repeat_day_codes(rd),
-            "repeat_interval": _repeat_interval_for_row(rd),
-            "project_label": pl,
-            "has_project": bool(pl),
-            "project_id": _task_row_project_id(t),
-        }
-
-    from collections import defaultdict
-
-    buckets: dict[tuple, list[tuple[int, dict]]] = defaultdict(list)
-    for num, t in numbered:
-        if t.get("is_routine"):
-            buckets[("routine",)].append((num, t))
-        elif t.get("due_date"):
-            buckets[("date", t["due_date"])].append((num, t))
-        else:
-            buckets[("nodate",)].append((num, t))
-
-    date_keys = sorted((k for k in buckets if k[0] == "date"), key=lambda k: k[1])
-    section_order = list(date_keys)
-    if ("nodate",) in buckets:
-        section_order.append(("nodate",))
-    if ("routine",) in buckets:
-        section_order.append(("routine",))
+    await db_async.run(_maybe_transfer_overdue, uid)
+    sections, category_choices, project_choices = await asyncio.gather(
+        db_async.run(db.tasks_page_sections, uid, _TASKS_SECTION_ROWS, _TASKS_EAGER_SECTIONS),
+        db_async.run(_category_choices, uid),
+        db_async.run(_composer_projects, uid),
+    )
+    await db_async.attach_project_labels(uid, [t for sec in sections for t in sec["rows"]])
 
     task_sections: list[dict] = []
-    for sk in section_order:
-        if sk[0] == "date":
-            title = _format_date_human(sk[1])
-        elif sk[0] == "nodate":
-            title = "Без срока"
-        else:
-            title = "Рутины"
-        pairs = buckets[sk]
-        if sk[0] == "date":
-            sec_kind = "date"
-            sec_date = sk[1]
-        elif sk[0] == "nodate":
-            sec_kind = "nodate"
-            sec_date = ""
-        else:
-            sec_kind = "routine"
-            sec_date = ""
+    for sec in sections:
+        kind, _, sec_date = sec["key"].partition(":")
         task_sections.append(
             {
-                "section_title": title,
-                "section_kind": sec_kind,
+                "section_title": _tasks_section_title(sec["key"]),
+                "section_kind": kind,
                 "section_date": sec_date,
-                "rows": [_row_dict(num, t) for num, t in pairs],
+                "section_key": sec["key"],
+                "rows": [_tasks_row(t) for t in sec["rows"]],
+                "remaining": sec["count"] - len(sec["rows"]),
+                "cursor": _tasks_cursor(sec["next_after"]),
             }
         )
 
@@ -994,15 +1227,98 @@ async def page_tasks(request: Request):
         "tasks.html",
         _ctx(
             task_sections=task_sections,
-            empty=len(tasks) == 0,
+            empty=not task_sections,
             next_url="/tasks",
-            category_choices=_category_choices(uid),
+            category_choices=category_choices,
             color_choices=TASK_COLOR_CHOICES,
-            project_choices=_composer_projects(uid),
+            project_choices=project_choices,
         ),
     )
 
 
+@app.get("/tasks/section")
+async def tasks_section_more(request: Request, key: str = "", cursor: str = ""):
+    """Следующие строки раздела /tasks («Показать ещё»): {html, cursor, has_more}."""
+    if not _is_authenticated(request):
+        return JSONResponse({"ok": False, "message": "Требуется вход."}, status_code=401)
+    uid = get_user_row(request)["id"]
+    try:
+        after = _parse_tasks_cursor(cursor)
+    except ValueError:
+        return JSONResponse({"ok": False, "message": "Неверный курсор."}, status_code=400)
+    rows, next_after = await db_async.run(db.list_tasks_section, uid, key, after, _TASKS_SECTION_ROWS)
+    await db_async.attach_project_labels(uid, rows)
+    category_choices, project_choices = await asyncio.gather(
+        db_async.run(_category_choices, uid),
+        db_async.run(_composer_projects, uid),
+    )
+    tpl = templates.get_template("partials/tasks_row.html")
+    html = "".join(
+        tpl.render(
+            row=_tasks_row(t),
+            next_url="/tasks",
+            category_choices=category_choices,
+            color_choices=TASK_COLOR_CHOICES,
+            project_choices=project_choices,
+        )
+        for t in rows
+    )
+    return JSONResponse(
+        {"ok": True, "html": html, "cursor": _tasks_cursor(next_after), "has_more": next_after is not None}
+    )
+
+
+# GET /events — SSE-поток «данные изменились» для открытой вкладки (см. events.py).
+# Соединение живёт не дольше WEB_EVENTS_MAX_SEC, потом EventSource переподключается
+# сам и по Last-Event-ID узнаёт, не пропустил ли изменения. 0 — поток выключен.
+_EVENTS_MAX_SEC = _env_float("WEB_EVENTS_MAX_SEC", 600.0)
+_EVENTS_PING_SEC = max(1.0, _env_float("WEB_EVENTS_PING_SEC", 25.0))
+
+
+def _events_id(uid: int) -> str:
+    return f"{_BOOT_TOKEN}.{db.user_data_version(uid)}"
+
+
+def _sse_changed(uid: int, origin: str | None) -> str:
+    data = json.dumps({"origin": origin}, separators=(",", ":"))
+    return f"id: {_events_id(uid)}\nevent: changed\ndata: {data}\n\n"
+
+
+@app.get("/events")
+async def events_stream(request: Request):
+    uid = web_auth.current_user_id(request)
+    if not uid:
+        return JSONResponse({"ok": False, "message": "Требуется вход."}, status_code=401)
+    if _EVENTS_MAX_SEC <= 0:
+        # 204 — сигнал EventSource больше не переподключаться.
+        return Response(status_code=204)
+    uid = int(uid)
+    last_id = request.headers.get("last-event-id", "")
+
+    async def stream():
+        deadline = time.monotonic() + _EVENTS_MAX_SEC
+        with events.subscribe(uid) as sub:
+            if last_id and last_id != _events_id(uid):
+                yield _sse_changed(uid, None)
+            else:
+                yield f"retry: 3000\nid: {_events_id(uid)}\nevent: hello\ndata: {{}}\n\n"
+            while True:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return
+                event = await sub.get(timeout=min(_EVENTS_PING_SEC, left))
+                if event is None:
+                    yield ": ping\n\n"
+                else:
+                    yield _sse_changed(uid, event["origin"])
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/reports/today", response_class=HTMLResponse)
 async def page_report_today(request: Request):
     if not _is_authenticated(request):
@@ -1012,9 +1328,11 @@ async def page_report_today(request: Request):
     user_row = get_user_row(request)
     uid = user_row["id"]
     tz_name = (user_row.get("timezone") or "Europe/Moscow").strip() or "Europe/Moscow"
-    tasks = db.get_done_tasks_today(uid)
-    db.attach_project_labels(uid, tasks)
-    sched = db.list_routines_due_today(uid)
+    tasks, sched = await asyncio.gather(
+        db_async.get_done_tasks_today(uid),
+        db_async.list_routines_due_today(uid),
+    )
+    await db_async.attach_project_labels(uid, tasks)
     text = _format_done_report_today(tasks, tz_name, routines_scheduled=sched)
     body_html = report_text_to_html(text)
     return templates.TemplateResponse(
@@ -1057,8 +1375,11 @@ async def page_projects(request: Request):
     if not _is_authenticated(request):
         return RedirectResponse("/login", status_code=302)
     uid = get_user_row(request)["id"]
-    raw = db.list_projects(uid)
-    counts = db.count_active_tasks_by_project(uid)
+    raw, counts, archived_count = await asyncio.gather(
+        db_async.list_projects(uid),
+        db_async.count_active_tasks_by_project(uid),
+        db_async.count_archived_projects(uid),
+    )
     project_rows: list[dict] = []
     for p in raw:
         pid = int(p["id"])
@@ -1070,7 +1391,6 @@ async def page_projects(request: Request):
                 "n_active": counts.get(pid, 0),
             }
         )
-    archived_count = db.count_archived_projects(uid)
     return templates.TemplateResponse(
         request,
         "projects.html",
@@ -1124,10 +1444,17 @@ async def action_project_archive(request: Request, project_id: int):
     if not _is_authenticated(request):
         return RedirectResponse("/login", status_code=302)
     uid = get_user_row(request)["id"]
-    result = db.archive_project(uid, project_id, complete_active=True)
+    if _wants_json(request):
+        return await _accepted_job(uid, "project_archive", _archive_project_job, uid, project_id)
+    result = await db_async.run(db.archive_project, uid, project_id, complete_active=True)
     return _flash_redirect(request, "/projects", result["message"], result["ok"])
 
 
+def _archive_project_job(uid: int, project_id: int) -> dict:
+    result = db.archive_project(uid, project_id, complete_active=True)
+    return {**result, "redirect": "/projects"}
+
+
 @app.post("/projects/{project_id}/unarchive")
 async def action_project_unarchive(request: Request, project_id: int):
     if not _is_authenticated(request):
@@ -1327,8 +1654,10 @@ async def page_plan(request: Request):
     from datetime import date as _date, timedelta as _td
 
     uid = get_user_row(request)["id"]
-    gs = _user_plan_grid_start_min(uid)
-    today_str = db.user_local_date_offset(uid, 0)
+    gs, today_str = await asyncio.gather(
+        db_async.run(_user_plan_grid_start_min, uid),
+        db_async.run(db.user_local_date_offset, uid, 0),
+    )
     raw_date = (request.query_params.get("date") or "").strip() or today_str
     try:
         d = _date.fromisoformat(raw_date)
@@ -1338,13 +1667,14 @@ async def page_plan(request: Request):
     prev_date = (d - _td(days=1)).strftime("%Y-%m-%d")
     next_date = (d + _td(days=1)).strftime("%Y-%m-%d")
 
-    db.ensure_plan_slots_from_due_time(uid, date_str, gs)
+    await db_async.ensure_plan_slots_from_due_time(uid, date_str, gs)
 
-    slots = db.get_plan_slots(uid, date_str)
+    slots, day_tasks = await asyncio.gather(
+        db_async.get_plan_slots(uid, date_str),
+        db_async.get_tasks_for_date(uid, date_str),
+    )
     planned_task_ids = {int(s["task_id"]) for s in slots}
-
-    day_tasks = db.get_tasks_for_date(uid, date_str)
-    db.attach_project_labels(uid, day_tasks)
+    await db_async.attach_project_labels(uid, day_tasks)
 
     backlog: list[dict] = []
     for t in day_tasks:
@@ -1369,8 +1699,10 @@ async def page_plan(request: Request):
 
     other_tasks: list[dict] = []
     day_task_ids = {int(t["id"]) for t in day_tasks}
-    extras = db.get_active_tasks_for_plan_sidebar(uid, planned_task_ids | day_task_ids)
-    db.attach_project_labels(uid, extras)
+    extras = await db_async.run(
+        db.get_active_tasks_for_plan_sidebar, uid, planned_task_ids | day_task_ids
+    )
+    await db_async.attach_project_labels(uid, extras)
     for t in extras:
         tid = int(t["id"])
         pref_o = db._preferred_plan_start_min(t, gs)
@@ -1395,7 +1727,8 @@ async def page_plan(request: Request):
         start = int(s["start_min"])
         dur = int(s["duration_min"])
         total_planned += dur
-        done_on_date = db.is_task_done_on_local_date(
+        done_on_date = await db_async.run(
+            db.is_task_done_on_local_date,
             uid,
             date_str,
             {
@@ -1570,10 +1903,17 @@ async def action_plan_auto_place(request: Request, date: str = Form(...)):
         return _plan_admin_denied(request)
     uid = get_user_row(request)["id"]
     date_str = (date or "").strip()[:10]
-    result = _plan_auto_place_backlog(uid, date_str)
+    if _wants_json(request):
+        return await _accepted_job(uid, "plan_auto_place", _plan_auto_place_job, uid, date_str)
+    result = await db_async.run(_plan_auto_place_backlog, uid, date_str)
     return _flash_redirect(request, f"/plan?date={date_str}", str(result["message"]), bool(result["ok"]))
 
 
+def _plan_auto_place_job(uid: int, date_str: str) -> dict:
+    result = _plan_auto_place_backlog(uid, date_str)
+    return {**result, "redirect": f"/plan?date={date_str}"}
+
+
 @app.post("/plan/update_slot")
 async def action_plan_update_slot(
     request: Request,
@@ -1636,7 +1976,7 @@ async def action_set_estimate(
     ok = db.set_task_estimate(uid, task_id, int(minutes))
     result = {"ok": ok, "message": "Оценка обновлена." if ok else "Не удалось обновить."}
     if _wants_json(request):
-        return JSONResponse(result)
+        return await _task_action_json(uid, task_id, next_dest, result)
     return _flash_redirect(request, next_dest, result["message"], result["ok"])
 
 
@@ -1754,7 +2094,11 @@ async def page_routines(request: Request):
     from bot_v2 import _group_tasks_by_time_bucket
 
     uid = get_user_row(request)["id"]
-    routine_tasks = db.get_routine_tasks(uid)
+    routine_tasks, category_choices, project_choices = await asyncio.gather(
+        db_async.get_routine_tasks(uid),
+        db_async.run(_category_choices, uid),
+        db_async.run(_composer_projects, uid),
+    )
     if not routine_tasks:
         return templates.TemplateResponse(
             request,
@@ -1763,9 +2107,9 @@ async def page_routines(request: Request):
                 sections=[],
                 empty=True,
                 next_url="/routines",
-                category_choices=_category_choices(uid),
+                category_choices=category_choices,
                 color_choices=TASK_COLOR_CHOICES,
-                project_choices=_composer_projects(uid),
+                project_choices=project_choices,
             ),
         )
     _titles = {
@@ -1821,9 +2165,9 @@ async def page_routines(request: Request):
             sections=sections,
             empty=False,
             next_url="/routines",
-            category_choices=_category_choices(uid),
+            category_choices=category_choices,
             color_choices=TASK_COLOR_CHOICES,
-            project_choices=_composer_projects(uid),
+            project_choices=project_choices,
         ),
     )
 
@@ -1833,7 +2177,7 @@ async def page_actions(request: Request):
     if not _is_authenticated(request):
         return RedirectResponse("/login", status_code=302)
     uid = get_user_row(request)["id"]
-    done = db.get_done_tasks_today(uid)
+    done = await db_async.get_done_tasks_today(uid)
     done_items = [{"text": t.get("text", ""), "task_id": t["id"]} for t in done]
     return templates.TemplateResponse(
         request,
@@ -1930,9 +2274,11 @@ async def page_report_week(request: Request):
     user_row = get_user_row(request)
     uid = user_row["id"]
     tz_name = (user_row.get("timezone") or "Europe/Moscow").strip() or "Europe/Moscow"
-    tasks, mon, sun, start_utc, end_utc = db.get_done_tasks_calendar_week(uid)
-    db.attach_project_labels(uid, tasks)
-    raw_h = db.routine_completions_raw_between(uid, start_utc, end_utc)
+    tasks, mon, sun, start_utc, end_utc = await db_async.get_done_tasks_calendar_week(uid)
+    _, raw_h = await asyncio.gather(
+        db_async.attach_project_labels(uid, tasks),
+        db_async.routine_completions_raw_between(uid, start_utc, end_utc),
+    )
     text = _format_done_report_week(
         tasks,
         tz_name,
@@ -2112,10 +2458,25 @@ async def action_complete(request: Request):
     flash_dest = _flash_allowed(path)
 
     if not ids:
+        if _wants_json(request):
+            return JSONResponse({"ok": False, "message": "Отметь галочками задачи в списке."})
         if flash_dest:
             return _flash_redirect(request, dest, "Отметь галочками задачи в списке.", False)
         return RedirectResponse(f"{dest}?err=complete", status_code=302)
     ok_titles, fail = complete_task_ids(uid, ids)
+    if _wants_json(request):
+        # Страница просто убирает отмеченные строки, без перезагрузки.
+        failed = set(fail)
+        message = f"Отмечено выполненным: {len(ok_titles)}."
+        if fail:
+            message = f"Частично: {len(ok_titles)} ок, не найдены или не отмечены: {fail}."
+        return JSONResponse(
+            {
+                "ok": bool(ok_titles),
+                "message": message if ok_titles else "Не удалось отметить выбранное.",
+                "completed_ids": [i for i in ids if i not in failed],
+            }
+        )
     if flash_dest:
         if ok_titles and not fail:
             return _flash_redirect(
@@ -2181,6 +2542,79 @@ def _wants_json(request: Request) -> bool:
     return "application/json" in (request.headers.get("accept") or "")
 
 
+def _task_row_fragment(uid: int, task_id: int, next_url: str) -> dict:
+    """
+    Что поменялось на странице next_url после действия с задачей:
+    {"removed": True} — строки на странице больше нет; {"row_html", "section"} —
+    свежая разметка строки и раздел (data-section-key), где она должна стоять;
+    {} — частичное обновление не поддержано, app.js перезагрузит страницу.
+
+    На /tasks строка несёт сквозной номер (data-task-num, «выполни N»): app.js
+    сдвигает номера после удалённой строки, а если у строки сменился номер или
+    раздел (раздел мог быть загружен не целиком — keyset «Показать ещё»),
+    перезагружает страницу.
+    """
+    from bot_v2 import _active_tasks_display_order
+
+    page = (next_url or "").split("?", 1)[0].rstrip("/") or "/"
+    if page == "/today":
+        tasks = db.get_today_tasks(uid)
+    elif page == "/tasks":
+        tasks = _active_tasks_display_order(uid)
+    else:
+        tasks = db.get_active_tasks_ordered(uid)
+    pos, task = next(((i, t) for i, t in enumerate(tasks, start=1) if int(t["id"]) == int(task_id)), (0, None))
+    if task is None:
+        return {"removed": True}
+    if page not in ("/today", "/tasks"):
+        return {}
+    if page == "/tasks":
+        task["num"] = pos
+    else:
+        db.attach_project_labels(uid, [task])
+    ctx = {
+        "next_url": page,
+        "category_choices": _category_choices(uid),
+        "color_choices": TASK_COLOR_CHOICES,
+        "project_choices": _composer_projects(uid),
+    }
+    if page == "/today":
+        row = _today_row(task, _web_today_bucket_key(task))
+        template, section = "partials/today_row.html", f"bucket:{row['bucket_key']}"
+        ctx["kebab_hide_schedule"] = True
+    else:
+        row = _tasks_row(task)
+        template, section = "partials/tasks_row.html", _tasks_section_key(task)
+    return {"row_html": templates.get_template(template).render(row=row, **ctx), "section": section}
+
+
+async def _task_action_json(uid: int, task_id: int, next_url: str, result: dict) -> JSONResponse:
+    """JSON-ответ на действие из меню ⋯: при успехе — с фрагментом строки (см. app.js)."""
+    if result.get("ok"):
+        result = {**result, **await db_async.run(_task_row_fragment, uid, task_id, next_url)}
+    return JSONResponse(result)
+
+
+async def _accepted_job(uid: int, kind: str, fn, *args) -> JSONResponse:
+    """Медленное действие — в фоновую очередь; клиент опрашивает status_url (см. app.js)."""
+    job_id = await web_jobs.submit(uid, kind, fn, *args)
+    return JSONResponse(
+        {"ok": True, "job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"},
+        status_code=202,
+    )
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(request: Request, job_id: str):
+    if not _is_authenticated(request):
+        return JSONResponse({"ok": False, "message": "Требуется вход."}, status_code=401)
+    uid = get_user_row(request)["id"]
+    status = await web_jobs.get_status(job_id, uid)
+    if status is None:
+        return JSONResponse({"ok": False, "message": "Задача не найдена."}, status_code=404)
+    return JSONResponse(status)
+
+
 @app.post("/tasks/delete_id")
 async def action_delete_id(
     request: Request,
@@ -2194,7 +2628,7 @@ async def action_delete_id(
     uid = get_user_row(request)["id"]
     result = delete_task_by_id(uid, task_id)
     if _wants_json(request):
-        return JSONResponse(result)
+        return await _task_action_json(uid, task_id, next, result)
     return _flash_redirect(request, next, result["message"], result["ok"])
 
 
@@ -2211,7 +2645,7 @@ async def action_routine_snooze_today(
     uid = get_user_row(request)["id"]
     result = routine_snooze_from_today_plan(uid, task_id)
     if _wants_json(request):
-        return JSONResponse(result)
+        return await _task_action_json(uid, task_id, next, result)
     return _flash_redirect(request, next, result["message"], result["ok"])
 
 
@@ -2251,7 +2685,7 @@ async def action_reschedule_id(
     if preset == "nodate":
         result = move_task_tasks_page_by_id(uid, task_id, "nodate", None)
         if _wants_json(request):
-            return JSONResponse(result)
+            return await _task_action_json(uid, task_id, next, result)
         return _flash_redirect(request, next, result["message"], result["ok"])
     if preset == "today":
         due = db.user_local_date_offset(uid, 0)
@@ -2266,7 +2700,7 @@ async def action_reschedule_id(
         return _flash_redirect(request, next, err["message"], False)
     result = reschedule_task_by_id(uid, task_id, due)
     if _wants_json(request):
-        return JSONResponse(result)
+        return await _task_action_json(uid, task_id, next, result)
     return _flash_redirect(request, next, result["message"], result["ok"])
 
 
@@ -2294,7 +2728,7 @@ async def action_drag_move(
     else:
         result = {"ok": False, "message": "Неизвестный режим переноса."}
     if _wants_json(request):
-        return JSONResponse(result)
+        return await _task_action_json(uid, task_id, next, result)
     return _flash_redirect(request, next, result["message"], result["ok"])
 
 
@@ -2312,7 +2746,7 @@ async def action_set_category(
     uid = get_user_row(request)["id"]
     result = set_task_category_by_id(uid, task_id, category_name)
     if _wants_json(request):
-        return JSONResponse(result)
+        return await _task_action_json(uid, task_id, next, result)
     return _flash_redirect(request, next, result["message"], result["ok"])
 
 
@@ -2330,7 +2764,7 @@ async def action_set_project(
     uid = get_user_row(request)["id"]
     result = set_task_project_by_id(uid, task_id, project_id)
     if _wants_json(request):
-        return JSONResponse(result)
+        return await _task_action_json(uid, task_id, next, result)
     return _flash_redirect(request, next, result["message"], result["ok"])
 
 
@@ -2437,7 +2871,7 @@ async def action_set_color(
     uid = get_user_row(request)["id"]
     result = set_task_color_by_id(uid, task_id, color)
     if _wants_json(request):
-        return JSONResponse(result)
+        return await _task_action_json(uid, task_id, next, result)
     return _flash_redirect(request, next, result["message"], result["ok"])
 
 
@@ -2455,7 +2889,7 @@ async def action_set_repeat_day(
     uid = get_user_row(request)["id"]
     result = set_task_repeat_day_by_id(uid, task_id, repeat_day)
     if _wants_json(request):
-        return JSONResponse(result)
+        return await _task_action_json(uid, task_id, next, result)
     return _flash_redirect(request, next, result["message"], result["ok"])
 
 
@@ -2474,7 +2908,7 @@ async def action_set_routine_kind(
     flag = (make_routine or "").strip().lower() in ("1", "true", "yes", "on")
     result = set_task_routine_kind_by_id(uid, task_id, flag)
     if _wants_json(request):
-        return JSONResponse(result)
+        return await _task_action_json(uid, task_id, next, result)
     return _flash_redirect(request, next, result["message"], result["ok"])
 
 
@@ -2561,6 +2995,23 @@ def _category_name_exists(uid: int, name: str) -> bool:
     return any((r.get("name") or "").strip().lower() == n for r in db.get_categories(uid))
 
 
+_VOICE_READ_CHUNK = 64 * 1024
+
+
+async def _read_upload_limited(file: UploadFile, limit: int) -> bytes | None:
+    """Читает загрузку кусками (Starlette держит её в SpooledTemporaryFile); None — больше limit."""
+    if file.size is not None and file.size > limit:
+        return None
+    buf = bytearray()
+    while True:
+        chunk = await file.read(_VOICE_READ_CHUNK)
+        if not chunk:
+            return bytes(buf)
+        buf += chunk
+        if len(buf) > limit:
+            return None
+
+
 @app.post("/tasks/voice")
 async def action_voice(request: Request, file: UploadFile = File(...)):
     if not _is_authenticated(request):
@@ -2569,40 +3020,48 @@ async def action_voice(request: Request, file: UploadFile = File(...)):
         return RedirectResponse("/login", status_code=302)
     wants_json = "application/json" in (request.headers.get("accept") or "")
     dest = request.query_params.get("next", "/")
-    body = await file.read()
-    if not body:
-        if wants_json:
-            return JSONResponse({"ok": False, "message": "Пустой файл."})
-        return _flash_redirect(request, dest, "Пустой файл.", False)
     max_voice_bytes = int(os.environ.get("WEB_MAX_VOICE_BYTES", str(5 * 1024 * 1024)))
-    if len(body) > max_voice_bytes:
+    body = await _read_upload_limited(file, max_voice_bytes)
+    if body is None:
         msg = "Файл слишком большой. Максимум 5 МБ."
         if wants_json:
             return JSONResponse({"ok": False, "message": msg}, status_code=413)
         return _flash_redirect(request, dest, msg, False)
+    if not body:
+        if wants_json:
+            return JSONResponse({"ok": False, "message": "Пустой файл."})
+        return _flash_redirect(request, dest, "Пустой файл.", False)
     raw_name = file.filename or ""
     suf = Path(raw_name).suffix.lower()
     if suf not in (".ogg", ".oga", ".webm", ".wav", ".mp3", ".m4a", ".mp4"):
         suf = ".webm"
-    text = ai_module.transcribe_voice(body, suffix=suf)
-    if not text:
-        msg = "Не удалось распознать речь (проверьте ключ API и формат аудио)."
-        if wants_json:
-            return JSONResponse({"ok": False, "message": msg})
-        return _flash_redirect(request, dest, msg, False)
     user_row = get_user_row(request)
-    result = add_task_from_text(user_row, text)
     if wants_json:
-        return JSONResponse(
-            {
-                "ok": result["ok"],
-                "message": result["message"],
-                "transcript": text if result["ok"] else None,
-            }
-        )
+        return await _accepted_job(user_row["id"], "voice", _voice_to_task, user_row, body, suf)
+    result = await _voice_to_task(user_row, body, suf)
     return _flash_redirect(request, dest, result["message"], result["ok"])
 
 
+async def _voice_to_task(user_row: dict, body: bytes, suffix: str) -> dict:
+    """Распознаёт голос и добавляет задачу: {ok, message, transcript}."""
+    text = await ai_module.transcribe_voice_async(body, suffix=suffix)
+    if not text:
+        return {
+            "ok": False,
+            "message": "Не удалось распознать речь (проверьте ключ API и формат аудио).",
+            "transcript": None,
+        }
+    result = await db_async.run(add_task_from_text, user_row, text)
+    return {
+        "ok": result["ok"],
+        "message": result["message"],
+        "transcript": text if result["ok"] else None,
+    }
+
+
+app.include_router(api_v1.router)
+app.include_router(telegram_webhook.router)
+
 # Статика
 _static = ROOT / "web" / "static"
 if _static.is_dir():
@@ -5,10 +5,16 @@
 """
 from __future__ import annotations
 
+import asyncio
+import functools
+import logging
+import os
 import re
 import secrets
+import threading
 import time
 from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Deque
 
 from argon2 import PasswordHasher
@@ -17,6 +23,8 @@ from fastapi import Form, HTTPException, Request
 
 import db
 
+logger = logging.getLogger(__name__)
+
 _ph = PasswordHasher()
 
 EMAIL_RE = re.compile(r"^[^\s@]+@[^\s@]+\.[^\s@]+$")
@@ -49,6 +57,84 @@ def needs_rehash(stored_hash: str) -> bool:
         return False
 
 
+# ── Пул для хеширования ─────────────────────────────────────────────────
+# argon2 — это десятки миллисекунд CPU на попытку. В обработчике async def он
+# останавливал бы event loop и страницы всех пользователей; поэтому хеширование
+# идёт в отдельном небольшом пуле потоков. Очередь к пулу ограничена: при
+# всплеске входов (или подборе паролей) лишние попытки сразу получают 429.
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, "") or default)
+    except ValueError:
+        return default
+
+
+AUTH_HASH_WORKERS = max(1, _env_int("AUTH_HASH_WORKERS", 2))
+AUTH_HASH_QUEUE_MAX = max(0, _env_int("AUTH_HASH_QUEUE_MAX", 16))
+
+_hash_executor: ThreadPoolExecutor | None = None
+_hash_lock = threading.Lock()
+_hash_metrics = {"inflight": 0, "peak": 0, "completed": 0, "rejected": 0}
+
+
+class HashPoolBusy(RuntimeError):
+    """Очередь на хеширование переполнена — попытку надо отклонить (429)."""
+
+
+def _get_hash_executor() -> ThreadPoolExecutor:
+    global _hash_executor
+    with _hash_lock:
+        if _hash_executor is None:
+            _hash_executor = ThreadPoolExecutor(
+                max_workers=AUTH_HASH_WORKERS, thread_name_prefix="argon2"
+            )
+        return _hash_executor
+
+
+def hash_pool_saturated() -> bool:
+    with _hash_lock:
+        return _hash_metrics["inflight"] >= AUTH_HASH_WORKERS + AUTH_HASH_QUEUE_MAX
+
+
+def hash_pool_stats() -> dict:
+    """Метрики пула: в работе и в очереди, пик, выполнено, отклонено."""
+    with _hash_lock:
+        m = dict(_hash_metrics)
+    m["workers"] = AUTH_HASH_WORKERS
+    m["queue_max"] = AUTH_HASH_QUEUE_MAX
+    m["queued"] = max(0, m["inflight"] - AUTH_HASH_WORKERS)
+    return m
+
+
+async def _run_hashing(fn, *args):
+    executor = _get_hash_executor()
+    with _hash_lock:
+        if _hash_metrics["inflight"] >= AUTH_HASH_WORKERS + AUTH_HASH_QUEUE_MAX:
+            _hash_metrics["rejected"] += 1
+            logger.warning("argon2 pool saturated: %s in flight", _hash_metrics["inflight"])
+            raise HashPoolBusy("password hashing queue is full")
+        _hash_metrics["inflight"] += 1
+        _hash_metrics["peak"] = max(_hash_metrics["peak"], _hash_metrics["inflight"])
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(fn, *args))
+    finally:
+        with _hash_lock:
+            _hash_metrics["inflight"] -= 1
+            _hash_metrics["completed"] += 1
+
+
+async def hash_password_async(plain: str) -> str:
+    return await _run_hashing(hash_password, plain)
+
+
+async def verify_password_async(stored_hash: str, plain: str) -> bool:
+    if not stored_hash or not plain:
+        return False
+    return await _run_hashing(verify_password, stored_hash, plain)
+
+
 # ── Валидация ──────────────────────────────────────────────────────────
 
 def validate_email(email: str) -> str | None:
@@ -80,7 +166,11 @@ _RL_MAX_PER_WINDOW = 8
 
 
 def rate_limit_hit(key: str) -> bool:
-    """True, если лимит уже исчерпан и запрос надо отклонить."""
+    """True, если лимит уже исчерпан (или переполнен пул хеширования) и запрос надо отклонить."""
+    if hash_pool_saturated():
+        with _hash_lock:
+            _hash_metrics["rejected"] += 1
+        return True
     now = time.monotonic()
     bucket = _rl_buckets[key]
     while bucket and now - bucket[0] > _RL_WINDOW_SEC:
@@ -147,7 +237,13 @@ def is_authenticated(request: Request) -> bool:
 
 
 def get_current_user_row(request: Request) -> dict | None:
+    """Строка users по сессии; за запрос читается не больше одного раза (request.state.user_row)."""
     uid = current_user_id(request)
     if uid is None:
         return None
-    return db.get_user_by_id(uid)
+    cached = getattr(request.state, "user_row", None)
+    if cached is not None and int(cached["id"]) == uid:
+        return cached
+    row = db.get_user_by_id_cached(uid)
+    request.state.user_row = row
+    return row
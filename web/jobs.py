@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Фоновые задачи веба: медленные действия (распознавание голоса, авторасстановка
+плана, закрытие проекта) выполняются вне запроса.
+
+Обработчик кладёт работу в asyncio-очередь и сразу отвечает 202 + job_id;
+несколько воркеров в том же event loop разбирают очередь. Статус и результат
+пишутся в таблицу jobs (SQLite/PG), поэтому GET /jobs/{id} отвечает и после
+перезапуска.
+
+WEB_JOB_TIMEOUT_SEC ограничивает ожидание в очереди: не дождавшаяся воркера
+задача получает ошибку и не запускается. Запущенную задачу не прерываем —
+работа в потоке всё равно доделала бы своё (например, закрыла проект) уже
+после ответа «не удалось». Вместо этого, пока она идёт, воркер раз в четверть
+таймаута обновляет updated_at; задача, не обновлявшаяся дольше таймаута,
+брошена (процесс упал или перезапущен) — такие при старте помечаются ошибкой
+(db.fail_interrupted_jobs), а задачи соседних живых процессов не трогаются.
+
+Функция задачи — корутина или обычная функция (её запускаем через db_async,
+в пуле потоков); возвращает dict в формате {ok, message, ...}.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import uuid
+
+import db
+import db_async
+
+logger = logging.getLogger(__name__)
+
+
+def _workers_count() -> int:
+    try:
+        return max(1, int(os.environ.get("WEB_JOB_WORKERS", "") or 2))
+    except ValueError:
+        return 2
+
+
+def job_timeout_sec() -> float:
+    try:
+        return max(1.0, float(os.environ.get("WEB_JOB_TIMEOUT_SEC", "") or 600))
+    except ValueError:
+        return 600.0
+
+
+_TIMEOUT_RESULT = {"ok": False, "message": "Сервер занят, действие не выполнено. Попробуйте ещё раз."}
+
+_queue: asyncio.Queue | None = None
+_workers: list[asyncio.Task] = []
+_loop: asyncio.AbstractEventLoop | None = None
+
+
+async def _call(fn, args, kwargs):
+    if asyncio.iscoroutinefunction(fn):
+        return await fn(*args, **kwargs)
+    return await db_async.run(fn, *args, **kwargs)
+
+
+async def _run_job(job_id: str, fn, args, kwargs, deadline: float) -> None:
+    loop = asyncio.get_running_loop()
+    if deadline <= loop.time():
+        logger.warning("job %s: timed out in queue", job_id)
+        await db_async.run(db.set_job_status, job_id, "error", _TIMEOUT_RESULT)
+        return
+    # Задачу уже могли пометить брошенной (db.fail_interrupted_jobs) — тогда не запускаем.
+    if not await db_async.run(db.claim_job, job_id):
+        logger.warning("job %s: no longer queued, skipped", job_id)
+        return
+    timeout = job_timeout_sec()
+    started = loop.time()
+    warned = False
+    work = asyncio.ensure_future(_call(fn, args, kwargs))
+    try:
+        while True:
+            done, _ = await asyncio.wait({work}, timeout=timeout / 4)
+            if done:
+                break
+            if not warned and loop.time() - started >= timeout:
+                logger.warning("job %s: still running after %.0f s", job_id, timeout)
+                warned = True
+            await db_async.run(db.set_job_status, job_id, "running")
+        result = dict(work.result() or {})
+        result.setdefault("ok", True)
+        status = "done"
+    except Exception as exc:
+        logger.exception("job %s failed: %s", job_id, exc)
+        result = {"ok": False, "message": "Не удалось выполнить действие. Попробуйте ещё раз."}
+        status = "error"
+    await db_async.run(db.set_job_status, job_id, status, result)
+
+
+async def _worker() -> None:
+    assert _queue is not None
+    while True:
+        job_id, fn, args, kwargs, deadline = await _queue.get()
+        try:
+            await _run_job(job_id, fn, args, kwargs, deadline)
+        except Exception as exc:
+            logger.exception("job %s: status not saved: %s", job_id, exc)
+        finally:
+            _queue.task_done()
+
+
+def _ensure_workers() -> asyncio.Queue:
+    """Очередь и воркеры текущего event loop (создаются при первой задаче)."""
+    global _queue, _loop
+    loop = asyncio.get_running_loop()
+    if _queue is None or _loop is not loop:
+        _loop = loop
+        _queue = asyncio.Queue()
+        _workers.clear()
+        for i in range(_workers_count()):
+            _workers.append(loop.create_task(_worker(), name=f"web-job-{i}"))
+    return _queue
+
+
+async def submit(user_id: int, kind: str, fn, *args, **kwargs) -> str:
+    """Ставит задачу в очередь и возвращает её id."""
+    job_id = uuid.uuid4().hex
+    await db_async.run(db.create_job, job_id, user_id, kind)
+    deadline = asyncio.get_running_loop().time() + job_timeout_sec()
+    _ensure_workers().put_nowait((job_id, fn, args, kwargs, deadline))
+    return job_id
+
+
+async def get_status(job_id: str, user_id: int) -> dict | None:
+    """{id, kind, status, ok, message, ...результат} или None, если задачи нет у пользователя."""
+    row = await db_async.run(db.get_job, job_id, user_id)
+    if row is None:
+        return None
+    out = {"id": row["id"], "kind": row["kind"], "status": row["status"]}
+    out.update(row.get("result") or {})
+    return out
+
+
+async def drain() -> None:
+    """Дождаться, пока очередь опустеет (для тестов и плавной остановки)."""
+    if _queue is not None and _loop is asyncio.get_running_loop():
+        await _queue.join()
+
+
+async def shutdown() -> None:
+    global _queue, _loop
+    for task in _workers:
+        task.cancel()
+    _workers.clear()
+    _queue = None
+    _loop = None
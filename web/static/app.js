@@ -43,16 +43,76 @@
     });
   }
 
+  // Метка вкладки: события GET /events, вызванные её же запросами, она пропускает.
+  var TAB_ID = Math.random().toString(36).slice(2, 10) + Date.now().toString(36);
+
+  // Медленные действия сервер отдаёт в фоновую очередь: ответ 202 с job_id,
+  // итог забираем опросом status_url. Обычный ответ возвращается как есть.
+  var JOB_POLL_MS = 700;
+  var JOB_POLL_MAX_MS = 120000;
+
+  function waitJob(data) {
+    if (!data || !data.job_id || !data.status_url) return Promise.resolve(data);
+    var started = Date.now();
+    return new Promise(function (resolve, reject) {
+      function tick() {
+        fetch(data.status_url, {
+          headers: { Accept: "application/json" },
+          credentials: "same-origin",
+        })
+          .then(function (r) {
+            return r.json();
+          })
+          .then(function (st) {
+            // Без status — ошибка самого опроса (401/404): отдаём как результат.
+            if (!st.status || st.status === "done" || st.status === "error") {
+              resolve(st);
+            } else if (Date.now() - started > JOB_POLL_MAX_MS) {
+              reject(new Error("Действие выполняется слишком долго — обновите страницу позже."));
+            } else {
+              setTimeout(tick, JOB_POLL_MS);
+            }
+          })
+          .catch(reject);
+      }
+      setTimeout(tick, JOB_POLL_MS);
+    });
+  }
+
   function postVoiceBlob(endpoint, blob, filename) {
     var fd = new FormData();
     fd.append("file", blob, filename || "voice.webm");
     return fetch(endpoint, {
       method: "POST",
       body: fd,
-      headers: { Accept: "application/json" },
+      headers: { Accept: "application/json", "X-Tab-Id": TAB_ID },
       credentials: "same-origin",
-    }).then(function (r) {
-      return r.json();
+    })
+      .then(function (r) {
+        return r.json();
+      })
+      .then(waitJob);
+  }
+
+  // <form data-job-form>: отправка через fetch, ожидание фоновой задачи, затем переход.
+  function initJobForms() {
+    document.addEventListener("submit", function (e) {
+      var form = e.target.closest("form[data-job-form]");
+      if (!form || e.defaultPrevented) return;
+      e.preventDefault();
+      var btn = form.querySelector("button[type=submit], button:not([type])");
+      if (btn) btn.disabled = true;
+      postTaskAction(form.getAttribute("action"), new FormData(form))
+        .then(waitJob)
+        .then(function (res) {
+          if (!res.ok) window.alert(res.message || "Ошибка");
+          if (res.redirect) window.location.href = res.redirect;
+          else window.location.reload();
+        })
+        .catch(function (err) {
+          window.alert(err.message || "Ошибка сети");
+          if (btn) btn.disabled = false;
+        });
     });
   }
 
@@ -126,6 +186,7 @@
               if (!blob.size) {
                 showStatus("Пустая запись.", true);
                 recording = false;
+                root.removeAttribute("data-busy");
                 btn.textContent = "Записать голосом";
                 return;
               }
@@ -136,10 +197,12 @@
                   showStatus("Ошибка сети.", true);
                 });
               recording = false;
+              root.removeAttribute("data-busy");
               btn.textContent = "Записать голосом";
             };
             mediaRecorder.start();
             recording = true;
+            root.setAttribute("data-busy", "");
             btn.textContent = "Закончить и отправить";
             showStatus("Идёт запись… Нажми ещё раз, чтобы отправить.", false);
           })
@@ -162,7 +225,7 @@
     return fetch(url, {
       method: "POST",
       body: fd,
-      headers: { Accept: "application/json" },
+      headers: { Accept: "application/json", "X-Tab-Id": TAB_ID },
       credentials: "same-origin",
     }).then(function (r) {
       var ct = (r.headers.get("content-type") || "").toLowerCase();
@@ -175,6 +238,102 @@
     });
   }
 
+  function syncReorderButtonsForUl(ul) {
+    if (!ul) return;
+    var items = ul.querySelectorAll(":scope > .task-line");
+    var n = items.length;
+    for (var i = 0; i < n; i++) {
+      var li = items[i];
+      var ut = li.querySelector('[data-action="move-up-today"]');
+      var dt = li.querySelector('[data-action="move-down-today"]');
+      if (ut) ut.disabled = i <= 0;
+      if (dt) dt.disabled = i >= n - 1;
+      var up = li.querySelector('[data-action="move-up"]');
+      var dn = li.querySelector('[data-action="move-down"]');
+      if (up) up.disabled = i <= 0;
+      if (dn) dn.disabled = i >= n - 1;
+    }
+  }
+
+  function reloadIfNoTasksLeft() {
+    if (!document.querySelector(".task-line")) window.location.reload();
+  }
+
+  // Ответ действия с задачей: {removed} — убрать строку; {row_html, section} —
+  // заменить строку свежей разметкой (или перенести в другой раздел страницы).
+  // false — частичное обновление невозможно, нужна перезагрузка.
+  // На /tasks у строк сквозные номера для «выполни N» в боте. Когда строки
+  // удалены, номера всех, кто стоял после них, уменьшаются.
+  function shiftTaskNumbers(removedNums) {
+    if (!removedNums.length) return;
+    document.querySelectorAll(".task-line[data-task-num]").forEach(function (li) {
+      var num = parseInt(li.getAttribute("data-task-num"), 10);
+      if (isNaN(num)) return;
+      var shift = removedNums.filter(function (n) {
+        return n < num;
+      }).length;
+      if (!shift) return;
+      num -= shift;
+      li.setAttribute("data-task-num", String(num));
+      var badge = li.querySelector(".task-num-emoji--static");
+      if (badge) badge.title = "№ " + num + " — для «выполни " + num + "» в боте";
+    });
+  }
+
+  function taskNum(line) {
+    var num = parseInt(line.getAttribute("data-task-num"), 10);
+    return isNaN(num) ? null : num;
+  }
+
+  function applyTaskFragment(line, data) {
+    var oldUl = line.parentElement;
+    var oldNum = taskNum(line);
+    if (data.removed) {
+      line.remove();
+      syncReorderButtonsForUl(oldUl);
+      if (oldNum !== null) shiftTaskNumbers([oldNum]);
+      reloadIfNoTasksLeft();
+      return true;
+    }
+    if (!data.row_html) return false;
+    var tpl = document.createElement("template");
+    tpl.innerHTML = data.row_html.trim();
+    var fresh = tpl.content.firstElementChild;
+    if (!fresh) return false;
+    var section = line.closest("[data-section-key]");
+    var sameSection = section && section.getAttribute("data-section-key") === data.section;
+    // Номер сменился — сдвинулись и соседние строки; переезд в другой раздел
+    // на /tasks тоже не патчим: раздел мог быть загружен не целиком, и строка
+    // в конце списка задвоилась бы после «Показать ещё».
+    if (oldNum !== null && (taskNum(fresh) !== oldNum || !sameSection)) return false;
+    if (sameSection) {
+      line.replaceWith(fresh);
+    } else {
+      var target = null;
+      document.querySelectorAll("[data-section-key]").forEach(function (el) {
+        if (el.getAttribute("data-section-key") === data.section) target = el;
+      });
+      var targetUl = target && target.querySelector("ul.task-list");
+      if (!targetUl) return false;
+      line.remove();
+      targetUl.appendChild(fresh);
+      syncReorderButtonsForUl(oldUl);
+    }
+    syncReorderButtonsForUl(fresh.parentElement);
+    return true;
+  }
+
+  function taskActionPatch(line, httpPromise) {
+    return httpPromise
+      .then(function (data) {
+        if (!data.ok) window.alert(data.message || "Ошибка");
+        else if (!applyTaskFragment(line, data)) window.location.reload();
+      })
+      .catch(function (err) {
+        window.alert(err.message || "Ошибка сети");
+      });
+  }
+
   function taskActionReload(httpPromise) {
     return httpPromise
       .then(function (data) {
@@ -201,23 +360,6 @@
       if (det) det.removeAttribute("open");
     }
 
-    function syncReorderButtonsForUl(ul) {
-      if (!ul) return;
-      var items = ul.querySelectorAll(":scope > .task-line");
-      var n = items.length;
-      for (var i = 0; i < n; i++) {
-        var li = items[i];
-        var ut = li.querySelector('[data-action="move-up-today"]');
-        var dt = li.querySelector('[data-action="move-down-today"]');
-        if (ut) ut.disabled = i <= 0;
-        if (dt) dt.disabled = i >= n - 1;
-        var up = li.querySelector('[data-action="move-up"]');
-        var dn = li.querySelector('[data-action="move-down"]');
-        if (up) up.disabled = i <= 0;
-        if (dn) dn.disabled = i >= n - 1;
-      }
-    }
-
     function optimisticLineReorder(line, url, dir) {
       var ul = line.parentElement;
       if (!ul || (ul.tagName !== "UL" && ul.tagName !== "OL")) return false;
@@ -274,7 +416,7 @@
               return;
             }
             closeKebab(line);
-            window.location.reload();
+            if (!applyTaskFragment(line, data)) window.location.reload();
           });
         }
         if (!silentEmpty) window.alert("Интервал: число от 2 до 365 или оставь пустым.");
@@ -306,7 +448,7 @@
           return;
         }
         closeKebab(line);
-        window.location.reload();
+        if (!applyTaskFragment(line, data)) window.location.reload();
       });
     }
 
@@ -355,22 +497,22 @@
       }
       if (action === "today") {
         fd.append("preset", "today");
-        taskActionReload(postTaskAction("/tasks/reschedule_id", fd));
+        taskActionPatch(line, postTaskAction("/tasks/reschedule_id", fd));
         return;
       }
       if (action === "tomorrow") {
         fd.append("preset", "tomorrow");
-        taskActionReload(postTaskAction("/tasks/reschedule_id", fd));
+        taskActionPatch(line, postTaskAction("/tasks/reschedule_id", fd));
         return;
       }
       if (action === "plus2") {
         fd.append("preset", "plus2");
-        taskActionReload(postTaskAction("/tasks/reschedule_id", fd));
+        taskActionPatch(line, postTaskAction("/tasks/reschedule_id", fd));
         return;
       }
       if (action === "clear-due") {
         fd.append("preset", "nodate");
-        taskActionReload(postTaskAction("/tasks/reschedule_id", fd));
+        taskActionPatch(line, postTaskAction("/tasks/reschedule_id", fd));
         return;
       }
       if (action === "apply-date") {
@@ -381,7 +523,7 @@
           return;
         }
         fd.append("due_date", d);
-        taskActionReload(postTaskAction("/tasks/reschedule_id", fd));
+        taskActionPatch(line, postTaskAction("/tasks/reschedule_id", fd));
         return;
       }
       if (action === "time-bucket") {
@@ -390,17 +532,17 @@
         fd.append("bucket", bk);
         fd.append("section_kind", "");
         fd.append("section_date", "");
-        taskActionReload(postTaskAction("/tasks/drag_move", fd));
+        taskActionPatch(line, postTaskAction("/tasks/drag_move", fd));
         return;
       }
       if (action === "routine-snooze-today") {
-        taskActionReload(postTaskAction("/tasks/routine_snooze_today", fd));
+        taskActionPatch(line, postTaskAction("/tasks/routine_snooze_today", fd));
         return;
       }
       if (action === "set-color") {
         var col = (btn.getAttribute("data-color") || "").trim();
         fd.append("color", col);
-        taskActionReload(postTaskAction("/tasks/set_color", fd));
+        taskActionPatch(line, postTaskAction("/tasks/set_color", fd));
         return;
       }
       if (action === "move-up" || action === "move-down") {
@@ -417,12 +559,12 @@
         var mins = btn.getAttribute("data-minutes") || "0";
         fd.append("minutes", mins);
         fd.append("next", line.dataset.nextUrl || "/today");
-        taskActionReload(postTaskAction("/tasks/set_estimate", fd));
+        taskActionPatch(line, postTaskAction("/tasks/set_estimate", fd));
         return;
       }
       if (action === "delete") {
         if (!window.confirm("Удалить эту задачу?")) return;
-        taskActionReload(postTaskAction("/tasks/delete_id", fd));
+        taskActionPatch(line, postTaskAction("/tasks/delete_id", fd));
         return;
       }
       if (action === "make-routine") {
@@ -434,14 +576,14 @@
           return;
         closeKebab(line);
         fd.append("make_routine", "1");
-        taskActionReload(postTaskAction("/tasks/set_routine_kind", fd));
+        taskActionPatch(line, postTaskAction("/tasks/set_routine_kind", fd));
         return;
       }
       if (action === "make-normal") {
         if (!window.confirm("Сделать обычной задачей на сегодня?")) return;
         closeKebab(line);
         fd.append("make_routine", "0");
-        taskActionReload(postTaskAction("/tasks/set_routine_kind", fd));
+        taskActionPatch(line, postTaskAction("/tasks/set_routine_kind", fd));
         return;
       }
       if (action === "save-repeat-days") {
@@ -503,7 +645,7 @@
         if (!line || !cat.value) return;
         var fd = taskFd(line);
         fd.append("category_name", cat.value);
-        taskActionReload(postTaskAction("/tasks/set_category", fd));
+        taskActionPatch(line, postTaskAction("/tasks/set_category", fd));
         return;
       }
 
@@ -513,11 +655,84 @@
         if (!lineP) return;
         var fdP = taskFd(lineP);
         fdP.append("project_id", projSel.value || "");
-        taskActionReload(postTaskAction("/tasks/set_project", fdP));
+        taskActionPatch(lineP, postTaskAction("/tasks/set_project", fdP));
         return;
       }
     });
 
+    // «Показать ещё» на /tasks: следующее окно раздела с сервера.
+    document.addEventListener("click", function (e) {
+      var btn = e.target.closest("[data-load-more]");
+      if (!btn) return;
+      e.preventDefault();
+      var section = btn.closest("[data-section-key]");
+      var ul = section && section.querySelector("ul.task-list");
+      if (!ul) return;
+      btn.disabled = true;
+      var params = new URLSearchParams({
+        key: btn.getAttribute("data-load-more"),
+        cursor: btn.getAttribute("data-cursor") || "",
+      });
+      fetch("/tasks/section?" + params.toString(), {
+        headers: { Accept: "application/json" },
+        credentials: "same-origin",
+      })
+        .then(function (r) {
+          return r.json();
+        })
+        .then(function (data) {
+          if (!data.ok) throw new Error(data.message || "Ошибка");
+          var tpl = document.createElement("template");
+          tpl.innerHTML = data.html;
+          Array.prototype.slice.call(tpl.content.children).forEach(function (li) {
+            // Строка могла уже оказаться здесь после действия из меню ⋯.
+            var sel = '.task-line[data-task-id="' + li.dataset.taskId + '"]';
+            if (!document.querySelector(sel)) ul.appendChild(li);
+          });
+          syncReorderButtonsForUl(ul);
+          if (data.has_more) {
+            btn.setAttribute("data-cursor", data.cursor);
+            btn.textContent = "Показать ещё";
+            btn.disabled = false;
+          } else {
+            btn.remove();
+          }
+        })
+        .catch(function (err) {
+          btn.disabled = false;
+          window.alert(err.message || "Ошибка сети");
+        });
+    });
+
+    // «Отметить выбранное»: строки выполненных задач убираются без перезагрузки.
+    document.addEventListener("submit", function (e) {
+      var form = e.target.closest("form[data-complete-inline]");
+      if (!form || e.defaultPrevented) return;
+      e.preventDefault();
+      postTaskAction(form.getAttribute("action"), new FormData(form))
+        .then(function (data) {
+          if (!data.ok) {
+            window.alert(data.message || "Ошибка");
+            return;
+          }
+          var removedNums = [];
+          (data.completed_ids || []).forEach(function (id) {
+            var li = document.querySelector('.task-line[data-task-id="' + id + '"]');
+            if (!li) return;
+            var ul = li.parentElement;
+            var num = taskNum(li);
+            if (num !== null) removedNums.push(num);
+            li.remove();
+            syncReorderButtonsForUl(ul);
+          });
+          shiftTaskNumbers(removedNums);
+          reloadIfNoTasksLeft();
+        })
+        .catch(function (err) {
+          window.alert(err.message || "Ошибка сети");
+        });
+    });
+
     function startEdit(line) {
       var display = line.querySelector(".task-text-display");
       var input = line.querySelector(".task-text-input");
@@ -839,7 +1054,7 @@
         } else {
           return;
         }
-        taskActionReload(postTaskAction("/tasks/drag_move", fd));
+        taskActionPatch(dragLine, postTaskAction("/tasks/drag_move", fd));
       },
       true
     );
@@ -853,10 +1068,126 @@
     }
   });
 
+  // Живые обновления: задачу добавили или закрыли в Telegram (или в другой
+  // вкладке) — сервер присылает событие по GET /events, страница тихо
+  // перезапрашивается (без изменений — 304) и подменяется содержимое <main>.
+  // Пока пользователь что-то вводит, выбирает или перетаскивает, обновление ждёт.
+  var LIVE_DEBOUNCE_MS = 400;
+  var LIVE_BUSY_RETRY_MS = 2000;
+
+  function initLiveUpdates() {
+    var main = document.querySelector("main[data-live-updates]");
+    if (!main || !window.EventSource || !window.DOMParser) return;
+    var source = null;
+    var knownId = null;
+    var lastEtag = null;
+    var timer = null;
+    var stale = false;
+
+    function isBusy() {
+      var active = document.activeElement;
+      if (active && main.contains(active) && /^(INPUT|TEXTAREA|SELECT)$/.test(active.tagName)) {
+        return true;
+      }
+      if (main.querySelector(".task-kebab[open], .task-line--dragging, [data-busy], .task-cb:checked")) {
+        return true;
+      }
+      var typed = false;
+      main.querySelectorAll("input[type=text], textarea").forEach(function (el) {
+        if (el.value) typed = true;
+      });
+      return typed;
+    }
+
+    function schedule(delay) {
+      if (timer) clearTimeout(timer);
+      timer = setTimeout(refresh, delay);
+    }
+
+    function refresh() {
+      timer = null;
+      if (document.hidden) {
+        stale = true;
+        return;
+      }
+      if (isBusy()) {
+        schedule(LIVE_BUSY_RETRY_MS);
+        return;
+      }
+      stale = false;
+      fetch(window.location.href, {
+        headers: { Accept: "text/html" },
+        credentials: "same-origin",
+        cache: "no-cache",
+      })
+        .then(function (r) {
+          if (!r.ok || r.redirected) return null;
+          var tag = r.headers.get("ETag");
+          if (tag && tag === lastEtag) return null;
+          lastEtag = tag;
+          return r.text();
+        })
+        .then(function (html) {
+          if (!html) return;
+          if (isBusy()) {
+            lastEtag = null;
+            schedule(LIVE_BUSY_RETRY_MS);
+            return;
+          }
+          var doc = new DOMParser().parseFromString(html, "text/html");
+          var fresh = doc.querySelector("main[data-live-updates]");
+          if (!fresh) return;
+          main.innerHTML = fresh.innerHTML;
+          main.querySelectorAll("[data-voice-root]").forEach(initVoiceRoot);
+        })
+        .catch(function () {});
+    }
+
+    function open() {
+      if (source) return;
+      source = new EventSource("/events");
+      source.addEventListener("hello", function (e) {
+        // Переподключились после паузы — изменения могли пройти мимо.
+        if (knownId && e.lastEventId !== knownId) schedule(LIVE_DEBOUNCE_MS);
+        knownId = e.lastEventId;
+      });
+      source.addEventListener("changed", function (e) {
+        knownId = e.lastEventId;
+        var data = {};
+        try {
+          data = JSON.parse(e.data || "{}");
+        } catch (err) {}
+        if (data.origin !== TAB_ID) schedule(LIVE_DEBOUNCE_MS);
+      });
+      source.onerror = function () {
+        // 401/204 — EventSource закрывается сам и больше не переподключается.
+        if (source && source.readyState === EventSource.CLOSED) source = null;
+      };
+    }
+
+    function close() {
+      if (source) source.close();
+      source = null;
+    }
+
+    // Скрытая вкладка не держит соединение (у браузера их всего ~6 на сайт).
+    document.addEventListener("visibilitychange", function () {
+      if (document.hidden) {
+        close();
+      } else {
+        open();
+        if (stale) schedule(LIVE_DEBOUNCE_MS);
+      }
+    });
+    if (!document.hidden) open();
+  }
+
   document.addEventListener("DOMContentLoaded", function () {
     initNav();
     initVoice();
+    initJobForms();
     initTaskRows();
     initTaskDragDrop();
+    initLiveUpdates();
   });
 })();
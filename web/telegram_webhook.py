@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Webhook-режим бота: Telegram присылает апдейты в POST /telegram/webhook того же
+FastAPI-процесса, что обслуживает веб. Отдельный процесс с run_polling (и
+http.server для пингов в bot_replit.py) в этом режиме не нужен: бот и веб
+делят пул соединений БД, кеши снимков и события events.
+
+Включается, если заданы TELEGRAM_BOT_TOKEN, TELEGRAM_WEBHOOK_URL (публичный
+адрес веба, без пути) и TELEGRAM_WEBHOOK_SECRET (1–256 символов A–Z a–z 0–9 _ -).
+Telegram присылает секрет в заголовке X-Telegram-Bot-Api-Secret-Token; чужие
+запросы получают 403. Апдейт кладётся в update_queue Application, дальше его
+разбирает PTB в этом же event loop (параллельно по чатам, см. bot_updates).
+
+Состояние диалогов бота (ожидание задачи после /add) живёт в памяти процесса,
+поэтому веб в этом режиме запускается одним воркером uvicorn.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import re
+import secrets
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, Response
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = "/telegram/webhook"
+_SECRET_RE = re.compile(r"^[A-Za-z0-9_-]{1,256}$")
+
+router = APIRouter()
+
+_application = None
+_secret = ""
+
+
+def webhook_settings() -> tuple[str, str] | None:
+    """(полный URL webhook, секрет) или None, если режим не настроен."""
+    token = os.environ.get("TELEGRAM_BOT_TOKEN", "").strip()
+    base = os.environ.get("TELEGRAM_WEBHOOK_URL", "").strip().rstrip("/")
+    secret = os.environ.get("TELEGRAM_WEBHOOK_SECRET", "").strip()
+    if not token or not base:
+        return None
+    if not _SECRET_RE.match(secret):
+        logger.warning("TELEGRAM_WEBHOOK_SECRET не задан или некорректен: webhook не включён.")
+        return None
+    return base + WEBHOOK_PATH, secret
+
+
+async def start() -> bool:
+    """Поднимает Application бота и регистрирует webhook (из lifespan веба)."""
+    global _application, _secret
+    settings = webhook_settings()
+    if settings is None or _application is not None:
+        return False
+    url, secret = settings
+    from telegram import Update
+
+    import bot_v2
+
+    application = bot_v2.build_application()
+    await application.initialize()
+    if application.post_init is not None:
+        await application.post_init(application)
+    await application.start()
+    _application, _secret = application, secret
+    try:
+        await application.bot.set_webhook(
+            url=url, secret_token=secret, allowed_updates=Update.ALL_TYPES
+        )
+        logger.info("Бот v2: webhook %s", url)
+    except Exception as exc:
+        # Апдейты пойдут, как только Telegram примет адрес (например, после следующего деплоя).
+        logger.exception("set_webhook не удался: %s", exc)
+    return True
+
+
+async def stop() -> None:
+    global _application
+    application, _application = _application, None
+    if application is None:
+        return
+    try:
+        await application.stop()
+    finally:
+        await application.shutdown()
+        if application.post_shutdown is not None:
+            await application.post_shutdown(application)
+
+
+@router.post(WEBHOOK_PATH)
+async def telegram_webhook(request: Request):
+    application = _application
+    if application is None:
+        return JSONResponse({"ok": False, "message": "Webhook выключен."}, status_code=404)
+    token = request.headers.get("x-telegram-bot-api-secret-token", "")
+    if not secrets.compare_digest(token.encode("utf-8"), _secret.encode("utf-8")):
+        return JSONResponse({"ok": False, "message": "Forbidden"}, status_code=403)
+    try:
+        data = await request.json()
+    except ValueError:
+        return JSONResponse({"ok": False, "message": "Некорректный JSON."}, status_code=400)
+    from telegram import Update
+
+    # Ответ Telegram — сразу: обработка идёт в фоне, медленный Whisper не
+    # задерживает подтверждение и не вызывает повторной доставки.
+    await application.update_queue.put(Update.de_json(data, application.bot))
+    return Response(status_code=200)